@@ -23,13 +23,18 @@ instances.
 
 """
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import bisect
 import hashlib
 import os
+import time
+import threading
 import logging
 from io import StringIO, BytesIO
 
 from libcloud.compute.base import NodeAuthSSHKey
 from libcloud.storage.types import ContainerAlreadyExistsError, ContainerDoesNotExistError
+from libcloud.storage.types import ObjectDoesNotExistError
 
 from .exceptions import ItemNotFound, KeyPairExists, MethodNotAllowed
 from .exceptions import OverLimit, BadRequest, ServiceUnavailable
@@ -64,6 +69,155 @@ def parse_exception(exception):
     return status, error_text
 
 
+def file_md5(file_path, chunk_size=1024 * 1024):
+    """
+    Computes the MD5 hash of a file, reading it by chunks.
+
+    :param file_path: path to the file
+    :param chunk_size: number of bytes read at once
+    :return: hexadecimal hash
+    """
+
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def read_chunks(file_path, offset=0, length=None, chunk_size=1024 * 1024, progress=None):
+    """
+    Generator reading a part of a file by chunks.
+
+    :param file_path: path to the file
+    :param offset: first byte to read
+    :param length: number of bytes to read (None for the rest of the file)
+    :param chunk_size: number of bytes read at once
+    :param progress: callable receiving the number of bytes of each chunk
+    """
+
+    with open(file_path, 'rb') as file:
+        file.seek(offset)
+        while length is None or length > 0:
+            chunk = file.read(chunk_size if length is None else min(chunk_size, length))
+            if not chunk:
+                break
+            if length is not None:
+                length -= len(chunk)
+            if progress:
+                progress(len(chunk))
+            yield chunk
+
+
+class ProjectListingCache(object):
+    """
+    Local cache of the metadata (ETag, last modified) of the projects stored
+    in the cloud, sorted by object name for the pagination.
+
+    The listing is considered fresh during ttl seconds as long as the container
+    object count and size haven't changed (the container HEAD is cheap).
+
+    :param ttl: maximum age of the listing in seconds
+    """
+
+    def __init__(self, ttl=60):
+
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._names = []
+        self._metadata = {}
+        self._container_state = None
+        self._refreshed = None
+
+    def is_fresh(self, container_state, now=None):
+        """
+        Checks if the listing can be used.
+
+        :param container_state: tuple (object count, size) of the container
+        :param now: current time
+        :return: boolean
+        """
+
+        if now is None:
+            now = time.time()
+        with self._lock:
+            if self._refreshed is None or now - self._refreshed > self._ttl:
+                return False
+            if self._container_state is None:
+                # the cache has been updated by this controller, adopt the new state
+                self._container_state = container_state
+                return True
+            return container_state == self._container_state
+
+    def replace(self, objects, container_state, now=None):
+        """
+        Replaces the listing.
+
+        :param objects: project objects
+        :param container_state: tuple (object count, size) of the container
+        :param now: current time
+        """
+
+        metadata = {}
+        for obj in objects:
+            metadata[obj.name] = (obj.hash, (obj.extra or {}).get('last_modified'))
+        with self._lock:
+            self._metadata = metadata
+            self._names = sorted(metadata)
+            self._container_state = container_state
+            self._refreshed = time.time() if now is None else now
+
+    def update(self, obj):
+        """
+        Adds or updates a project uploaded by this controller.
+
+        :param obj: project object
+        """
+
+        with self._lock:
+            if self._refreshed is None:
+                return
+            if obj.name not in self._metadata:
+                bisect.insort(self._names, obj.name)
+            self._metadata[obj.name] = (obj.hash, (obj.extra or {}).get('last_modified'))
+            self._container_state = None
+
+    def metadata(self, object_name):
+        """
+        Returns the cached metadata of a project.
+
+        :param object_name: object name
+        :return: tuple (ETag, last modified) or None
+        """
+
+        return self._metadata.get(object_name)
+
+    def page(self, marker=None, limit=None):
+        """
+        Returns the object names following marker.
+
+        :param marker: last object name of the previous page
+        :param limit: maximum number of names
+        :return: list of object names
+        """
+
+        with self._lock:
+            start = 0 if marker is None else bisect.bisect_right(self._names, marker)
+            end = len(self._names) if limit is None else start + limit
+            return self._names[start:end]
+
+    def clear(self):
+        """
+        Forgets the listing.
+        """
+
+        with self._lock:
+            self._names = []
+            self._metadata = {}
+            self._container_state = None
+            self._refreshed = None
+
+
 class BaseCloudCtrl(object):
 
     """ Base class for interacting with a cloud provider API. """
@@ -79,10 +233,18 @@ class BaseCloudCtrl(object):
     }
 
     GNS3_CONTAINER_NAME = 'GNS3'
+    PROJECTS_PREFIX = 'projects/'
+    PROJECT_LISTING_TTL = 60
+
+    # files bigger than this are uploaded as segments (if the storage supports manifests)
+    UPLOAD_SEGMENT_SIZE = 256 * 1024 * 1024
+    UPLOAD_WORKERS = 4
+    UPLOAD_CHUNK_SIZE = 1024 * 1024
 
     def __init__(self, username, api_key):
         self.username = username
         self.api_key = api_key
+        self._project_cache = ProjectListingCache(self.PROJECT_LISTING_TTL)
 
     def _handle_exception(self, status, error_text, response_overrides=None):
         """ Raise an exception based on the HTTP status. """
@@ -216,11 +378,12 @@ class BaseCloudCtrl(object):
 
         return self.driver.list_key_pairs()
 
-    def upload_file(self, file_path, folder):
+    def upload_file(self, file_path, folder, progress_callback=None):
         """
         Uploads file to cloud storage (if it is not identical to a file already in cloud storage).
         :param file_path: path to file to upload
         :param folder: folder in cloud storage to save file in
+        :param progress_callback: callable receiving the number of bytes uploaded and the file size
         :return: True if file was uploaded, False if it was skipped because it already existed and was identical
         """
         try:
@@ -228,17 +391,20 @@ class BaseCloudCtrl(object):
         except ContainerAlreadyExistsError:
             gns3_container = self.storage_driver.get_container(self.GNS3_CONTAINER_NAME)
 
-        with open(file_path, 'rb') as file:
-            local_file_hash = hashlib.md5(file.read()).hexdigest()
+        local_file_hash = file_md5(file_path, self.UPLOAD_CHUNK_SIZE)
 
-            cloud_object_name = folder + '/' + os.path.basename(file_path)
-            cloud_hash_name = cloud_object_name + '.md5'
-            cloud_objects = [obj.name for obj in gns3_container.list_objects()]
+        cloud_object_name = folder + '/' + os.path.basename(file_path)
+        cloud_hash_name = cloud_object_name + '.md5'
 
-            # if the file and its hash are in object storage, and the local and storage file hashes match
-            # do not upload the file, otherwise upload it
-            if cloud_object_name in cloud_objects and cloud_hash_name in cloud_objects:
-                hash_object = gns3_container.get_object(cloud_hash_name)
+        # if the file is in object storage and the local and storage file hashes match
+        # do not upload the file, otherwise upload it
+        cloud_object = self._get_object(gns3_container, cloud_object_name)
+        if cloud_object is not None:
+            # the ETag is the MD5 hash of the objects that are not segmented
+            if cloud_object.hash and cloud_object.hash.strip('"') == local_file_hash:
+                return False
+            hash_object = self._get_object(gns3_container, cloud_hash_name)
+            if hash_object is not None:
                 cloud_object_hash = ''
                 for chunk in hash_object.as_stream():
                     cloud_object_hash += chunk.decode('utf8')
@@ -246,28 +412,117 @@ class BaseCloudCtrl(object):
                 if cloud_object_hash == local_file_hash:
                     return False
 
-            file.seek(0)
-            self.storage_driver.upload_object_via_stream(file, gns3_container, cloud_object_name)
-            self.storage_driver.upload_object_via_stream(StringIO(local_file_hash), gns3_container, cloud_hash_name)
-            return True
+        file_size = os.path.getsize(file_path)
+        uploaded = [0]
+        lock = threading.Lock()
+
+        def progress(size):
+            if progress_callback:
+                with lock:
+                    uploaded[0] += size
+                    progress_callback(uploaded[0], file_size)
+
+        if file_size > self.UPLOAD_SEGMENT_SIZE and hasattr(self.storage_driver, '_upload_object_manifest'):
+            cloud_object = self._upload_segments(file_path, file_size, gns3_container, cloud_object_name, progress)
+        else:
+            cloud_object = self.storage_driver.upload_object_via_stream(read_chunks(file_path,
+                                                                                    chunk_size=self.UPLOAD_CHUNK_SIZE,
+                                                                                    progress=progress),
+                                                                        gns3_container,
+                                                                        cloud_object_name)
+        self.storage_driver.upload_object_via_stream(StringIO(local_file_hash), gns3_container, cloud_hash_name)
+        if self._is_project(cloud_object_name) and cloud_object is not None:
+            self._project_cache.update(cloud_object)
+        return True
+
+    def _get_object(self, container, object_name):
+        """
+        Looks up an object (HEAD request) without listing the container.
+
+        :param container: container
+        :param object_name: name of the object
+        :return: the object or None if it doesn't exist
+        """
+
+        try:
+            return container.get_object(object_name)
+        except ObjectDoesNotExistError:
+            return None
 
-    def list_projects(self):
+    def _segment_storage_driver(self):
         """
-        Lists projects in cloud storage
+        Returns the storage driver used by the current thread to upload segments.
+        """
+
+        return self.storage_driver
+
+    def _upload_segments(self, file_path, file_size, container, object_name, progress):
+        """
+        Uploads a large file as segments in parallel and the manifest
+        joining them (<object_name>/<segment number>).
+
+        :param file_path: path to file to upload
+        :param file_size: size of the file
+        :param container: container
+        :param object_name: name of the object
+        :param progress: callable receiving the number of bytes of each chunk
+        :return: the manifest object
+        """
+
+        segment_size = self.UPLOAD_SEGMENT_SIZE
+        segments = ["{}/{:08d}".format(object_name, index) for index in range((file_size + segment_size - 1) // segment_size)]
+
+        def upload_segment(index):
+            chunks = read_chunks(file_path,
+                                 offset=index * segment_size,
+                                 length=segment_size,
+                                 chunk_size=self.UPLOAD_CHUNK_SIZE,
+                                 progress=progress)
+            self._segment_storage_driver().upload_object_via_stream(chunks, container, segments[index])
+
+        log.info("uploading {} as {} segments".format(file_path, len(segments)))
+        with ThreadPoolExecutor(max_workers=self.UPLOAD_WORKERS) as executor:
+            # list() re-raises the upload errors
+            list(executor.map(upload_segment, range(len(segments))))
+
+        # the segments of a previous bigger upload would be joined too
+        for obj in self.storage_driver.list_container_objects(container, ex_prefix=object_name + '/'):
+            if obj.name not in segments:
+                self.storage_driver.delete_object(obj)
+
+        return self.storage_driver._upload_object_manifest(container, object_name)
+
+    def _is_project(self, object_name):
+
+        return object_name.startswith(self.PROJECTS_PREFIX) and object_name[-4:] == '.zip'
+
+    def list_projects(self, marker=None, limit=None, refresh=False):
+        """
+        Lists projects in cloud storage, only the objects under the projects prefix
+        are listed and the listing is cached until the container changes.
+        :param marker: object name of the last project of the previous page
+        :param limit: maximum number of projects to return
+        :param refresh: do not use the cached listing
         :return: List of (project name, object name in storage)
         """
 
         try:
             gns3_container = self.storage_driver.get_container(self.GNS3_CONTAINER_NAME)
-            projects = [
-                (obj.name.replace('projects/', '').replace('.zip', ''), obj.name)
-                for obj in gns3_container.list_objects()
-                if obj.name.startswith('projects/') and obj.name[-4:] == '.zip'
-            ]
-            return projects
         except ContainerDoesNotExistError:
+            self._project_cache.clear()
             return []
 
+        extra = gns3_container.extra or {}
+        container_state = (extra.get('object_count'), extra.get('size'))
+        if refresh or not self._project_cache.is_fresh(container_state):
+            objects = self.storage_driver.iterate_container_objects(gns3_container, ex_prefix=self.PROJECTS_PREFIX)
+            self._project_cache.replace((obj for obj in objects if self._is_project(obj.name)), container_state)
+
+        return [
+            (name[len(self.PROJECTS_PREFIX):-4], name)
+            for name in self._project_cache.page(marker, limit)
+        ]
+
     def download_file(self, file_name, destination=None):
         """
         Downloads file from cloud storage
@@ -19,6 +19,10 @@
 
 from .base_cloud_ctrl import BaseCloudCtrl
 import json
+import time
+import calendar
+import datetime
+import threading
 import requests
 from libcloud.compute.drivers.rackspace import ENDPOINT_ARGS_MAP
 from libcloud.compute.providers import get_driver
@@ -37,33 +41,47 @@ log = logging.getLogger(__name__)
 RACKSPACE_REGIONS = [{ENDPOINT_ARGS_MAP[k]['region']: k} for k in
                      ENDPOINT_ARGS_MAP]
 
+IDENTITY_ENDPOINT = "https://identity.api.rackspacecloud.com/v2.0/tokens"
+
+# lifetime assumed when the identity API doesn't tell when the token expires
+DEFAULT_TOKEN_LIFETIME = 3600
+
+# the tokens are renewed when they expire in less than this number of seconds
+TOKEN_REFRESH_MARGIN = 300
+
 
 class RackspaceCtrl(BaseCloudCtrl):
 
     """ Controller class for interacting with Rackspace API. """
 
-    def __init__(self, username, api_key, gns3_ias_url):
+    def __init__(self, username, api_key, gns3_ias_url, identity_ep=IDENTITY_ENDPOINT):
         super(RackspaceCtrl, self).__init__(username, api_key)
 
         self.gns3_ias_url = gns3_ias_url
 
+        # the HTTP connections are kept alive between requests,
+        # the session is shared by the threads using a cached provider
+        self.session = requests.Session()
+        self._session_lock = threading.Lock()
+
         # set this up so it can be swapped out with a mock for testing
-        self.post_fn = requests.post
+        self.post_fn = self.session.post
         self.driver_cls = get_driver(Provider.RACKSPACE)
         self.storage_driver_cls = get_storage_driver(StorageProvider.CLOUDFILES)
 
         self.driver = None
-        self.storage_driver = None
         self.region = None
+        self._storage_drivers = threading.local()
         self.instances = {}
 
         self.authenticated = False
-        self.identity_ep = \
-            "https://identity.api.rackspacecloud.com/v2.0/tokens"
+        self.identity_ep = identity_ep
 
         self.regions = []
         self.token = None
+        self.token_expires = None
         self.tenant_id = None
+        self.storage_endpoints = {}
         self.flavor_ep = "https://dfw.servers.api.rackspacecloud.com/v2/{username}/flavors"
         self._flavors = OrderedDict([
             ('2', '512MB, 1 VCPU'),
@@ -88,12 +106,13 @@ class RackspaceCtrl(BaseCloudCtrl):
         """
         Submit username and api key to API service.
 
-        If authentication is successful, set self.regions and self.token.
-        Return boolean.
+        If authentication is successful, set self.regions, self.token and
+        self.token_expires. Return boolean.
 
         """
 
         self.authenticated = False
+        self.token_expires = None
 
         if len(self.username) < 1:
             return False
@@ -115,7 +134,8 @@ class RackspaceCtrl(BaseCloudCtrl):
             'Accept': 'application/json'
         }
 
-        response = self.post_fn(self.identity_ep, data=data, headers=headers)
+        with self._session_lock:
+            response = self.post_fn(self.identity_ep, data=data, headers=headers)
 
         if response.status_code == 200:
 
@@ -124,18 +144,31 @@ class RackspaceCtrl(BaseCloudCtrl):
 
             if self.token:
                 self.authenticated = True
+                self.token_expires = self._parse_token_expires(api_data)
                 user_regions = self._parse_endpoints(api_data)
                 self.regions = self._make_region_list(user_regions)
                 self.tenant_id = self._parse_tenant_id(api_data)
+                self.storage_endpoints = self._parse_storage_endpoints(api_data)
 
         else:
             self.regions = []
             self.token = None
 
-        response.connection.close()
-
         return self.authenticated
 
+    def token_expires_in(self, now=None):
+        """
+        Return the number of seconds before the token expires
+        (0 if not authenticated).
+
+        """
+
+        if not self.authenticated or self.token_expires is None:
+            return 0
+        if now is None:
+            now = time.time()
+        return max(self.token_expires - now, 0)
+
     def list_regions(self):
         """ Return a list the regions available to the user. """
 
@@ -166,6 +199,29 @@ class RackspaceCtrl(BaseCloudCtrl):
 
         return region_codes
 
+    def _parse_storage_endpoints(self, api_data):
+        """
+        Parse the JSON-encoded data returned by the Identity Service API.
+
+        Return a dictionary of the Cloud Files endpoints per region.
+
+        """
+
+        endpoints = {}
+
+        try:
+            for ep_type in api_data['access']['serviceCatalog']:
+                if ep_type['name'] == "cloudFiles" \
+                        and ep_type['type'] == "object-store":
+
+                    for ep in ep_type['endpoints']:
+                        if 'publicURL' in ep:
+                            endpoints[ep['region']] = ep['publicURL']
+        except KeyError:
+            pass
+
+        return endpoints
+
     def _parse_token(self, api_data):
         """ Parse the token from the JSON-encoded data returned by the API. """
 
@@ -176,6 +232,22 @@ class RackspaceCtrl(BaseCloudCtrl):
 
         return token
 
+    def _parse_token_expires(self, api_data):
+        """
+        Parse the token expiration time (e.g. "2014-11-24T22:05:39.115Z")
+        from the JSON-encoded data returned by the API.
+
+        Return a timestamp.
+
+        """
+
+        try:
+            expires = api_data['access']['token']['expires']
+            expires = datetime.datetime.strptime(expires[:19], "%Y-%m-%dT%H:%M:%S")
+            return calendar.timegm(expires.timetuple())
+        except (KeyError, TypeError, ValueError):
+            return time.time() + DEFAULT_TOKEN_LIFETIME
+
     def _parse_tenant_id(self, api_data):
         """  """
         try:
@@ -213,11 +285,15 @@ class RackspaceCtrl(BaseCloudCtrl):
     def set_region(self, region):
         """ Set self.region and self.driver. Returns True or False. """
 
+        if region == self.region and self.driver is not None:
+            # keep the drivers and their connections
+            return True
+
         try:
             self.driver = self.driver_cls(self.username, self.api_key,
                                           region=region)
-            self.storage_driver = self.storage_driver_cls(self.username, self.api_key,
-                                                          region=region)
+            # fails early on unknown regions, the drivers are created per thread
+            self.storage_driver_cls(self.username, self.api_key, region=region)
 
         except ValueError:
             return False
@@ -225,6 +301,25 @@ class RackspaceCtrl(BaseCloudCtrl):
         self.region = region
         return True
 
+    @property
+    def storage_driver(self):
+        """
+        Returns the storage driver of the current thread (the libcloud
+        connections cannot be shared between threads). The drivers reuse
+        the token of the provider and are replaced when it is renewed.
+        """
+
+        drivers = self._storage_drivers
+        if getattr(drivers, 'state', None) != (self.region, self.token):
+            kwargs = {}
+            endpoint = self.storage_endpoints.get(self.region.upper()) if self.region else None
+            if self.token and endpoint:
+                # no authentication request per thread
+                kwargs = {'ex_force_auth_token': self.token, 'ex_force_base_url': endpoint}
+            drivers.driver = self.storage_driver_cls(self.username, self.api_key, region=self.region, **kwargs)
+            drivers.state = (self.region, self.token)
+        return drivers.driver
+
     def _get_shared_images(self, username, region, gns3_version):
         """
         Given a GNS3 version, ask gns3-ias to share compatible images
@@ -241,7 +336,8 @@ class RackspaceCtrl(BaseCloudCtrl):
             "gns3_version": gns3_version,
         }
         try:
-            response = requests.get(endpoint, params=params)
+            with self._session_lock:
+                response = self.session.get(endpoint, params=params)
         except requests.ConnectionError:
             raise ApiError("Unable to connect to IAS")
 
@@ -278,34 +374,127 @@ class RackspaceCtrl(BaseCloudCtrl):
         return self.driver.get_image(image_id)
 
 
+class ProviderCache(object):
+    """
+    Process-wide cache of the authenticated cloud providers, the
+    providers (and their HTTP connections) are reused and their
+    token is renewed before it expires. The providers are shared
+    between threads, each thread uses its own storage driver.
+
+    :param identity_ep: identity API endpoint
+    :param refresh_margin: seconds before expiration when the tokens are renewed
+    """
+
+    def __init__(self, identity_ep=IDENTITY_ENDPOINT, refresh_margin=TOKEN_REFRESH_MARGIN):
+
+        self._identity_ep = identity_ep
+        self._refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._providers = {}
+        self._key_locks = {}
+
+    @staticmethod
+    def _key(cloud_settings):
+
+        return (cloud_settings['cloud_user_name'],
+                cloud_settings['cloud_api_key'],
+                cloud_settings['cloud_region'],
+                cloud_settings.get('gns3_ias_url', ''))
+
+    def get(self, cloud_settings):
+        """
+        Returns a provider already authenticated and with the region set.
+
+        :param cloud_settings: cloud settings dictionary
+        :return: a provider instance or None on errors
+        """
+
+        try:
+            key = self._key(cloud_settings)
+        except KeyError as e:
+            log.error("Unable to create cloud provider: {}".format(e))
+            return
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # only one thread authenticates for given settings
+        with key_lock:
+            provider = self._providers.get(key)
+            if provider is not None and provider.token_expires_in() > self._refresh_margin:
+                return provider
+
+            if provider is None:
+                username, apikey, region, ias_url = key
+                provider = RackspaceCtrl(username, apikey, ias_url, identity_ep=self._identity_ep)
+            else:
+                log.info("Renewing cloud provider token for {}".format(provider.username))
+
+            if not provider.authenticate():
+                log.error("Authentication failed for cloud provider")
+                self._providers.pop(key, None)
+                return
+
+            region = key[2]
+            if not region:
+                region = list(provider.list_regions()[0].values())[0]
+
+            if not provider.set_region(region):
+                log.error("Unable to set cloud provider region")
+                self._providers.pop(key, None)
+                return
+
+            self._providers[key] = provider
+            return provider
+
+    def invalidate(self, cloud_settings):
+        """
+        Forgets the provider for given settings (e.g. after an authorization error).
+
+        :param cloud_settings: cloud settings dictionary
+        """
+
+        try:
+            key = self._key(cloud_settings)
+        except KeyError:
+            return
+        with self._lock:
+            provider = self._providers.pop(key, None)
+        if provider is not None:
+            provider.session.close()
+
+    def clear(self):
+        """
+        Forgets all the providers.
+        """
+
+        with self._lock:
+            providers = list(self._providers.values())
+            self._providers.clear()
+        for provider in providers:
+            provider.session.close()
+
+
+_provider_cache = ProviderCache()
+
+
 def get_provider(cloud_settings):
     """
     Utility function to retrieve a cloud provider instance already authenticated and with the
-    region set
+    region set. The providers are cached and reused.
 
     :param cloud_settings: cloud settings dictionary
     :return: a provider instance or None on errors
     """
-    try:
-        username = cloud_settings['cloud_user_name']
-        apikey = cloud_settings['cloud_api_key']
-        region = cloud_settings['cloud_region']
-        ias_url = cloud_settings.get('gns3_ias_url', '')
-    except KeyError as e:
-        log.error("Unable to create cloud provider: {}".format(e))
-        return
 
-    provider = RackspaceCtrl(username, apikey, ias_url)
+    return _provider_cache.get(cloud_settings)
 
-    if not provider.authenticate():
-        log.error("Authentication failed for cloud provider")
-        return
 
-    if not region:
-        region = provider.list_regions().values()[0]
+def invalidate_provider(cloud_settings):
+    """
+    Utility function to forget a cached cloud provider.
 
-    if not provider.set_region(region):
-        log.error("Unable to set cloud provider region")
-        return
+    :param cloud_settings: cloud settings dictionary
+    """
 
-    return provider
+    _provider_cache.invalidate(cloud_settings)
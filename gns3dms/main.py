@@ -30,7 +30,6 @@ communication is lost.
 
 import os
 import sys
-import time
 import getopt
 import datetime
 import logging
@@ -53,6 +52,7 @@ EXTRA_LIB = "%s/modules" % (SCRIPT_PATH)
 sys.path.append(EXTRA_LIB)
 
 from . import cloud
+from .monitor import DeadManSwitch
 from rackspace_cloud import Rackspace
 
 LOG_NAME = "gns3dms"
@@ -63,6 +63,7 @@ sys.path.append(EXTRA_LIB)
 import daemon
 
 my_daemon = None
+dead_man_switch = None
 
 usage = """
 USAGE: %s
@@ -84,7 +85,8 @@ Options:
                       Default:
                       Example --deadtime=3600 (60 minutes)
 
-  --check-interval    Defaults to --deadtime, used for debugging
+  --check-interval    How often the file is checked when inotify is not available
+                      Default: 10
 
   --init-wait         Inital wait time, how long before we start pulling the file.
                       Default: 300 (5 min)
@@ -92,6 +94,8 @@ Options:
 
   --file              The file we monitor for updates
 
+  --socket            UNIX socket receiving the heartbeats (optional)
+
   -k                  Kill previous instance running in background
   --background        Run in background
 
@@ -117,6 +121,7 @@ def parse_cmd_line(argv):
                     "init-wait=",
                     "check-interval=",
                     "file=",
+                    "socket=",
                     "background",
                     )
     try:
@@ -137,6 +142,7 @@ def parse_cmd_line(argv):
     cmd_line_option_list["check-interval"] = None
     cmd_line_option_list["init-wait"] = 5 * 60
     cmd_line_option_list["file"] = None
+    cmd_line_option_list["socket"] = None
     cmd_line_option_list["shutdown"] = False
     cmd_line_option_list["daemon"] = False
     cmd_line_option_list['starttime'] = datetime.datetime.now()
@@ -175,6 +181,8 @@ def parse_cmd_line(argv):
             cmd_line_option_list["init-wait"] = int(val)
         elif (opt in ("--file")):
             cmd_line_option_list["file"] = val
+        elif (opt in ("--socket")):
+            cmd_line_option_list["socket"] = val
         elif (opt in ("-k")):
             cmd_line_option_list["shutdown"] = True
         elif (opt in ("--background")):
@@ -183,7 +191,7 @@ def parse_cmd_line(argv):
     if cmd_line_option_list["shutdown"] == False:
 
         if cmd_line_option_list["check-interval"] is None:
-            cmd_line_option_list["check-interval"] = cmd_line_option_list["deadtime"] + 120
+            cmd_line_option_list["check-interval"] = 10
 
         if cmd_line_option_list["cloud_user_name"] is None:
             print("You need to specify a username!!!!")
@@ -295,43 +303,27 @@ def _get_file_age(filename):
 
 def monitor_loop(options):
     """
-    Checks the options["file"] modification time against an interval. If the
-    modification time is too old we terminate the instance.
+    Waits for heartbeats (updates of options["file"] or datagrams received on
+    options["socket"]). If no heartbeat has been received for too long we
+    terminate the instance.
     """
 
-    log.debug("Waiting for init-wait to pass: %s" % (options["init-wait"]))
-    time.sleep(options["init-wait"])
-
-    log.info("Starting monitor_loop")
-
-    terminate_attempts = 0
+    global dead_man_switch
 
-    while options['shutdown'] == False:
-        log.debug("In monitor_loop for : %s" % (
-            datetime.datetime.now() - options['starttime'])
-        )
+    def terminate():
+        rksp = Rackspace(options)
+        rksp.terminate()
 
-        file_last_modified = _get_file_age(options["file"])
-        now = datetime.datetime.now()
-
-        delta = now - file_last_modified
-        log.debug("File last updated: %s seconds ago" % (delta.seconds))
-
-        if delta.seconds > options["deadtime"]:
-            log.warning("Deadtime exceeded, terminating instance ...")
-            #Terminate involes many layers of HTTP / API calls, lots of
-            #different errors types could occur here.
-            try:
-                rksp = Rackspace(options)
-                rksp.terminate()
-            except Exception as e:
-                log.critical("Exception during terminate: %s" % (e))
+    log.info("Starting monitor_loop")
 
-            terminate_attempts+=1
-            log.warning("Termination sent, attempt: %s" % (terminate_attempts))
-            time.sleep(600)
-        else:
-            time.sleep(options["check-interval"])
+    dead_man_switch = DeadManSwitch(terminate,
+                                    options["deadtime"],
+                                    heartbeat_file=options["file"],
+                                    socket_path=options["socket"],
+                                    init_wait=options["init-wait"],
+                                    poll_interval=options["check-interval"])
+    if options["shutdown"] == False:
+        dead_man_switch.run()
 
     log.info("Leaving monitor_loop")
     log.info("Shutting down")
@@ -352,6 +344,8 @@ def main():
 
         log.info("Received shutdown signal")
         options["shutdown"] = True
+        if dead_man_switch:
+            dead_man_switch.stop()
 
     pid_file = "%s/.gns3dms.pid" % (expanduser("~"))
 
@@ -28,7 +28,7 @@ import json
 import logging
 import socket
 
-from gns3dms.cloud.rackspace_ctrl import RackspaceCtrl
+from gns3dms.cloud.rackspace_ctrl import get_provider, invalidate_provider
 
 
 LOG_NAME = "gns3dms.rksp"
@@ -43,14 +43,22 @@ class Rackspace(object):
         self.instance_id = options["instance_id"]
         self.region = options["region"]
 
+        # the provider (and its token) is cached between termination attempts
+        self.cloud_settings = {
+            "cloud_user_name": self.username,
+            "cloud_api_key": self.apikey,
+            "cloud_region": self.region,
+        }
+
         log.debug("Authenticating with Rackspace")
         log.debug("My hostname: %s" % (self.hostname))
-        self.rksp = RackspaceCtrl(self.username, self.apikey)
-        self.authenticated = self.rksp.authenticate()
+        self.rksp = get_provider(self.cloud_settings)
+        self.authenticated = self.rksp is not None
 
     def _find_my_instance(self):
         if self.authenticated == False:
             log.critical("Not authenticated against rackspace!!!!")
+            return
 
         for region in self.rksp.list_regions():
             log.debug("Rackspace regions: %s" % (region))
@@ -65,6 +73,11 @@ class Rackspace(object):
                 return server
 
     def terminate(self):
-        server = self._find_my_instance()
-        log.warning("Sending termination")
-        self.rksp.delete_instance(server)
+        try:
+            server = self._find_my_instance()
+            log.warning("Sending termination")
+            self.rksp.delete_instance(server)
+        except Exception:
+            # authenticate again on the next attempt
+            invalidate_provider(self.cloud_settings)
+            raise
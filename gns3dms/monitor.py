@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Event driven dead man switch: waits for heartbeats (datagrams received on a
+UNIX socket or changes of the heartbeat file, watched with inotify or by
+polling) and terminates the instance when no heartbeat has been received
+for too long, retrying with an exponential backoff.
+"""
+
+import os
+import sys
+import time
+import sched
+import errno
+import socket
+import struct
+import fcntl
+import select
+import logging
+
+LOG_NAME = "gns3dms.monitor"
+log = logging.getLogger("%s" % (LOG_NAME))
+
+# inotify(7) events for a file written, touched or replaced
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_EVENT = struct.Struct("iIII")
+
+
+class InotifyWatcher(object):
+    """
+    Watches a file with inotify (Linux only). The directory is watched
+    so the file can be replaced or created after the watcher.
+
+    :param path: path of the file to watch
+    """
+
+    def __init__(self, path):
+
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not supported by the C library")
+
+        self._name = os.fsencode(os.path.basename(path))
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        directory = os.path.dirname(os.path.abspath(path))
+        mask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(self._fd, os.fsencode(directory), mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(error, "cannot watch {}".format(directory))
+
+    def fileno(self):
+
+        return self._fd
+
+    def read_events(self):
+        """
+        Reads the pending events.
+
+        :returns: True if the watched file has changed
+        """
+
+        changed = False
+        while True:
+            try:
+                data = os.read(self._fd, 4096)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset + IN_EVENT.size <= len(data):
+                _, _, _, length = IN_EVENT.unpack_from(data, offset)
+                offset += IN_EVENT.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if name == self._name:
+                    changed = True
+
+    def close(self):
+
+        os.close(self._fd)
+
+
+class PollingWatcher(object):
+    """
+    Watches the modification time of a file (fallback when inotify
+    is not available).
+
+    :param path: path of the file to watch
+    """
+
+    def __init__(self, path):
+
+        self._path = path
+        self._mtime = self.mtime()
+
+    def mtime(self):
+        """
+        Returns the modification time of the file.
+
+        :returns: timestamp or None if the file doesn't exist
+        """
+
+        try:
+            return os.path.getmtime(self._path)
+        except OSError:
+            return None
+
+    def check(self):
+        """
+        Checks the modification time.
+
+        :returns: True if the file has changed since the last check
+        """
+
+        mtime = self.mtime()
+        if mtime != self._mtime:
+            self._mtime = mtime
+            return mtime is not None
+        return False
+
+    def close(self):
+
+        pass
+
+
+class DeadManSwitch(object):
+    """
+    Dead man switch.
+
+    :param terminate: callable terminating the instance (calls the cloud provider)
+    :param deadtime: seconds without heartbeat before terminating the instance
+    :param heartbeat_file: file updated by the server (optional)
+    :param socket_path: path of the UNIX socket receiving the heartbeats (optional)
+    :param init_wait: seconds to wait before the first termination
+    :param poll_interval: seconds between checks of the file when inotify is not available
+    :param retry_delay: seconds before the first termination retry
+    :param max_retry_delay: maximum seconds between termination retries
+    :param clock: monotonic time function
+    """
+
+    def __init__(self,
+                 terminate,
+                 deadtime,
+                 heartbeat_file=None,
+                 socket_path=None,
+                 init_wait=0,
+                 poll_interval=10,
+                 retry_delay=30,
+                 max_retry_delay=600,
+                 clock=time.monotonic):
+
+        self._terminate = terminate
+        self._deadtime = deadtime
+        self._poll_interval = poll_interval
+        self._retry_delay = retry_delay
+        self._max_retry_delay = max_retry_delay
+        self._clock = clock
+        self._scheduler = sched.scheduler(clock, lambda delay: None)
+        self._readers = {}  # file object -> callback
+        self._check_event = None
+        self._poll_event = None
+        self._stopped = False
+        self._terminate_attempts = 0
+        self._next_retry_delay = retry_delay
+
+        now = clock()
+        self._not_before = now + init_wait
+        self._last_heartbeat = now
+
+        # a pipe wakes up the loop when the switch is stopped (by a signal handler)
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        for fd in (self._wakeup_read, self._wakeup_write):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._readers[self._wakeup_read] = self._wakeup
+
+        self._watcher = None
+        if heartbeat_file:
+            try:
+                self._watcher = InotifyWatcher(heartbeat_file)
+                self._readers[self._watcher] = self._file_changed
+                log.info("Watching %s with inotify" % (heartbeat_file))
+            except OSError as e:
+                log.info("inotify not available (%s), polling %s every %s seconds" % (e, heartbeat_file, poll_interval))
+                self._watcher = PollingWatcher(heartbeat_file)
+                self._poll_event = self._scheduler.enter(poll_interval, 0, self._poll)
+            try:
+                # the last heartbeat written before we started
+                age = time.time() - os.path.getmtime(heartbeat_file)
+                self._last_heartbeat = now - max(age, 0)
+            except OSError:
+                pass
+
+        self._socket = None
+        self._socket_path = socket_path
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._socket.setblocking(False)
+            self._socket.bind(socket_path)
+            self._readers[self._socket] = self._datagrams_received
+            log.info("Receiving heartbeats on %s" % (socket_path))
+
+        self._schedule_check()
+
+    @property
+    def last_heartbeat(self):
+        """
+        Returns the (monotonic) time of the last heartbeat.
+
+        :returns: timestamp
+        """
+
+        return self._last_heartbeat
+
+    @property
+    def terminate_attempts(self):
+        """
+        Returns the number of termination attempts.
+
+        :returns: number of attempts
+        """
+
+        return self._terminate_attempts
+
+    def heartbeat(self):
+        """
+        Records a heartbeat: the termination deadline is pushed back
+        and the pending termination retries are cancelled.
+        """
+
+        self._last_heartbeat = self._clock()
+        if self._terminate_attempts:
+            log.info("Heartbeat received after %s termination attempts" % (self._terminate_attempts))
+        self._terminate_attempts = 0
+        self._next_retry_delay = self._retry_delay
+        self._schedule_check()
+
+    def _schedule_check(self, when=None):
+        """
+        (Re)schedules the next deadline check.
+
+        :param when: time of the check (default is the termination deadline)
+        """
+
+        if self._check_event is not None:
+            try:
+                self._scheduler.cancel(self._check_event)
+            except ValueError:
+                pass
+        if when is None:
+            when = max(self._last_heartbeat + self._deadtime, self._not_before)
+        self._check_event = self._scheduler.enterabs(when, 0, self._check)
+
+    def _check(self):
+        """
+        Terminates the instance if the deadline has passed.
+        """
+
+        self._check_event = None
+        now = self._clock()
+        if now - self._last_heartbeat < self._deadtime or now < self._not_before:
+            # a heartbeat has been received in the meantime
+            self._schedule_check()
+            return
+
+        log.warning("Deadtime exceeded, terminating instance ...")
+        self._terminate_attempts += 1
+        # terminating involves many layers of HTTP / API calls,
+        # lots of different errors types could occur here.
+        try:
+            self._terminate()
+            log.warning("Termination sent, attempt: %s" % (self._terminate_attempts))
+        except Exception as e:
+            log.critical("Exception during terminate: %s" % (e))
+
+        # retry until the instance is gone or a heartbeat is received
+        delay = self._next_retry_delay
+        self._next_retry_delay = min(self._next_retry_delay * 2, self._max_retry_delay)
+        log.info("Next termination attempt in %s seconds" % (delay))
+        self._schedule_check(now + delay)
+
+    def _poll(self):
+        """
+        Checks the heartbeat file (polling mode).
+        """
+
+        if self._watcher.check():
+            self.heartbeat()
+        self._poll_event = self._scheduler.enter(self._poll_interval, 0, self._poll)
+
+    def _file_changed(self):
+
+        if self._watcher.read_events():
+            self.heartbeat()
+
+    def _datagrams_received(self):
+
+        received = False
+        while True:
+            try:
+                self._socket.recv(64)
+                received = True
+            except (BlockingIOError, InterruptedError):
+                break
+        if received:
+            self.heartbeat()
+
+    def _wakeup(self):
+
+        try:
+            while os.read(self._wakeup_read, 64):
+                pass
+        except BlockingIOError:
+            pass
+
+    def run_once(self, timeout=None):
+        """
+        Waits for heartbeats until the next scheduled event
+        and runs the scheduled events that are due.
+
+        :param timeout: maximum seconds to wait (None to wait for the next event)
+        """
+
+        delay = self._scheduler.run(blocking=False)
+        if delay is not None and (timeout is None or delay < timeout):
+            timeout = delay
+        try:
+            readable = select.select(list(self._readers), [], [], timeout)[0]
+        except InterruptedError:
+            # Python < 3.5 doesn't retry the system calls interrupted by a signal
+            readable = []
+        for reader in readable:
+            self._readers[reader]()
+        self._scheduler.run(blocking=False)
+
+    def run(self):
+        """
+        Runs the dead man switch until it is stopped.
+        """
+
+        log.info("Starting dead man switch, deadtime: %s seconds" % (self._deadtime))
+        while not self._stopped:
+            self.run_once()
+        self.close()
+        log.info("Dead man switch stopped")
+
+    def stop(self):
+        """
+        Stops the dead man switch (can be called from a signal handler).
+        """
+
+        self._stopped = True
+        try:
+            os.write(self._wakeup_write, b"\0")
+        except OSError:
+            pass
+
+    def close(self):
+        """
+        Releases the file descriptors.
+        """
+
+        self._readers.clear()
+        if self._watcher:
+            self._watcher.close()
+            self._watcher = None
+        if self._socket:
+            self._socket.close()
+            self._socket = None
+            try:
+                os.remove(self._socket_path)
+            except OSError:
+                pass
+        for fd in (self._wakeup_read, self._wakeup_write):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
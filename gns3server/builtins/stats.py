@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Keeps the resource telemetry pushed by the modules and sends it
+to requesting clients in JSON-RPC Websocket handler.
+"""
+
+from ..config import Config
+from ..telemetry import TelemetryStore
+from ..sharding import module_name
+from ..jsonrpc import JSONRPCResponse
+from ..jsonrpc import JSONRPCNotification
+
+import logging
+log = logging.getLogger(__name__)
+
+_store = None
+
+
+def get_telemetry_store():
+    """
+    Returns the telemetry store of this server.
+
+    :returns: TelemetryStore instance
+    """
+
+    global _store
+    if _store is None:
+        server_config = Config.instance().get_default_section()
+        _store = TelemetryStore(capacity=server_config.getint("telemetry_history", fallback=120),
+                                cpu_threshold=server_config.getfloat("telemetry_cpu_threshold", fallback=0),
+                                rss_threshold=server_config.getfloat("telemetry_rss_threshold", fallback=0) * 1024 * 1024)
+    return _store
+
+
+def telemetry(handler_class, module, params):
+    """
+    Module notification with the latest resource samples of a module.
+    Clients are notified when a node crosses a threshold.
+
+    :param handler_class: JSONRPCWebSocket class
+    :param module: name of the module pushing the samples (or worker identity)
+    :param params: JSON-RPC notification params
+    """
+
+    # the workers of a sharded module share the history of the module
+    breaches = get_telemetry_store().add_samples(module_name(module), params["timestamp"], params["nodes"], worker=module)
+    for breach in breaches:
+        log.warning("{module} node {name} [id={id}]: {field} is {value} (threshold {threshold})".format(**breach))
+        notification = JSONRPCNotification("builtin.stats_threshold", breach)()
+        for client in handler_class.clients:
+            client.write_message(notification)
+
+
+def stats(handler, request_id, params):
+    """
+    Builtin destination to return the resource history (CPU, RSS and I/O)
+    of the nodes and modules.
+
+    Optional request parameters:
+    - module (module name)
+    - id (node identifier, requires module)
+    - samples (number of most recent samples)
+
+    :param handler: JSONRPCWebSocket instance
+    :param request_id: JSON-RPC call identifier
+    :param params: JSON-RPC method params
+    """
+
+    if params is None:
+        params = {}
+    response = get_telemetry_store().to_json(module=params.get("module"),
+                                             node_id=params.get("id"),
+                                             count=params.get("samples"))
+    handler.write_message(JSONRPCResponse(response, request_id)())
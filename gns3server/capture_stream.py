@@ -0,0 +1,540 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Live streaming of packet captures.
+
+Capture files written by the emulators (Dynamips capture filters, iouyap,
+VirtualBox) are followed as they grow and complete pcap records are pushed
+to subscribers (HTTP or Websocket clients). Each subscriber has a bounded
+queue: when a client cannot keep up, whole records are dropped and counted
+so the stream always stays a valid pcap file.
+"""
+
+import os
+import sys
+import struct
+import collections
+import tornado.ioloop
+
+import logging
+log = logging.getLogger(__name__)
+
+PCAP_HEADER_SIZE = 24
+PCAP_RECORD_HEADER_SIZE = 16
+
+# pcap magic numbers (microsecond and nanosecond resolutions)
+PCAP_MAGICS = {b"\xd4\xc3\xb2\xa1": "<",
+               b"\xa1\xb2\xc3\xd4": ">",
+               b"\x4d\x3c\xb2\xa1": "<",
+               b"\xa1\xb2\x3c\x4d": ">"}
+
+# records larger than this are considered as a corrupted file
+MAX_RECORD_SIZE = 262144
+
+
+def pcap_endianness(header):
+    """
+    Returns the byte order of a pcap file.
+
+    :param header: pcap global header
+
+    :returns: struct byte order character or None if this is not a pcap file
+    """
+
+    return PCAP_MAGICS.get(header[:4])
+
+
+def split_pcap_records(data, endianness):
+    """
+    Splits pcap data into complete records.
+
+    :param data: pcap data following the global header
+    :param endianness: struct byte order character
+
+    :returns: tuple (list of records, remaining incomplete data)
+    """
+
+    records = []
+    offset = 0
+    length = len(data)
+    record_size_format = endianness + "I"
+    while length - offset >= PCAP_RECORD_HEADER_SIZE:
+        captured_length, = struct.unpack_from(record_size_format, data, offset + 8)
+        if captured_length > MAX_RECORD_SIZE:
+            raise ValueError("record of {} bytes".format(captured_length))
+        end = offset + PCAP_RECORD_HEADER_SIZE + captured_length
+        if end > length:
+            break
+        records.append(data[offset:end])
+        offset = end
+    return records, data[offset:]
+
+
+class PcapTail(object):
+    """
+    Incrementally reads complete records from a growing pcap file.
+
+    :param path: path to the pcap file
+    """
+
+    def __init__(self, path):
+
+        self._path = path
+        self._file = None
+        self._inode = None
+        self._buffer = b""
+        self._endianness = None
+        self.header = None
+
+    @property
+    def path(self):
+        """
+        Returns the path to the pcap file.
+
+        :returns: path
+        """
+
+        return self._path
+
+    def _open(self):
+
+        try:
+            self._file = open(self._path, "rb")
+        except OSError:
+            return False
+        self._inode = os.fstat(self._file.fileno()).st_ino
+        self._buffer = b""
+        self._endianness = None
+        self.header = None
+        return True
+
+    def _reopen_if_replaced(self):
+        """
+        Detects if the file has been truncated or replaced (e.g. a new capture
+        on the same port) and restarts from its beginning.
+
+        :returns: True if the file has been reopened
+        """
+
+        try:
+            st = os.stat(self._path)
+        except OSError:
+            return False
+        if st.st_ino != self._inode or st.st_size < self._file.tell():
+            self.close()
+            return self._open()
+        return False
+
+    def skip_to_end(self):
+        """
+        Skips the records already in the file, only the pcap
+        global header and the following records will be read.
+        """
+
+        if self._file is None and not self._open():
+            return
+        self.read()
+        if self.header is not None:
+            self._file.seek(0, os.SEEK_END)
+            self._buffer = b""
+
+    def read(self):
+        """
+        Reads the new complete records.
+
+        :returns: list of records (record header + packet data)
+        """
+
+        if self._file is None:
+            if not self._open():
+                return []
+        else:
+            self._reopen_if_replaced()
+
+        data = self._file.read()
+        if data:
+            self._buffer += data
+
+        if self.header is None:
+            if len(self._buffer) < PCAP_HEADER_SIZE:
+                return []
+            self._endianness = pcap_endianness(self._buffer)
+            if self._endianness is None:
+                log.warning("{} is not a pcap file".format(self._path))
+                self._buffer = b""
+                return []
+            self.header = self._buffer[:PCAP_HEADER_SIZE]
+            self._buffer = self._buffer[PCAP_HEADER_SIZE:]
+
+        try:
+            records, self._buffer = split_pcap_records(self._buffer, self._endianness)
+        except ValueError as e:
+            log.warning("{} is corrupted: {}".format(self._path, e))
+            records, self._buffer = [], b""
+        return records
+
+    def close(self):
+        """
+        Closes the pcap file.
+        """
+
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+class CaptureSubscriber(object):
+    """
+    Subscriber to a capture stream with a bounded queue.
+
+    :param writer: function called with (data, callback) to send data to the client,
+    the callback must be called once the data has been sent
+    :param max_pending: maximum number of bytes waiting to be sent before dropping records
+    """
+
+    def __init__(self, writer, max_pending=1048576):
+
+        self._writer = writer
+        self._pending = collections.deque()
+        self._pending_bytes = 0
+        self._writing = False
+        self.max_pending = max_pending
+        self.records_sent = 0
+        self.records_dropped = 0
+        self.bytes_sent = 0
+        self.closed = False
+
+    def push(self, data, droppable=True):
+        """
+        Queues data for the client.
+
+        :param data: pcap header or record
+        :param droppable: the data can be dropped if the client is too slow
+
+        :returns: False if the data has been dropped
+        """
+
+        if self.closed:
+            return False
+        if droppable and self._pending_bytes + len(data) > self.max_pending:
+            self.records_dropped += 1
+            return False
+        self._pending.append(data)
+        self._pending_bytes += len(data)
+        if droppable:
+            self.records_sent += 1
+        self._flush()
+        return True
+
+    def _flush(self):
+
+        if self._writing or not self._pending or self.closed:
+            return
+        data = b"".join(self._pending)
+        self._pending.clear()
+        self._pending_bytes = 0
+        self._writing = True
+        self.bytes_sent += len(data)
+        self._writer(data, self._on_written)
+
+    def _on_written(self):
+
+        self._writing = False
+        self._flush()
+
+    def stats(self):
+        """
+        Returns the subscriber counters.
+
+        :returns: dictionary
+        """
+
+        return {"records_sent": self.records_sent,
+                "records_dropped": self.records_dropped,
+                "bytes_sent": self.bytes_sent,
+                "bytes_pending": self._pending_bytes}
+
+    def close(self):
+        """
+        Stops sending data to the client.
+        """
+
+        self.closed = True
+        self._pending.clear()
+        self._pending_bytes = 0
+
+
+class CaptureSource(object):
+    """
+    Shared reader of one capture file, pushing records to its subscribers.
+
+    :param path: path to the pcap file
+    """
+
+    def __init__(self, path):
+
+        self._tail = PcapTail(path)
+        self._tail.skip_to_end()
+        self._subscribers = []
+        self.records_read = 0
+
+    @property
+    def path(self):
+
+        return self._tail.path
+
+    @property
+    def subscribers(self):
+
+        return list(self._subscribers)
+
+    def subscribe(self, subscriber):
+        """
+        Adds a subscriber, the pcap global header is sent first.
+
+        :param subscriber: CaptureSubscriber instance
+        """
+
+        self._subscribers.append(subscriber)
+        if self._tail.header is not None:
+            subscriber.push(self._tail.header, droppable=False)
+
+    def unsubscribe(self, subscriber):
+        """
+        Removes a subscriber.
+
+        :param subscriber: CaptureSubscriber instance
+        """
+
+        if subscriber in self._subscribers:
+            self._subscribers.remove(subscriber)
+        subscriber.close()
+
+    def poll(self):
+        """
+        Reads the new records and pushes them to the subscribers.
+        """
+
+        had_header = self._tail.header is not None
+        records = self._tail.read()
+        if not had_header and self._tail.header is not None:
+            # the capture file has just been created (or replaced)
+            for subscriber in self._subscribers:
+                subscriber.push(self._tail.header, droppable=False)
+        self.records_read += len(records)
+        for record in records:
+            for subscriber in self._subscribers:
+                subscriber.push(record)
+
+    def close(self):
+        """
+        Closes the source and all its subscribers.
+        """
+
+        for subscriber in self._subscribers:
+            subscriber.close()
+        self._subscribers = []
+        self._tail.close()
+
+
+class Inotify(object):
+    """
+    Minimal inotify binding (Linux only) using ctypes.
+
+    :param callback: function called with the watched directory when it changes
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    def __init__(self, callback, io_loop=None):
+
+        import ctypes
+        import ctypes.util
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        self._fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._callback = callback
+        self._watches = {}  # watch descriptor -> directory
+        self._io_loop = io_loop or tornado.ioloop.IOLoop.current()
+        self._io_loop.add_handler(self._fd, self._on_events, tornado.ioloop.IOLoop.READ)
+
+    @staticmethod
+    def available():
+        """
+        Returns True if inotify can be used on this platform.
+        """
+
+        return sys.platform.startswith("linux")
+
+    def watch(self, directory):
+        """
+        Watches a directory.
+
+        :param directory: path to the directory
+        """
+
+        if directory in self._watches.values():
+            return
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), mask)
+        if wd < 0:
+            raise OSError("could not watch {}".format(directory))
+        self._watches[wd] = directory
+
+    def unwatch(self, directory):
+        """
+        Stops watching a directory.
+
+        :param directory: path to the directory
+        """
+
+        for wd, watched in list(self._watches.items()):
+            if watched == directory:
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._watches[wd]
+
+    def _on_events(self, fd, events):
+
+        changed = set()
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            offset = 0
+            while offset + 16 <= len(data):
+                wd, mask, cookie, name_length = struct.unpack_from("iIII", data, offset)
+                if wd in self._watches:
+                    changed.add(self._watches[wd])
+                offset += 16 + name_length
+        for directory in changed:
+            self._callback(directory)
+
+    def close(self):
+        """
+        Closes the inotify instance.
+        """
+
+        self._io_loop.remove_handler(self._fd)
+        os.close(self._fd)
+        self._watches = {}
+
+
+class CaptureStreamer(object):
+    """
+    Registry of the capture sources, followed with inotify when
+    available and periodically polled otherwise (and as a safety net).
+
+    :param poll_interval: polling interval in milliseconds
+    """
+
+    def __init__(self, poll_interval=200, io_loop=None):
+
+        self._sources = {}
+        self._io_loop = io_loop or tornado.ioloop.IOLoop.current()
+        self._inotify = None
+        if Inotify.available():
+            try:
+                self._inotify = Inotify(self._directory_changed, self._io_loop)
+                poll_interval = max(poll_interval, 1000)
+            except (OSError, AttributeError) as e:
+                log.warning("inotify is not available, falling back to polling: {}".format(e))
+        self._poller = tornado.ioloop.PeriodicCallback(self.poll, poll_interval, io_loop=self._io_loop)
+        self._polling = False
+
+    def subscribe(self, path, subscriber):
+        """
+        Subscribes to a capture file.
+
+        :param path: path to the pcap file
+        :param subscriber: CaptureSubscriber instance
+
+        :returns: CaptureSource instance
+        """
+
+        path = os.path.realpath(path)
+        source = self._sources.get(path)
+        if source is None:
+            source = self._sources[path] = CaptureSource(path)
+            if self._inotify:
+                try:
+                    self._inotify.watch(os.path.dirname(path))
+                except OSError as e:
+                    log.warning("{}, polling instead".format(e))
+            if not self._polling:
+                self._poller.start()
+                self._polling = True
+            log.info("streaming capture {}".format(path))
+        source.subscribe(subscriber)
+        return source
+
+    def unsubscribe(self, source, subscriber):
+        """
+        Unsubscribes from a capture file, the source is closed
+        once it has no subscribers.
+
+        :param source: CaptureSource instance
+        :param subscriber: CaptureSubscriber instance
+        """
+
+        source.unsubscribe(subscriber)
+        if not source.subscribers and self._sources.get(source.path) is source:
+            source.close()
+            del self._sources[source.path]
+            directory = os.path.dirname(source.path)
+            if self._inotify and not any(os.path.dirname(path) == directory for path in self._sources):
+                self._inotify.unwatch(directory)
+            if not self._sources:
+                self._poller.stop()
+                self._polling = False
+            log.info("stopped streaming capture {}".format(source.path))
+
+    def _directory_changed(self, directory):
+
+        for path, source in list(self._sources.items()):
+            if os.path.dirname(path) == directory:
+                source.poll()
+
+    def poll(self):
+        """
+        Polls all the capture sources.
+        """
+
+        for source in list(self._sources.values()):
+            source.poll()
+
+    def stats(self):
+        """
+        Returns the counters of all the streams.
+
+        :returns: dictionary (path -> stream counters)
+        """
+
+        stats = {}
+        for path, source in self._sources.items():
+            stats[path] = {"records_read": source.records_read,
+                           "subscribers": [subscriber.stats() for subscriber in source.subscribers]}
+        return stats
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Envelope of the messages exchanged between the server and the module processes.
+
+A message is one ZeroMQ frame: a header line (compact JSON array ending with
+a newline) followed by the payload, the JSON-RPC message encoded with the codec
+named in the header. The session ID is in the header (null when the message
+isn't related to a session).
+
+Requests sent to a module have a header [session ID, codec, time sent].
+Messages sent by a module have a header [session ID, codec, JSON-RPC id,
+method, error code] so the server can track the requests and forward the
+payload to the Websocket client without decoding it. Messages for a client
+are always encoded in JSON, the other codecs are only used for the messages
+between the server and the modules (requests and notifications to the
+server itself).
+"""
+
+import json
+import time
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+
+
+def available_codec(codec):
+    """
+    Returns the codec to use, JSON if the requested codec isn't available.
+
+    :param codec: codec name
+
+    :returns: codec name
+    """
+
+    if codec == MSGPACK and msgpack is not None:
+        return MSGPACK
+    return JSON
+
+
+def encode(codec, message):
+    """
+    Encodes a message.
+
+    :param codec: codec name
+    :param message: message (JSON compatible)
+
+    :returns: bytes
+    """
+
+    if codec == MSGPACK:
+        return msgpack.packb(message, use_bin_type=True)
+    return json.dumps(message, separators=(",", ":")).encode("utf-8")
+
+
+def decode(codec, payload):
+    """
+    Decodes a message.
+
+    :param codec: codec name
+    :param payload: encoded message (bytes)
+
+    :returns: message
+
+    :raises ValueError: if the payload cannot be decoded
+    """
+
+    if codec == MSGPACK:
+        if msgpack is None:
+            raise ValueError("msgpack is not installed")
+        try:
+            return msgpack.unpackb(payload, raw=False)
+        except Exception as e:
+            raise ValueError("could not decode msgpack payload: {}".format(e))
+    return json.loads(payload.decode("utf-8"))
+
+
+def _split(frames):
+    """
+    Splits a message into its header and payload.
+
+    :param frames: list of frames
+
+    :returns: tuple (header, payload)
+
+    :raises ValueError: if the message is malformed
+    """
+
+    if len(frames) != 1:
+        raise ValueError("expected 1 frame, got {}".format(len(frames)))
+    header, separator, payload = frames[0].partition(b"\n")
+    if not separator:
+        raise ValueError("missing envelope header")
+    return json.loads(header.decode("utf-8")), payload
+
+
+def encode_request(session_id, request, codec=JSON):
+    """
+    Builds the frames of a request sent to a module.
+
+    :param session_id: session ID (or None)
+    :param request: JSON-RPC request
+    :param codec: codec name
+
+    :returns: list of frames
+    """
+
+    header = json.dumps([session_id, codec, time.time()], separators=(",", ":")).encode("utf-8")
+    return [header + b"\n" + encode(codec, request)]
+
+
+def decode_request(frames):
+    """
+    Decodes the frames of a request received by a module.
+
+    :param frames: list of frames
+
+    :returns: tuple (session ID, JSON-RPC request, time sent)
+
+    :raises ValueError: if the request cannot be decoded
+    """
+
+    (session_id, codec, sent), payload = _split(frames)
+    return session_id, decode(codec, payload), sent
+
+
+def encode_module_message(session_id, message, codec=JSON):
+    """
+    Builds the frames of a message sent by a module.
+
+    :param session_id: session ID (None for the messages to the server itself)
+    :param message: JSON-RPC response or notification
+    :param codec: codec name (JSON is used for the messages sent to the clients)
+
+    :returns: list of frames
+    """
+
+    if session_id is not None:
+        codec = JSON
+    error = message.get("error")
+    header = [session_id, codec, message.get("id"), message.get("method"), error.get("code") if error else None]
+    return [json.dumps(header, separators=(",", ":")).encode("utf-8") + b"\n" + encode(codec, message)]
+
+
+def decode_module_header(frames):
+    """
+    Decodes the header of a message sent by a module,
+    the payload is left encoded.
+
+    :param frames: list of frames (without the module identity)
+
+    :returns: tuple (session ID, codec, JSON-RPC id, method, error code, payload)
+
+    :raises ValueError: if the message is malformed
+    """
+
+    (session_id, codec, request_id, method, error_code), payload = _split(frames)
+    return session_id, codec, request_id, method, error_code, payload
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Live packet capture streaming handlers (chunked HTTP and Websocket).
+
+The capture_file_path returned by the *.start_capture methods is given
+as the "path" argument, e.g. wireshark can follow a remote capture with:
+curl -sN "http://server:8000/capture/stream?path=<capture_file_path>" | wireshark -k -i -
+"""
+
+import os
+import tempfile
+import tornado.web
+import tornado.ioloop
+from .auth_handler import GNS3BaseHandler
+from .auth_handler import GNS3WebSocketBaseHandler
+from .jsonrpc_websocket import server_metrics
+from ..capture_stream import CaptureStreamer
+from ..capture_stream import CaptureSubscriber
+from ..config import Config
+
+import logging
+log = logging.getLogger(__name__)
+
+RECORDS_SENT = server_metrics.counter("gns3_capture_records_sent_total",
+                                      "Capture records sent to streaming clients")
+RECORDS_DROPPED = server_metrics.counter("gns3_capture_records_dropped_total",
+                                         "Capture records dropped because a streaming client was too slow")
+SUBSCRIBERS = server_metrics.gauge("gns3_capture_subscribers",
+                                   "Clients streaming a packet capture")
+
+_streamer = None
+
+
+def get_capture_streamer():
+    """
+    Returns the capture streamer shared by all the handlers.
+
+    :returns: CaptureStreamer instance
+    """
+
+    global _streamer
+    if _streamer is None:
+        server_config = Config.instance().get_default_section()
+        _streamer = CaptureStreamer(poll_interval=server_config.getint("capture_poll_interval", fallback=200))
+    return _streamer
+
+
+def capture_file_path(path):
+    """
+    Validates a capture file path given by a client: only files in a "captures"
+    directory below the projects or temporary directories can be streamed.
+
+    :param path: path to the capture file
+
+    :returns: real path to the capture file
+    """
+
+    server_config = Config.instance().get_default_section()
+    projects_dir = os.path.expandvars(os.path.expanduser(server_config.get("projects_directory", "~/GNS3/projects")))
+    temp_dir = server_config.get("temporary_directory", tempfile.gettempdir())
+
+    path = os.path.realpath(path)
+    if os.path.basename(os.path.dirname(path)) != "captures":
+        raise tornado.web.HTTPError(403, "{} is not in a captures directory".format(path))
+    for root in (projects_dir, temp_dir):
+        root = os.path.realpath(root)
+        if os.path.commonprefix([root + os.sep, path]) == root + os.sep:
+            return path
+    raise tornado.web.HTTPError(403, "{} is not in the projects or temporary directories".format(path))
+
+
+class CaptureStreamMixin(object):
+    """
+    Common code to subscribe a handler to a capture stream.
+    """
+
+    def _subscribe(self, writer):
+
+        server_config = Config.instance().get_default_section()
+        path = capture_file_path(self.get_argument("path"))
+        max_pending = server_config.getint("capture_max_pending_bytes", fallback=1048576)
+        self._subscriber = CaptureSubscriber(writer, max_pending)
+        self._source = get_capture_streamer().subscribe(path, self._subscriber)
+        SUBSCRIBERS.inc()
+        log.info("{} streaming capture {}".format(self.request.remote_ip, path))
+
+    def _unsubscribe(self):
+
+        if getattr(self, "_source", None) is None:
+            return
+        get_capture_streamer().unsubscribe(self._source, self._subscriber)
+        SUBSCRIBERS.dec()
+        stats = self._subscriber.stats()
+        RECORDS_SENT.inc(amount=stats["records_sent"])
+        RECORDS_DROPPED.inc(amount=stats["records_dropped"])
+        log.info("{} stopped streaming capture {}: {records_sent} records sent, {records_dropped} dropped".format(
+                 self.request.remote_ip, self._source.path, **stats))
+        self._source = None
+
+
+class CaptureStreamHandler(CaptureStreamMixin, GNS3BaseHandler):
+    """
+    Streams a capture file as a chunked HTTP response (pcap format).
+    """
+
+    @tornado.web.asynchronous
+    @tornado.web.authenticated
+    def get(self):
+
+        self.set_header("Content-Type", "application/vnd.tcpdump.pcap")
+        self.set_header("Cache-Control", "no-cache")
+        self._subscribe(self._write)
+
+    def _write(self, data, callback):
+
+        if self.request.connection.stream.closed():
+            return
+        self.write(data)
+        self.flush(callback=callback)
+
+    def on_connection_close(self):
+
+        self._unsubscribe()
+
+    def on_finish(self):
+
+        self._unsubscribe()
+
+
+class CaptureWebSocket(CaptureStreamMixin, GNS3WebSocketBaseHandler):
+    """
+    Streams a capture file as binary Websocket frames (pcap format),
+    the first frame is the pcap global header.
+    """
+
+    def check_origin(self, origin):
+        return True
+
+    def open(self):
+
+        if not self.get_current_user():
+            log.info("capture streaming non-authenticated user attempt")
+            self.close()
+            return
+        try:
+            self._subscribe(self._write)
+        except tornado.web.HTTPError as e:
+            log.warning("capture streaming refused: {}".format(e))
+            self.close()
+
+    def _write(self, data, callback):
+
+        stream = self.ws_connection.stream if self.ws_connection else None
+        if stream is None or stream.closed():
+            return
+        self.write_message(data, binary=True)
+        self._wait_for_drain(stream, callback)
+
+    def _wait_for_drain(self, stream, callback):
+        """
+        Calls the callback once the data has been written to the socket.
+        """
+
+        if stream.closed():
+            return
+        if not stream.writing():
+            callback()
+        else:
+            io_loop = tornado.ioloop.IOLoop.current()
+            io_loop.add_timeout(io_loop.time() + 0.01, lambda: self._wait_for_drain(stream, callback))
+
+    def on_message(self, message):
+
+        pass
+
+    def on_close(self):
+
+        self._unsubscribe()
@@ -19,22 +19,327 @@
 JSON-RPC protocol over Websockets.
 """
 
-import zmq
 import uuid
+import time
+import itertools
+import collections
+import tornado.ioloop
 import tornado.websocket
 from .auth_handler import GNS3WebSocketBaseHandler
+from .websocket_deflate import DeflateWebSocketMixin
 from tornado.escape import json_decode
+from tornado.escape import json_encode
 from ..jsonrpc import JSONRPCParseError
 from ..jsonrpc import JSONRPCInvalidRequest
 from ..jsonrpc import JSONRPCMethodNotFound
 from ..jsonrpc import JSONRPCNotification
 from ..jsonrpc import JSONRPCCustomError
+from ..jsonrpc import JSONRPCInternalError
+from ..jsonrpc import JSONRPCResponse
+from ..metrics import MetricsRegistry
+from ..metrics import UNKNOWN_METHOD
+from ..sharding import WorkerRouter
+from ..sharding import broadcast_merge
+from ..module_spawner import ModuleSpawner
+from .. import envelope
 
 import logging
 log = logging.getLogger(__name__)
 
+# metrics of the server process (exposed by the /metrics handler)
+server_metrics = MetricsRegistry()
+REQUESTS = server_metrics.counter("gns3_jsonrpc_requests_total",
+                                  "JSON-RPC requests received over the Websocket",
+                                  ("method",))
+ERRORS = server_metrics.counter("gns3_jsonrpc_errors_total",
+                                "JSON-RPC error responses",
+                                ("method", "code"))
+LATENCY = server_metrics.histogram("gns3_jsonrpc_request_duration_seconds",
+                                   "End-to-end JSON-RPC request latency (Websocket request to response)",
+                                   ("method",))
+IN_FLIGHT = server_metrics.gauge("gns3_jsonrpc_requests_in_flight",
+                                 "JSON-RPC requests sent to a module and waiting for a response",
+                                 ("module",))
+DROPPED = server_metrics.counter("gns3_websocket_messages_dropped_total",
+                                 "Messages for slow Websocket clients dropped from the outbound queue",
+                                 ("reason",))
+COALESCED = server_metrics.counter("gns3_websocket_messages_coalesced_total",
+                                   "Queued notifications replaced by a newer notification",
+                                   ("method",))
+COMPRESSION_INPUT = server_metrics.counter("gns3_websocket_compression_input_bytes_total",
+                                           "Size of the Websocket messages compressed with permessage-deflate")
+COMPRESSION_OUTPUT = server_metrics.counter("gns3_websocket_compression_output_bytes_total",
+                                            "Compressed size of the Websocket messages compressed with permessage-deflate")
+
+
+class OutboundQueue(object):
+    """
+    Outbound messages of a Websocket client. Messages are written right away
+    while the bytes written since the socket buffer was last empty are below
+    the high-water mark, otherwise they are queued and written when the buffer
+    is flushed. A queued notification with the same coalescing key as a new
+    one is replaced by the new one.
+
+    When the queue exceeds its maximum size, the oldest notifications
+    are dropped. If only responses are left, the client cannot keep up:
+    the queue is discarded and the overflow callback is called.
+
+    :param write: function writing a message to the client (message, binary)
+    :param wait_flush: function calling a callback once the socket buffer is empty
+    :param high_water_mark: size (bytes) of the unflushed messages above which messages are queued
+    :param max_size: maximum size (bytes) of the queued messages
+    :param on_overflow: function called when the queue overflows
+    :param io_loop: I/O loop used to wait for the socket buffer to drain
+    """
+
+    drain_interval = 0.01  # seconds between checks of the queue while the buffer is full
+
+    def __init__(self, write, wait_flush, high_water_mark, max_size, on_overflow=None, io_loop=None):
+
+        self._write = write
+        self._wait_flush = wait_flush
+        self._high_water_mark = high_water_mark
+        self._max_size = max_size
+        self._on_overflow = on_overflow
+        self._io_loop = io_loop
+        self._messages = collections.OrderedDict()  # key -> (message, binary, method or None for responses)
+        self._size = 0
+        self._unflushed = 0
+        self._counter = itertools.count()
+        self._timeout_handle = None
+
+    @property
+    def size(self):
+        """
+        Returns the size of the queued messages.
+
+        :returns: size in bytes
+        """
+
+        return self._size
+
+    @property
+    def unflushed(self):
+        """
+        Returns the size of the messages written since
+        the socket buffer was last empty.
+
+        :returns: size in bytes
+        """
+
+        return self._unflushed
+
+    def __len__(self):
+
+        return len(self._messages)
+
+    def put(self, message, binary=False, method=None, coalesce_key=None):
+        """
+        Writes or queues a message.
+
+        :param message: encoded message
+        :param binary: binary message
+        :param method: notification method (None for responses)
+        :param coalesce_key: key identifying the notifications superseded by this one
+        """
+
+        if not self._messages and self._unflushed < self._high_water_mark:
+            self._send(message, binary)
+            return
+
+        if coalesce_key is None:
+            coalesce_key = next(self._counter)
+        elif coalesce_key in self._messages:
+            # the queued notification is superseded by this one
+            self._size -= len(self._messages.pop(coalesce_key)[0])
+            COALESCED.inc(method)
+        self._messages[coalesce_key] = (message, binary, method)
+        self._size += len(message)
+
+        while self._size > self._max_size:
+            if not self._drop_notification():
+                log.warning("outbound queue overflow ({} bytes), the client is too slow".format(self._size))
+                DROPPED.inc("overflow", amount=len(self._messages))
+                self.close()
+                if self._on_overflow:
+                    self._on_overflow()
+                return
+        self._schedule_drain()
+
+    def _drop_notification(self):
+        """
+        Drops the oldest queued notification.
+
+        :returns: False if there is no notification to drop
+        """
+
+        for key, (message, binary, method) in self._messages.items():
+            if method is not None:
+                del self._messages[key]
+                self._size -= len(message)
+                DROPPED.inc("queue_full")
+                return True
+        return False
+
+    def _send(self, message, binary):
+
+        self._write(message, binary)
+        self._unflushed += len(message)
+        # (re)armed after each write, other writes may replace the callback
+        self._wait_flush(self.flushed)
+
+    def flushed(self):
+        """
+        Called when the socket buffer is empty: writes the queued messages.
+        """
+
+        self._unflushed = 0
+        self._write_queued()
+
+    def _write_queued(self):
+
+        while self._messages and self._unflushed < self._high_water_mark:
+            message, binary, method = self._messages.popitem(last=False)[1]
+            self._size -= len(message)
+            self._send(message, binary)
+
+    def drain(self):
+        """
+        Writes the queued messages while the unflushed messages are below the
+        high-water mark and waits again for the socket buffer to be flushed.
+        """
+
+        self._timeout_handle = None
+        self._write_queued()
+        if self._messages:
+            self._wait_flush(self.flushed)
+        self._schedule_drain()
 
-class JSONRPCWebSocket(GNS3WebSocketBaseHandler):
+    def _schedule_drain(self):
+
+        if self._messages and self._timeout_handle is None:
+            if self._io_loop is None:
+                self._io_loop = tornado.ioloop.IOLoop.instance()
+            self._timeout_handle = self._io_loop.add_timeout(self._io_loop.time() + self.drain_interval, self.drain)
+
+    def close(self):
+        """
+        Discards the queued messages.
+        """
+
+        if self._timeout_handle is not None:
+            self._io_loop.remove_timeout(self._timeout_handle)
+            self._timeout_handle = None
+        self._messages.clear()
+        self._size = 0
+        self._unflushed = 0
+
+
+class JSONRPCBatch(object):
+    """
+    Collects the responses of a JSON-RPC batch and sends
+    them back in one array once they have all arrived.
+
+    :param handler: JSONRPCWebSocket instance
+    :param timeout: seconds to wait for the module responses
+    """
+
+    def __init__(self, handler, timeout):
+
+        self._handler = handler
+        self._timeout = timeout
+        self._responses = []
+        self._expected = []
+        self._sealed = False
+        self._timeout_handle = None
+
+    def write_message(self, message):
+        """
+        Adds a response produced by the server itself (errors, built-ins).
+
+        :param message: JSON-RPC response
+        """
+
+        self._responses.append(json_encode(message))
+
+    def expect(self, request_id):
+        """
+        Registers a request waiting for a module response.
+
+        :param request_id: JSON-RPC identifier
+        """
+
+        self._expected.append(request_id)
+
+    def add_response(self, request_id, response):
+        """
+        Adds a response sent by a module.
+
+        :param request_id: JSON-RPC identifier
+        :param response: JSON-RPC response (encoded in JSON)
+        """
+
+        if request_id in self._expected:
+            self._expected.remove(request_id)
+            if isinstance(response, bytes):
+                response = response.decode("utf-8")
+            self._responses.append(response)
+        self._complete()
+
+    def seal(self):
+        """
+        Called once all the requests of the batch have been routed.
+        """
+
+        self._sealed = True
+        if self._expected:
+            io_loop = tornado.ioloop.IOLoop.instance()
+            self._timeout_handle = io_loop.add_timeout(time.time() + self._timeout, self._expire)
+        self._complete()
+
+    def cancel(self):
+        """
+        Cancels the batch (e.g. the client has disconnected).
+        """
+
+        if self._timeout_handle:
+            tornado.ioloop.IOLoop.instance().remove_timeout(self._timeout_handle)
+            self._timeout_handle = None
+        self._expected = []
+        self._responses = []
+        self._sealed = False
+
+    def _expire(self):
+        """
+        Replaces the responses modules did not send in time by errors.
+        """
+
+        self._timeout_handle = None
+        log.warn("JSON-RPC batch timeout, no response for {}".format(self._expected))
+        for request_id in self._expected:
+            self._responses.append(json_encode(JSONRPCInternalError(request_id)()))
+        self._expected = []
+        self._complete()
+
+    def _complete(self):
+        """
+        Sends the array of responses when the batch is complete.
+        """
+
+        if not self._sealed or self._expected:
+            return
+        if self._timeout_handle:
+            tornado.ioloop.IOLoop.instance().remove_timeout(self._timeout_handle)
+            self._timeout_handle = None
+        self._handler.forget_batch(self)
+        # a batch of notifications does not get a response,
+        # the responses are already encoded and are joined in a JSON array
+        if self._responses:
+            self._handler.write_message("[" + ",".join(self._responses) + "]")
+            self._responses = []
+
+
+class JSONRPCWebSocket(DeflateWebSocketMixin, GNS3WebSocketBaseHandler):
     """
     STOMP protocol over Tornado Websockets with message
     routing to ZeroMQ dealer clients.
@@ -46,12 +351,90 @@ class JSONRPCWebSocket(GNS3WebSocketBaseHandler):
 
     clients = set()
     destinations = {}
+    module_notifications = {}
+    coalesced_notifications = {}  # notification method -> params identifying superseded notifications
+    pending_requests = {}  # (session ID, request ID) -> (method, module, start time)
+    pending_broadcasts = {}  # (session ID, request ID) -> [responses left, error response, results to merge]
+    worker_router = WorkerRouter()  # routes requests to the workers of sharded modules
+    module_spawner = ModuleSpawner()  # spawns the module processes on demand
     version = 2.0  # only JSON-RPC version 2.0 is supported
+    module_codec = envelope.JSON  # codec of the requests sent to the modules
+    batch_timeout = 60  # seconds to wait for all the responses of a batch
+    high_water_mark = 1024 * 1024  # unflushed bytes above which messages are queued
+    max_queue_size = 16 * 1024 * 1024  # maximum size (bytes) of the outbound queue of a client
 
     def __init__(self, application, request, zmq_router):
         tornado.websocket.WebSocketHandler.__init__(self, application, request)
         self._session_id = str(uuid.uuid4())
         self.zmq_router = zmq_router
+        self._batches = {}  # request ID -> JSONRPCBatch
+        self._outbound = OutboundQueue(self._write_now,
+                                       self._wait_flush,
+                                       self.high_water_mark,
+                                       self.max_queue_size,
+                                       on_overflow=self._outbound_overflow)
+
+    def outbound_buffer_size(self):
+        """
+        Returns the number of bytes written to this client since
+        the socket buffer was last empty (upper bound of the
+        bytes waiting to be sent).
+
+        :returns: buffer size in bytes
+        """
+
+        return self._outbound.unflushed
+
+    def outbound_queue_size(self):
+        """
+        Returns the number of bytes queued for this client.
+
+        :returns: queue size in bytes
+        """
+
+        return self._outbound.size
+
+    def write_message(self, message, binary=False):
+        """
+        Sends a message to this client through the outbound queue.
+
+        :param message: message (string or dictionary encoded in JSON)
+        :param binary: binary message
+        """
+
+        method = None
+        coalesce_key = None
+        if isinstance(message, dict):
+            if "method" in message and message.get("id") is None:
+                method = message["method"]
+                coalesce_key = self._coalesce_key(method, message.get("params"))
+            message = json_encode(message)
+        self._outbound.put(message, binary, method, coalesce_key)
+
+    def _wait_flush(self, callback):
+
+        stream = getattr(self, "stream", None)
+        if self.ws_connection is None or stream is None or stream.closed():
+            return
+        # an empty write sets the callback called once the buffer is empty
+        stream.write(b"", callback)
+
+    def _write_now(self, message, binary):
+
+        if self.ws_connection is None:
+            # the connection has been closed
+            return
+        tornado.websocket.WebSocketHandler.write_message(self, message, binary)
+
+    def on_compressed(self, original_size, compressed_size):
+
+        COMPRESSION_INPUT.inc(amount=original_size)
+        COMPRESSION_OUTPUT.inc(amount=compressed_size)
+
+    def _outbound_overflow(self):
+
+        log.warning("closing Websocket client {}: outbound queue overflow".format(self.session_id))
+        self.close()
 
     def check_origin(self, origin):
         return True
@@ -71,29 +454,65 @@ class JSONRPCWebSocket(GNS3WebSocketBaseHandler):
         """
         Sends a message to Websocket client
 
-        :param message: message from a module (received via ZeroMQ)
+        :param message: message frames from a module (received via ZeroMQ)
         """
 
-        # Module name that is replying
+        # Module (worker identity if the module is sharded) that is replying
         module = message[0].decode("utf-8")
 
-        # ZMQ responses are encoded in JSON
-        # format is a JSON array: [session ID, JSON-RPC response]
+        # only the envelope header is decoded, see gns3server.envelope
         try:
-            json_message = json_decode(message[1])
-        except ValueError as e:
-            stream.send_string("Cannot decode message!")
-            log.critical("Couldn't decode message: {}".format(e))
+            session_id, codec, request_id, method, error_code, payload = envelope.decode_module_header(message[1:])
+        except (ValueError, TypeError, UnicodeDecodeError) as e:
+            log.critical("Couldn't decode message from module {}: {}".format(module, e))
             return
 
-        session_id = json_message[0]
-        jsonrpc_response = json_message[1]
+        log.debug("Received message from module {}: session {} id {} method {}".format(module, session_id, request_id, method))
+
+        if session_id is None and method in cls.module_notifications:
+            # notification from a module to the server itself
+            try:
+                notification = envelope.decode(codec, payload)
+            except (ValueError, UnicodeDecodeError) as e:
+                log.critical("Couldn't decode notification {} from module {}: {}".format(method, module, e))
+                return
+            cls.module_notifications[method](cls, module, notification.get("params"))
+            return
 
-        log.debug("Received message from module {}: {}".format(module, json_message))
+        if request_id is not None and method is None:
+            broadcast = cls.pending_broadcasts.get((session_id, request_id))
+            if broadcast:
+                # request sent to all the workers of a module: one response is
+                # sent back to the client, with the first error if any.
+                broadcast[0] -= 1
+                if error_code is not None:
+                    if broadcast[1] is None:
+                        broadcast[1] = (error_code, payload)
+                elif broadcast[2] is not None:
+                    try:
+                        broadcast[2].append(envelope.decode(codec, payload)["result"])
+                    except (ValueError, KeyError, UnicodeDecodeError) as e:
+                        log.critical("Couldn't decode response {} from module {}: {}".format(request_id, module, e))
+                if broadcast[0] > 0:
+                    return
+                del cls.pending_broadcasts[(session_id, request_id)]
+                if broadcast[1] is not None:
+                    error_code, payload = broadcast[1]
+                elif broadcast[2]:
+                    # the results of the workers are merged (see gns3server.sharding)
+                    method_called = cls.pending_requests[(session_id, request_id)][0]
+                    payload = json_encode(JSONRPCResponse(broadcast_merge(method_called)(broadcast[2]), request_id)())
+            pending = cls.pending_requests.pop((session_id, request_id), None)
+            if pending:
+                method_called, module, start = pending
+                LATENCY.observe(time.time() - start, method_called)
+                IN_FLIGHT.dec(module)
+                if error_code is not None:
+                    ERRORS.inc(method_called, error_code)
 
         for client in cls.clients:
             if client.session_id == session_id:
-                client.write_message(jsonrpc_response)
+                client.deliver(payload, request_id, method)
 
     @classmethod
     def register_destination(cls, destination, module):
@@ -114,6 +533,32 @@ class JSONRPCWebSocket(GNS3WebSocketBaseHandler):
             log.debug("registering {} as a destination for the {} module".format(destination, module))
         cls.destinations[destination] = module
 
+    @classmethod
+    def register_coalesced_notification(cls, method, key_params=("id",)):
+        """
+        Registers a notification superseding the queued notifications
+        with the same method and key params (e.g. status updates of a device)
+        when a client is too slow to receive them.
+
+        :param method: notification method
+        :param key_params: names of the params identifying the notification subject
+        """
+
+        cls.coalesced_notifications[method] = tuple(key_params)
+
+    @classmethod
+    def register_module_notification(cls, method, callback):
+        """
+        Registers a callback for notifications sent by modules
+        to the server (not related to any session).
+
+        :param method: notification method
+        :param callback: callback (handler class, module name, params)
+        """
+
+        assert method not in cls.module_notifications
+        cls.module_notifications[method] = callback
+
     def open(self):
         """
         Invoked when a new WebSocket is opened.
@@ -145,44 +590,148 @@ class JSONRPCWebSocket(GNS3WebSocketBaseHandler):
 
         try:
             request = json_decode(message)
+        except:
+            ERRORS.inc(UNKNOWN_METHOD, -32700)
+            return self.write_message(JSONRPCParseError()())
+
+        if isinstance(request, list):
+            return self._handle_batch(request)
+        self._handle_request(request, self)
+
+    def _handle_batch(self, requests):
+        """
+        Handles a JSON-RPC batch: each request is routed to its module
+        and the responses are sent back in one array.
+
+        :param requests: list of JSON-RPC requests
+        """
+
+        if not requests:
+            ERRORS.inc(UNKNOWN_METHOD, -32600)
+            return self.write_message(JSONRPCInvalidRequest()())
+
+        batch = JSONRPCBatch(self, self.batch_timeout)
+        for request in requests:
+            self._handle_request(request, batch)
+        batch.seal()
+
+    def _handle_request(self, request, replier):
+        """
+        Handles a single JSON-RPC request.
+
+        :param request: JSON-RPC request (decoded)
+        :param replier: object used to send the responses
+        (this handler or a JSONRPCBatch instance)
+        """
+
+        try:
             jsonrpc_version = request["jsonrpc"]
             method = request["method"]
             # This is a JSON-RPC notification if request_id is None
             request_id = request.get("id")
         except:
-            return self.write_message(JSONRPCParseError()())
+            if isinstance(replier, JSONRPCBatch):
+                # invalid entry in a batch
+                ERRORS.inc(UNKNOWN_METHOD, -32600)
+                return replier.write_message(JSONRPCInvalidRequest()())
+            ERRORS.inc(UNKNOWN_METHOD, -32700)
+            return replier.write_message(JSONRPCParseError()())
 
         if jsonrpc_version != self.version:
-            return self.write_message(JSONRPCInvalidRequest()())
+            ERRORS.inc(UNKNOWN_METHOD, -32600)
+            return replier.write_message(JSONRPCInvalidRequest()())
 
         if len(self.clients) > 1:
             #TODO: multiple client support
             log.warn("GNS3 server doesn't support multiple clients yet")
-            return self.write_message(JSONRPCCustomError(-3200,
-                                                         "There are {} clients connected, the GNS3 server cannot handle multiple clients yet".format(len(self.clients)),
-                                                         request_id)())
+            return replier.write_message(JSONRPCCustomError(-3200,
+                                                            "There are {} clients connected, the GNS3 server cannot handle multiple clients yet".format(len(self.clients)),
+                                                            request_id)())
 
         if method not in self.destinations:
             if request_id:
                 log.warn("JSON-RPC method not found: {}".format(method))
-                return self.write_message(JSONRPCMethodNotFound(request_id)())
+                ERRORS.inc(str(method), -32601)
+                return replier.write_message(JSONRPCMethodNotFound(request_id)())
             else:
                 # This is a notification, silently ignore this error...
                 return
 
+        REQUESTS.inc(method)
         if method.startswith("builtin") and request_id:
             log.info("calling built-in method {}".format(method))
-            self.destinations[method](self, request_id, request.get("params"))
+            start = time.time()
+            self.destinations[method](replier, request_id, request.get("params"))
+            LATENCY.observe(time.time() - start, method)
             return
 
+        if request_id is not None and (request_id in self._batches or
+                                       (isinstance(replier, JSONRPCBatch) and (self.session_id, request_id) in self.pending_requests)):
+            # the response could not be told apart from the one of the request in flight
+            log.warn("JSON-RPC request ID {} is already in flight".format(request_id))
+            ERRORS.inc(UNKNOWN_METHOD, -32600)
+            return replier.write_message(JSONRPCInvalidRequest()())
+
         module = self.destinations[method]
-        # ZMQ requests are encoded in JSON
-        # format is a JSON array: [session ID, JSON-RPC request]
-        zmq_request = [self.session_id, request]
-        # Route to the correct module
-        self.zmq_router.send_string(module, zmq.SNDMORE)
-        # Send the JSON request
-        self.zmq_router.send_json(zmq_request)
+        workers = self.worker_router.route(module, method, request.get("params"))
+        if request_id is not None:
+            self.pending_requests[(self.session_id, request_id)] = (method, module, time.time())
+            if len(workers) > 1:
+                self.pending_broadcasts[(self.session_id, request_id)] = [len(workers), None, [] if broadcast_merge(method) else None]
+            IN_FLIGHT.inc(module)
+            if isinstance(replier, JSONRPCBatch):
+                replier.expect(request_id)
+                self._batches[request_id] = replier
+        # multipart message: session ID, header (codec, time sent) and JSON-RPC request
+        zmq_request = envelope.encode_request(self.session_id, request, self.module_codec)
+        for worker in workers:
+            # the module process is spawned if needed
+            self.module_spawner.send(worker, zmq_request)
+
+    def deliver(self, payload, request_id, method):
+        """
+        Sends a module response or notification to this client,
+        responses to batched requests are added to their batch.
+
+        :param payload: JSON-RPC response or notification (encoded in JSON)
+        :param request_id: JSON-RPC identifier
+        :param method: notification method (None for responses)
+        """
+
+        if request_id is not None and method is None and request_id in self._batches:
+            self._batches.pop(request_id).add_response(request_id, payload)
+            return
+        coalesce_key = None
+        if method in self.coalesced_notifications:
+            # only the notifications that can be coalesced are decoded
+            coalesce_key = self._coalesce_key(method, json_decode(payload).get("params"))
+        self._outbound.put(payload, False, method, coalesce_key)
+
+    def _coalesce_key(self, method, params):
+        """
+        Returns the key identifying the notifications superseded by a notification.
+
+        :param method: notification method
+        :param params: notification params
+
+        :returns: key or None if the notification cannot be coalesced
+        """
+
+        key_params = self.coalesced_notifications.get(method)
+        if key_params is None or not isinstance(params, dict):
+            return None
+        return (method,) + tuple(params.get(name) for name in key_params)
+
+    def forget_batch(self, batch):
+        """
+        Forgets the requests of a completed batch.
+
+        :param batch: JSONRPCBatch instance
+        """
+
+        for request_id, pending_batch in list(self._batches.items()):
+            if pending_batch is batch:
+                del self._batches[request_id]
 
     def on_close(self):
         """
@@ -191,14 +740,32 @@ class JSONRPCWebSocket(GNS3WebSocketBaseHandler):
 
         log.info("Websocket client {} disconnected".format(self.session_id))
         self.clients.remove(self)
+        self._outbound.close()
+
+        # forget the requests still waiting for a response
+        for key in [key for key in self.pending_requests if key[0] == self.session_id]:
+            method, module, start = self.pending_requests.pop(key)
+            self.pending_broadcasts.pop(key, None)
+            IN_FLIGHT.dec(module)
+        for batch in set(self._batches.values()):
+            batch.cancel()
+        self._batches.clear()
+
+        # the modules forget the subscriptions of this session
+        # Modules can implement a session_closed destination
+        if not self.zmq_router.closed:
+            for destination, module in self.destinations.items():
+                if destination.endswith(".session_closed"):
+                    notification = envelope.encode_request(self.session_id, JSONRPCNotification(destination)(), self.module_codec)
+                    for worker in self.worker_router.workers(module):
+                        self.module_spawner.send(worker, notification, spawn=False)
 
         # Reset the modules if there are no clients anymore
         # Modules must implement a reset destination
         if not self.clients and not self.zmq_router.closed:
             for destination, module in self.destinations.items():
                 if destination.endswith("reset"):
-                    # Route to the correct module
-                    self.zmq_router.send_string(module, zmq.SNDMORE)
-                    # Send the JSON request
-                    notification = JSONRPCNotification(destination)()
-                    self.zmq_router.send_json([self.session_id, notification])
+                    notification = envelope.encode_request(self.session_id, JSONRPCNotification(destination)(), self.module_codec)
+                    for worker in self.worker_router.workers(module):
+                        # modules that haven't been spawned have nothing to reset
+                        self.module_spawner.send(worker, notification, spawn=False)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Metrics handler (Prometheus text format).
+"""
+
+from .auth_handler import GNS3BaseHandler
+from .jsonrpc_websocket import JSONRPCWebSocket
+from .jsonrpc_websocket import server_metrics
+from ..metrics import MetricsRegistry
+from ..metrics import Gauge
+from ..metrics import render
+
+
+class MetricsHandler(GNS3BaseHandler):
+
+    module_snapshots = {}  # module name -> metrics snapshot pushed by the module
+
+    @classmethod
+    def update_module_metrics(cls, handler_class, module, params):
+        """
+        Module notification with a snapshot of the module metrics.
+
+        :param handler_class: JSONRPCWebSocket class
+        :param module: name of the module pushing the metrics
+        :param params: JSON-RPC notification params
+        """
+
+        cls.module_snapshots[module] = params["metrics"]
+
+    def get(self):
+
+        buffers = Gauge("gns3_websocket_outbound_buffer_bytes",
+                        "Bytes waiting to be sent to a Websocket client",
+                        ("session",))
+        queues = Gauge("gns3_websocket_outbound_queue_bytes",
+                       "Bytes queued for a Websocket client above the high-water mark",
+                       ("session",))
+        for client in JSONRPCWebSocket.clients:
+            buffers.set(client.outbound_buffer_size(), client.session_id)
+            queues.set(client.outbound_queue_size(), client.session_id)
+
+        metrics = server_metrics.metrics() + [buffers, queues]
+        for module, snapshot in sorted(self.module_snapshots.items()):
+            metrics.extend(MetricsRegistry.load(snapshot, {"module": module}))
+
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(render(metrics))
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Project export & import handlers (zip archives) and snapshot handlers.
+
+curl -s http://server:8000/projects/<name>/export > project.zip
+curl -s --data-binary @project.zip http://server:8000/projects/<name>/import
+curl -s -d "" http://server:8000/projects/<name>/snapshots?name=<snapshot>
+curl -s -d "" http://server:8000/projects/<name>/snapshots/<snapshot>/restore
+"""
+
+import os
+import shutil
+import threading
+import tornado.web
+import tornado.ioloop
+from .auth_handler import GNS3BaseHandler
+from ..project_archive import ProjectArchiveWriter
+from ..project_archive import extract_archive
+from ..project_snapshot import ProjectSnapshots
+from ..project_snapshot import SnapshotError
+from ..project_snapshot import SNAPSHOTS_DIR
+from ..config import Config
+
+import logging
+log = logging.getLogger(__name__)
+
+
+def project_directory(name):
+    """
+    Returns the directory of a project given by a client.
+
+    :param name: project name
+
+    :returns: path to the project directory
+    """
+
+    if not name or name in (".", "..") or "/" in name or "\\" in name:
+        raise tornado.web.HTTPError(400, "invalid project name {}".format(name))
+    server_config = Config.instance().get_default_section()
+    projects_dir = os.path.expandvars(os.path.expanduser(server_config.get("projects_directory", "~/GNS3/projects")))
+    return os.path.join(projects_dir, name)
+
+
+def project_snapshots(name):
+    """
+    Returns the snapshots of an existing project.
+
+    :param name: project name
+
+    :returns: ProjectSnapshots instance
+    """
+
+    project_dir = project_directory(name)
+    if not os.path.isdir(project_dir):
+        raise tornado.web.HTTPError(404, "project {} doesn't exist".format(name))
+    server_config = Config.instance().get_default_section()
+    qemu_img = server_config.get("qemu_img_path", shutil.which("qemu-img"))
+    return ProjectSnapshots(project_dir, qemu_img=qemu_img)
+
+
+def archive_workers():
+    """
+    Returns the number of threads compressing or extracting an archive.
+    """
+
+    server_config = Config.instance().get_default_section()
+    return server_config.getint("archive_workers", fallback=os.cpu_count() or 1)
+
+
+class ProjectExportHandler(GNS3BaseHandler):
+    """
+    Streams a project directory as a zip archive (chunked HTTP response),
+    the archive is generated by a thread and written as the client reads it.
+    """
+
+    @tornado.web.asynchronous
+    @tornado.web.authenticated
+    def get(self, name):
+
+        project_dir = project_directory(name)
+        if not os.path.isdir(project_dir):
+            raise tornado.web.HTTPError(404, "project {} doesn't exist".format(name))
+
+        self.set_header("Content-Type", "application/zip")
+        self.set_header("Content-Disposition", 'attachment; filename="{}.zip"'.format(name))
+        self._io_loop = tornado.ioloop.IOLoop.current()
+        self._closed = False
+        self._written = threading.Event()
+        archive = ProjectArchiveWriter(project_dir, workers=archive_workers(), exclude=(SNAPSHOTS_DIR,))
+        log.info("{} exporting project {}".format(self.request.remote_ip, project_dir))
+        thread = threading.Thread(target=self._produce, args=(iter(archive),), name="export-{}".format(name))
+        thread.daemon = True
+        thread.start()
+
+    def _produce(self, archive):
+        """
+        Sends the archive to the I/O loop (runs in a thread), waits for
+        each piece to be flushed to apply backpressure.
+        """
+
+        try:
+            for data in archive:
+                self._written.clear()
+                self._io_loop.add_callback(self._write, data)
+                self._written.wait()
+                if self._closed:
+                    archive.close()
+                    return
+        except Exception as e:
+            log.error("could not export the project: {}".format(e), exc_info=1)
+            self._io_loop.add_callback(self._abort)
+            return
+        self._io_loop.add_callback(self._finish)
+
+    def _write(self, data):
+
+        if self._closed or self.request.connection.stream.closed():
+            self._closed = True
+            self._written.set()
+            return
+        self.write(data)
+        self.flush(callback=self._written.set)
+
+    def _finish(self):
+
+        if not self._closed:
+            self.finish()
+
+    def _abort(self):
+
+        # the response has started, the client sees a truncated archive
+        if not self._closed:
+            self.request.connection.stream.close()
+
+    def on_connection_close(self):
+
+        self._closed = True
+        self._written.set()
+
+
+class ProjectImportHandler(GNS3BaseHandler):
+    """
+    Creates a project directory from a zip archive (request body),
+    the files are extracted by several threads.
+    """
+
+    @tornado.web.asynchronous
+    @tornado.web.authenticated
+    def post(self, name):
+
+        project_dir = project_directory(name)
+        if os.path.exists(project_dir):
+            raise tornado.web.HTTPError(409, "project {} already exists".format(name))
+
+        io_loop = tornado.ioloop.IOLoop.current()
+        body = self.request.body
+        log.info("{} importing project {} ({} bytes)".format(self.request.remote_ip, project_dir, len(body)))
+
+        def extract():
+            try:
+                count = extract_archive(body, project_dir, workers=archive_workers())
+                io_loop.add_callback(self._respond, 200, {"project": name, "files": count})
+            except FileExistsError as e:
+                io_loop.add_callback(self._respond, 409, {"error": str(e)})
+            except Exception as e:
+                log.warning("could not import project {}: {}".format(name, e))
+                io_loop.add_callback(self._respond, 400, {"error": str(e)})
+
+        thread = threading.Thread(target=extract, name="import-{}".format(name))
+        thread.daemon = True
+        thread.start()
+
+    def _respond(self, status, result):
+
+        self.set_status(status)
+        self.finish(result)
+
+
+class SnapshotHandlerMixin(object):
+    """
+    Runs a snapshot operation in a thread and sends its result.
+    """
+
+    def _run(self, operation, *args):
+
+        io_loop = tornado.ioloop.IOLoop.current()
+
+        def run():
+            try:
+                result = operation(*args)
+                io_loop.add_callback(self._respond, 200, result)
+            except SnapshotError as e:
+                io_loop.add_callback(self._respond, 409, {"error": str(e)})
+            except Exception as e:
+                log.error("snapshot operation failed: {}".format(e), exc_info=1)
+                io_loop.add_callback(self._respond, 500, {"error": str(e)})
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    def _respond(self, status, result):
+
+        self.set_status(status)
+        self.finish(result)
+
+
+class ProjectSnapshotsHandler(SnapshotHandlerMixin, GNS3BaseHandler):
+    """
+    Lists (GET) or creates (POST with a name argument) the snapshots of a project.
+    """
+
+    @tornado.web.authenticated
+    def get(self, name):
+
+        self.finish({"snapshots": project_snapshots(name).list()})
+
+    @tornado.web.asynchronous
+    @tornado.web.authenticated
+    def post(self, name):
+
+        snapshots = project_snapshots(name)
+        self._run(snapshots.create, self.get_argument("name"))
+
+
+class ProjectSnapshotHandler(SnapshotHandlerMixin, GNS3BaseHandler):
+    """
+    Deletes a snapshot.
+    """
+
+    @tornado.web.asynchronous
+    @tornado.web.authenticated
+    def delete(self, name, snapshot):
+
+        snapshots = project_snapshots(name)
+        self._run(lambda: snapshots.delete(snapshot) or {"deleted": snapshot})
+
+
+class ProjectSnapshotRestoreHandler(SnapshotHandlerMixin, GNS3BaseHandler):
+    """
+    Restores a snapshot.
+    """
+
+    @tornado.web.asynchronous
+    @tornado.web.authenticated
+    def post(self, name, snapshot):
+
+        self._run(project_snapshots(name).restore, snapshot)
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Per-message compression of Websocket messages (permessage-deflate, RFC 7692).
+
+Tornado 3 doesn't support Websocket extensions: the extension is negotiated
+during the opening handshake and the RFC 6455 protocol is extended to compress
+outgoing messages above a size threshold and to decompress incoming messages.
+"""
+
+import struct
+import zlib
+import tornado.escape
+import tornado.websocket
+from tornado.iostream import StreamClosedError
+
+import logging
+log = logging.getLogger(__name__)
+
+EXTENSION = "permessage-deflate"
+RSV1 = 0x40  # frame header bit set on compressed messages
+DEFLATE_TAIL = b"\x00\x00\xff\xff"  # end of a sync flush, removed from the messages
+
+
+def negotiate_deflate(extensions_header):
+    """
+    Selects the first acceptable permessage-deflate offer sent by a client.
+
+    :param extensions_header: value of the Sec-WebSocket-Extensions header
+
+    :returns: tuple (response header value, server_no_context_takeover)
+    or None if there is no acceptable offer
+    """
+
+    for offer in extensions_header.split(","):
+        params = [param.strip() for param in offer.split(";")]
+        if params[0].lower() != EXTENSION:
+            continue
+        response = [EXTENSION]
+        no_context_takeover = False
+        for param in params[1:]:
+            name, _, value = param.partition("=")
+            name = name.strip().lower()
+            value = value.strip().strip('"')
+            if name == "server_no_context_takeover" and not value:
+                no_context_takeover = True
+                response.append(name)
+            elif name == "client_no_context_takeover" and not value:
+                # the messages are always decompressed with a 32 KB window
+                pass
+            elif name == "server_max_window_bits" and value.isdigit() and 9 <= int(value) <= 15:
+                # zlib cannot produce raw deflate streams with a 256 bytes window
+                response.append("{}={}".format(name, value))
+            elif name == "client_max_window_bits" and (not value or (value.isdigit() and 8 <= int(value) <= 15)):
+                pass
+            else:
+                break
+        else:
+            return "; ".join(response), no_context_takeover
+    return None
+
+
+class DeflateWebSocketProtocol(tornado.websocket.WebSocketProtocol13):
+    """
+    RFC 6455 protocol with the permessage-deflate extension.
+
+    :param handler: Websocket handler
+    :param extension: negotiated extension (response header value)
+    :param no_context_takeover: reset the compressor after each message
+    :param compression_level: zlib compression level (1 to 9)
+    :param threshold: messages smaller than this number of bytes are not compressed
+    :param max_message_size: maximum size of a decompressed message
+    :param on_compressed: function called with the original and compressed sizes of each compressed message
+    """
+
+    def __init__(self, handler, extension, no_context_takeover, compression_level, threshold, max_message_size, on_compressed=None):
+
+        tornado.websocket.WebSocketProtocol13.__init__(self, handler)
+        self._extension = extension
+        self._no_context_takeover = no_context_takeover
+        self._compression_level = compression_level
+        self._threshold = threshold
+        self._max_message_size = max_message_size
+        self._on_compressed = on_compressed
+        self._window_bits = 15
+        for param in extension.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "server_max_window_bits":
+                self._window_bits = int(value)
+        self._compressor = None
+        self._decompressor = zlib.decompressobj(-15)
+        self._message_compressed = False
+
+    def _accept_connection(self):
+
+        subprotocol_header = ""
+        subprotocols = self.request.headers.get("Sec-WebSocket-Protocol", "")
+        subprotocols = [s.strip() for s in subprotocols.split(",")]
+        if subprotocols:
+            selected = self.handler.select_subprotocol(subprotocols)
+            if selected:
+                assert selected in subprotocols
+                subprotocol_header = "Sec-WebSocket-Protocol: {}\r\n".format(selected)
+
+        self.stream.write(tornado.escape.utf8(
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            "Sec-WebSocket-Accept: {}\r\n"
+            "Sec-WebSocket-Extensions: {}\r\n"
+            "{}"
+            "\r\n".format(self._challenge_response(), self._extension, subprotocol_header)))
+
+        self.async_callback(self.handler.open)(*self.handler.open_args, **self.handler.open_kwargs)
+        self._receive_frame()
+
+    def compress(self, data):
+        """
+        Compresses a message payload.
+
+        :param data: payload (bytes)
+
+        :returns: compressed payload (bytes)
+        """
+
+        if self._compressor is None or self._no_context_takeover:
+            self._compressor = zlib.compressobj(self._compression_level, zlib.DEFLATED, -self._window_bits)
+        data = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        assert data.endswith(DEFLATE_TAIL)
+        return data[:-len(DEFLATE_TAIL)]
+
+    def decompress(self, data):
+        """
+        Decompresses a message payload.
+
+        :param data: compressed payload (bytes)
+
+        :returns: payload (bytes) or None if the message is too large
+        """
+
+        data = self._decompressor.decompress(data + DEFLATE_TAIL, self._max_message_size)
+        if self._decompressor.unconsumed_tail:
+            return None
+        return data
+
+    def write_message(self, message, binary=False):
+
+        message = tornado.escape.utf8(message)
+        if len(message) < self._threshold:
+            return tornado.websocket.WebSocketProtocol13.write_message(self, message, binary)
+
+        compressed = self.compress(message)
+        if self._on_compressed:
+            self._on_compressed(len(message), len(compressed))
+        opcode = 0x2 if binary else 0x1
+        try:
+            # RSV1 is in the same byte as the opcode
+            self._write_frame(True, opcode | RSV1, compressed)
+        except StreamClosedError:
+            self._abort()
+
+    def _on_frame_start(self, data):
+
+        header, payloadlen = struct.unpack("BB", data)
+        opcode = header & 0xf
+        if opcode in (0x1, 0x2):
+            # RSV1 is only set on the first frame of a compressed message
+            self._message_compressed = bool(header & RSV1)
+            data = struct.pack("BB", header & ~RSV1, payloadlen)
+        tornado.websocket.WebSocketProtocol13._on_frame_start(self, data)
+
+    def _handle_message(self, opcode, data):
+
+        if opcode in (0x1, 0x2) and self._message_compressed:
+            try:
+                data = self.decompress(data)
+            except zlib.error as e:
+                log.warning("could not decompress a Websocket message: {}".format(e))
+                data = None
+            if data is None:
+                self._abort()
+                return
+        tornado.websocket.WebSocketProtocol13._handle_message(self, opcode, data)
+
+
+class DeflateWebSocketMixin(object):
+    """
+    Negotiates the permessage-deflate extension for a Websocket handler.
+
+    Handlers set compression_level to None to disable the compression.
+    """
+
+    compression_level = 6  # zlib compression level (None to disable compression)
+    compression_threshold = 1024  # messages smaller than this number of bytes are not compressed
+    max_message_size = 16 * 1024 * 1024  # maximum size of a decompressed message
+
+    def _execute(self, transforms, *args, **kwargs):
+
+        headers = self.request.headers
+        offer = None
+        if self.compression_level is not None and headers.get("Sec-WebSocket-Version") in ("7", "8", "13"):
+            offer = negotiate_deflate(headers.get("Sec-WebSocket-Extensions", ""))
+        connection = [value.strip().lower() for value in headers.get("Connection", "").split(",")]
+        if (offer is None or self.request.method != "GET" or
+                headers.get("Upgrade", "").lower() != "websocket" or "upgrade" not in connection):
+            # no compression or invalid request (Tornado sends the error response)
+            return tornado.websocket.WebSocketHandler._execute(self, transforms, *args, **kwargs)
+
+        self.open_args = args
+        self.open_kwargs = kwargs
+        extension, no_context_takeover = offer
+        self.ws_connection = DeflateWebSocketProtocol(self,
+                                                      extension,
+                                                      no_context_takeover,
+                                                      self.compression_level,
+                                                      self.compression_threshold,
+                                                      self.max_message_size,
+                                                      on_compressed=self.on_compressed)
+        self.ws_connection.accept_connection()
+
+    def on_compressed(self, original_size, compressed_size):
+        """
+        Called for each compressed message.
+
+        :param original_size: message size in bytes
+        :param compressed_size: compressed message size in bytes
+        """
+
+        pass
@@ -28,16 +28,30 @@ class JSONRPCObject(object):
     """
     Base object for JSON-RPC requests, responses,
     notifications and errors.
+
+    The message is built as a dictionary when the object is created,
+    calling the object returns it and str() returns its JSON encoding.
     """
 
-    def __init__(self):
-        return JSONRPCEncoder().default(self)
+    __slots__ = ("_message",)
+
+    def __init__(self, message):
+        self._message = message
 
     def __str__(self, *args, **kwargs):
-        return json.dumps(self, cls=JSONRPCEncoder)
+        return json.dumps(self._message)
 
     def __call__(self):
-        return JSONRPCEncoder().default(self)
+        return self._message
+
+    def __getattr__(self, name):
+        # gives access to the message fields (e.g. request.id)
+        if not name.startswith("_"):
+            try:
+                return self._message[name]
+            except KeyError:
+                pass
+        raise AttributeError(name)
 
 
 class JSONRPCEncoder(json.JSONEncoder):
@@ -51,12 +65,7 @@ class JSONRPCEncoder(json.JSONEncoder):
         """
 
         if isinstance(obj, JSONRPCObject):
-            message = {"jsonrpc": 2.0}
-            for field in dir(obj):
-                if not field.startswith('_'):
-                    value = getattr(obj, field)
-                    message[field] = value
-            return message
+            return obj()
         return json.JSONEncoder.default(self, obj)
 
 
@@ -65,10 +74,12 @@ class JSONRPCInvalidRequest(JSONRPCObject):
     Error response for an invalid request.
     """
 
+    __slots__ = ()
+
     def __init__(self):
-        JSONRPCObject.__init__(self)
-        self.id = None
-        self.error = {"code": -32600, "message": "Invalid Request"}
+        JSONRPCObject.__init__(self, {"jsonrpc": 2.0,
+                                      "id": None,
+                                      "error": {"code": -32600, "message": "Invalid Request"}})
 
 
 class JSONRPCMethodNotFound(JSONRPCObject):
@@ -78,10 +89,12 @@ class JSONRPCMethodNotFound(JSONRPCObject):
     :param request_id: JSON-RPC identifier
     """
 
+    __slots__ = ()
+
     def __init__(self, request_id):
-        JSONRPCObject.__init__(self)
-        self.id = request_id
-        self.error = {"code": -32601, "message": "Method not found"}
+        JSONRPCObject.__init__(self, {"jsonrpc": 2.0,
+                                      "id": request_id,
+                                      "error": {"code": -32601, "message": "Method not found"}})
 
 
 class JSONRPCInvalidParams(JSONRPCObject):
@@ -91,10 +104,12 @@ class JSONRPCInvalidParams(JSONRPCObject):
     :param request_id: JSON-RPC identifier
     """
 
+    __slots__ = ()
+
     def __init__(self, request_id):
-        JSONRPCObject.__init__(self)
-        self.id = request_id
-        self.error = {"code": -32602, "message": "Invalid params"}
+        JSONRPCObject.__init__(self, {"jsonrpc": 2.0,
+                                      "id": request_id,
+                                      "error": {"code": -32602, "message": "Invalid params"}})
 
 
 class JSONRPCInternalError(JSONRPCObject):
@@ -104,10 +119,12 @@ class JSONRPCInternalError(JSONRPCObject):
     :param request_id: JSON-RPC identifier (optional)
     """
 
+    __slots__ = ()
+
     def __init__(self, request_id=None):
-        JSONRPCObject.__init__(self)
-        self.id = request_id
-        self.error = {"code": -32603, "message": "Internal error"}
+        JSONRPCObject.__init__(self, {"jsonrpc": 2.0,
+                                      "id": request_id,
+                                      "error": {"code": -32603, "message": "Internal error"}})
 
 
 class JSONRPCParseError(JSONRPCObject):
@@ -115,10 +132,12 @@ class JSONRPCParseError(JSONRPCObject):
     Error response for parsing error.
     """
 
+    __slots__ = ()
+
     def __init__(self):
-        JSONRPCObject.__init__(self)
-        self.id = None
-        self.error = {"code": -32700, "message": "Parse error"}
+        JSONRPCObject.__init__(self, {"jsonrpc": 2.0,
+                                      "id": None,
+                                      "error": {"code": -32700, "message": "Parse error"}})
 
 
 class JSONRPCCustomError(JSONRPCObject):
@@ -130,10 +149,12 @@ class JSONRPCCustomError(JSONRPCObject):
     :param request_id: JSON-RPC identifier (optional)
     """
 
+    __slots__ = ()
+
     def __init__(self, code, message, request_id=None):
-        JSONRPCObject.__init__(self)
-        self.id = request_id
-        self.error = {"code": code, "message": message}
+        JSONRPCObject.__init__(self, {"jsonrpc": 2.0,
+                                      "id": request_id,
+                                      "error": {"code": code, "message": message}})
 
 
 class JSONRPCResponse(JSONRPCObject):
@@ -144,10 +165,12 @@ class JSONRPCResponse(JSONRPCObject):
     :param request_id: JSON-RPC identifier
     """
 
+    __slots__ = ()
+
     def __init__(self, result, request_id):
-        JSONRPCObject.__init__(self)
-        self.id = request_id
-        self.result = result
+        JSONRPCObject.__init__(self, {"jsonrpc": 2.0,
+                                      "id": request_id,
+                                      "result": result})
 
 
 class JSONRPCRequest(JSONRPCObject):
@@ -159,14 +182,17 @@ class JSONRPCRequest(JSONRPCObject):
     :param request_id: JSON-RPC identifier (generated by default)
     """
 
+    __slots__ = ()
+
     def __init__(self, method, params=None, request_id=None):
-        JSONRPCObject.__init__(self)
         if request_id is None:
             request_id = str(uuid.uuid4())
-        self.id = request_id
-        self.method = method
+        message = {"jsonrpc": 2.0,
+                   "id": request_id,
+                   "method": method}
         if params:
-            self.params = params
+            message["params"] = params
+        JSONRPCObject.__init__(self, message)
 
 
 class JSONRPCNotification(JSONRPCObject):
@@ -177,8 +203,11 @@ class JSONRPCNotification(JSONRPCObject):
     :param params: JSON-RPC params for the corresponding method (optional)
     """
 
+    __slots__ = ()
+
     def __init__(self, method, params=None):
-        JSONRPCObject.__init__(self)
-        self.method = method
+        message = {"jsonrpc": 2.0,
+                   "method": method}
         if params:
-            self.params = params
+            message["params"] = params
+        JSONRPCObject.__init__(self, message)
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Low overhead metrics (counters, gauges and histograms) exposed
+in the Prometheus text format.
+
+Each process (server and modules) has its own registry, modules
+periodically push a snapshot of theirs to the server.
+"""
+
+import bisect
+
+# label value of the requests without a (valid) method
+UNKNOWN_METHOD = "unknown"
+
+# latency buckets in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Metric(object):
+    """
+    Base class for metrics, values are stored per label values.
+
+    :param name: metric name
+    :param description: help text
+    :param labels: label names
+    """
+
+    type = "untyped"
+
+    def __init__(self, name, description, labels=()):
+
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def samples(self):
+        """
+        Returns the samples of this metric.
+
+        :returns: list of (name suffix, label dictionary, value)
+        """
+
+        samples = []
+        for label_values, value in sorted(self._values.items()):
+            samples.append(("", dict(zip(self.labels, label_values)), value))
+        return samples
+
+    def dump(self):
+        """
+        Returns a JSON serializable snapshot of this metric.
+        """
+
+        return {"name": self.name,
+                "type": self.type,
+                "help": self.description,
+                "labels": self.labels,
+                "values": [[list(label_values), value] for label_values, value in self._values.items()]}
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing counter.
+    """
+
+    type = "counter"
+
+    def inc(self, *label_values, amount=1):
+        """
+        Increments the counter.
+
+        :param label_values: label values
+        :param amount: increment
+        """
+
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    Value that can go up and down.
+    """
+
+    type = "gauge"
+
+    def set(self, value, *label_values):
+        """
+        Sets the gauge.
+
+        :param value: new value
+        :param label_values: label values
+        """
+
+        self._values[label_values] = value
+
+    def inc(self, *label_values, amount=1):
+        """
+        Increments the gauge.
+
+        :param label_values: label values
+        :param amount: increment
+        """
+
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        """
+        Decrements the gauge.
+
+        :param label_values: label values
+        :param amount: decrement
+        """
+
+        self._values[label_values] = self._values.get(label_values, 0) - amount
+
+    def clear(self):
+        """
+        Removes all the values.
+        """
+
+        self._values.clear()
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values in cumulative buckets.
+
+    :param buckets: bucket upper bounds
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+
+        Metric.__init__(self, name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        """
+        Records a value.
+
+        :param value: observed value
+        :param label_values: label values
+        """
+
+        state = self._values.get(label_values)
+        if state is None:
+            # per bucket counts (last one is +Inf), sum
+            state = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def samples(self):
+
+        samples = []
+        for label_values, (counts, total) in sorted(self._values.items()):
+            labels = dict(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                bucket_labels = dict(labels)
+                bucket_labels["le"] = "+Inf" if bound == float("inf") else repr(bound)
+                samples.append(("_bucket", bucket_labels, cumulative))
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, cumulative))
+        return samples
+
+    def dump(self):
+
+        snapshot = Metric.dump(self)
+        snapshot["buckets"] = self.buckets
+        return snapshot
+
+
+class MetricsRegistry(object):
+    """
+    Collection of metrics.
+    """
+
+    def __init__(self):
+
+        self._metrics = {}
+
+    def _register(self, metric):
+
+        if metric.name in self._metrics:
+            return self._metrics[metric.name]
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, description, labels=()):
+        """
+        Creates (or returns the existing) counter.
+        """
+
+        return self._register(Counter(name, description, labels))
+
+    def gauge(self, name, description, labels=()):
+        """
+        Creates (or returns the existing) gauge.
+        """
+
+        return self._register(Gauge(name, description, labels))
+
+    def histogram(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        """
+        Creates (or returns the existing) histogram.
+        """
+
+        return self._register(Histogram(name, description, labels, buckets))
+
+    def metrics(self):
+        """
+        Returns all the metrics.
+
+        :returns: list of Metric instances
+        """
+
+        return list(self._metrics.values())
+
+    def dump(self):
+        """
+        Returns a JSON serializable snapshot of all the metrics.
+
+        :returns: list of metric snapshots
+        """
+
+        return [metric.dump() for metric in self._metrics.values()]
+
+    @staticmethod
+    def load(snapshot, extra_labels=None):
+        """
+        Rebuilds metrics from a snapshot (e.g. pushed by a module).
+
+        :param snapshot: list of metric snapshots
+        :param extra_labels: dictionary of labels added to all the values
+
+        :returns: list of Metric instances
+        """
+
+        if extra_labels is None:
+            extra_labels = {}
+        extra_names = tuple(extra_labels.keys())
+        extra_values = tuple(extra_labels.values())
+        metrics = []
+        for entry in snapshot:
+            labels = extra_names + tuple(entry["labels"])
+            if entry["type"] == "histogram":
+                metric = Histogram(entry["name"], entry["help"], labels, entry["buckets"])
+            elif entry["type"] == "counter":
+                metric = Counter(entry["name"], entry["help"], labels)
+            else:
+                metric = Gauge(entry["name"], entry["help"], labels)
+            for label_values, value in entry["values"]:
+                metric._values[extra_values + tuple(label_values)] = value
+            metrics.append(metric)
+        return metrics
+
+
+def _format_labels(labels):
+
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in sorted(labels.items()):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append('{}="{}"'.format(name, value))
+    return "{" + ",".join(pairs) + "}"
+
+
+def render(metrics):
+    """
+    Renders metrics in the Prometheus text exposition format.
+    Metrics with the same name (e.g. from several modules) are grouped.
+
+    :param metrics: list of Metric instances
+
+    :returns: text (string)
+    """
+
+    grouped = {}
+    for metric in metrics:
+        grouped.setdefault(metric.name, []).append(metric)
+
+    lines = []
+    for name in sorted(grouped):
+        first = grouped[name][0]
+        lines.append("# HELP {} {}".format(name, first.description))
+        lines.append("# TYPE {} {}".format(name, first.type))
+        for metric in grouped[name]:
+            for suffix, labels, value in metric.samples():
+                lines.append("{}{}{} {}".format(name, suffix, _format_labels(labels), value))
+    return "\n".join(lines) + "\n"
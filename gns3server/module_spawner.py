@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+On-demand spawning of the module processes.
+
+The destinations of a module are registered from its routes (static
+metadata), its processes are spawned when the first request for the module
+is received. Requests are queued until the module process has connected
+to the ZeroMQ server and sent the builtin.module_ready notification.
+Idle modules can be stopped when no client is connected (the modules have
+been reset and don't have any device).
+"""
+
+import zmq
+import time
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class ModuleSpawner(object):
+    """
+    Spawns the module processes on demand.
+
+    :param idle_timeout: seconds without requests before an idle module
+    is stopped (0 to never stop the modules)
+    """
+
+    def __init__(self, idle_timeout=0):
+
+        self.router = None  # ZeroMQ router socket (set by the server)
+        self._idle_timeout = idle_timeout
+        self._factories = {}  # module name -> function returning the module instances
+        self._lazy = {}  # module name -> spawned on demand
+        self._instances = {}  # module name -> list of module instances
+        self._stopping = set()  # names of the modules being stopped
+        self._ready = set()  # identities of the processes ready to receive requests
+        self._queues = {}  # identity -> queued messages
+        self._last_request = {}  # module name -> time of the last request
+        self._spawned_at = {}  # module name -> spawn time
+        self.startup_times = {}  # identity -> seconds between the spawn and the ready notification
+
+    def register(self, name, factory, lazy=True):
+        """
+        Registers a module.
+
+        :param name: module name
+        :param factory: function returning the (not started) module instances
+        :param lazy: spawn the module on the first request
+        """
+
+        self._factories[name] = factory
+        self._lazy[name] = lazy
+        if not lazy:
+            for instance in self.spawn(name):
+                # requests are sent right away, like before the module was spawned on demand
+                self._ready.add(instance.identity)
+
+    def instances(self):
+        """
+        Returns the spawned module instances.
+
+        :returns: list of IModule instances
+        """
+
+        return [instance for instances in self._instances.values() for instance in instances]
+
+    def is_spawned(self, name):
+        """
+        Returns either a module has been spawned.
+
+        :param name: module name
+
+        :returns: boolean
+        """
+
+        return name in self._instances
+
+    def spawn(self, name):
+        """
+        Spawns the processes of a module.
+
+        :param name: module name
+
+        :returns: list of module instances
+        """
+
+        log.info("spawning module {}".format(name))
+        self._spawned_at[name] = time.time()
+        self._last_request[name] = time.time()
+        instances = self._factories[name]()
+        for instance in instances:
+            instance.start()  # starts the new process
+        self._instances[name] = instances
+        return instances
+
+    def send(self, identity, message, spawn=True):
+        """
+        Sends a message to a module process, the module is spawned if needed.
+
+        :param identity: module name or worker identity
+        :param message: message frames (see gns3server.envelope)
+        :param spawn: spawn the module if it isn't running
+
+        :returns: False if the message has been discarded
+        """
+
+        name = identity.split(":")[0]
+        if identity in self._ready or name not in self._factories:
+            self._send(identity, message)
+            self._last_request[name] = time.time()
+            return True
+
+        if name not in self._instances and not spawn:
+            return False
+        self._queues.setdefault(identity, []).append(message)
+        self._last_request[name] = time.time()
+        if name not in self._instances and name not in self._stopping:
+            self.spawn(name)
+        return True
+
+    def _send(self, identity, message):
+
+        # Route to the correct module, the frames are sent as they are
+        self.router.send_multipart([identity.encode("utf-8")] + message)
+
+    def module_ready(self, identity):
+        """
+        Called when a module process is ready to receive requests,
+        the queued requests are sent.
+
+        :param identity: module name or worker identity
+        """
+
+        name = identity.split(":")[0]
+        self._ready.add(identity)
+        if name in self._spawned_at:
+            self.startup_times[identity] = time.time() - self._spawned_at[name]
+            log.info("module {} ready in {:.3f} seconds".format(identity, self.startup_times[identity]))
+        for message in self._queues.pop(identity, []):
+            self._send(identity, message)
+
+    def reap(self, clients_connected):
+        """
+        Stops the idle modules and forgets the modules that have stopped.
+        Called periodically by the server.
+
+        :param clients_connected: either clients are connected
+        """
+
+        now = time.time()
+        for name, instances in list(self._instances.items()):
+            alive = [instance for instance in instances if instance.is_alive()]
+            if name in self._stopping:
+                if alive:
+                    continue
+                self._forget(name, instances)
+                if any(self._queues.get(instance.identity) for instance in instances):
+                    # requests have been received while the module was stopping
+                    self.spawn(name)
+                continue
+
+            if not self._lazy[name]:
+                continue
+
+            if not alive and not any(instance.identity in self._ready for instance in instances):
+                log.error("module {} has exited before being ready".format(name))
+                for instance in instances:
+                    self._queues.pop(instance.identity, None)
+                self._forget(name, instances)
+                continue
+
+            if self._idle_timeout and not clients_connected and now - self._last_request[name] >= self._idle_timeout:
+                log.info("stopping idle module {}".format(name))
+                self._stopping.add(name)
+                for instance in instances:
+                    self._ready.discard(instance.identity)
+                    if instance.is_alive():
+                        self.router.send_string(instance.identity, zmq.SNDMORE)
+                        self.router.send_string("stop")
+
+    def _forget(self, name, instances):
+
+        for instance in instances:
+            instance.join(timeout=0)
+            self._ready.discard(instance.identity)
+        del self._instances[name]
+        self._stopping.discard(name)
@@ -26,10 +26,16 @@ import socket
 import stat
 import errno
 import time
+import hashlib
+
+from ..sharding import port_range
 
 import logging
 log = logging.getLogger(__name__)
 
+# path -> (digest, modification time, size) of the config files written
+_config_digests = {}
+
 
 def find_unused_port(start_port, end_port, host='127.0.0.1', socket_type="TCP", ignore_ports=[]):
     """
@@ -45,6 +51,9 @@ def find_unused_port(start_port, end_port, host='127.0.0.1', socket_type="TCP",
     if end_port < start_port:
         raise Exception("Invalid port range {}-{}".format(start_port, end_port))
 
+    # a worker of a sharded module only uses its own slice of the range
+    start_port, end_port = port_range(start_port, end_port)
+
     if socket_type == "UDP":
         socket_type = socket.SOCK_DGRAM
     else:
@@ -144,3 +153,49 @@ def has_privileged_access(executable):
             log.error("could not determine if CAP_NET_RAW capability is set for {}: {}".format(executable, e))
 
     return False
+
+
+def write_config_file(path, config):
+    """
+    Writes a config file unless it already has the same content.
+    The file is written atomically: the config is written to a temporary
+    file which is then renamed over the config file.
+
+    :param path: path to the config file
+    :param config: config (string)
+
+    :returns: True if the file has been written, False if it was unchanged
+    """
+
+    digest = hashlib.sha1(config.encode("utf-8")).hexdigest()
+    try:
+        file_stat = os.stat(path)
+        known = _config_digests.get(path)
+        if known and known[1:] == (file_stat.st_mtime, file_stat.st_size):
+            if known[0] == digest:
+                return False
+        else:
+            # not written by us (or changed since), compare the content
+            with open(path, "r", errors="replace") as f:
+                if hashlib.sha1(f.read().encode("utf-8")).hexdigest() == digest:
+                    _config_digests[path] = (digest, file_stat.st_mtime, file_stat.st_size)
+                    return False
+    except OSError:
+        pass
+
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with open(temp_path, "w") as f:
+            f.write(config)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except OSError:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    file_stat = os.stat(path)
+    _config_digests[path] = (digest, file_stat.st_mtime, file_stat.st_size)
+    return True
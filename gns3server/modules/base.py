@@ -25,14 +25,137 @@ import traceback
 import gns3server.jsonrpc as jsonrpc
 import multiprocessing
 import zmq
+import zmq.eventloop.ioloop
+import zmq.eventloop.zmqstream
 import signal
+import time
+import threading
+import functools
+import collections
+from concurrent.futures import ThreadPoolExecutor
 
 from gns3server.config import Config
+from gns3server.telemetry import ProcessSampler
+from gns3server.metrics import MetricsRegistry
+from gns3server.metrics import UNKNOWN_METHOD
+from gns3server.sharding import set_worker
+from gns3server.sharding import worker_identity
+from gns3server import envelope
+from .link_impairment import LinkImpairments
+from .link_impairment import LINK_IMPAIRMENT_SCHEMA
 from jsonschema import validate, ValidationError
 
 import logging
 log = logging.getLogger(__name__)
 
+# request being handled by the current thread (session, call ID, destination)
+_request_context = threading.local()
+
+
+class RequestDispatcher(object):
+    """
+    Runs the module request handlers in a bounded thread pool.
+
+    Requests for the same device are handled in the order they have been
+    received. Module-level requests (key None) are handled on the I/O loop
+    once the running requests have completed, the requests received after
+    them wait until they are done.
+
+    :param io_loop: module I/O loop
+    :param max_workers: number of threads (0 to handle all the requests on the I/O loop)
+    """
+
+    def __init__(self, io_loop, max_workers):
+
+        self._io_loop = io_loop
+        self._max_workers = max_workers
+        self._executor = None
+        if max_workers > 0:
+            self._executor = ThreadPoolExecutor(max_workers)
+        self._waiting = collections.deque()  # (key, callback)
+        self._running = set()  # keys of the requests being handled by the pool
+
+    @property
+    def threaded(self):
+        """
+        Returns either the requests can be handled by the thread pool.
+
+        :returns: boolean
+        """
+
+        return self._executor is not None
+
+    def queued(self):
+        """
+        Returns the number of requests waiting to be handled.
+
+        :returns: integer
+        """
+
+        return len(self._waiting)
+
+    def submit(self, key, callback):
+        """
+        Submits a request.
+
+        :param key: device key (requests with the same key are serialized)
+        or None for a module-level request
+        :param callback: function handling the request
+        """
+
+        if not self.threaded:
+            key = None
+        self._waiting.append((key, callback))
+        self._schedule()
+
+    def _schedule(self):
+        """
+        Starts the waiting requests that can be handled.
+        """
+
+        waiting = collections.deque()
+        blocked = set()
+        while self._waiting:
+            key, callback = self._waiting.popleft()
+            if key is None:
+                if self._running or waiting:
+                    # barrier: wait for the previous requests
+                    waiting.append((key, callback))
+                    break
+                callback()
+                continue
+            if key in self._running or key in blocked or len(self._running) >= self._max_workers:
+                # keep the order of the requests for this device
+                blocked.add(key)
+                waiting.append((key, callback))
+                continue
+            self._running.add(key)
+            future = self._executor.submit(callback)
+            future.add_done_callback(functools.partial(self._request_done, key))
+        waiting.extend(self._waiting)
+        self._waiting = waiting
+
+    def _request_done(self, key, future):
+        """
+        Called by a pool thread when a request has been handled.
+        """
+
+        self._io_loop.add_callback(self._release, key)
+
+    def _release(self, key):
+
+        self._running.discard(key)
+        self._schedule()
+
+    def shutdown(self):
+        """
+        Stops handling requests.
+        """
+
+        self._waiting.clear()
+        if self._executor:
+            self._executor.shutdown(wait=False)
+
 
 class IModule(multiprocessing.Process):
     """
@@ -41,10 +164,21 @@ class IModule(multiprocessing.Process):
     :param name: module name
     :param args: arguments for the module
     :param kwargs: named arguments for the module
+    (worker: tuple (worker index, number of workers) if the module is sharded)
     """
 
     modules = {}
 
+    # the module can run as several worker processes
+    shardable = False
+
+    # the module process is spawned on the first request
+    lazy = True
+
+    # routes changing state shared by the devices of the module,
+    # they are serialized like the module-level routes
+    exclusive_routes = (".delete", ".allocate_udp_port", ".add_nio", ".delete_nio")
+
     def __init__(self, name, *args, **kwargs):
 
         config = Config.instance()
@@ -57,21 +191,118 @@ class IModule(multiprocessing.Process):
         self._dealer = None
         self._zmq_host = args[0]  # ZeroMQ server address
         self._zmq_port = args[1]  # ZeroMQ server port
-        self._current_session = None
-        self._current_destination = None
-        self._current_call_id = None
+        self._worker_index, self._worker_count = kwargs.get("worker", (0, 1))
+        self._identity = worker_identity(name, self._worker_index, self._worker_count)
         self._stopping = False
+        # codec of the messages to the server itself (the messages for the clients are in JSON)
+        self._codec = envelope.available_codec(server_config.get("module_codec", envelope.JSON))
+        module_config = config.get_section_config(name.upper())
+        self._handler_threads = module_config.getint("handler_threads",
+                                                     fallback=server_config.getint("handler_threads", fallback=4))
+        self._dispatcher = None
+        self._ioloop_thread = None
         self._cloud_settings = config.cloud_settings()
+        self._telemetry_interval = server_config.getfloat("telemetry_interval", fallback=5.0)
+        self._telemetry_sampler = None
+        self._telemetry_callback = None
+        self._metrics_interval = server_config.getfloat("metrics_interval", fallback=10.0)
+        self._metrics_callback = None
+        self._metrics = MetricsRegistry()
+        self._handler_requests = self._metrics.counter("gns3_module_requests_total",
+                                                       "Requests handled by the module",
+                                                       ("method",))
+        self._handler_errors = self._metrics.counter("gns3_module_errors_total",
+                                                     "Error responses sent by the module",
+                                                     ("method",))
+        self._handler_latency = self._metrics.histogram("gns3_module_handler_duration_seconds",
+                                                        "Time spent in the module request handler",
+                                                        ("method",))
+        self._queue_latency = self._metrics.histogram("gns3_module_queue_wait_seconds",
+                                                      "Time between the server sending a request and the module receiving it",
+                                                      ("method",))
+        self._queued_requests = self._metrics.gauge("gns3_module_queued_requests",
+                                                    "Requests waiting for a module handler thread")
+        self._link_impairments = None
+        self._link_packets = self._metrics.gauge("gns3_link_impairment_packets",
+                                                 "Packets sent by the emulators on impaired links",
+                                                 ("lport",))
+        self._link_drops = self._metrics.gauge("gns3_link_impairment_drops",
+                                               "Packets dropped on impaired links",
+                                               ("lport", "reason"))
 
     def _setup(self):
         """
         Sets up PyZMQ and creates the stream to handle requests
         """
 
+        # the module may be spawned by the running server: never use the
+        # I/O loop inherited from it (HTTP, Websocket and ZeroMQ sockets)
+        self._release_inherited_ioloop()
         self._context = zmq.Context()
-        self._ioloop = zmq.eventloop.ioloop.IOLoop.instance()
+        self._ioloop = zmq.eventloop.ioloop.ZMQIOLoop()
+        self._ioloop.install()
+        self._ioloop.make_current()
+        self._ioloop_thread = threading.current_thread()
+        self._dispatcher = RequestDispatcher(self._ioloop, self._handler_threads)
         self._stream = self._create_stream(self._zmq_host, self._zmq_port, self._decode_request)
 
+        if self._telemetry_interval > 0 and os.path.isdir("/proc"):
+            # resource telemetry is only available on platforms with procfs
+            self._telemetry_sampler = ProcessSampler()
+            self._telemetry_callback = self.add_periodic_callback(self._sample_telemetry, self._telemetry_interval * 1000)
+            self._telemetry_callback.start()
+
+        if self._metrics_interval > 0:
+            self._metrics_callback = self.add_periodic_callback(self._push_metrics, self._metrics_interval * 1000)
+            self._metrics_callback.start()
+
+        # the server sends the requests received before the process was ready
+        notification = jsonrpc.JSONRPCNotification("builtin.module_ready", {"pid": os.getpid()})()
+        self._stream.send_multipart(envelope.encode_module_message(None, notification, self._codec))
+
+    @staticmethod
+    def _release_inherited_ioloop():
+        """
+        Closes the file descriptors registered in the I/O loop
+        inherited from the parent process and forgets this loop.
+        """
+
+        ioloop = zmq.eventloop.ioloop.IOLoop
+        if not ioloop.initialized():
+            return
+        inherited = ioloop.instance()
+        if hasattr(ioloop, "clear_instance"):
+            ioloop.clear_instance()
+        else:
+            # Tornado < 4.0
+            del ioloop._instance
+        if not sys.platform.startswith("win"):
+            # the inherited loop may have set the wakeup fd for the signals
+            try:
+                signal.set_wakeup_fd(-1)
+            except ValueError:
+                pass
+        handlers = getattr(inherited, "_handlers", {})
+        for fd in list(handlers):
+            if isinstance(fd, zmq.Socket):
+                # ZeroMQ sockets cannot be safely used (or closed) after a fork
+                continue
+            if not isinstance(fd, int):
+                fd = fd.fileno()
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        # the file descriptors of the loop itself (poller and waker)
+        waker = getattr(inherited, "_waker", None)
+        poller = getattr(inherited, "_impl", None)
+        for fd_owner, method in ((waker, "write_fileno"), (poller, "fileno")):
+            if fd_owner is not None and hasattr(fd_owner, method):
+                try:
+                    os.close(getattr(fd_owner, method)())
+                except (OSError, ValueError):
+                    pass
+
     def _create_stream(self, host=None, port=0, callback=None):
         """
         Creates a new ZMQ stream.
@@ -80,16 +311,16 @@ class IModule(multiprocessing.Process):
         """
 
         self._dealer = self._context.socket(zmq.DEALER)
-        self._dealer.setsockopt(zmq.IDENTITY, self.name.encode("utf-8"))
+        self._dealer.setsockopt(zmq.IDENTITY, self._identity.encode("utf-8"))
         if host and port:
-            log.info("ZeroMQ client ({}) connecting to {}:{}".format(self.name, host, port))
+            log.info("ZeroMQ client ({}) connecting to {}:{}".format(self._identity, host, port))
             try:
                 self._dealer.connect("tcp://{}:{}".format(host, port))
             except zmq.error.ZMQError as e:
                 log.critical("Could not connect to ZeroMQ server on {}:{}, reason: {}".format(host, port, e))
                 raise SystemExit
         else:
-            log.info("ZeroMQ client ({}) connecting to ipc:///tmp/gns3.ipc".format(self.name))
+            log.info("ZeroMQ client ({}) connecting to ipc:///tmp/gns3.ipc".format(self._identity))
             try:
                 self._dealer.connect("ipc:///tmp/gns3.ipc")
             except zmq.error.ZMQError as e:
@@ -129,7 +360,9 @@ class IModule(multiprocessing.Process):
         for sig in signals:
             signal.signal(sig, signal_handler)
 
-        log.info("{} module running with PID {}".format(self.name, self.pid))
+        log.info("{} module running with PID {}".format(self._identity, self.pid))
+        # device identifiers and ports allocated by this process
+        set_worker(self._worker_index, self._worker_count)
         self._setup()
         try:
             self._ioloop.start()
@@ -145,6 +378,18 @@ class IModule(multiprocessing.Process):
 
         self._ioloop.stop()
 
+        if self._dispatcher:
+            self._dispatcher.shutdown()
+
+        if self._telemetry_callback:
+            self._telemetry_callback.stop()
+
+        if self._metrics_callback:
+            self._metrics_callback.stop()
+
+        if self._link_impairments:
+            self._link_impairments.close()
+
         if self._stream and not self._stream.closed:
             # close the zeroMQ stream
             self._stream.close()
@@ -167,6 +412,61 @@ class IModule(multiprocessing.Process):
             else:
                 self._ioloop.add_callback(self._shutdown)
 
+    @property
+    def _current_session(self):
+
+        return getattr(_request_context, "session", None)
+
+    @_current_session.setter
+    def _current_session(self, session):
+
+        _request_context.session = session
+
+    @property
+    def _current_call_id(self):
+
+        return getattr(_request_context, "call_id", None)
+
+    @_current_call_id.setter
+    def _current_call_id(self, call_id):
+
+        _request_context.call_id = call_id
+
+    @property
+    def _current_destination(self):
+
+        return getattr(_request_context, "destination", None)
+
+    @_current_destination.setter
+    def _current_destination(self, destination):
+
+        _request_context.destination = destination
+
+    def _call_on_ioloop(self, callback, *args):
+        """
+        Calls a function on the I/O loop, calls made by
+        a handler thread are marshalled to the I/O loop.
+
+        :param callback: function to call
+        :param args: function arguments
+        """
+
+        if threading.current_thread() is self._ioloop_thread:
+            callback(*args)
+        else:
+            self._ioloop.add_callback(callback, *args)
+
+    def _send_message(self, session, message):
+        """
+        Sends a message to the ZeroMQ server.
+
+        :param session: session ID
+        :param message: JSON-RPC message
+        """
+
+        frames = envelope.encode_module_message(session, message, self._codec)
+        self._call_on_ioloop(self._stream.send_multipart, frames)
+
     def send_response(self, results):
         """
         Sends a response back to the requester.
@@ -176,10 +476,8 @@ class IModule(multiprocessing.Process):
 
         jsonrpc_response = jsonrpc.JSONRPCResponse(results, self._current_call_id)()
 
-        # add session to the response
-        response = [self._current_session, jsonrpc_response]
-        log.debug("ZeroMQ client ({}) sending: {}".format(self.name, response))
-        self._stream.send_json(response)
+        log.debug("ZeroMQ client ({}) sending: {}".format(self.name, jsonrpc_response))
+        self._send_message(self._current_session, jsonrpc_response)
 
     def send_param_error(self):
         """
@@ -187,11 +485,10 @@ class IModule(multiprocessing.Process):
         """
 
         jsonrpc_response = jsonrpc.JSONRPCInvalidParams(self._current_call_id)()
+        self._call_on_ioloop(self._handler_errors.inc, self._current_destination or UNKNOWN_METHOD)
 
-        # add session to the response
-        response = [self._current_session, jsonrpc_response]
         log.info("ZeroMQ client ({}) sending JSON-RPC param error for call id {}".format(self.name, self._current_call_id))
-        self._stream.send_json(response)
+        self._send_message(self._current_session, jsonrpc_response)
 
     def send_internal_error(self):
         """
@@ -199,11 +496,10 @@ class IModule(multiprocessing.Process):
         """
 
         jsonrpc_response = jsonrpc.JSONRPCInternalError()()
+        self._call_on_ioloop(self._handler_errors.inc, self._current_destination or UNKNOWN_METHOD)
 
-        # add session to the response
-        response = [self._current_session, jsonrpc_response]
         log.critical("ZeroMQ client ({}) sending JSON-RPC internal error".format(self.name))
-        self._stream.send_json(response)
+        self._send_message(self._current_session, jsonrpc_response)
 
     def send_custom_error(self, message, code=-3200):
         """
@@ -211,13 +507,12 @@ class IModule(multiprocessing.Process):
         """
 
         jsonrpc_response = jsonrpc.JSONRPCCustomError(code, message, self._current_call_id)()
+        self._call_on_ioloop(self._handler_errors.inc, self._current_destination or UNKNOWN_METHOD)
 
-        # add session to the response
-        response = [self._current_session, jsonrpc_response]
         log.info("ZeroMQ client ({}) sending JSON-RPC custom error: {} for call id {}".format(self.name,
                                                                                               message,
                                                                                               self._current_call_id))
-        self._stream.send_json(response)
+        self._send_message(self._current_session, jsonrpc_response)
 
     def send_notification(self, destination, results):
         """
@@ -229,16 +524,64 @@ class IModule(multiprocessing.Process):
 
         jsonrpc_response = jsonrpc.JSONRPCNotification(destination, results)()
 
-        # add session to the response
-        response = [self._current_session, jsonrpc_response]
-        log.debug("ZeroMQ client ({}) sending: {}".format(self.name, response))
-        self._stream.send_json(response)
+        log.debug("ZeroMQ client ({}) sending: {}".format(self.name, jsonrpc_response))
+        self._send_message(self._current_session, jsonrpc_response)
 
-    def _decode_request(self, request):
+    def telemetry_nodes(self):
         """
-        Decodes the request to JSON.
+        Nodes and processes to sample for resource telemetry.
+        Modules managing processes must override this method.
 
-        :param request: request from ZeroMQ server
+        :returns: dictionary node ID -> {"name": node name, "pids": list of PIDs}
+        """
+
+        return {}
+
+    def _sample_telemetry(self):
+        """
+        Periodic callback to sample the processes managed by this module
+        and push the samples to the server.
+        """
+
+        if self._stopping:
+            return
+
+        try:
+            samples = self._telemetry_sampler.sample(self.telemetry_nodes())
+        except Exception as e:
+            log.error("could not sample {} module processes: {}".format(self.name, e))
+            return
+
+        # not related to a session, the server keeps the samples
+        notification = jsonrpc.JSONRPCNotification("builtin.telemetry", {"timestamp": time.time(),
+                                                                          "nodes": samples})()
+        self._stream.send_multipart(envelope.encode_module_message(None, notification, self._codec))
+
+    def _push_metrics(self):
+        """
+        Periodic callback to push the metrics of this module to the server.
+        """
+
+        if self._stopping:
+            return
+
+        if self._dispatcher:
+            self._queued_requests.set(self._dispatcher.queued())
+        self._link_packets.clear()
+        self._link_drops.clear()
+        if self._link_impairments:
+            for lport, stats in self._link_impairments.stats().items():
+                self._link_packets.set(stats["packets"], str(lport))
+                for reason, drops in stats["drops"].items():
+                    self._link_drops.set(drops, str(lport), reason)
+        notification = jsonrpc.JSONRPCNotification("builtin.metrics", {"metrics": self._metrics.dump()})()
+        self._stream.send_multipart(envelope.encode_module_message(None, notification, self._codec))
+
+    def _decode_request(self, frames):
+        """
+        Decodes a request.
+
+        :param frames: request frames from ZeroMQ server
         """
 
         # server is shutting down, do not process
@@ -249,29 +592,66 @@ class IModule(multiprocessing.Process):
         # handle special request to stop the module
         # e.g. useful on Windows where the
         # SIGBREAK signal cound't be propagated
-        if request[0] == b"stop":
+        if frames[0] == b"stop":
             self.stop()
             return
 
+        received = time.time()
         try:
-            request = zmq.utils.jsonapi.loads(request[0])
-        except ValueError:
+            session, request, sent = envelope.decode_request(frames)
+        except (ValueError, TypeError, UnicodeDecodeError):
             self._current_session = None
+            self._current_destination = None
             self.send_internal_error()
             return
 
         log.debug("ZeroMQ client ({}) received: {}".format(self.name, request))
-        self._current_session = request[0]
-        self._current_call_id = request[1].get("id")
-        destination = request[1].get("method")
-        params = request[1].get("params")
+        self._current_session = session
+        self._current_call_id = request.get("id")
+        destination = request.get("method")
+        params = request.get("params")
+        self._current_destination = destination
 
         if destination not in self.modules[self.name]:
             self.send_internal_error()
             return
 
-        log.debug("Routing request to {}: {}".format(destination, request[1]))
+        log.debug("Routing request to {}: {}".format(destination, request))
+
+        self._handler_requests.inc(destination)
+        # time between the server sending the request and the module receiving it
+        self._queue_latency.observe(max(received - sent, 0), destination)
+
+        # requests for a device can be handled by the thread pool,
+        # requests for the same device are handled in order.
+        key = None
+        if isinstance(params, dict) and isinstance(params.get("id"), int) and not destination.endswith(self.exclusive_routes):
+            # e.g. dynamips.vm and dynamips.ethsw have their own IDs
+            key = (destination.rsplit(".", 1)[0], params["id"])
+        self._dispatcher.submit(key, functools.partial(self._handle_request,
+                                                       session,
+                                                       request.get("id"),
+                                                       destination,
+                                                       params,
+                                                       received))
+
+    def _handle_request(self, session, call_id, destination, params, received):
+        """
+        Calls the handler of a request (on the I/O loop or in a handler thread).
+
+        :param session: session ID
+        :param call_id: JSON-RPC call identifier
+        :param destination: destination (or method)
+        :param params: JSON-RPC params
+        :param received: time the request has been received
+        """
+
+        if self._stopping:
+            return
 
+        self._current_session = session
+        self._current_call_id = call_id
+        self._current_destination = destination
         try:
             self.modules[self.name][destination](self, params)
         except Exception as e:
@@ -282,6 +662,67 @@ class IModule(multiprocessing.Process):
             self.send_custom_error("uncaught exception {type}: {string}\n{tb}".format(type=type(e),
                                                                                       string=str(e),
                                                                                       tb=tb))
+        finally:
+            self._call_on_ioloop(self._handler_latency.observe, time.time() - received, destination)
+
+    @property
+    def link_impairments(self):
+        """
+        Returns the link impairments of the UDP NIOs of this module.
+
+        :returns: LinkImpairments instance
+        """
+
+        if self._link_impairments is None:
+            self._link_impairments = LinkImpairments()
+        return self._link_impairments
+
+    def apply_link_impairment(self, request):
+        """
+        Handles a <module>.set_link_impairment request: sets the latency, jitter,
+        packet loss and rate of the packets sent on a UDP NIO. The impairment
+        is applied by a relay inserted when the NIO is added, it is applied
+        immediately if the NIO has already been added with an impairment.
+        The request is sent to all the workers of a sharded module, the
+        server responds with the result of the worker owning the NIO.
+
+        Mandatory request parameters:
+        - lport (local port of the UDP NIO)
+
+        Optional request parameters:
+        - latency (delay in milliseconds)
+        - jitter (delay variation in milliseconds)
+        - loss (packet loss in percent)
+        - rate (rate in kilobits per second, 0 for no limit)
+        - burst (burst size in bytes)
+        - queue_limit (maximum time a packet waits for the rate shaper in milliseconds)
+        - clear (remove the impairment, it is otherwise kept when the NIO is deleted)
+
+        Response parameters:
+        - lport (local port of the UDP NIO)
+        - active (True if the impairment is applied, False until the NIO is added)
+        - stats (packets, forwarded packets and bytes, drops per reason)
+
+        :param request: JSON request
+        """
+
+        if not self.validate_request(request, LINK_IMPAIRMENT_SCHEMA):
+            return
+
+        lport = request["lport"]
+        if request.get("clear"):
+            active = self.link_impairments.clear(lport)
+        else:
+            active = self.link_impairments.set(lport,
+                                               latency=request.get("latency", 0),
+                                               jitter=request.get("jitter", 0),
+                                               loss=request.get("loss", 0),
+                                               rate=request.get("rate", 0),
+                                               burst=request.get("burst", 0),
+                                               queue_limit=request.get("queue_limit", 500))
+        self.send_response({"lport": lport,
+                            "active": active,
+                            "stats": self.link_impairments.stats(lport)})
 
     def validate_request(self, request, schema):
         """
@@ -335,6 +776,16 @@ class IModule(multiprocessing.Process):
             return method
         return wrapper
 
+    @property
+    def identity(self):
+        """
+        Returns the ZeroMQ identity of this module process.
+
+        :returns: module name or module:worker if the module is sharded
+        """
+
+        return self._identity
+
     @property
     def images_directory(self):
 
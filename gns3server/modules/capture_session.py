@@ -0,0 +1,415 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Packet capture sessions with size/time limits (ring buffer of capture files).
+
+The emulators (Dynamips, iouyap and VirtualBox) write their capture to a
+named pipe. A post-processing thread reads the pcap records from it and writes
+them to the capture file, rotating it when it is too big or too old and
+pruning the oldest rotated files.
+"""
+
+import os
+import time
+import uuid
+import errno
+import threading
+import collections
+
+from ..capture_stream import PCAP_HEADER_SIZE
+from ..capture_stream import pcap_endianness
+from ..capture_stream import split_pcap_records
+from ..config import Config
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class CaptureSession(object):
+    """
+    Capture session writing a ring buffer of capture files.
+
+    :param output_file: path to the capture file
+    :param max_file_size: maximum size of a capture file in bytes (0 for no limit)
+    :param max_files: number of capture files to keep (0 for no limit)
+    :param max_file_duration: maximum duration of a capture file in seconds (0 for no limit)
+    """
+
+    def __init__(self, output_file, max_file_size=0, max_files=0, max_file_duration=0):
+
+        self._output_file = output_file
+        self._max_file_size = max_file_size
+        self._max_files = max_files
+        self._max_file_duration = max_file_duration
+        self._fifo = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self._detached = False
+        self._output = None
+        self._output_size = 0
+        self._output_opened_at = 0
+        self._header = None
+        self._rotated_files = collections.deque()
+        self._rotation_index = 0
+        self._started_at = None
+        self.bytes = 0
+        self.packets = 0
+        self.drops = 0
+        self.rotations = 0
+        self.pruned = 0
+
+    @property
+    def output_file(self):
+        """
+        Returns the path to the (current) capture file.
+
+        :returns: path
+        """
+
+        return self._output_file
+
+    @property
+    def writer_path(self):
+        """
+        Returns the path the emulator must write the capture to.
+
+        :returns: path to the named pipe or to the capture file
+        if named pipes are not supported on this platform
+        """
+
+        if self._fifo:
+            return self._fifo
+        return self._output_file
+
+    def start(self):
+        """
+        Creates the named pipe and starts the post-processing thread.
+        """
+
+        directory, filename = os.path.split(self._output_file)
+        os.makedirs(directory, exist_ok=True)
+        self._started_at = time.time()
+
+        if not hasattr(os, "mkfifo"):
+            log.warning("capture limits are not supported on this platform, {} will not be rotated".format(self._output_file))
+            return
+
+        # unique name, a capture may still be running on this file
+        self._fifo = os.path.join(directory, ".{}.{}.fifo".format(filename, uuid.uuid4().hex[:8]))
+        os.mkfifo(self._fifo, 0o600)
+        self._thread = threading.Thread(target=self._run, name="capture {}".format(filename))
+        self._thread.daemon = True
+        self._thread.start()
+        log.info("capture session started for {}".format(self._output_file))
+
+    def _run(self):
+        """
+        Thread reading the named pipe until the session is stopped.
+        The pipe is re-opened if the emulator closes it (e.g. VM restart).
+        """
+
+        try:
+            while not self._stopping.is_set():
+                # blocks until the emulator opens the pipe for writing
+                with open(self._fifo, "rb", buffering=0) as fifo:
+                    self._copy(fifo)
+        except OSError as e:
+            log.error("capture session for {} failed: {}".format(self._output_file, e))
+        finally:
+            self._close_output()
+
+    def _copy(self, fifo):
+        """
+        Copies the pcap records from the pipe until the writer closes it.
+
+        :param fifo: named pipe file object
+        """
+
+        buffer = b""
+        endianness = None
+        while True:
+            data = fifo.read(65536)
+            if not data:
+                return
+            if self._detached:
+                # the session has been stopped but the emulator still writes
+                self._close_output()
+                self._discard(fifo)
+                return
+            if endianness is None:
+                buffer += data
+                if len(buffer) < PCAP_HEADER_SIZE:
+                    continue
+                endianness = pcap_endianness(buffer)
+                if endianness is None:
+                    log.warning("{} doesn't receive pcap data, discarding".format(self._output_file))
+                    self._discard(fifo)
+                    return
+                if self._header is None:
+                    self._header = buffer[:PCAP_HEADER_SIZE]
+                if self._output is None:
+                    try:
+                        self._open_output()
+                    except OSError as e:
+                        log.error("could not create {}: {}".format(self._output_file, e))
+                data = buffer[PCAP_HEADER_SIZE:]
+                buffer = b""
+
+            try:
+                records, buffer = split_pcap_records(buffer + data, endianness)
+            except ValueError as e:
+                log.warning("corrupted capture data for {}: {}".format(self._output_file, e))
+                self.drops += 1
+                self._discard(fifo)
+                return
+            for record in records:
+                self._write_record(record)
+            if self._output:
+                try:
+                    self._output.flush()
+                except OSError:
+                    pass
+
+    def _discard(self, fifo):
+        """
+        Reads and discards data until the writer closes the pipe,
+        so the emulator is never blocked.
+        """
+
+        while fifo.read(65536):
+            pass
+
+    def _write_record(self, record):
+        """
+        Writes a record to the current capture file, rotating it if needed.
+
+        :param record: pcap record
+        """
+
+        try:
+            if self._output is None:
+                self._open_output()
+            elif self._limit_reached(len(record)):
+                self._rotate()
+            self._output.write(record)
+        except OSError as e:
+            if self.drops == 0 or e.errno != errno.ENOSPC:
+                log.error("could not write to {}: {}".format(self._output_file, e))
+            self.drops += 1
+            return
+        self._output_size += len(record)
+        self.bytes += len(record)
+        self.packets += 1
+
+    def _limit_reached(self, record_size):
+
+        if self._output_size <= PCAP_HEADER_SIZE:
+            return False  # at least one record per file
+        if self._max_file_size and self._output_size + record_size > self._max_file_size:
+            return True
+        if self._max_file_duration and time.time() - self._output_opened_at >= self._max_file_duration:
+            return True
+        return False
+
+    def _open_output(self):
+
+        self._output = open(self._output_file, "wb")
+        self._output.write(self._header)
+        self._output_size = PCAP_HEADER_SIZE
+        self._output_opened_at = time.time()
+
+    def _close_output(self):
+
+        if self._output:
+            try:
+                self._output.close()
+            except OSError:
+                pass
+            self._output = None
+
+    def _rotated_file_path(self, index):
+
+        base, extension = os.path.splitext(self._output_file)
+        return "{}_{:05d}{}".format(base, index, extension)
+
+    def _rotate(self):
+        """
+        Renames the current capture file, prunes the oldest ones
+        and starts a new capture file.
+        """
+
+        self._close_output()
+        self._rotation_index += 1
+        rotated_file = self._rotated_file_path(self._rotation_index)
+        os.replace(self._output_file, rotated_file)
+        self._rotated_files.append(rotated_file)
+        self.rotations += 1
+
+        # the current capture file counts as one of the kept files
+        while self._max_files and len(self._rotated_files) > self._max_files - 1:
+            oldest = self._rotated_files.popleft()
+            try:
+                os.remove(oldest)
+                self.pruned += 1
+            except OSError as e:
+                log.warning("could not delete capture file {}: {}".format(oldest, e))
+        self._open_output()
+
+    def stop(self, timeout=2):
+        """
+        Stops the session, the emulator must have stopped writing first.
+
+        :param timeout: time to wait for the post-processing thread to finish
+
+        :returns: capture stats
+        """
+
+        self._stopping.set()
+        if self._thread and self._thread.is_alive():
+            deadline = time.time() + timeout
+            while self._thread.is_alive() and time.time() < deadline:
+                # wake up the thread if it is waiting for a writer
+                try:
+                    fd = os.open(self._fifo, os.O_WRONLY | os.O_NONBLOCK)
+                    os.close(fd)
+                except OSError:
+                    pass
+                self._thread.join(0.05)
+            if self._thread.is_alive():
+                log.warning("the emulator is still writing to {}, discarding its data".format(self._fifo))
+                self._detached = True
+
+        if self._fifo:
+            try:
+                os.remove(self._fifo)
+            except OSError:
+                pass
+        elif os.path.isfile(self._output_file):
+            # no post-processing, count what has been written to the capture file
+            self._count_records()
+
+        stats = self.stats()
+        log.info("capture session stopped for {}: {packets} packets, {bytes} bytes, {drops} drops".format(self._output_file,
+                                                                                                          **stats))
+        return stats
+
+    def _count_records(self):
+
+        try:
+            with open(self._output_file, "rb") as f:
+                data = f.read()
+            endianness = pcap_endianness(data)
+            if endianness:
+                records, _ = split_pcap_records(data[PCAP_HEADER_SIZE:], endianness)
+                self.packets = len(records)
+                self.bytes = sum(len(record) for record in records)
+        except (OSError, ValueError) as e:
+            log.warning("could not read capture file {}: {}".format(self._output_file, e))
+
+    def stats(self):
+        """
+        Returns the capture stats.
+
+        :returns: dictionary
+        """
+
+        files = list(self._rotated_files)
+        if os.path.isfile(self._output_file):
+            files.append(self._output_file)
+        return {"bytes": self.bytes,
+                "packets": self.packets,
+                "drops": self.drops,
+                "rotations": self.rotations,
+                "pruned": self.pruned,
+                "duration": round(time.time() - self._started_at, 3) if self._started_at else 0,
+                "files": [os.path.basename(path) for path in files]}
+
+
+class CaptureSessions(object):
+    """
+    Capture sessions of a module, limits not given in the start_capture
+    requests are read from the configuration file (in MB and seconds).
+
+    :param module_name: module name (configuration section)
+    """
+
+    def __init__(self, module_name):
+
+        self._module_name = module_name
+        self._sessions = {}
+
+    def _limit(self, request, name, fallback):
+
+        if name in request:
+            return request[name]
+        config = Config.instance()
+        value = config.get_section_config(self._module_name.upper()).get("capture_{}".format(name))
+        if value is None:
+            value = config.get_default_section().get("capture_{}".format(name), fallback)
+        return int(value)
+
+    def start(self, key, output_file, request, start_capture):
+        """
+        Starts a capture session.
+
+        :param key: key identifying the captured port
+        :param output_file: path to the capture file
+        :param request: start_capture JSON request (for the optional limits)
+        :param start_capture: function starting the capture in the emulator,
+        called with the path the emulator must write to
+
+        :returns: CaptureSession instance
+        """
+
+        session = CaptureSession(output_file,
+                                 max_file_size=self._limit(request, "max_file_size", 100) * 1048576,
+                                 max_files=self._limit(request, "max_files", 10),
+                                 max_file_duration=self._limit(request, "max_file_duration", 0))
+        session.start()
+        try:
+            start_capture(session.writer_path)
+        except Exception:
+            session.stop()
+            raise
+
+        # a previous session for this port is stale if the emulator accepted the new capture
+        self.stop(key)
+        self._sessions[key] = session
+        return session
+
+    def stop(self, key):
+        """
+        Stops a capture session.
+
+        :param key: key identifying the captured port
+
+        :returns: capture stats or None if there is no session
+        """
+
+        session = self._sessions.pop(key, None)
+        if session is None:
+            return None
+        return session.stop()
+
+    def stop_all(self):
+        """
+        Stops all the capture sessions.
+        """
+
+        for key in list(self._sessions.keys()):
+            self.stop(key)
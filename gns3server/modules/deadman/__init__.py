@@ -21,6 +21,7 @@ DeadMan server module.
 
 import os
 import time
+import socket
 import subprocess
 
 from gns3server.modules import IModule
@@ -39,6 +40,9 @@ class DeadMan(IModule):
     :param kwargs: named arguments for the module
     """
 
+    # the dead man switch is started with the server
+    lazy = False
+
     def __init__(self, name, *args, **kwargs):
         config = Config.instance()
 
@@ -54,6 +58,16 @@ class DeadMan(IModule):
         if 'heartbeat_file' in kwargs:
             self._heartbeat_file = kwargs['heartbeat_file']
 
+        # heartbeats are sent as datagrams to gns3dms, the heartbeat file
+        # is only written when gns3dms cannot be reached.
+        self._heartbeat_socket = "%s/gns3dms.sock" % (self._tempdir)
+        if 'heartbeat_socket' in kwargs:
+            self._heartbeat_socket = kwargs['heartbeat_socket']
+        self._heartbeat_sender = None
+        if hasattr(socket, "AF_UNIX"):
+            self._heartbeat_sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._heartbeat_sender.setblocking(False)
+
         self._is_enabled = False
         try:
             cloud_config = Config.instance().get_section_config("CLOUD_SERVER")
@@ -82,6 +96,9 @@ class DeadMan(IModule):
         cmd.append("gns3dms")
         cmd.append("--file")
         cmd.append("%s" % (self._heartbeat_file))
+        if self._heartbeat_sender:
+            cmd.append("--socket")
+            cmd.append("%s" % (self._heartbeat_socket))
         cmd.append("--background")
         log.info("Deadman: Running command: %s"%(cmd))
 
@@ -144,12 +161,32 @@ class DeadMan(IModule):
         log.info("Deadman: Module has been reset")
 
 
+    def _send_heartbeat(self):
+        """
+        Sends a heartbeat datagram to gns3dms.
+
+        :returns: True if the heartbeat has been sent
+        """
+
+        if not self._heartbeat_sender:
+            return False
+        try:
+            self._heartbeat_sender.sendto(b"\x01", self._heartbeat_socket)
+        except OSError as e:
+            log.debug("Deadman: cannot send heartbeat to {}: {}".format(self._heartbeat_socket, e))
+            return False
+        return True
+
     @IModule.route("deadman.heartbeat")
     def heartbeat(self, request=None):
         """
-        Update a file on the server that the deadman switch will monitor
+        Sends a heartbeat to the deadman switch, falls back to updating
+        the file it monitors (and starting it) if it cannot be reached.
         """
 
+        if self._send_heartbeat():
+            return
+
         now = time.time()
 
         with open(self._heartbeat_file, 'w') as heartbeat_file:
@@ -161,4 +198,4 @@ class DeadMan(IModule):
                 now,
             ))
 
-        self.start()
\ No newline at end of file
+        self.start()
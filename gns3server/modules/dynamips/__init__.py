@@ -26,12 +26,17 @@ import tempfile
 import shutil
 import glob
 import socket
+import time
+import gns3server.jsonrpc as jsonrpc
 from gns3server.modules import IModule
 from gns3server.config import Config
 from gns3server.builtins.interfaces import get_windows_interfaces
+from gns3server.modules.capture_session import CaptureSessions
+from gns3server.modules.attic import write_config_file
 
 from .hypervisor import Hypervisor
 from .hypervisor_manager import HypervisorManager
+from .nio_stats import NIOStatsCollector
 from .dynamips_error import DynamipsError
 
 # Nodes
@@ -90,6 +95,8 @@ from .backends import ethhub
 from .backends import frsw
 from .backends import atmsw
 
+from .schemas.nio_stats import NIO_STATS_SCHEMA
+
 import logging
 log = logging.getLogger(__name__)
 
@@ -103,6 +110,13 @@ class Dynamips(IModule):
     :param kwargs: named arguments for the module
     """
 
+    shardable = True
+
+    # updating a router can create a ghost IOS instance shared by
+    # the routers using the same image (see set_ghost_ios), the MAC
+    # address tables are also refreshed and pushed by the I/O loop
+    exclusive_routes = IModule.exclusive_routes + (".vm.update", ".ethsw.mac_table")
+
     def __init__(self, name, *args, **kwargs):
 
         # get the Dynamips location
@@ -138,12 +152,38 @@ class Dynamips(IModule):
         self._working_dir = self._projects_dir
         self._host = dynamips_config.get("host", kwargs["host"])
         self._console_host = dynamips_config.get("console_host", kwargs["console_host"])
+        self._capture_sessions = CaptureSessions(name)
 
         if not sys.platform.startswith("win32"):
             #FIXME: pickle issues Windows
             self._callback = self.add_periodic_callback(self._check_hypervisors, 5000)
             self._callback.start()
 
+        # periodically save the configs of the routers with a modified NVRAM
+        self._autosave_callback = None
+        autosave_interval = dynamips_config.getint("autosave_interval", fallback=60)
+        if autosave_interval > 0 and not sys.platform.startswith("win32"):
+            self._autosave_callback = self.add_periodic_callback(self._autosave_configs, autosave_interval * 1000)
+            self._autosave_callback.start()
+
+        # NIO statistics, pushed periodically to the subscribed sessions
+        self._nio_stats = NIOStatsCollector(history=dynamips_config.getint("nio_stats_history", fallback=60))
+        self._nio_stats_interval = dynamips_config.getint("nio_stats_interval", fallback=10)
+        self._nio_stats_subscribers = set()
+        self._nio_stats_callback = None
+        if self._nio_stats_interval > 0 and not sys.platform.startswith("win32"):
+            self._nio_stats_callback = self.add_periodic_callback(self._push_nio_stats, self._nio_stats_interval * 1000)
+            self._nio_stats_callback.start()
+
+        # changes of the MAC address tables, pushed periodically to the subscribed sessions
+        self._mac_table_subscribers = {}  # Ethernet switch ID -> sessions
+        self._mac_table_pushed = {}  # Ethernet switch ID -> last version pushed
+        self._mac_table_callback = None
+        mac_table_interval = dynamips_config.getint("mac_table_interval", fallback=5)
+        if mac_table_interval > 0 and not sys.platform.startswith("win32"):
+            self._mac_table_callback = self.add_periodic_callback(self._push_mac_table_changes, mac_table_interval * 1000)
+            self._mac_table_callback.start()
+
     def stop(self, signum=None):
         """
         Properly stops the module.
@@ -153,19 +193,22 @@ class Dynamips(IModule):
 
         if not sys.platform.startswith("win32"):
             self._callback.stop()
+        if self._autosave_callback:
+            self._autosave_callback.stop()
+        if self._nio_stats_callback:
+            self._nio_stats_callback.stop()
+        if self._mac_table_callback:
+            self._mac_table_callback.stop()
 
         # automatically save configs for all router instances
-        for router_id in self._routers:
-            router = self._routers[router_id]
-            try:
-                router.save_configs()
-            except DynamipsError:
-                continue
+        # (only the routers with a modified NVRAM)
+        self._autosave_configs()
 
         # stop all Dynamips hypervisors
         if self._hypervisor_manager:
             self._hypervisor_manager.stop_all_hypervisors()
 
+        self._capture_sessions.stop_all()
         self.delete_dynamips_files()
         IModule.stop(self, signum)  # this will stop the I/O loop
 
@@ -190,6 +233,35 @@ class Dynamips(IModule):
                     self.send_notification("{}.dynamips_stopped".format(self.name), notification)
                     hypervisor.stop()
 
+    def _autosave_configs(self):
+        """
+        Saves the configs of the routers with a modified NVRAM.
+        Also called periodically (autosave_interval setting).
+        """
+
+        for router in self._routers.values():
+            try:
+                if router.autosave_configs():
+                    log.debug("configs for router {} have been saved".format(router.name))
+            except DynamipsError as e:
+                log.warn("could not save the configs for router {}: {}".format(router.name, e))
+
+    def telemetry_nodes(self):
+        """
+        Returns the Dynamips hypervisor processes to sample for resource telemetry.
+
+        :returns: dictionary node ID -> {"name": node name, "pids": list of PIDs}
+        """
+
+        nodes = {}
+        if self._hypervisor_manager:
+            # routers sharing a hypervisor cannot be told apart at the process level
+            for hypervisor in self._hypervisor_manager.hypervisors:
+                device_names = [device.name for device in hypervisor.devices]
+                nodes["hypervisor-{}".format(hypervisor.port)] = {"name": ", ".join(device_names),
+                                                                  "pids": hypervisor.pids()}
+        return nodes
+
     def get_device_instance(self, device_id, instance_dict):
         """
         Returns a device instance.
@@ -233,12 +305,8 @@ class Dynamips(IModule):
         """
 
         # automatically save configs for all router instances
-        for router_id in self._routers:
-            router = self._routers[router_id]
-            try:
-                router.save_configs()
-            except DynamipsError:
-                continue
+        # (only the routers with a modified NVRAM)
+        self._autosave_configs()
 
         # stop all Dynamips hypervisors
         if self._hypervisor_manager:
@@ -260,11 +328,17 @@ class Dynamips(IModule):
         NIO_FIFO.reset()
         NIO_Mcast.reset()
         NIO_Null.reset()
+        self.link_impairments.close()
+        self._nio_stats.clear()
+        self._nio_stats_subscribers.clear()
+        self._mac_table_subscribers.clear()
+        self._mac_table_pushed.clear()
 
         self._routers.clear()
         self._ethernet_switches.clear()
         self._frame_relay_switches.clear()
         self._atm_switches.clear()
+        self._capture_sessions.stop_all()
 
         self.delete_dynamips_files()
 
@@ -390,6 +464,206 @@ class Dynamips(IModule):
             log.debug("received request {}".format(request))
             self.send_response(request)
 
+    @IModule.route("dynamips.set_link_impairment")
+    def set_link_impairment(self, request):
+        """
+        Sets the impairment (latency, jitter, packet loss and rate)
+        of the packets sent on a UDP NIO of any Dynamips node.
+
+        Mandatory request parameters:
+        - lport (local port of the UDP NIO)
+
+        Optional request parameters:
+        - latency, jitter, loss, rate, burst, queue_limit
+
+        Response parameters:
+        - lport (local port of the UDP NIO)
+        - active (True if the impairment is applied, False until the NIO is added)
+        - stats (packets, forwarded packets and bytes, drops per reason)
+
+        :param request: JSON request
+        """
+
+        self.apply_link_impairment(request)
+
+    def _nio_endpoints(self):
+        """
+        Lists the NIOs connected to the ports of the nodes.
+
+        :returns: list of tuples (NIO, node description dictionary)
+        """
+
+        endpoints = []
+        for router in self._routers.values():
+            for slot_id, adapter in enumerate(router.slots):
+                if adapter is None:
+                    continue
+                for port, nio in adapter.ports.items():
+                    if nio is not None:
+                        endpoints.append((nio, {"type": "vm", "id": router.id, "name": router.name, "slot": slot_id, "port": port}))
+        for device_type, devices in (("ethsw", self._ethernet_switches),
+                                     ("frsw", self._frame_relay_switches),
+                                     ("atmsw", self._atm_switches)):
+            for device in devices.values():
+                for port, nio in device.nios.items():
+                    endpoints.append((nio, {"type": device_type, "id": device.id, "name": device.name, "port": port}))
+        for hub in self._ethernet_hubs.values():
+            for port, nio in hub.mapping.items():
+                endpoints.append((nio, {"type": "ethhub", "id": hub.id, "name": hub.name, "port": port}))
+        return endpoints
+
+    def _nio_stats_results(self, history=False):
+        """
+        Returns the NIO statistics sent to the clients.
+
+        :param history: include the time series of the counters
+
+        :returns: dictionary
+        """
+
+        return {"timestamp": self._nio_stats.last_collection,
+                "interval": self._nio_stats_interval,
+                "nios": self._nio_stats.snapshot(history)}
+
+    def _push_nio_stats(self):
+        """
+        Periodic callback to collect the NIO statistics
+        and send them to the subscribed sessions.
+        """
+
+        if not self._nio_stats_subscribers:
+            return
+
+        self._nio_stats.collect(self._nio_endpoints())
+        results = self._nio_stats_results()
+        # the workers of a sharded module each send the statistics of their nodes
+        results["worker"] = self.identity
+        notification = jsonrpc.JSONRPCNotification("dynamips.nio_stats", results)()
+        for session in self._nio_stats_subscribers:
+            self._send_message(session, notification)
+
+    def _push_mac_table_changes(self):
+        """
+        Periodic callback to refresh the MAC address tables of the
+        Ethernet switches with subscribers and send them the changes.
+        """
+
+        for ethsw_id, sessions in list(self._mac_table_subscribers.items()):
+            ethsw = self._ethernet_switches.get(ethsw_id)
+            if not ethsw or not sessions:
+                continue
+            try:
+                ethsw.refresh_mac_table()
+            except DynamipsError as e:
+                log.warn("could not read the MAC address table of Ethernet switch {}: {}".format(ethsw.name, e))
+                continue
+            # the table may also have been refreshed by dynamips.ethsw.mac_table requests
+            pushed_version = self._mac_table_pushed.get(ethsw_id)
+            if pushed_version == ethsw.mac_table.version:
+                continue
+            changes = ethsw.mac_table.changes_since(pushed_version)
+            self._mac_table_pushed[ethsw_id] = changes["version"]
+            changes["id"] = ethsw_id
+            notification = jsonrpc.JSONRPCNotification("dynamips.ethsw.mac_table_changed", changes)()
+            for session in list(sessions):
+                self._send_message(session, notification)
+
+    @IModule.route("dynamips.nio_stats")
+    def nio_stats(self, request):
+        """
+        Returns the statistics of the NIOs of all the nodes, the counters
+        of a hypervisor are read in one batch. When the module is sharded, the
+        request is sent to all the workers and the server merges their responses,
+        each worker pushes the notifications for the NIOs of its own nodes
+        (with the identity of the worker in the worker parameter).
+
+        Optional request parameters:
+        - subscribe (receive the statistics in periodic dynamips.nio_stats notifications
+        (true) or stop receiving them (false))
+        - history (include the time series of the counters)
+
+        Response parameters:
+        - timestamp (time of the collection)
+        - interval (collection interval in seconds)
+        - nios (list of NIOs with node type, id, name, slot and port, counters, rates per second
+        and history if requested)
+
+        :param request: JSON request
+        """
+
+        if request is None:
+            request = {}
+        if not self.validate_request(request, NIO_STATS_SCHEMA):
+            return
+
+        if "subscribe" in request:
+            if request["subscribe"]:
+                self._nio_stats_subscribers.add(self._current_session)
+            else:
+                self._nio_stats_subscribers.discard(self._current_session)
+
+        last_collection = self._nio_stats.last_collection
+        if last_collection is None or time.time() - last_collection >= max(self._nio_stats_interval, 1):
+            self._nio_stats.collect(self._nio_endpoints())
+        self.send_response(self._nio_stats_results(request.get("history", False)))
+
+    @IModule.route("dynamips.session_closed")
+    def session_closed(self, request):
+        """
+        Forgets the subscriptions of a client that has
+        disconnected (JSON-RPC notification sent by the server).
+
+        :param request: JSON request (not used)
+        """
+
+        self._nio_stats_subscribers.discard(self._current_session)
+        for ethsw_id, sessions in list(self._mac_table_subscribers.items()):
+            sessions.discard(self._current_session)
+            if not sessions:
+                del self._mac_table_subscribers[ethsw_id]
+
+    def delete_nio(self, nio):
+        """
+        Deletes a NIO and the relay of its link impairment, if any.
+
+        :param nio: NIO instance
+        """
+
+        nio.delete()
+        if isinstance(nio, NIO_UDP):
+            self.link_impairments.detach(nio.lport)
+
+    def _create_nio_udp(self, node, lport, rhost, rport, attempts=3):
+        """
+        Creates a NIO UDP, relayed if an impairment has been set for its port.
+
+        :param node: node requesting the NIO
+        :param lport: local port
+        :param rhost: remote host
+        :param rport: remote port
+        :param attempts: number of relay ports tried
+
+        :returns: NIO_UDP instance
+        """
+
+        for attempt in range(attempts):
+            try:
+                nio_lport, nio_rhost, nio_rport = self.link_impairments.attach(lport, rhost, rport, node.hypervisor.host)
+            except OSError as e:
+                raise DynamipsError("Could not relay UDP port {} for the link impairment: {}".format(lport, e))
+            # the hypervisor binds the port right away
+            self.link_impairments.release(nio_lport)
+            try:
+                return NIO_UDP(node.hypervisor, nio_lport, nio_rhost, nio_rport)
+            except DynamipsError:
+                if nio_lport == lport:
+                    raise
+                self.link_impairments.detach(nio_lport)
+                if attempt == attempts - 1:
+                    raise
+                # the port may have been taken since it was released, try another one
+                log.warning("could not bind relayed UDP port {}, retrying".format(nio_lport))
+
     def create_nio(self, node, request):
         """
         Creates a new NIO.
@@ -414,9 +688,14 @@ class Dynamips(IModule):
                 raise DynamipsError("Could not create an UDP connection to {}:{}: {}".format(rhost, rport, e))
             # check if we have an allocated NIO UDP auto
             nio = node.hypervisor.get_nio_udp_auto(lport)
+            if nio and lport in self.link_impairments:
+                # the relay takes over the port bound by the hypervisor
+                nio.delete()
+                nio = None
             if not nio:
-                # otherwise create an NIO UDP
-                nio = NIO_UDP(node.hypervisor, lport, rhost, rport)
+                # otherwise create an NIO UDP,
+                # a relay is inserted if an impairment has been set for this port
+                nio = self._create_nio_udp(node, lport, rhost, rport)
             else:
                 nio.connect(rhost, rport)
         elif request["nio"]["type"] == "nio_generic_ethernet":
@@ -569,9 +848,8 @@ class Dynamips(IModule):
 
         config_path = destination_config_path
         try:
-            with open(config_path, "w") as f:
-                log.info("saving startup-config to {}".format(config_path))
-                f.write(config)
+            if write_config_file(config_path, config):
+                log.info("startup-config saved to {}".format(config_path))
         except OSError as e:
             raise DynamipsError("Could not save the configuration {}: {}".format(config_path, e))
         return "configs" + os.sep + os.path.basename(config_path)
@@ -237,27 +237,22 @@ class ATMSW(object):
         try:
             atmsw.add_nio(nio, port)
             pvc_entry = re.compile(r"""^([0-9]*):([0-9]*):([0-9]*)$""")
+            connections = []
             for source, destination in mappings.items():
                 match_source_pvc = pvc_entry.search(source)
                 match_destination_pvc = pvc_entry.search(destination)
                 if match_source_pvc and match_destination_pvc:
                     # add the virtual channels mapped with this port/nio
-                    source_port, source_vpi, source_vci = map(int, match_source_pvc.group(1, 2, 3))
-                    destination_port, destination_vpi, destination_vci = map(int, match_destination_pvc.group(1, 2, 3))
-                    if atmsw.has_port(destination_port):
-                        if (source_port, source_vpi, source_vci) not in atmsw.mapping and \
-                           (destination_port, destination_vpi, destination_vci) not in atmsw.mapping:
-                            atmsw.map_pvc(source_port, source_vpi, source_vci, destination_port, destination_vpi, destination_vci)
-                            atmsw.map_pvc(destination_port, destination_vpi, destination_vci, source_port, source_vpi, source_vci)
+                    source = tuple(map(int, match_source_pvc.group(1, 2, 3)))
+                    destination = tuple(map(int, match_destination_pvc.group(1, 2, 3)))
                 else:
                     # add the virtual paths mapped with this port/nio
-                    source_port, source_vpi = map(int, source.split(':'))
-                    destination_port, destination_vpi = map(int, destination.split(':'))
-                    if atmsw.has_port(destination_port):
-                        if (source_port, source_vpi) not in atmsw.mapping and (destination_port, destination_vpi) not in atmsw.mapping:
-                            atmsw.map_vp(source_port, source_vpi, destination_port, destination_vpi)
-                            atmsw.map_vp(destination_port, destination_vpi, source_port, source_vpi)
-
+                    source = tuple(map(int, source.split(':')))
+                    destination = tuple(map(int, destination.split(':')))
+                if atmsw.has_port(destination[0]):
+                    connections.append((source, destination))
+                    connections.append((destination, source))
+            atmsw.map_connections(connections)
         except DynamipsError as e:
             self.send_custom_error(str(e))
             return
@@ -290,24 +285,11 @@ class ATMSW(object):
 
         port = request["port"]
         try:
-            for source, destination in atmsw.mapping.copy().items():
-                if len(source) == 3 and len(destination) == 3:
-                    # remove the virtual channels mapped with this port/nio
-                    source_port, source_vpi, source_vci = source
-                    destination_port, destination_vpi, destination_vci = destination
-                    if port == source_port:
-                        atmsw.unmap_pvc(source_port, source_vpi, source_vci, destination_port, destination_vpi, destination_vci)
-                        atmsw.unmap_pvc(destination_port, destination_vpi, destination_vci, source_port, source_vpi, source_vci)
-                else:
-                    # remove the virtual paths mapped with this port/nio
-                    source_port, source_vpi = source
-                    destination_port, destination_vpi = destination
-                    if port == source_port:
-                        atmsw.unmap_vp(source_port, source_vpi, destination_port, destination_vpi)
-                        atmsw.unmap_vp(destination_port, destination_vpi, source_port, source_vpi)
+            # remove the virtual channels and paths mapped with this port/nio
+            atmsw.unmap_port(port)
 
             nio = atmsw.remove_nio(port)
-            nio.delete()
+            self.delete_nio(nio)
         except DynamipsError as e:
             self.send_custom_error(str(e))
             return
@@ -327,6 +309,9 @@ class ATMSW(object):
 
         Optional request parameters:
         - data_link_type (PCAP DLT_* value)
+        - max_file_size (rotate the capture file after this size in MB)
+        - max_files (number of capture files to keep)
+        - max_file_duration (rotate the capture file after this duration in seconds)
 
         Response parameters:
         - port_id (port identifier)
@@ -348,10 +333,12 @@ class ATMSW(object):
         capture_file_name = request["capture_file_name"]
         data_link_type = request.get("data_link_type")
 
+        capture_key = ("atmsw", request["id"], port)
         try:
             capture_file_path = os.path.join(atmsw.hypervisor.working_dir, "captures", capture_file_name)
-            atmsw.start_capture(port, capture_file_path, data_link_type)
-        except DynamipsError as e:
+            self._capture_sessions.start(capture_key, capture_file_path, request,
+                                         lambda writer_path: atmsw.start_capture(port, writer_path, data_link_type))
+        except (DynamipsError, OSError) as e:
             self.send_custom_error(str(e))
             return
 
@@ -371,6 +358,7 @@ class ATMSW(object):
 
         Response parameters:
         - port_id (port identifier)
+        - capture_stats (bytes, packets, drops, rotated and pruned files)
 
         :param request: JSON request
         """
@@ -385,6 +373,7 @@ class ATMSW(object):
             return
 
         port = request["port"]
+        capture_key = ("atmsw", request["id"], port)
         try:
             atmsw.stop_capture(port)
         except DynamipsError as e:
@@ -392,4 +381,7 @@ class ATMSW(object):
             return
 
         response = {"port_id": request["port_id"]}
+        capture_stats = self._capture_sessions.stop(capture_key)
+        if capture_stats is not None:
+            response["capture_stats"] = capture_stats
         self.send_response(response)
@@ -265,7 +265,7 @@ class ETHHUB(object):
         port = request["port"]
         try:
             nio = ethhub.remove_nio(port)
-            nio.delete()
+            self.delete_nio(nio)
         except DynamipsError as e:
             self.send_custom_error(str(e))
             return
@@ -285,6 +285,9 @@ class ETHHUB(object):
 
         Optional request parameters:
         - data_link_type (PCAP DLT_* value)
+        - max_file_size (rotate the capture file after this size in MB)
+        - max_files (number of capture files to keep)
+        - max_file_duration (rotate the capture file after this duration in seconds)
 
         Response parameters:
         - port_id (port identifier)
@@ -306,10 +309,12 @@ class ETHHUB(object):
         capture_file_name = request["capture_file_name"]
         data_link_type = request.get("data_link_type")
 
+        capture_key = ("ethhub", request["id"], port)
         try:
             capture_file_path = os.path.join(ethhub.hypervisor.working_dir, "captures", capture_file_name)
-            ethhub.start_capture(port, capture_file_path, data_link_type)
-        except DynamipsError as e:
+            self._capture_sessions.start(capture_key, capture_file_path, request,
+                                         lambda writer_path: ethhub.start_capture(port, writer_path, data_link_type))
+        except (DynamipsError, OSError) as e:
             self.send_custom_error(str(e))
             return
 
@@ -329,6 +334,7 @@ class ETHHUB(object):
 
         Response parameters:
         - port_id (port identifier)
+        - capture_stats (bytes, packets, drops, rotated and pruned files)
 
         :param request: JSON request
         """
@@ -343,6 +349,7 @@ class ETHHUB(object):
             return
 
         port = request["port"]
+        capture_key = ("ethhub", request["id"], port)
         try:
             ethhub.stop_capture(port)
         except DynamipsError as e:
@@ -350,4 +357,7 @@ class ETHHUB(object):
             return
 
         response = {"port_id": request["port_id"]}
+        capture_stats = self._capture_sessions.stop(capture_key)
+        if capture_stats is not None:
+            response["capture_stats"] = capture_stats
         self.send_response(response)
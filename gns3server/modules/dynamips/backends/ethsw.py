@@ -28,6 +28,7 @@ from ..schemas.ethsw import ETHSW_ADD_NIO_SCHEMA
 from ..schemas.ethsw import ETHSW_DELETE_NIO_SCHEMA
 from ..schemas.ethsw import ETHSW_START_CAPTURE_SCHEMA
 from ..schemas.ethsw import ETHSW_STOP_CAPTURE_SCHEMA
+from ..schemas.ethsw import ETHSW_MAC_TABLE_SCHEMA
 
 import logging
 log = logging.getLogger(__name__)
@@ -99,6 +100,8 @@ class ETHSW(object):
             ethsw.delete()
             self._hypervisor_manager.unallocate_hypervisor_for_simulated_device(ethsw)
             del self._ethernet_switches[ethsw_id]
+            self._mac_table_subscribers.pop(ethsw_id, None)
+            self._mac_table_pushed.pop(ethsw_id, None)
         except DynamipsError as e:
             self.send_custom_error(str(e))
             return
@@ -132,22 +135,15 @@ class ETHSW(object):
             return
 
         if "ports" in request:
-            ports = request["ports"]
-
-            # update the port settings
-            for port, info in ports.items():
-                vlan = info["vlan"]
-                port_type = info["type"]
-                try:
-                    if port_type == "access":
-                        ethsw.set_access_port(int(port), vlan)
-                    elif port_type == "dot1q":
-                        ethsw.set_dot1q_port(int(port), vlan)
-                    elif port_type == "qinq":
-                        ethsw.set_qinq_port(int(port), vlan)
-                except DynamipsError as e:
-                    self.send_custom_error(str(e))
-                    return
+            # update the port settings, only the changed ports are reconfigured
+            ports = {}
+            for port, info in request["ports"].items():
+                ports[int(port)] = (info["type"], info["vlan"])
+            try:
+                ethsw.update_ports(ports)
+            except DynamipsError as e:
+                self.send_custom_error(str(e))
+                return
 
         response = {}
         # rename the switch if requested
@@ -294,13 +290,70 @@ class ETHSW(object):
         port = request["port"]
         try:
             nio = ethsw.remove_nio(port)
-            nio.delete()
+            self.delete_nio(nio)
         except DynamipsError as e:
             self.send_custom_error(str(e))
             return
 
         self.send_response(True)
 
+    @IModule.route("dynamips.ethsw.mac_table")
+    def ethsw_mac_table(self, request):
+        """
+        Returns the MAC address table of an Ethernet switch
+        or the changes since a version of the table.
+
+        Mandatory request parameters:
+        - id (switch identifier)
+
+        Optional request parameters:
+        - since (version of the table the client has)
+        - subscribe (receive the changes in periodic dynamips.ethsw.mac_table_changed
+        notifications (true) or stop receiving them (false))
+
+        Response parameters:
+        - id (switch identifier)
+        - version (version of the table)
+        - full (True if the whole table is returned)
+        - entries (whole table: list of [MAC address, VLAN, port])
+        - learned (changes: list of [MAC address, VLAN, port], new or moved entries)
+        - aged (changes: list of [MAC address, VLAN])
+
+        :param request: JSON request
+        """
+
+        # validate the request
+        if not self.validate_request(request, ETHSW_MAC_TABLE_SCHEMA):
+            return
+
+        # get the Ethernet switch instance
+        ethsw_id = request["id"]
+        ethsw = self.get_device_instance(ethsw_id, self._ethernet_switches)
+        if not ethsw:
+            return
+
+        try:
+            ethsw.refresh_mac_table()
+        except DynamipsError as e:
+            self.send_custom_error(str(e))
+            return
+
+        if "subscribe" in request:
+            subscribers = self._mac_table_subscribers.setdefault(ethsw_id, set())
+            if request["subscribe"]:
+                if not subscribers:
+                    # the first notification has the changes since this response
+                    self._mac_table_pushed[ethsw_id] = ethsw.mac_table.version
+                subscribers.add(self._current_session)
+            else:
+                subscribers.discard(self._current_session)
+                if not subscribers:
+                    del self._mac_table_subscribers[ethsw_id]
+
+        response = ethsw.mac_table.changes_since(request.get("since"))
+        response["id"] = ethsw_id
+        self.send_response(response)
+
     @IModule.route("dynamips.ethsw.start_capture")
     def ethsw_start_capture(self, request):
         """
@@ -314,6 +367,9 @@ class ETHSW(object):
 
         Optional request parameters:
         - data_link_type (PCAP DLT_* value)
+        - max_file_size (rotate the capture file after this size in MB)
+        - max_files (number of capture files to keep)
+        - max_file_duration (rotate the capture file after this duration in seconds)
 
         Response parameters:
         - port_id (port identifier)
@@ -335,10 +391,12 @@ class ETHSW(object):
         capture_file_name = request["capture_file_name"]
         data_link_type = request.get("data_link_type")
 
+        capture_key = ("ethsw", request["id"], port)
         try:
             capture_file_path = os.path.join(ethsw.hypervisor.working_dir, "captures", capture_file_name)
-            ethsw.start_capture(port, capture_file_path, data_link_type)
-        except DynamipsError as e:
+            self._capture_sessions.start(capture_key, capture_file_path, request,
+                                         lambda writer_path: ethsw.start_capture(port, writer_path, data_link_type))
+        except (DynamipsError, OSError) as e:
             self.send_custom_error(str(e))
             return
 
@@ -358,6 +416,7 @@ class ETHSW(object):
 
         Response parameters:
         - port_id (port identifier)
+        - capture_stats (bytes, packets, drops, rotated and pruned files)
 
         :param request: JSON request
         """
@@ -372,6 +431,7 @@ class ETHSW(object):
             return
 
         port = request["port"]
+        capture_key = ("ethsw", request["id"], port)
         try:
             ethsw.stop_capture(port)
         except DynamipsError as e:
@@ -379,4 +439,7 @@ class ETHSW(object):
             return
 
         response = {"port_id": request["port_id"]}
+        capture_stats = self._capture_sessions.stop(capture_key)
+        if capture_stats is not None:
+            response["capture_stats"] = capture_stats
         self.send_response(response)
@@ -237,14 +237,15 @@ class FRSW(object):
         try:
             frsw.add_nio(nio, port)
 
-            # add the VCs mapped with this port/nio
+            # add the VCs mapped with this port/nio (both directions)
+            vcs = []
             for source, destination in mappings.items():
                 source_port, source_dlci = map(int, source.split(':'))
                 destination_port, destination_dlci = map(int, destination.split(':'))
                 if frsw.has_port(destination_port):
-                    if (source_port, source_dlci) not in frsw.mapping and (destination_port, destination_dlci) not in frsw.mapping:
-                        frsw.map_vc(source_port, source_dlci, destination_port, destination_dlci)
-                        frsw.map_vc(destination_port, destination_dlci, source_port, source_dlci)
+                    vcs.append((source_port, source_dlci, destination_port, destination_dlci))
+                    vcs.append((destination_port, destination_dlci, source_port, source_dlci))
+            frsw.map_vcs(vcs)
         except DynamipsError as e:
             self.send_custom_error(str(e))
             return
@@ -278,15 +279,10 @@ class FRSW(object):
         port = request["port"]
         try:
             # remove the VCs mapped with this port/nio
-            for source, destination in frsw.mapping.copy().items():
-                source_port, source_dlci = source
-                destination_port, destination_dlci = destination
-                if port == source_port:
-                    frsw.unmap_vc(source_port, source_dlci, destination_port, destination_dlci)
-                    frsw.unmap_vc(destination_port, destination_dlci, source_port, source_dlci)
+            frsw.unmap_port(port)
 
             nio = frsw.remove_nio(port)
-            nio.delete()
+            self.delete_nio(nio)
         except DynamipsError as e:
             self.send_custom_error(str(e))
             return
@@ -306,6 +302,9 @@ class FRSW(object):
 
         Optional request parameters:
         - data_link_type (PCAP DLT_* value)
+        - max_file_size (rotate the capture file after this size in MB)
+        - max_files (number of capture files to keep)
+        - max_file_duration (rotate the capture file after this duration in seconds)
 
         Response parameters:
         - port_id (port identifier)
@@ -327,10 +326,12 @@ class FRSW(object):
         capture_file_name = request["capture_file_name"]
         data_link_type = request.get("data_link_type")
 
+        capture_key = ("frsw", request["id"], port)
         try:
             capture_file_path = os.path.join(frsw.hypervisor.working_dir, "captures", capture_file_name)
-            frsw.start_capture(port, capture_file_path, data_link_type)
-        except DynamipsError as e:
+            self._capture_sessions.start(capture_key, capture_file_path, request,
+                                         lambda writer_path: frsw.start_capture(port, writer_path, data_link_type))
+        except (DynamipsError, OSError) as e:
             self.send_custom_error(str(e))
             return
 
@@ -350,6 +351,7 @@ class FRSW(object):
 
         Response parameters:
         - port_id (port identifier)
+        - capture_stats (bytes, packets, drops, rotated and pruned files)
 
         :param request: JSON request
         """
@@ -364,6 +366,7 @@ class FRSW(object):
             return
 
         port = request["port"]
+        capture_key = ("frsw", request["id"], port)
         try:
             frsw.stop_capture(port)
         except DynamipsError as e:
@@ -371,4 +374,7 @@ class FRSW(object):
             return
 
         response = {"port_id": request["port_id"]}
+        capture_stats = self._capture_sessions.stop(capture_key)
+        if capture_stats is not None:
+            response["capture_stats"] = capture_stats
         self.send_response(response)
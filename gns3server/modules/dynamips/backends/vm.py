@@ -192,14 +192,14 @@ class VM(object):
                 if ios_image in jitsharing_groups:
                     router.jit_sharing_group = jitsharing_groups[ios_image]
                 else:
-                    new_jit_group = -1
-                    for jit_group in range(0, 127):
-                        if jit_group not in jitsharing_groups.values():
-                            new_jit_group = jit_group
-                            break
-                    if new_jit_group == -1:
+                    new_jit_group = hypervisor.allocate_jitsharing_group()
+                    if new_jit_group is None:
                         raise DynamipsError("All JIT groups are allocated!")
-                    router.jit_sharing_group = new_jit_group
+                    try:
+                        router.jit_sharing_group = new_jit_group
+                    except DynamipsError:
+                        hypervisor.release_jitsharing_group(new_jit_group)
+                        raise
 
             # Ghost IOS support
             if self._hypervisor_manager.ghost_ios_support:
@@ -523,6 +523,9 @@ class VM(object):
 
         Optional request parameters:
         - data_link_type (PCAP DLT_* value)
+        - max_file_size (rotate the capture file after this size in MB)
+        - max_files (number of capture files to keep)
+        - max_file_duration (rotate the capture file after this duration in seconds)
 
         Response parameters:
         - port_id (port identifier)
@@ -545,10 +548,12 @@ class VM(object):
         capture_file_name = request["capture_file_name"]
         data_link_type = request.get("data_link_type")
 
+        capture_key = ("vm", request["id"], slot, port)
         try:
             capture_file_path = os.path.join(router.hypervisor.working_dir, "captures", capture_file_name)
-            router.start_capture(slot, port, capture_file_path, data_link_type)
-        except DynamipsError as e:
+            self._capture_sessions.start(capture_key, capture_file_path, request,
+                                         lambda writer_path: router.start_capture(slot, port, writer_path, data_link_type))
+        except (DynamipsError, OSError) as e:
             self.send_custom_error(str(e))
             return
 
@@ -569,6 +574,7 @@ class VM(object):
 
         Response parameters:
         - port_id (port identifier)
+        - capture_stats (bytes, packets, drops, rotated and pruned files)
 
         :param request: JSON request
         """
@@ -584,6 +590,7 @@ class VM(object):
 
         slot = request["slot"]
         port = request["port"]
+        capture_key = ("vm", request["id"], slot, port)
         try:
             router.stop_capture(slot, port)
         except DynamipsError as e:
@@ -591,6 +598,9 @@ class VM(object):
             return
 
         response = {"port_id": request["port_id"]}
+        capture_stats = self._capture_sessions.stop(capture_key)
+        if capture_stats is not None:
+            response["capture_stats"] = capture_stats
         self.send_response(response)
 
     @IModule.route("dynamips.vm.save_config")
@@ -893,7 +903,7 @@ class VM(object):
         port = request["port"]
         try:
             nio = router.slot_remove_nio_binding(slot, port)
-            nio.delete()
+            self.delete_nio(nio)
         except DynamipsError as e:
             self.send_custom_error(str(e))
             return
@@ -22,8 +22,10 @@ http://github.com/GNS3/dynamips/blob/master/README.hypervisor#L46
 
 import socket
 import re
+import threading
 import logging
 from .dynamips_error import DynamipsError
+from ..id_allocator import IdAllocator
 from .nios.nio_udp_auto import NIO_UDP_auto
 
 log = logging.getLogger(__name__)
@@ -52,6 +54,7 @@ class DynamipsHypervisor(object):
         self._devices = []
         self._ghosts = {}
         self._jitsharing_groups = {}
+        self._jitsharing_group_ids = IdAllocator(0, 127, sharded=False)
         self._working_dir = working_dir
         self._console_start_port_range = 2001
         self._console_end_port_range = 2500
@@ -64,6 +67,8 @@ class DynamipsHypervisor(object):
         self._timeout = timeout
         self._socket = None
         self._uuid = None
+        # commands for devices handled by different threads share the connection
+        self._lock = threading.Lock()
 
     def connect(self):
         """
@@ -386,6 +391,26 @@ class DynamipsHypervisor(object):
         """
 
         self._jitsharing_groups[image_name] = group_number
+        self._jitsharing_group_ids.reserve(group_number)
+
+    def allocate_jitsharing_group(self):
+        """
+        Allocates an unused JIT blocks sharing group number.
+
+        :returns: group (integer) or None if all the groups are allocated
+        """
+
+        return self._jitsharing_group_ids.allocate()
+
+    def release_jitsharing_group(self, group_number):
+        """
+        Releases a JIT blocks sharing group number not used by any image.
+
+        :param group_number: group (integer)
+        """
+
+        if group_number not in self._jitsharing_groups.values():
+            self._jitsharing_group_ids.release(group_number)
 
     @property
     def host(self):
@@ -453,6 +478,71 @@ class DynamipsHypervisor(object):
         :returns: results as a list
         """
 
+        with self._lock:
+            return self._send(command)
+
+    def send_batch(self, commands):
+        """
+        Sends several commands to this hypervisor in one round trip:
+        all the commands are written at once then the responses are read.
+
+        :param commands: list of Dynamips hypervisor commands
+
+        :returns: list with, for each command, its results as a list
+        or the DynamipsError instance if the command has failed
+        """
+
+        if not commands:
+            return []
+
+        with self._lock:
+            if not self._socket:
+                raise DynamipsError("Not connected")
+
+            try:
+                data = "".join(command.strip() + "\n" for command in commands)
+                log.debug("sending batch of {} commands".format(len(commands)))
+                self.socket.sendall(data.encode("utf-8"))
+            except OSError as e:
+                raise DynamipsError("Lost communication with {host}:{port} :{error}"
+                                    .format(host=self._host, port=self._port, error=e))
+
+            # responses are read line by line as they may arrive in the same chunk
+            results = []
+            data = []
+            buf = ""
+            while len(results) < len(commands):
+                while "\r\n" not in buf:
+                    try:
+                        chunk = self.socket.recv(1024)
+                    except OSError as e:
+                        raise DynamipsError("Communication timed out with {host}:{port} :{error}"
+                                            .format(host=self._host, port=self._port, error=e))
+                    if not chunk:
+                        raise DynamipsError("Could not communicate with {host}:{port}"
+                                            .format(host=self._host, port=self._port))
+                    buf += chunk.decode("utf-8")
+
+                line, buf = buf.split("\r\n", 1)
+                data.append(line)
+                if self.error_re.search(line):
+                    results.append(DynamipsError(line[4:]))
+                    data = []
+                elif line[:4] == "100-":
+                    data[-1] = line[4:]
+                    if data[-1] == "OK":
+                        data.pop()
+                    for index in range(len(data)):
+                        if self.success_re.search(data[index]):
+                            data[index] = data[index][4:]
+                    results.append(data)
+                    data = []
+
+        log.debug("returned results {}".format(results))
+        return results
+
+    def _send(self, command):
+
         # Dynamips responses are of the form:
         #   1xx yyyyyy\r\n
         #   1xx yyyyyy\r\n
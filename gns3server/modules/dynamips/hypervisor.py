@@ -268,6 +268,17 @@ class Hypervisor(DynamipsHypervisor):
             return True
         return False
 
+    def pids(self):
+        """
+        Returns the PIDs of the running processes of this hypervisor.
+
+        :returns: list of PIDs
+        """
+
+        if self.is_running():
+            return [self._process.pid]
+        return []
+
     def _build_command(self):
         """
         Command to start the Dynamips hypervisor process.
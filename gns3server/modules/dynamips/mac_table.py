@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Versioned snapshots of the MAC address table of an Ethernet switch.
+
+Each refresh that changes the table increments the version and records the
+learned and aged entries, so the clients can ask for the changes since the
+version they have instead of the whole table.
+"""
+
+import threading
+import collections
+
+
+def parse_mac_addr_table(lines, nio_ports):
+    """
+    Parses the output of "ethsw show_mac_addr_table".
+
+    :param lines: lines of the output (Ethernet address, VLAN, NIO name)
+    :param nio_ports: dictionary NIO name -> switch port
+
+    :returns: dictionary (Ethernet address, VLAN) -> port (None if the NIO is unknown)
+    """
+
+    entries = {}
+    for line in lines:
+        fields = line.split()
+        if len(fields) != 3:
+            continue
+        mac, vlan, nio_name = fields
+        try:
+            vlan = int(vlan)
+        except ValueError:
+            continue
+        entries[(mac.lower(), vlan)] = nio_ports.get(nio_name)
+    return entries
+
+
+class MacAddressTable(object):
+    """
+    Last snapshot of a MAC address table with the changes of the last versions.
+
+    :param max_changes: number of versions for which the changes are kept
+    """
+
+    def __init__(self, max_changes=64):
+
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._version = 0
+        self._changes = collections.deque(maxlen=max_changes)  # (version, learned, aged)
+
+    @property
+    def version(self):
+        """
+        Returns the version of the snapshot.
+
+        :returns: version number
+        """
+
+        return self._version
+
+    def update(self, entries):
+        """
+        Replaces the snapshot.
+
+        :param entries: dictionary (Ethernet address, VLAN) -> port
+
+        :returns: tuple (version, learned entries, aged entries), learned entries are
+        [Ethernet address, VLAN, port] (new or moved) and aged entries [Ethernet address, VLAN]
+        """
+
+        with self._lock:
+            learned = [[mac, vlan, port] for (mac, vlan), port in entries.items()
+                       if (mac, vlan) not in self._entries or self._entries[(mac, vlan)] != port]
+            aged = [[mac, vlan] for (mac, vlan) in self._entries if (mac, vlan) not in entries]
+            if learned or aged:
+                self._version += 1
+                self._entries = dict(entries)
+                self._changes.append((self._version, learned, aged))
+            return self._version, learned, aged
+
+    def changes_since(self, version=None):
+        """
+        Returns the table or the changes since a version.
+
+        :param version: version the client has (None for the whole table)
+
+        :returns: dictionary with the version and either the entries (full table)
+        or the learned and aged entries
+        """
+
+        with self._lock:
+            if version == self._version:
+                return {"version": self._version, "full": False, "learned": [], "aged": []}
+            if version is not None and self._changes and self._changes[0][0] <= version + 1 and version < self._version:
+                merged = {}
+                for change_version, learned, aged in self._changes:
+                    if change_version <= version:
+                        continue
+                    for mac, vlan, port in learned:
+                        merged[(mac, vlan)] = [mac, vlan, port]
+                    for mac, vlan in aged:
+                        merged[(mac, vlan)] = None
+                return {"version": self._version,
+                        "full": False,
+                        "learned": [entry for entry in merged.values() if entry is not None],
+                        "aged": [[mac, vlan] for (mac, vlan), entry in merged.items() if entry is None]}
+            # unknown or too old version
+            return {"version": self._version,
+                    "full": True,
+                    "entries": [[mac, vlan, port] for (mac, vlan), port in sorted(self._entries.items())]}
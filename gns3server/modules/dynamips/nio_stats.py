@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Collection of the NIO statistics (packets and bytes in/out) of the Dynamips
+nodes: the counters of all the NIOs of a hypervisor are read in one batch of
+"nio get_stats" commands and kept in time series to compute the rates.
+"""
+
+import time
+import array
+
+from .dynamips_error import DynamipsError
+
+import logging
+log = logging.getLogger(__name__)
+
+COUNTERS = ("packets_in", "packets_out", "bytes_in", "bytes_out")
+
+
+class CounterSeries(object):
+    """
+    Time series of the counters of a NIO, stored in arrays used as ring buffers.
+
+    :param capacity: number of samples to keep
+    """
+
+    def __init__(self, capacity):
+
+        self._capacity = capacity
+        self._timestamps = array.array("d", [0.0] * capacity)
+        self._values = array.array("Q", [0] * (capacity * len(COUNTERS)))
+        self._count = 0
+
+    def __len__(self):
+
+        return min(self._count, self._capacity)
+
+    def append(self, timestamp, values):
+        """
+        Adds a sample.
+
+        :param timestamp: time of the sample
+        :param values: counter values (in COUNTERS order)
+        """
+
+        index = self._count % self._capacity
+        self._timestamps[index] = timestamp
+        offset = index * len(COUNTERS)
+        self._values[offset:offset + len(COUNTERS)] = array.array("Q", values)
+        self._count += 1
+
+    def sample(self, age=0):
+        """
+        Returns a sample.
+
+        :param age: 0 for the last sample, 1 for the previous one, etc.
+
+        :returns: tuple (timestamp, counter values)
+        """
+
+        index = (self._count - 1 - age) % self._capacity
+        offset = index * len(COUNTERS)
+        return self._timestamps[index], self._values[offset:offset + len(COUNTERS)].tolist()
+
+    def rates(self):
+        """
+        Computes the rates between the last two samples.
+
+        :returns: list of rates per second (in COUNTERS order) or None if there is only one sample
+        """
+
+        if len(self) < 2:
+            return None
+        timestamp, values = self.sample()
+        previous_timestamp, previous_values = self.sample(1)
+        elapsed = timestamp - previous_timestamp
+        if elapsed <= 0:
+            return None
+        rates = []
+        for value, previous_value in zip(values, previous_values):
+            if value < previous_value:
+                # the counters have been reset
+                previous_value = 0
+            rates.append((value - previous_value) / elapsed)
+        return rates
+
+    def history(self):
+        """
+        Returns all the samples, oldest first.
+
+        :returns: list of [timestamp, counter values...]
+        """
+
+        samples = []
+        for age in range(len(self) - 1, -1, -1):
+            timestamp, values = self.sample(age)
+            samples.append([timestamp] + values)
+        return samples
+
+
+class NIOStatsCollector(object):
+    """
+    Collects the statistics of the NIOs of the Dynamips nodes.
+
+    :param history: number of samples to keep per NIO
+    """
+
+    def __init__(self, history=60):
+
+        self._history = history
+        self._series = {}  # NIO name -> CounterSeries
+        self._endpoints = {}  # NIO name -> node description
+        self._last_collection = None
+
+    @property
+    def last_collection(self):
+        """
+        Returns the time of the last collection.
+
+        :returns: timestamp or None
+        """
+
+        return self._last_collection
+
+    def collect(self, endpoints, now=None):
+        """
+        Reads the counters of NIOs, one batch of commands per hypervisor.
+
+        :param endpoints: list of tuples (NIO, node description dictionary)
+        :param now: time of the collection
+        """
+
+        if now is None:
+            now = time.time()
+        per_hypervisor = {}
+        for nio, description in endpoints:
+            per_hypervisor.setdefault(nio.hypervisor, []).append((nio, description))
+
+        collected = {}
+        for hypervisor, nios in per_hypervisor.items():
+            commands = ["nio get_stats {}".format(nio.name) for nio, _ in nios]
+            try:
+                results = hypervisor.send_batch(commands)
+            except DynamipsError as e:
+                log.warn("could not get the NIO statistics from hypervisor {}:{}: {}".format(hypervisor.host, hypervisor.port, e))
+                continue
+            for (nio, description), result in zip(nios, results):
+                if isinstance(result, DynamipsError) or not result:
+                    continue
+                try:
+                    values = [int(value) for value in result[0].split()[:len(COUNTERS)]]
+                except ValueError:
+                    continue
+                if len(values) != len(COUNTERS):
+                    continue
+                series = self._series.get(nio.name)
+                if series is None:
+                    series = CounterSeries(self._history)
+                collected[nio.name] = series
+                series.append(now, values)
+                self._endpoints[nio.name] = description
+
+        # forget the NIOs that have been deleted
+        self._series = collected
+        self._endpoints = {name: self._endpoints[name] for name in collected}
+        self._last_collection = now
+
+    def snapshot(self, history=False):
+        """
+        Returns the last counters and rates of the NIOs.
+
+        :param history: include the time series
+
+        :returns: list of dictionaries
+        """
+
+        nios = []
+        for name, series in sorted(self._series.items()):
+            timestamp, values = series.sample()
+            entry = dict(self._endpoints[name])
+            entry["nio"] = name
+            entry["timestamp"] = timestamp
+            entry.update(zip(COUNTERS, values))
+            rates = series.rates()
+            if rates is not None:
+                entry["rates"] = dict(zip(COUNTERS, rates))
+            if history:
+                entry["history"] = series.history()
+            nios.append(entry)
+        return nios
+
+    def clear(self):
+        """
+        Forgets all the samples.
+        """
+
+        self._series.clear()
+        self._endpoints.clear()
+        self._last_collection = None
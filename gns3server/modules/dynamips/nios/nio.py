@@ -43,6 +43,16 @@ class NIO(object):
         self._output_filter_options = None  # no output filter options by default
         self._dynamips_direction = {"in": 0, "out": 1, "both": 2}
 
+    @property
+    def hypervisor(self):
+        """
+        Returns the hypervisor this NIO is created on.
+
+        :returns: DynamipsHypervisor instance
+        """
+
+        return self._hypervisor
+
     def list(self):
         """
         Returns all NIOs.
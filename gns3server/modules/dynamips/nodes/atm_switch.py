@@ -21,6 +21,7 @@ http://github.com/GNS3/dynamips/blob/master/README.hypervisor#L593
 """
 
 import os
+from ...id_allocator import IdAllocator
 from ..dynamips_error import DynamipsError
 
 import logging
@@ -35,19 +36,13 @@ class ATMSwitch(object):
     :param name: name for this switch
     """
 
-    _instances = []
+    _instances = IdAllocator(1, 4097)
 
     def __init__(self, hypervisor, name):
 
         # find an instance identifier (0 < id <= 4096)
-        self._id = 0
-        for identifier in range(1, 4097):
-            if identifier not in self._instances:
-                self._id = identifier
-                self._instances.append(self._id)
-                break
-
-        if self._id == 0:
+        self._id = self._instances.allocate()
+        if self._id is None:
             raise DynamipsError("Maximum number of instances reached")
 
         self._hypervisor = hypervisor
@@ -67,7 +62,7 @@ class ATMSwitch(object):
         Resets the instance count and the allocated instances list.
         """
 
-        cls._instances.clear()
+        cls._instances.reset()
 
     @property
     def id(self):
@@ -156,7 +151,7 @@ class ATMSwitch(object):
         log.info("ATM switch {name} [id={id}] has been deleted".format(name=self._name,
                                                                        id=self._id))
         self._hypervisor.devices.remove(self)
-        self._instances.remove(self._id)
+        self._instances.release(self._id)
 
     def has_port(self, port):
         """
@@ -353,6 +348,116 @@ class ATMSwitch(object):
                                                                                                                                                  vci2=vci2))
         del self._mapping[(port1, vpi1, vci1)]
 
+    def _connection_command(self, action, source, destination):
+        """
+        Builds the hypervisor command to create or delete a connection.
+
+        :param action: "create" or "delete"
+        :param source: (port, VPI) for a VP or (port, VPI, VCI) for a VC
+        :param destination: (port, VPI) for a VP or (port, VPI, VCI) for a VC
+
+        :returns: command
+        """
+
+        if len(source) == 3:
+            return "atmsw {action}_vcc {name} {input_nio} {input_vpi} {input_vci} {output_nio} {output_vpi} {output_vci}".format(action=action,
+                                                                                                                                  name=self._name,
+                                                                                                                                  input_nio=self._nios[source[0]],
+                                                                                                                                  input_vpi=source[1],
+                                                                                                                                  input_vci=source[2],
+                                                                                                                                  output_nio=self._nios[destination[0]],
+                                                                                                                                  output_vpi=destination[1],
+                                                                                                                                  output_vci=destination[2])
+        return "atmsw {action}_vpc {name} {input_nio} {input_vpi} {output_nio} {output_vpi}".format(action=action,
+                                                                                                     name=self._name,
+                                                                                                     input_nio=self._nios[source[0]],
+                                                                                                     input_vpi=source[1],
+                                                                                                     output_nio=self._nios[destination[0]],
+                                                                                                     output_vpi=destination[1])
+
+    def _apply_connections(self, action, connections):
+        """
+        Sends the commands to create or delete connections in one batch
+        and updates the mapping.
+
+        :param action: "create" or "delete"
+        :param connections: list of tuples (source, destination)
+
+        :returns: list of the created or deleted connections
+        """
+
+        commands = [self._connection_command(action, source, destination) for source, destination in connections]
+        results = self._hypervisor.send_batch(commands)
+
+        error = None
+        applied = []
+        for (source, destination), result in zip(connections, results):
+            if isinstance(result, DynamipsError):
+                error = error or result
+                continue
+            log.info("ATM switch {name} [id={id}]: {kind} from port {source} to port {destination} {action}d".format(name=self._name,
+                                                                                                                     id=self._id,
+                                                                                                                     kind="VCC" if len(source) == 3 else "VPC",
+                                                                                                                     source=":".join(map(str, source)),
+                                                                                                                     destination=":".join(map(str, destination)),
+                                                                                                                     action=action))
+            if action == "create":
+                self._mapping[source] = destination
+            else:
+                del self._mapping[source]
+            applied.append((source, destination))
+        if error:
+            raise error
+        return applied
+
+    def map_connections(self, connections):
+        """
+        Creates Virtual Path and Virtual Channel connections (unidirectional),
+        the connections already created are skipped and the commands are sent in one batch.
+        A connection replacing another connection from the same source
+        is created once the previous connection has been deleted.
+
+        :param connections: list of tuples (source, destination), source and destination
+        are (port, VPI) for a VP or (port, VPI, VCI) for a VC
+
+        :returns: list of the created connections
+        """
+
+        changes = []
+        stale = []
+        for source, destination in connections:
+            for port in (source[0], destination[0]):
+                if port not in self._nios:
+                    raise DynamipsError("Port {} is not allocated".format(port))
+            mapped = self._mapping.get(source)
+            if mapped != destination:
+                if mapped is not None:
+                    stale.append((source, mapped))
+                changes.append((source, destination))
+
+        if stale:
+            self._apply_connections("delete", stale)
+        return self._apply_connections("create", changes)
+
+    def unmap_port(self, port):
+        """
+        Deletes all the Virtual Path and Virtual Channel connections going to
+        or coming from a port, the commands are sent in one batch.
+
+        :param port: allocated port
+
+        :returns: list of the deleted connections
+        """
+
+        if port not in self._nios:
+            raise DynamipsError("Port {} is not allocated".format(port))
+
+        connections = []
+        for source, destination in self._mapping.items():
+            if port in (source[0], destination[0]) and source[0] in self._nios and destination[0] in self._nios:
+                connections.append((source, destination))
+        return self._apply_connections("delete", connections)
+
     def start_capture(self, port, output_file, data_link_type="DLT_ATM_RFC1483"):
         """
         Starts a packet capture.
@@ -21,7 +21,10 @@ http://github.com/GNS3/dynamips/blob/master/README.hypervisor#L558
 """
 
 import os
+from ...id_allocator import IdAllocator
 from ..dynamips_error import DynamipsError
+from ..mac_table import MacAddressTable
+from ..mac_table import parse_mac_addr_table
 
 import logging
 log = logging.getLogger(__name__)
@@ -35,19 +38,13 @@ class EthernetSwitch(object):
     :param name: name for this switch
     """
 
-    _instances = []
+    _instances = IdAllocator(1, 4097)
 
     def __init__(self, hypervisor, name):
 
          # find an instance identifier (0 < id <= 4096)
-        self._id = 0
-        for identifier in range(1, 4097):
-            if identifier not in self._instances:
-                self._id = identifier
-                self._instances.append(self._id)
-                break
-
-        if self._id == 0:
+        self._id = self._instances.allocate()
+        if self._id is None:
             raise DynamipsError("Maximum number of instances reached")
 
         self._hypervisor = hypervisor
@@ -60,6 +57,7 @@ class EthernetSwitch(object):
         self._hypervisor.devices.append(self)
         self._nios = {}
         self._mapping = {}
+        self._mac_table = MacAddressTable()
 
     @classmethod
     def reset(cls):
@@ -67,7 +65,7 @@ class EthernetSwitch(object):
         Resets the instance count and the allocated instances list.
         """
 
-        cls._instances.clear()
+        cls._instances.reset()
 
     @property
     def id(self):
@@ -156,7 +154,7 @@ class EthernetSwitch(object):
         log.info("Ethernet switch {name} [id={id}] has been deleted".format(name=self._name,
                                                                             id=self._id))
         self._hypervisor.devices.remove(self)
-        self._instances.remove(self._id)
+        self._instances.release(self._id)
 
     def add_nio(self, nio, port):
         """
@@ -273,6 +271,50 @@ class EthernetSwitch(object):
                                                                                                                        vlan_id=outer_vlan))
         self._mapping[port] = ("qinq", outer_vlan)
 
+    def update_ports(self, ports):
+        """
+        Applies port settings. Only the ports whose settings differ from the
+        applied ones are reconfigured, the commands are sent in one batch.
+
+        :param ports: dictionary port -> (port type, VLAN), port type is
+        "access", "dot1q" or "qinq"
+
+        :returns: list of the reconfigured ports
+        """
+
+        changes = []
+        for port, settings in sorted(ports.items()):
+            if port not in self._nios:
+                raise DynamipsError("Port {} is not allocated".format(port))
+            port_type, vlan_id = settings
+            if port_type not in ("access", "dot1q", "qinq"):
+                raise DynamipsError("Unknown port type {} for port {}".format(port_type, port))
+            if self._mapping.get(port) != (port_type, vlan_id):
+                changes.append((port, port_type, vlan_id))
+
+        commands = ["ethsw set_{port_type}_port {name} {nio} {vlan_id}".format(port_type=port_type,
+                                                                                name=self._name,
+                                                                                nio=self._nios[port],
+                                                                                vlan_id=vlan_id) for port, port_type, vlan_id in changes]
+        results = self._hypervisor.send_batch(commands)
+
+        error = None
+        updated = []
+        for (port, port_type, vlan_id), result in zip(changes, results):
+            if isinstance(result, DynamipsError):
+                error = error or result
+                continue
+            log.info("Ethernet switch {name} [id={id}]: port {port} set as {port_type} port in VLAN {vlan_id}".format(name=self._name,
+                                                                                                                     id=self._id,
+                                                                                                                     port=port,
+                                                                                                                     port_type=port_type,
+                                                                                                                     vlan_id=vlan_id))
+            self._mapping[port] = (port_type, vlan_id)
+            updated.append(port)
+        if error:
+            raise error
+        return updated
+
     def get_mac_addr_table(self):
         """
         Returns the MAC address table for this Ethernet switch.
@@ -282,6 +324,26 @@ class EthernetSwitch(object):
 
         return self._hypervisor.send("ethsw show_mac_addr_table {}".format(self._name))
 
+    @property
+    def mac_table(self):
+        """
+        Returns the last snapshot of the MAC address table.
+
+        :returns: MacAddressTable instance
+        """
+
+        return self._mac_table
+
+    def refresh_mac_table(self):
+        """
+        Reads the MAC address table and updates the snapshot.
+
+        :returns: tuple (version, learned entries, aged entries)
+        """
+
+        nio_ports = {nio.name: port for port, nio in self._nios.items()}
+        return self._mac_table.update(parse_mac_addr_table(self.get_mac_addr_table(), nio_ports))
+
     def clear_mac_addr_table(self):
         """
         Clears the MAC address table for this Ethernet switch.
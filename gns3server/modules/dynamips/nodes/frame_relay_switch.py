@@ -21,6 +21,7 @@ http://github.com/GNS3/dynamips/blob/master/README.hypervisor#L642
 """
 
 import os
+from ...id_allocator import IdAllocator
 from ..dynamips_error import DynamipsError
 
 import logging
@@ -35,19 +36,13 @@ class FrameRelaySwitch(object):
     :param name: name for this switch
     """
 
-    _instances = []
+    _instances = IdAllocator(1, 4097)
 
     def __init__(self, hypervisor, name):
 
         # find an instance identifier (0 < id <= 4096)
-        self._id = 0
-        for identifier in range(1, 4097):
-            if identifier not in self._instances:
-                self._id = identifier
-                self._instances.append(self._id)
-                break
-
-        if self._id == 0:
+        self._id = self._instances.allocate()
+        if self._id is None:
             raise DynamipsError("Maximum number of instances reached")
 
         self._hypervisor = hypervisor
@@ -67,7 +62,7 @@ class FrameRelaySwitch(object):
         Resets the instance count and the allocated instances list.
         """
 
-        cls._instances.clear()
+        cls._instances.reset()
 
     @property
     def id(self):
@@ -156,7 +151,7 @@ class FrameRelaySwitch(object):
         log.info("Frame Relay switch {name} [id={id}] has been deleted".format(name=self._name,
                                                                                id=self._id))
         self._hypervisor.devices.remove(self)
-        self._instances.remove(self._id)
+        self._instances.release(self._id)
 
     def has_port(self, port):
         """
@@ -275,6 +270,96 @@ class FrameRelaySwitch(object):
                                                                                                                                       dlci2=dlci2))
         del self._mapping[(port1, dlci1)]
 
+    def _apply_vcs(self, action, vcs):
+        """
+        Sends the commands to create or delete Virtual Circuit
+        connections in one batch and updates the mapping.
+
+        :param action: "create" or "delete"
+        :param vcs: list of tuples (input port, input DLCI, output port, output DLCI)
+
+        :returns: list of the created or deleted VCs
+        """
+
+        commands = []
+        for port1, dlci1, port2, dlci2 in vcs:
+            commands.append("frsw {action}_vc {name} {input_nio} {input_dlci} {output_nio} {output_dlci}".format(action=action,
+                                                                                                                 name=self._name,
+                                                                                                                 input_nio=self._nios[port1],
+                                                                                                                 input_dlci=dlci1,
+                                                                                                                 output_nio=self._nios[port2],
+                                                                                                                 output_dlci=dlci2))
+        results = self._hypervisor.send_batch(commands)
+
+        error = None
+        applied = []
+        for (port1, dlci1, port2, dlci2), result in zip(vcs, results):
+            if isinstance(result, DynamipsError):
+                error = error or result
+                continue
+            log.info("Frame Relay switch {name} [id={id}]: VC from port {port1} DLCI {dlci1} to port {port2} DLCI {dlci2} {action}d".format(name=self._name,
+                                                                                                                                            id=self._id,
+                                                                                                                                            port1=port1,
+                                                                                                                                            dlci1=dlci1,
+                                                                                                                                            port2=port2,
+                                                                                                                                            dlci2=dlci2,
+                                                                                                                                            action=action))
+            if action == "create":
+                self._mapping[(port1, dlci1)] = (port2, dlci2)
+            else:
+                del self._mapping[(port1, dlci1)]
+            applied.append((port1, dlci1, port2, dlci2))
+        if error:
+            raise error
+        return applied
+
+    def map_vcs(self, vcs):
+        """
+        Creates Virtual Circuit connections (unidirectional), the VCs
+        already created are skipped and the commands are sent in one batch.
+        A VC replacing another VC from the same input port and DLCI
+        is created once the previous VC has been deleted.
+
+        :param vcs: list of tuples (input port, input DLCI, output port, output DLCI)
+
+        :returns: list of the created VCs
+        """
+
+        changes = []
+        stale = []
+        for port1, dlci1, port2, dlci2 in vcs:
+            for port in (port1, port2):
+                if port not in self._nios:
+                    raise DynamipsError("Port {} is not allocated".format(port))
+            mapped = self._mapping.get((port1, dlci1))
+            if mapped != (port2, dlci2):
+                if mapped is not None:
+                    stale.append((port1, dlci1) + mapped)
+                changes.append((port1, dlci1, port2, dlci2))
+
+        if stale:
+            self._apply_vcs("delete", stale)
+        return self._apply_vcs("create", changes)
+
+    def unmap_port(self, port):
+        """
+        Deletes all the Virtual Circuit connections going to or coming
+        from a port, the commands are sent in one batch.
+
+        :param port: allocated port
+
+        :returns: list of the deleted VCs
+        """
+
+        if port not in self._nios:
+            raise DynamipsError("Port {} is not allocated".format(port))
+
+        vcs = []
+        for (port1, dlci1), (port2, dlci2) in self._mapping.items():
+            if port in (port1, port2) and port1 in self._nios and port2 in self._nios:
+                vcs.append((port1, dlci1, port2, dlci2))
+        return self._apply_vcs("delete", vcs)
+
     def start_capture(self, port, output_file, data_link_type="DLT_FRELAY"):
         """
         Starts a packet capture.
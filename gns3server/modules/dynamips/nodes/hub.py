@@ -21,6 +21,7 @@ Hub object that uses the Bridge interface to create a hub with ports.
 
 import os
 from .bridge import Bridge
+from ...id_allocator import IdAllocator
 from ..dynamips_error import DynamipsError
 
 import logging
@@ -35,19 +36,13 @@ class Hub(Bridge):
     :param name: name for this hub
     """
 
-    _instances = []
+    _instances = IdAllocator(1, 4097)
 
     def __init__(self, hypervisor, name):
 
         # find an instance identifier (0 < id <= 4096)
-        self._id = 0
-        for identifier in range(1, 4097):
-            if identifier not in self._instances:
-                self._id = identifier
-                self._instances.append(self._id)
-                break
-
-        if self._id == 0:
+        self._id = self._instances.allocate()
+        if self._id is None:
             raise DynamipsError("Maximum number of instances reached")
 
         self._mapping = {}
@@ -62,7 +57,7 @@ class Hub(Bridge):
         Resets the instance count and the allocated instances list.
         """
 
-        cls._instances.clear()
+        cls._instances.reset()
 
     @property
     def id(self):
@@ -92,7 +87,7 @@ class Hub(Bridge):
         Bridge.delete(self)
         log.info("Ethernet hub {name} [id={id}] has been deleted".format(name=self._name,
                                                                          id=self._id))
-        self._instances.remove(self._id)
+        self._instances.release(self._id)
 
     def add_nio(self, nio, port):
         """
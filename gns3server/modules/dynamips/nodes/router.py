@@ -20,8 +20,10 @@ Interface for Dynamips virtual Machine module ("vm")
 http://github.com/GNS3/dynamips/blob/master/README.hypervisor#L77
 """
 
+from ...id_allocator import IdAllocator
 from ..dynamips_error import DynamipsError
 from ...attic import find_unused_port
+from ...attic import write_config_file
 
 import time
 import sys
@@ -43,7 +45,7 @@ class Router(object):
     :param ghost_flag: used when creating a ghost IOS.
     """
 
-    _instances = []
+    _instances = IdAllocator(1, 4097)
     _allocated_console_ports = []
     _allocated_aux_ports = []
     _status = {0: "inactive",
@@ -57,20 +59,13 @@ class Router(object):
 
             if not router_id:
                 # find an instance identifier if none is provided (0 < id <= 4096)
-                self._id = 0
-                for identifier in range(1, 4097):
-                    if identifier not in self._instances:
-                        self._id = identifier
-                        self._instances.append(self._id)
-                        break
-
-                if self._id == 0:
+                self._id = self._instances.allocate()
+                if self._id is None:
                     raise DynamipsError("Maximum number of instances reached")
             else:
-                if router_id in self._instances:
+                if not self._instances.reserve(router_id):
                     raise DynamipsError("Router identifier {} is already used by another router".format(router_id))
                 self._id = router_id
-                self._instances.append(self._id)
 
         else:
             log.info("creating a new ghost IOS file")
@@ -104,6 +99,7 @@ class Router(object):
         self._console = None
         self._aux = None
         self._mac_addr = None
+        self._saved_nvram_stamp = None  # NVRAM file (modification time, size) when the configs were saved
         self._system_id = "FTX0945W0MY"  # processor board ID in IOS
         self._slots = []
 
@@ -152,7 +148,7 @@ class Router(object):
         Resets the instance count and the allocated instances list.
         """
 
-        cls._instances.clear()
+        cls._instances.reset()
         cls._allocated_console_ports.clear()
         cls._allocated_aux_ports.clear()
 
@@ -308,8 +304,7 @@ class Router(object):
         self._hypervisor.send("vm delete {}".format(self._name))
         self._hypervisor.devices.remove(self)
         log.info("router {name} [id={id}] has been deleted".format(name=self._name, id=self._id))
-        if self._id in self._instances:
-            self._instances.remove(self._id)
+        self._instances.release(self._id)
         if self.console:
             self._allocated_console_ports.remove(self.console)
         if self.aux:
@@ -336,8 +331,7 @@ class Router(object):
                 os.remove(private_config_path)
 
         log.info("router {name} [id={id}] has been deleted (including associated files)".format(name=self._name, id=self._id))
-        if self._id in self._instances:
-            self._instances.remove(self._id)
+        self._instances.release(self._id)
         if self.console:
             self._allocated_console_ports.remove(self.console)
         if self.aux:
@@ -599,21 +593,49 @@ class Router(object):
             log.info("router {name} [id={id}]: new private-config pushed".format(name=self._name,
                                                                                  id=self._id))
 
+    def _nvram_stamp(self):
+        """
+        Returns the modification time and size of the NVRAM file
+        (created by Dynamips in the working directory).
+
+        :returns: tuple (modification time, size) or None if the file cannot be found
+        """
+
+        nvram_path = os.path.join(self.hypervisor.working_dir, "{}_{}_nvram".format(self._platform, self.name))
+        try:
+            nvram_stat = os.stat(nvram_path)
+        except OSError:
+            return None
+        return nvram_stat.st_mtime, nvram_stat.st_size
+
+    def nvram_changed(self):
+        """
+        Returns either the NVRAM may have changed since the configs were saved.
+        There is nothing to save if the router has no NVRAM yet (never started).
+
+        :returns: boolean
+        """
+
+        stamp = self._nvram_stamp()
+        return stamp is not None and stamp != self._saved_nvram_stamp
+
     def save_configs(self):
         """
         Saves the startup-config and private-config to files.
+        Config files are only written if their content has changed.
         """
 
         if self.startup_config or self.private_config:
+            # taken before extracting: a change during the extraction is saved next time
+            nvram_stamp = self._nvram_stamp()
             startup_config_base64, private_config_base64 = self.extract_config()
             if startup_config_base64:
                 try:
                     config = base64.decodebytes(startup_config_base64.encode("utf-8")).decode("utf-8")
                     config = "!\n" + config.replace("\r", "")
                     config_path = os.path.join(self.hypervisor.working_dir, self.startup_config)
-                    with open(config_path, "w") as f:
-                        log.info("saving startup-config to {}".format(self.startup_config))
-                        f.write(config)
+                    if write_config_file(config_path, config):
+                        log.info("startup-config saved to {}".format(self.startup_config))
                 except OSError as e:
                     raise DynamipsError("Could not save the startup configuration {}: {}".format(config_path, e))
 
@@ -622,11 +644,23 @@ class Router(object):
                     config = base64.decodebytes(private_config_base64.encode("utf-8")).decode("utf-8")
                     config = "!\n" + config.replace("\r", "")
                     config_path = os.path.join(self.hypervisor.working_dir, self.private_config)
-                    with open(config_path, "w") as f:
-                        log.info("saving private-config to {}".format(self.private_config))
-                        f.write(config)
+                    if write_config_file(config_path, config):
+                        log.info("private-config saved to {}".format(self.private_config))
                 except OSError as e:
                     raise DynamipsError("Could not save the private configuration {}: {}".format(config_path, e))
+            self._saved_nvram_stamp = nvram_stamp
+
+    def autosave_configs(self):
+        """
+        Saves the configs only if the NVRAM has changed since the last save.
+
+        :returns: True if the configs have been extracted
+        """
+
+        if not (self.startup_config or self.private_config) or not self.nvram_changed():
+            return False
+        self.save_configs()
+        return True
 
     @property
     def ram(self):
@@ -314,6 +314,21 @@ ETHSW_START_CAPTURE_SCHEMA = {
             "type": "string",
             "minLength": 1,
         },
+        "max_file_size": {
+            "description": "Rotate the capture file after this size in MB (0 for no limit)",
+            "type": "integer",
+            "minimum": 0
+        },
+        "max_files": {
+            "description": "Number of capture files to keep, the oldest are deleted (0 for no limit)",
+            "type": "integer",
+            "minimum": 0
+        },
+        "max_file_duration": {
+            "description": "Rotate the capture file after this duration in seconds (0 for no limit)",
+            "type": "integer",
+            "minimum": 0
+        },
         "data_link_type": {
             "description": "PCAP data link type",
             "type": "string",
@@ -346,3 +361,26 @@ ETHSW_STOP_CAPTURE_SCHEMA = {
     "additionalProperties": False,
     "required": ["id", "port_id", "port"]
 }
+
+ETHSW_MAC_TABLE_SCHEMA = {
+    "$schema": "http://json-schema.org/draft-04/schema#",
+    "description": "Request validation to get the MAC address table of an Ethernet switch instance",
+    "type": "object",
+    "properties": {
+        "id": {
+            "description": "Ethernet switch instance ID",
+            "type": "integer"
+        },
+        "since": {
+            "description": "Version of the table the client has, only the changes are returned",
+            "type": "integer",
+            "minimum": 0
+        },
+        "subscribe": {
+            "description": "Receive the changes in dynamips.ethsw.mac_table_changed notifications (true) or stop receiving them (false)",
+            "type": "boolean"
+        },
+    },
+    "additionalProperties": False,
+    "required": ["id"]
+}
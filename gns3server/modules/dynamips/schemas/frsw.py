@@ -288,6 +288,21 @@ FRSW_START_CAPTURE_SCHEMA = {
             "type": "string",
             "minLength": 1,
         },
+        "max_file_size": {
+            "description": "Rotate the capture file after this size in MB (0 for no limit)",
+            "type": "integer",
+            "minimum": 0
+        },
+        "max_files": {
+            "description": "Number of capture files to keep, the oldest are deleted (0 for no limit)",
+            "type": "integer",
+            "minimum": 0
+        },
+        "max_file_duration": {
+            "description": "Rotate the capture file after this duration in seconds (0 for no limit)",
+            "type": "integer",
+            "minimum": 0
+        },
         "data_link_type": {
             "description": "PCAP data link type",
             "type": "string",
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Identifier allocator with constant time allocation and release.
+"""
+
+from ..sharding import owned_ids
+
+
+class IdAllocator(object):
+    """
+    Allocates identifiers in a range. Identifiers are taken from a free list
+    of released identifiers, then from the identifiers never allocated yet.
+    A set keeps the identifiers in use.
+
+    When the module is sharded, only the identifiers owned by the worker
+    are allocated (the range is computed on first use, in the worker process).
+
+    :param start: first identifier
+    :param end: end of the range (excluded)
+    :param sharded: identifiers are shared by the workers of a sharded module
+    """
+
+    def __init__(self, start, end, sharded=True):
+
+        self._start = start
+        self._end = end
+        self._sharded = sharded
+        self._used = set()
+        self._free = []  # released identifiers
+        self._next = None  # iterator on the identifiers never allocated
+
+    def allocate(self):
+        """
+        Allocates an identifier.
+
+        :returns: identifier or None if all the identifiers are used
+        """
+
+        while self._free:
+            identifier = self._free.pop()
+            if identifier not in self._used:
+                self._used.add(identifier)
+                return identifier
+
+        if self._next is None:
+            if self._sharded:
+                self._next = iter(owned_ids(self._start, self._end))
+            else:
+                self._next = iter(range(self._start, self._end))
+        for identifier in self._next:
+            # skip the identifiers reserved before being reached
+            if identifier not in self._used:
+                self._used.add(identifier)
+                return identifier
+        return None
+
+    def reserve(self, identifier):
+        """
+        Reserves a given identifier.
+
+        :param identifier: identifier
+
+        :returns: False if the identifier is already used
+        """
+
+        if identifier in self._used:
+            return False
+        # a stale copy may remain in the free list, it is skipped by allocate()
+        self._used.add(identifier)
+        return True
+
+    def release(self, identifier):
+        """
+        Releases an identifier.
+
+        :param identifier: identifier
+        """
+
+        if identifier in self._used:
+            self._used.remove(identifier)
+            if self._start <= identifier < self._end:
+                self._free.append(identifier)
+
+    def reset(self):
+        """
+        Releases all the identifiers.
+        """
+
+        self._used.clear()
+        self._free.clear()
+        self._next = None
+
+    def __contains__(self, identifier):
+
+        return identifier in self._used
+
+    def __len__(self):
+
+        return len(self._used)
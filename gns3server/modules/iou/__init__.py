@@ -37,6 +37,8 @@ from .nios.nio_tap import NIO_TAP
 from .nios.nio_generic_ethernet import NIO_GenericEthernet
 from ..attic import find_unused_port
 from ..attic import has_privileged_access
+from ..attic import write_config_file
+from ..capture_session import CaptureSessions
 
 from .schemas import IOU_CREATE_SCHEMA
 from .schemas import IOU_DELETE_SCHEMA
@@ -64,6 +66,8 @@ class IOU(IModule):
     :param kwargs: named arguments for the module
     """
 
+    shardable = True
+
     def __init__(self, name, *args, **kwargs):
 
         # get the iouyap location
@@ -100,6 +104,7 @@ class IOU(IModule):
         self._tempdir = kwargs["temp_dir"]
         self._working_dir = self._projects_dir
         self._iourc = ""
+        self._capture_sessions = CaptureSessions(name)
 
         # check every 5 seconds
         self._iou_callback = self.add_periodic_callback(self._check_iou_is_alive, 5000)
@@ -120,9 +125,22 @@ class IOU(IModule):
             iou_instance.delete()
 
         self.delete_iourc_file()
+        self._capture_sessions.stop_all()
 
         IModule.stop(self, signum)  # this will stop the I/O loop
 
+    def telemetry_nodes(self):
+        """
+        Returns the IOU and iouyap processes to sample for resource telemetry.
+
+        :returns: dictionary node ID -> {"name": node name, "pids": list of PIDs}
+        """
+
+        nodes = {}
+        for iou_id, iou_instance in self._iou_instances.items():
+            nodes[iou_id] = {"name": iou_instance.name, "pids": iou_instance.pids()}
+        return nodes
+
     def _check_iou_is_alive(self):
         """
         Periodic callback to check if IOU and iouyap are alive
@@ -194,7 +212,9 @@ class IOU(IModule):
 
         self._iou_instances.clear()
         self._allocated_udp_ports.clear()
+        self.link_impairments.close()
         self.delete_iourc_file()
+        self._capture_sessions.stop_all()
 
         self._working_dir = self._projects_dir
         log.info("IOU module has been reset")
@@ -409,9 +429,8 @@ class IOU(IModule):
                 config = "!\n" + config.replace("\r", "")
                 config = config.replace('%h', iou_instance.name)
                 try:
-                    with open(config_path, "w") as f:
-                        log.info("saving initial-config to {}".format(config_path))
-                        f.write(config)
+                    if write_config_file(config_path, config):
+                        log.info("initial-config saved to {}".format(config_path))
                 except OSError as e:
                     raise IOUError("Could not save the configuration {}: {}".format(config_path, e))
                 # update the request with the new local initial-config path
@@ -422,10 +441,9 @@ class IOU(IModule):
                     try:
                         with open(request["initial_config"], "r", errors="replace") as f:
                             config = f.read()
-                        with open(config_path, "w") as f:
-                            config = "!\n" + config.replace("\r", "")
-                            config = config.replace('%h', iou_instance.name)
-                            f.write(config)
+                        config = "!\n" + config.replace("\r", "")
+                        config = config.replace('%h', iou_instance.name)
+                        write_config_file(config_path, config)
                         request["initial_config"] = os.path.basename(config_path)
                     except OSError as e:
                         raise IOUError("Could not save the configuration from {} to {}: {}".format(request["initial_config"], config_path, e))
@@ -474,6 +492,8 @@ class IOU(IModule):
         try:
             iou_instance.iouyap = self._iouyap
             iou_instance.iourc = self._iourc
+            # frees the ports the link impairment relays reserved for the emulator
+            self.link_impairments.release_all(iou_instance.id)
             iou_instance.start()
         except IOUError as e:
             self.send_custom_error(str(e))
@@ -536,6 +556,8 @@ class IOU(IModule):
         try:
             if iou_instance.is_running():
                 iou_instance.stop()
+            # frees the ports the link impairment relays reserved for the emulator
+            self.link_impairments.release_all(iou_instance.id)
             iou_instance.start()
         except IOUError as e:
             self.send_custom_error(str(e))
@@ -635,6 +657,11 @@ class IOU(IModule):
                         sock.connect((rhost, rport))
                 except OSError as e:
                     raise IOUError("Could not create an UDP connection to {}:{}: {}".format(rhost, rport, e))
+                try:
+                    # a relay is inserted if an impairment has been set for this port
+                    lport, rhost, rport = self.link_impairments.attach(lport, rhost, rport, self._host, iou_instance.id)
+                except OSError as e:
+                    raise IOUError("Could not relay UDP port {} for the link impairment: {}".format(lport, e))
                 nio = NIO_UDP(lport, rhost, rport)
             elif request["nio"]["type"] == "nio_tap":
                 tap_device = request["nio"]["tap_device"]
@@ -653,8 +680,13 @@ class IOU(IModule):
             return
 
         try:
+            if isinstance(nio, NIO_UDP) and iou_instance.is_running():
+                # the running emulator binds the port right away
+                self.link_impairments.release(nio.lport)
             iou_instance.slot_add_nio_binding(slot, port, nio)
         except IOUError as e:
+            if isinstance(nio, NIO_UDP):
+                self.link_impairments.detach(nio.lport)
             self.send_custom_error(str(e))
             return
 
@@ -689,14 +721,39 @@ class IOU(IModule):
         port = request["port"]
         try:
             nio = iou_instance.slot_remove_nio_binding(slot, port)
-            if isinstance(nio, NIO_UDP) and nio.lport in self._allocated_udp_ports:
-                self._allocated_udp_ports.remove(nio.lport)
+            if isinstance(nio, NIO_UDP):
+                # the allocated port is the one taken over by the relay, if any
+                lport = self.link_impairments.detach(nio.lport)
+                if lport in self._allocated_udp_ports:
+                    self._allocated_udp_ports.remove(lport)
         except IOUError as e:
             self.send_custom_error(str(e))
             return
 
         self.send_response(True)
 
+    @IModule.route("iou.set_link_impairment")
+    def set_link_impairment(self, request):
+        """
+        Sets the impairment (latency, jitter, packet loss and rate)
+        of the packets sent on a UDP NIO.
+
+        Mandatory request parameters:
+        - lport (local port of the UDP NIO)
+
+        Optional request parameters:
+        - latency, jitter, loss, rate, burst, queue_limit
+
+        Response parameters:
+        - lport (local port of the UDP NIO)
+        - active (True if the impairment is applied, False until the NIO is added)
+        - stats (packets, forwarded packets and bytes, drops per reason)
+
+        :param request: JSON request
+        """
+
+        self.apply_link_impairment(request)
+
     @IModule.route("iou.start_capture")
     def start_capture(self, request):
         """
@@ -711,6 +768,9 @@ class IOU(IModule):
 
         Optional request parameters:
         - data_link_type (PCAP DLT_* value)
+        - max_file_size (rotate the capture file after this size in MB)
+        - max_files (number of capture files to keep)
+        - max_file_duration (rotate the capture file after this duration in seconds)
 
         Response parameters:
         - port_id (port identifier)
@@ -733,10 +793,12 @@ class IOU(IModule):
         capture_file_name = request["capture_file_name"]
         data_link_type = request.get("data_link_type")
 
+        capture_key = (request["id"], slot, port)
         try:
             capture_file_path = os.path.join(self._working_dir, "captures", capture_file_name)
-            iou_instance.start_capture(slot, port, capture_file_path, data_link_type)
-        except IOUError as e:
+            self._capture_sessions.start(capture_key, capture_file_path, request,
+                                         lambda writer_path: iou_instance.start_capture(slot, port, writer_path, data_link_type))
+        except (IOUError, OSError) as e:
             self.send_custom_error(str(e))
             return
 
@@ -757,6 +819,7 @@ class IOU(IModule):
 
         Response parameters:
         - port_id (port identifier)
+        - capture_stats (bytes, packets, drops, rotated and pruned files)
 
         :param request: JSON request
         """
@@ -772,6 +835,7 @@ class IOU(IModule):
 
         slot = request["slot"]
         port = request["port"]
+        capture_key = (request["id"], slot, port)
         try:
             iou_instance.stop_capture(slot, port)
         except IOUError as e:
@@ -779,6 +843,9 @@ class IOU(IModule):
             return
 
         response = {"port_id": request["port_id"]}
+        capture_stats = self._capture_sessions.stop(capture_key)
+        if capture_stats is not None:
+            response["capture_stats"] = capture_stats
         self.send_response(response)
 
     @IModule.route("iou.export_config")
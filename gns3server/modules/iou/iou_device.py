@@ -30,6 +30,7 @@ import configparser
 import shutil
 
 from .ioucon import start_ioucon
+from ..id_allocator import IdAllocator
 from .iou_error import IOUError
 from .adapters.ethernet_adapter import EthernetAdapter
 from .adapters.serial_adapter import SerialAdapter
@@ -56,7 +57,7 @@ class IOUDevice(object):
     :param console_end_port_range: TCP console port range end
     """
 
-    _instances = []
+    _instances = IdAllocator(1, 513)
     _allocated_console_ports = []
 
     def __init__(self,
@@ -71,20 +72,13 @@ class IOUDevice(object):
 
         if not iou_id:
             # find an instance identifier if none is provided (0 < id <= 512)
-            self._id = 0
-            for identifier in range(1, 513):
-                if identifier not in self._instances:
-                    self._id = identifier
-                    self._instances.append(self._id)
-                    break
-
-            if self._id == 0:
+            self._id = self._instances.allocate()
+            if self._id is None:
                 raise IOUError("Maximum number of IOU instances reached")
         else:
-            if iou_id in self._instances:
+            if not self._instances.reserve(iou_id):
                 raise IOUError("IOU identifier {} is already used by another IOU device".format(iou_id))
             self._id = iou_id
-            self._instances.append(self._id)
 
         self._name = name
         self._path = path
@@ -175,7 +169,7 @@ class IOUDevice(object):
         Resets allocated instance list.
         """
 
-        cls._instances.clear()
+        cls._instances.reset()
         cls._allocated_console_ports.clear()
 
     @property
@@ -356,8 +350,7 @@ class IOUDevice(object):
         """
 
         self.stop()
-        if self._id in self._instances:
-            self._instances.remove(self._id)
+        self._instances.release(self._id)
 
         if self.console and self.console in self._allocated_console_ports:
             self._allocated_console_ports.remove(self.console)
@@ -371,8 +364,7 @@ class IOUDevice(object):
         """
 
         self.stop()
-        if self._id in self._instances:
-            self._instances.remove(self._id)
+        self._instances.release(self._id)
 
         if self.console:
             self._allocated_console_ports.remove(self.console)
@@ -684,6 +676,20 @@ class IOUDevice(object):
             return True
         return False
 
+    def pids(self):
+        """
+        Returns the PIDs of the running processes of this IOU device (IOU and iouyap).
+
+        :returns: list of PIDs
+        """
+
+        pids = []
+        if self.is_running():
+            pids.append(self._process.pid)
+        if self.is_iouyap_running():
+            pids.append(self._iouyap_process.pid)
+        return pids
+
     def slot_add_nio_binding(self, slot_id, port_id, nio):
         """
         Adds a slot NIO binding.
@@ -0,0 +1,786 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Link impairment of UDP NIOs: latency, jitter, packet loss and rate shaping.
+
+The impairment is set for the local port of a UDP NIO. When the NIO is added,
+a relay takes over this port and the emulator is connected to the relay
+instead. The packets sent by the emulator are impaired then forwarded to the
+peer from the local port (so the peer sees the address it expects), the
+packets sent by the peer are forwarded to the emulator as they are: each end
+of a link impairs its outgoing traffic.
+
+The relays of a module are driven by one event loop thread, the delayed
+packets are kept in a timer wheel and the rate is shaped with token buckets.
+"""
+
+import math
+import time
+import errno
+import random
+import socket
+import select
+import threading
+import collections
+
+import logging
+log = logging.getLogger(__name__)
+
+MAX_DATAGRAM_SIZE = 65535
+RECEIVE_BATCH = 64  # datagrams read from a socket per event
+
+LINK_IMPAIRMENT_SCHEMA = {
+    "$schema": "http://json-schema.org/draft-04/schema#",
+    "description": "Request validation to set the impairment of a link",
+    "type": "object",
+    "properties": {
+        "lport": {
+            "description": "Local port of the UDP NIO",
+            "type": "integer",
+            "minimum": 1,
+            "maximum": 65535
+        },
+        "latency": {
+            "description": "Delay in milliseconds",
+            "type": "number",
+            "minimum": 0
+        },
+        "jitter": {
+            "description": "Delay variation in milliseconds",
+            "type": "number",
+            "minimum": 0
+        },
+        "loss": {
+            "description": "Packet loss in percent",
+            "type": "number",
+            "minimum": 0,
+            "maximum": 100
+        },
+        "rate": {
+            "description": "Rate in kilobits per second (0 for no limit)",
+            "type": "number",
+            "minimum": 0
+        },
+        "burst": {
+            "description": "Burst size in bytes",
+            "type": "integer",
+            "minimum": 0
+        },
+        "queue_limit": {
+            "description": "Maximum time a packet waits for the rate shaper in milliseconds",
+            "type": "number",
+            "minimum": 0
+        },
+        "clear": {
+            "description": "Remove the impairment of the port",
+            "type": "boolean"
+        },
+    },
+    "additionalProperties": False,
+    "required": ["lport"]
+}
+
+
+class TokenBucket(object):
+    """
+    Token bucket shaping packets to a rate.
+
+    :param rate: rate in bytes per second
+    :param burst: bucket size in bytes
+    :param queue_limit: maximum delay of a packet in seconds,
+    the packets that would wait longer are dropped
+    :param now: current time (monotonic clock)
+    """
+
+    def __init__(self, rate, burst, queue_limit, now=None):
+
+        self._rate = rate
+        self._burst = burst
+        self._queue_limit = queue_limit
+        self._tokens = burst
+        self._last = time.monotonic() if now is None else now
+
+    def reserve(self, size, now):
+        """
+        Takes the tokens for a packet, the bucket can go in debt
+        for the packets waiting to be sent.
+
+        :param size: packet size in bytes
+        :param now: current time (monotonic clock)
+
+        :returns: delay in seconds before the packet can be sent
+        or None if the packet must be dropped
+        """
+
+        self._tokens = min(self._burst, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+        tokens = self._tokens - size
+        if tokens >= 0:
+            self._tokens = tokens
+            return 0
+        delay = -tokens / self._rate
+        if delay > self._queue_limit:
+            return None
+        self._tokens = tokens
+        return delay
+
+
+class TimerWheel(object):
+    """
+    Hashed timer wheel: an item is put in the slot of the tick it is due,
+    the slots are reused at each revolution of the wheel (the items due in
+    a later revolution stay in their slot).
+
+    :param tick: tick duration in seconds
+    :param slots: number of slots
+    :param now: current time (monotonic clock)
+    """
+
+    def __init__(self, tick=0.001, slots=1024, now=None):
+
+        self._tick = tick
+        self._slots = [[] for _ in range(slots)]
+        self._current = int((time.monotonic() if now is None else now) / tick)
+        self._count = 0
+
+    def __len__(self):
+
+        return self._count
+
+    def schedule(self, deadline, item):
+        """
+        Adds an item.
+
+        :param deadline: time the item is due (monotonic clock)
+        :param item: item
+        """
+
+        tick = max(int(math.ceil(deadline / self._tick)), self._current + 1)
+        self._slots[tick % len(self._slots)].append((tick, item))
+        self._count += 1
+
+    def expire(self, now):
+        """
+        Advances the wheel.
+
+        :param now: current time (monotonic clock)
+
+        :returns: list of the items due, in deadline order
+        """
+
+        now_tick = int(now / self._tick)
+        if now_tick <= self._current:
+            return []
+        if not self._count:
+            self._current = now_tick
+            return []
+
+        count = len(self._slots)
+        revolution = now_tick - self._current >= count
+        if revolution:
+            ticks = range(self._current + 1, self._current + 1 + count)
+        else:
+            ticks = range(self._current + 1, now_tick + 1)
+
+        due = []
+        for tick in ticks:
+            slot = self._slots[tick % count]
+            if not slot:
+                continue
+            remaining = [entry for entry in slot if entry[0] > now_tick]
+            if len(remaining) != len(slot):
+                due.extend(entry for entry in slot if entry[0] <= now_tick)
+                self._slots[tick % count] = remaining
+
+        if revolution:
+            due.sort(key=lambda entry: entry[0])
+        self._current = now_tick
+        self._count -= len(due)
+        return [item for _, item in due]
+
+    def next_deadline(self):
+        """
+        Returns when the wheel must be advanced next.
+
+        :returns: time (monotonic clock) or None if the wheel is empty
+        """
+
+        if not self._count:
+            return None
+        count = len(self._slots)
+        for offset in range(1, count + 1):
+            if self._slots[(self._current + offset) % count]:
+                return (self._current + offset) * self._tick
+        return None
+
+
+def _reserve_udp_port(host):
+    """
+    Binds a UDP port chosen by the system, the port
+    is free again when the returned socket is closed.
+
+    :param host: address to bind
+
+    :returns: socket instance
+    """
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.bind((host, 0))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+class ImpairedLink(object):
+    """
+    Relay between an emulator and the peer of a UDP NIO.
+
+    :param lport: local port of the NIO (taken over by the relay)
+    :param rhost: peer address
+    :param rport: peer port
+    :param host: address of the local port
+    :param owner: identifier of the node using the NIO
+    """
+
+    def __init__(self, lport, rhost, rport, host, owner=None):
+
+        self.owner = owner
+        self._lport = lport
+        self._peer = (rhost, rport)
+        if host in ("0.0.0.0", ""):
+            # the emulator and the relay talk over the loopback
+            internal_host = "127.0.0.1"
+        else:
+            internal_host = host
+        self._external = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._internal = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # the port of the emulator stays bound until the emulator takes it
+        self._reservation = None
+        try:
+            self._external.bind((host, lport))
+            self._internal.bind((internal_host, 0))
+            self._reservation = _reserve_udp_port(internal_host)
+            self._emulator = (internal_host, self._reservation.getsockname()[1])
+        except OSError:
+            self.close()
+            raise
+        self._external.setblocking(False)
+        self._internal.setblocking(False)
+        self._latency = 0
+        self._jitter = 0
+        self._loss = 0
+        self._bucket = None
+        self.packets = 0
+        self.bytes = 0
+        self.forwarded = 0
+        self.loss_drops = 0
+        self.queue_drops = 0
+        self.errors = 0
+
+    @property
+    def lport(self):
+        """
+        Returns the local port of the NIO (bound by the relay).
+
+        :returns: port number
+        """
+
+        return self._lport
+
+    @property
+    def emulator_port(self):
+        """
+        Returns the local port the emulator must bind.
+
+        :returns: port number
+        """
+
+        return self._emulator[1]
+
+    @property
+    def relay_host(self):
+        """
+        Returns the address the emulator must send its packets to.
+
+        :returns: address
+        """
+
+        return self._internal.getsockname()[0]
+
+    @property
+    def relay_port(self):
+        """
+        Returns the port the emulator must send its packets to.
+
+        :returns: port number
+        """
+
+        return self._internal.getsockname()[1]
+
+    def configure(self, latency=0, jitter=0, loss=0, rate=0, burst=0, queue_limit=500):
+        """
+        Sets the impairment.
+
+        :param latency: delay in milliseconds
+        :param jitter: delay variation in milliseconds
+        :param loss: packet loss in percent
+        :param rate: rate in kilobits per second (0 for no limit)
+        :param burst: burst size in bytes (0 for 10 ms at the rate)
+        :param queue_limit: maximum time a packet waits for the rate shaper in milliseconds
+        """
+
+        bucket = None
+        if rate:
+            rate = rate * 1000 / 8
+            if not burst:
+                burst = max(int(rate / 100), 2 * 1518)
+            bucket = TokenBucket(rate, burst, queue_limit / 1000)
+        # read by the event loop thread
+        self._bucket = bucket
+        self._latency = latency / 1000
+        self._jitter = jitter / 1000
+        self._loss = loss / 100
+
+    def impair(self, size, now):
+        """
+        Applies the impairment to a packet sent by the emulator.
+
+        :param size: packet size in bytes
+        :param now: current time (monotonic clock)
+
+        :returns: delay in seconds before the packet is sent or None to drop it
+        """
+
+        self.packets += 1
+        if self._loss and random.random() < self._loss:
+            self.loss_drops += 1
+            return None
+        delay = 0
+        bucket = self._bucket
+        if bucket is not None:
+            delay = bucket.reserve(size, now)
+            if delay is None:
+                self.queue_drops += 1
+                return None
+        if self._latency or self._jitter:
+            delay += max(0, self._latency + random.uniform(-self._jitter, self._jitter))
+        return delay
+
+    def send_to_peer(self, data):
+        """
+        Sends a packet to the peer from the local port of the NIO.
+
+        :param data: packet
+        """
+
+        try:
+            self._external.sendto(data, self._peer)
+            self.forwarded += 1
+            self.bytes += len(data)
+        except OSError:
+            # e.g. the peer isn't listening yet (ICMP port unreachable)
+            self.errors += 1
+
+    def send_to_emulator(self, data):
+        """
+        Sends a packet to the emulator.
+
+        :param data: packet
+        """
+
+        try:
+            self._internal.sendto(data, self._emulator)
+        except OSError:
+            self.errors += 1
+
+    def stats(self):
+        """
+        Returns the counters of this link.
+
+        :returns: dictionary
+        """
+
+        return {"packets": self.packets,
+                "forwarded": self.forwarded,
+                "bytes": self.bytes,
+                "drops": {"loss": self.loss_drops,
+                          "queue": self.queue_drops},
+                "errors": self.errors}
+
+    def release_emulator_port(self):
+        """
+        Frees the port reserved for the emulator.
+        """
+
+        if self._reservation is not None:
+            self._reservation.close()
+            self._reservation = None
+
+    def close(self):
+        """
+        Closes the sockets of the relay.
+        """
+
+        self.release_emulator_port()
+        self._external.close()
+        self._internal.close()
+
+
+class ReadPoller(object):
+    """
+    Waits for readable sockets with poll() or, where it is not
+    available (Windows), with select().
+    """
+
+    def __init__(self):
+
+        self._sockets = {}  # file descriptor -> (socket, data)
+        self._poll = select.poll() if hasattr(select, "poll") else None
+
+    def register(self, sock, data):
+        """
+        Watches a socket.
+
+        :param sock: socket instance
+        :param data: data returned with the socket when it is readable
+        """
+
+        self._sockets[sock.fileno()] = (sock, data)
+        if self._poll is not None:
+            self._poll.register(sock.fileno(), select.POLLIN)
+
+    def unregister(self, sock):
+        """
+        Stops watching a socket (must be called before it is closed).
+
+        :param sock: socket instance
+        """
+
+        fd = sock.fileno()
+        if self._sockets.pop(fd, None) is not None and self._poll is not None:
+            self._poll.unregister(fd)
+
+    def poll(self, timeout):
+        """
+        Waits for readable sockets.
+
+        :param timeout: maximum seconds to wait
+
+        :returns: list of (socket, data) tuples
+        """
+
+        try:
+            if self._poll is not None:
+                fds = [fd for fd, _ in self._poll.poll(timeout * 1000)]
+            else:
+                fds = select.select(list(self._sockets), [], [], timeout)[0]
+        except InterruptedError:
+            # Python < 3.5 doesn't retry the system calls interrupted by a signal
+            return []
+        return [self._sockets[fd] for fd in fds if fd in self._sockets]
+
+    def close(self):
+
+        self._sockets.clear()
+        self._poll = None
+
+
+class LinkImpairments(object):
+    """
+    Link impairments of a module: settings per local port of UDP NIO
+    and relays of the NIOs added with an impairment.
+
+    :param tick: resolution of the delays in seconds
+    """
+
+    def __init__(self, tick=0.001):
+
+        self._tick = tick
+        self._lock = threading.Lock()
+        self._settings = {}  # local port -> impairment settings
+        self._links = {}  # local port -> relay
+        self._emulator_ports = {}  # local port bound by the emulator -> local port of the NIO
+        self._poller = None
+        self._thread = None
+        self._wakeup = None
+        self._pending = collections.deque()  # callbacks to run in the event loop thread
+        self._wheel = None
+        self._stopping = False
+
+    def __contains__(self, lport):
+
+        with self._lock:
+            return lport in self._settings
+
+    def set(self, lport, latency=0, jitter=0, loss=0, rate=0, burst=0, queue_limit=500):
+        """
+        Sets the impairment of the link connected to a UDP NIO. It is applied
+        immediately if the NIO has been added with an impairment, otherwise
+        when the NIO is added.
+
+        :param lport: local port of the UDP NIO
+        :param latency: delay in milliseconds
+        :param jitter: delay variation in milliseconds
+        :param loss: packet loss in percent
+        :param rate: rate in kilobits per second (0 for no limit)
+        :param burst: burst size in bytes (0 for 10 ms at the rate)
+        :param queue_limit: maximum time a packet waits for the rate shaper in milliseconds
+
+        :returns: True if the impairment is applied
+        """
+
+        settings = {"latency": latency,
+                    "jitter": jitter,
+                    "loss": loss,
+                    "rate": rate,
+                    "burst": burst,
+                    "queue_limit": queue_limit}
+        with self._lock:
+            self._settings[lport] = settings
+            link = self._links.get(lport)
+            if link:
+                link.configure(**settings)
+        log.info("link impairment on UDP port {}: {}".format(lport, settings))
+        return link is not None
+
+    def clear(self, lport):
+        """
+        Removes the impairment of the link connected to a UDP NIO. The relay
+        of a NIO added with an impairment forwards the packets unchanged
+        until the NIO is deleted.
+
+        :param lport: local port of the UDP NIO
+
+        :returns: True if a relay is forwarding the packets
+        """
+
+        with self._lock:
+            self._settings.pop(lport, None)
+            link = self._links.get(lport)
+            if link:
+                link.configure()
+        log.info("link impairment on UDP port {} removed".format(lport))
+        return link is not None
+
+    def attach(self, lport, rhost, rport, host, owner=None):
+        """
+        Inserts a relay when a UDP NIO with an impairment is added.
+
+        :param lport: local port of the NIO
+        :param rhost: remote host of the NIO
+        :param rport: remote port of the NIO
+        :param host: address of the local port
+        :param owner: identifier of the node using the NIO (see release_all())
+
+        :returns: tuple (lport, rhost, rport) to create the NIO with, the local
+        port stays reserved until release() is called
+        """
+
+        with self._lock:
+            settings = self._settings.get(lport)
+            if settings is None:
+                return lport, rhost, rport
+            if lport in self._links:
+                raise OSError(errno.EADDRINUSE, "UDP port {} is already relayed".format(lport))
+            link = ImpairedLink(lport, rhost, rport, host, owner)
+            link.configure(**settings)
+            self._links[lport] = link
+            self._emulator_ports[link.emulator_port] = lport
+
+        self._call(self._register, link)
+        log.info("UDP port {} relayed to the emulator on port {} (peer {}:{})".format(lport, link.emulator_port, rhost, rport))
+        return link.emulator_port, link.relay_host, link.relay_port
+
+    def release(self, lport):
+        """
+        Frees the local port of a relayed NIO, right before
+        the emulator binds it.
+
+        :param lport: local port of the NIO as created (returned by attach())
+        """
+
+        with self._lock:
+            nio_port = self._emulator_ports.get(lport)
+            if nio_port is not None:
+                self._links[nio_port].release_emulator_port()
+
+    def release_all(self, owner):
+        """
+        Frees the local ports of the relayed NIOs of a node,
+        right before its emulator starts.
+
+        :param owner: identifier of the node given to attach()
+        """
+
+        with self._lock:
+            for link in self._links.values():
+                if link.owner == owner:
+                    link.release_emulator_port()
+
+    def detach(self, lport):
+        """
+        Removes the relay when a UDP NIO is deleted. The impairment
+        settings are kept: they apply again if the port is relinked,
+        until they are cleared or the module is reset.
+
+        :param lport: local port of the NIO as created (returned by attach())
+
+        :returns: local port of the NIO as allocated
+        """
+
+        with self._lock:
+            nio_port = self._emulator_ports.pop(lport, None)
+            if nio_port is None:
+                return lport
+            link = self._links.pop(nio_port)
+
+        # the port is free when this returns (e.g. to relink it)
+        removed = threading.Event()
+        self._call(self._unregister, link, removed)
+        removed.wait(5)
+        log.info("relay of UDP port {} removed".format(nio_port))
+        return nio_port
+
+    def stats(self, lport=None):
+        """
+        Returns the counters of the relayed links.
+
+        :param lport: local port of a NIO (all the links if None)
+
+        :returns: dictionary local port -> counters (or counters of the link)
+        """
+
+        with self._lock:
+            if lport is not None:
+                link = self._links.get(lport)
+                return link.stats() if link else None
+            return {port: link.stats() for port, link in self._links.items()}
+
+    def close(self):
+        """
+        Removes all the relays and stops the event loop.
+        """
+
+        with self._lock:
+            links = list(self._links.values())
+            self._links.clear()
+            self._emulator_ports.clear()
+            self._settings.clear()
+            thread = self._thread
+            self._thread = None
+            self._stopping = True
+
+        if thread:
+            self._wakeup[1].send(b"\x00")
+            thread.join()
+            self._poller.close()
+            self._wakeup[0].close()
+            self._wakeup[1].close()
+        for link in links:
+            link.close()
+
+    def _call(self, callback, *args):
+        """
+        Runs a callback in the event loop thread, which is started if needed.
+        """
+
+        with self._lock:
+            if self._thread is None:
+                self._stopping = False
+                self._poller = ReadPoller()
+                self._wakeup = socket.socketpair()
+                self._wakeup[0].setblocking(False)
+                self._poller.register(self._wakeup[0], None)
+                self._thread = threading.Thread(target=self._run, name="link-impairment", daemon=True)
+                self._thread.start()
+            self._pending.append((callback, args))
+        self._wakeup[1].send(b"\x00")
+
+    def _register(self, link):
+
+        self._poller.register(link._internal, (self._from_emulator, link))
+        self._poller.register(link._external, (self._from_peer, link))
+
+    def _unregister(self, link, removed=None):
+
+        self._poller.unregister(link._internal)
+        self._poller.unregister(link._external)
+        # delayed packets of this link are dropped when they expire
+        link.close()
+        if removed is not None:
+            removed.set()
+
+    def _from_emulator(self, sock, link, now):
+
+        for _ in range(RECEIVE_BATCH):
+            try:
+                data = sock.recv(MAX_DATAGRAM_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                link.errors += 1
+                return
+            delay = link.impair(len(data), now)
+            if delay is None:
+                continue
+            if delay <= 0:
+                link.send_to_peer(data)
+            else:
+                self._wheel.schedule(now + delay, (link, data))
+
+    def _from_peer(self, sock, link, now):
+
+        for _ in range(RECEIVE_BATCH):
+            try:
+                data = sock.recv(MAX_DATAGRAM_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                link.errors += 1
+                return
+            link.send_to_emulator(data)
+
+    def _run(self):
+        """
+        Event loop of the relays.
+        """
+
+        self._wheel = TimerWheel(self._tick)
+        while not self._stopping:
+            timeout = 1.0
+            deadline = self._wheel.next_deadline()
+            if deadline is not None:
+                timeout = min(max(deadline - time.monotonic(), 0), timeout)
+            for sock, data in self._poller.poll(timeout):
+                if data is None:
+                    try:
+                        sock.recv(4096)
+                    except BlockingIOError:
+                        pass
+                    while self._pending:
+                        callback, args = self._pending.popleft()
+                        callback(*args)
+                    continue
+                handler, link = data
+                if link._internal.fileno() != -1:
+                    handler(sock, link, time.monotonic())
+            for link, data in self._wheel.expire(time.monotonic()):
+                if link._external.fileno() != -1:
+                    link.send_to_peer(data)
@@ -57,6 +57,8 @@ class Qemu(IModule):
     :param kwargs: named arguments for the module
     """
 
+    shardable = True
+
     def __init__(self, name, *args, **kwargs):
 
         # a new process start when calling IModule
@@ -90,6 +92,18 @@ class Qemu(IModule):
 
         IModule.stop(self, signum)  # this will stop the I/O loop
 
+    def telemetry_nodes(self):
+        """
+        Returns the QEMU and cpulimit processes to sample for resource telemetry.
+
+        :returns: dictionary node ID -> {"name": node name, "pids": list of PIDs}
+        """
+
+        nodes = {}
+        for qemu_id, qemu_instance in self._qemu_instances.items():
+            nodes[qemu_id] = {"name": qemu_instance.name, "pids": qemu_instance.pids()}
+        return nodes
+
     def get_qemu_instance(self, qemu_id):
         """
         Returns a QEMU VM instance.
@@ -123,6 +137,7 @@ class Qemu(IModule):
 
         self._qemu_instances.clear()
         self._allocated_udp_ports.clear()
+        self.link_impairments.close()
 
         self._working_dir = self._projects_dir
         log.info("QEMU module has been reset")
@@ -327,6 +342,8 @@ class Qemu(IModule):
             return
 
         try:
+            # frees the ports the link impairment relays reserved for the emulator
+            self.link_impairments.release_all(qemu_instance.id)
             qemu_instance.start()
         except QemuError as e:
             self.send_custom_error(str(e))
@@ -541,6 +558,11 @@ class Qemu(IModule):
                         sock.connect((rhost, rport))
                 except OSError as e:
                     raise QemuError("Could not create an UDP connection to {}:{}: {}".format(rhost, rport, e))
+                try:
+                    # a relay is inserted if an impairment has been set for this port
+                    lport, rhost, rport = self.link_impairments.attach(lport, rhost, rport, self._host, qemu_instance.id)
+                except OSError as e:
+                    raise QemuError("Could not relay UDP port {} for the link impairment: {}".format(lport, e))
                 nio = NIO_UDP(lport, rhost, rport)
             if not nio:
                 raise QemuError("Requested NIO does not exist or is not supported: {}".format(request["nio"]["type"]))
@@ -549,8 +571,13 @@ class Qemu(IModule):
             return
 
         try:
+            if isinstance(nio, NIO_UDP) and qemu_instance.is_running():
+                # the running emulator binds the port right away
+                self.link_impairments.release(nio.lport)
             qemu_instance.port_add_nio_binding(port, nio)
         except QemuError as e:
+            if isinstance(nio, NIO_UDP):
+                self.link_impairments.detach(nio.lport)
             self.send_custom_error(str(e))
             return
 
@@ -583,8 +610,11 @@ class Qemu(IModule):
         port = request["port"]
         try:
             nio = qemu_instance.port_remove_nio_binding(port)
-            if isinstance(nio, NIO_UDP) and nio.lport in self._allocated_udp_ports:
-                self._allocated_udp_ports.remove(nio.lport)
+            if isinstance(nio, NIO_UDP):
+                # the allocated port is the one taken over by the relay, if any
+                lport = self.link_impairments.detach(nio.lport)
+                if lport in self._allocated_udp_ports:
+                    self._allocated_udp_ports.remove(lport)
         except QemuError as e:
             self.send_custom_error(str(e))
             return
@@ -611,6 +641,28 @@ class Qemu(IModule):
         except subprocess.SubprocessError as e:
             raise QemuError("Error while looking for the Qemu version: {}".format(e))
 
+    @IModule.route("qemu.set_link_impairment")
+    def set_link_impairment(self, request):
+        """
+        Sets the impairment (latency, jitter, packet loss and rate)
+        of the packets sent on a UDP NIO.
+
+        Mandatory request parameters:
+        - lport (local port of the UDP NIO)
+
+        Optional request parameters:
+        - latency, jitter, loss, rate, burst, queue_limit
+
+        Response parameters:
+        - lport (local port of the UDP NIO)
+        - active (True if the impairment is applied, False until the NIO is added)
+        - stats (packets, forwarded packets and bytes, drops per reason)
+
+        :param request: JSON request
+        """
+
+        self.apply_link_impairment(request)
+
     @IModule.route("qemu.qemu_list")
     def qemu_list(self, request):
         """
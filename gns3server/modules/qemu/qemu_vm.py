@@ -28,6 +28,7 @@ import shlex
 import ntpath
 
 from gns3server.config import Config
+from ..id_allocator import IdAllocator
 from gns3dms.cloud.rackspace_ctrl import get_provider
 
 from .qemu_error import QemuError
@@ -54,7 +55,7 @@ class QemuVM(object):
     :param console_end_port_range: TCP console port range end
     """
 
-    _instances = []
+    _instances = IdAllocator(1, 1024)
     _allocated_console_ports = []
 
     def __init__(self,
@@ -69,20 +70,13 @@ class QemuVM(object):
                  console_end_port_range=5500):
 
         if not qemu_id:
-            self._id = 0
-            for identifier in range(1, 1024):
-                if identifier not in self._instances:
-                    self._id = identifier
-                    self._instances.append(self._id)
-                    break
-
-            if self._id == 0:
+            self._id = self._instances.allocate()
+            if self._id is None:
                 raise QemuError("Maximum number of QEMU VM instances reached")
         else:
-            if qemu_id in self._instances:
+            if not self._instances.reserve(qemu_id):
                 raise QemuError("QEMU identifier {} is already used by another QEMU VM instance".format(qemu_id))
             self._id = qemu_id
-            self._instances.append(self._id)
 
         self._name = name
         self._working_dir = None
@@ -181,7 +175,7 @@ class QemuVM(object):
         Resets allocated instance list.
         """
 
-        cls._instances.clear()
+        cls._instances.reset()
         cls._allocated_console_ports.clear()
 
     @property
@@ -273,8 +267,7 @@ class QemuVM(object):
         """
 
         self.stop()
-        if self._id in self._instances:
-            self._instances.remove(self._id)
+        self._instances.release(self._id)
 
         if self.console and self.console in self._allocated_console_ports:
             self._allocated_console_ports.remove(self.console)
@@ -288,8 +281,7 @@ class QemuVM(object):
         """
 
         self.stop()
-        if self._id in self._instances:
-            self._instances.remove(self._id)
+        self._instances.release(self._id)
 
         if self.console:
             self._allocated_console_ports.remove(self.console)
@@ -689,7 +681,7 @@ class QemuVM(object):
         if self._cpulimit_process and self._cpulimit_process.poll() is None:
             self._cpulimit_process.kill()
             try:
-                self._process.wait(3)
+                self._cpulimit_process.wait(3)
             except subprocess.TimeoutExpired:
                 log.error("could not kill cpulimit process {}".format(self._cpulimit_process.pid))
 
@@ -706,7 +698,7 @@ class QemuVM(object):
                 cpulimit_exec = os.path.join(os.path.dirname(os.path.abspath(sys.executable)), "cpulimit", "cpulimit.exe")
             else:
                 cpulimit_exec = "cpulimit"
-            subprocess.Popen([cpulimit_exec, "--lazy", "--pid={}".format(self._process.pid), "--limit={}".format(self._cpu_throttling)], cwd=self._working_dir)
+            self._cpulimit_process = subprocess.Popen([cpulimit_exec, "--lazy", "--pid={}".format(self._process.pid), "--limit={}".format(self._cpu_throttling)], cwd=self._working_dir)
             log.info("CPU throttled to {}%".format(self._cpu_throttling))
         except FileNotFoundError:
             raise QemuError("cpulimit could not be found, please install it or deactivate CPU throttling")
@@ -902,6 +894,20 @@ class QemuVM(object):
             return True
         return False
 
+    def pids(self):
+        """
+        Returns the PIDs of the running processes of this QEMU VM (QEMU and cpulimit).
+
+        :returns: list of PIDs
+        """
+
+        pids = []
+        if self.is_running():
+            pids.append(self._process.pid)
+        if self._cpulimit_process and self._cpulimit_process.poll() is None:
+            pids.append(self._cpulimit_process.pid)
+        return pids
+
     def command(self):
         """
         Returns the QEMU command line.
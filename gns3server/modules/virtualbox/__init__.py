@@ -31,6 +31,7 @@ from .virtualbox_vm import VirtualBoxVM
 from .virtualbox_error import VirtualBoxError
 from .nios.nio_udp import NIO_UDP
 from ..attic import find_unused_port
+from ..capture_session import CaptureSessions
 
 from .schemas import VBOX_CREATE_SCHEMA
 from .schemas import VBOX_DELETE_SCHEMA
@@ -58,6 +59,8 @@ class VirtualBox(IModule):
     :param kwargs: named arguments for the module
     """
 
+    shardable = True
+
     def __init__(self, name, *args, **kwargs):
 
         # get the vboxmanage location
@@ -105,6 +108,7 @@ class VirtualBox(IModule):
         self._projects_dir = kwargs["projects_dir"]
         self._tempdir = kwargs["temp_dir"]
         self._working_dir = self._projects_dir
+        self._capture_sessions = CaptureSessions(name)
 
     def stop(self, signum=None):
         """
@@ -121,6 +125,7 @@ class VirtualBox(IModule):
             except VirtualBoxError:
                 continue
 
+        self._capture_sessions.stop_all()
         IModule.stop(self, signum)  # this will stop the I/O loop
 
     def get_vbox_instance(self, vbox_id):
@@ -156,6 +161,8 @@ class VirtualBox(IModule):
 
         self._vbox_instances.clear()
         self._allocated_udp_ports.clear()
+        self.link_impairments.close()
+        self._capture_sessions.stop_all()
 
         self._working_dir = self._projects_dir
         log.info("VirtualBox module has been reset")
@@ -371,6 +378,8 @@ class VirtualBox(IModule):
             return
 
         try:
+            # frees the ports the link impairment relays reserved for the emulator
+            self.link_impairments.release_all(vbox_instance.id)
             vbox_instance.start()
         except VirtualBoxError as e:
             self.send_custom_error(str(e))
@@ -585,6 +594,11 @@ class VirtualBox(IModule):
                         sock.connect((rhost, rport))
                 except OSError as e:
                     raise VirtualBoxError("Could not create an UDP connection to {}:{}: {}".format(rhost, rport, e))
+                try:
+                    # a relay is inserted if an impairment has been set for this port
+                    lport, rhost, rport = self.link_impairments.attach(lport, rhost, rport, self._host, vbox_instance.id)
+                except OSError as e:
+                    raise VirtualBoxError("Could not relay UDP port {} for the link impairment: {}".format(lport, e))
                 nio = NIO_UDP(lport, rhost, rport)
             if not nio:
                 raise VirtualBoxError("Requested NIO does not exist or is not supported: {}".format(request["nio"]["type"]))
@@ -593,8 +607,13 @@ class VirtualBox(IModule):
             return
 
         try:
+            if isinstance(nio, NIO_UDP) and vbox_instance.is_running():
+                # the running emulator binds the port right away
+                self.link_impairments.release(nio.lport)
             vbox_instance.port_add_nio_binding(port, nio)
         except VirtualBoxError as e:
+            if isinstance(nio, NIO_UDP):
+                self.link_impairments.detach(nio.lport)
             self.send_custom_error(str(e))
             return
 
@@ -627,14 +646,39 @@ class VirtualBox(IModule):
         port = request["port"]
         try:
             nio = vbox_instance.port_remove_nio_binding(port)
-            if isinstance(nio, NIO_UDP) and nio.lport in self._allocated_udp_ports:
-                self._allocated_udp_ports.remove(nio.lport)
+            if isinstance(nio, NIO_UDP):
+                # the allocated port is the one taken over by the relay, if any
+                lport = self.link_impairments.detach(nio.lport)
+                if lport in self._allocated_udp_ports:
+                    self._allocated_udp_ports.remove(lport)
         except VirtualBoxError as e:
             self.send_custom_error(str(e))
             return
 
         self.send_response(True)
 
+    @IModule.route("virtualbox.set_link_impairment")
+    def set_link_impairment(self, request):
+        """
+        Sets the impairment (latency, jitter, packet loss and rate)
+        of the packets sent on a UDP NIO.
+
+        Mandatory request parameters:
+        - lport (local port of the UDP NIO)
+
+        Optional request parameters:
+        - latency, jitter, loss, rate, burst, queue_limit
+
+        Response parameters:
+        - lport (local port of the UDP NIO)
+        - active (True if the impairment is applied, False until the NIO is added)
+        - stats (packets, forwarded packets and bytes, drops per reason)
+
+        :param request: JSON request
+        """
+
+        self.apply_link_impairment(request)
+
     @IModule.route("virtualbox.start_capture")
     def vbox_start_capture(self, request):
         """
@@ -646,6 +690,11 @@ class VirtualBox(IModule):
         - port_id (port identifier)
         - capture_file_name
 
+        Optional request parameters:
+        - max_file_size (rotate the capture file after this size in MB)
+        - max_files (number of capture files to keep)
+        - max_file_duration (rotate the capture file after this duration in seconds)
+
         Response parameters:
         - port_id (port identifier)
         - capture_file_path (path to the capture file)
@@ -665,10 +714,12 @@ class VirtualBox(IModule):
         port = request["port"]
         capture_file_name = request["capture_file_name"]
 
+        capture_key = (request["id"], port)
         try:
             capture_file_path = os.path.join(self._working_dir, "captures", capture_file_name)
-            vbox_instance.start_capture(port, capture_file_path)
-        except VirtualBoxError as e:
+            self._capture_sessions.start(capture_key, capture_file_path, request,
+                                         lambda writer_path: vbox_instance.start_capture(port, writer_path))
+        except (VirtualBoxError, OSError) as e:
             self.send_custom_error(str(e))
             return
 
@@ -688,6 +739,7 @@ class VirtualBox(IModule):
 
         Response parameters:
         - port_id (port identifier)
+        - capture_stats (bytes, packets, drops, rotated and pruned files)
 
         :param request: JSON request
         """
@@ -702,6 +754,7 @@ class VirtualBox(IModule):
             return
 
         port = request["port"]
+        capture_key = (request["id"], port)
         try:
             vbox_instance.stop_capture(port)
         except VirtualBoxError as e:
@@ -709,6 +762,9 @@ class VirtualBox(IModule):
             return
 
         response = {"port_id": request["port_id"]}
+        capture_stats = self._capture_sessions.stop(capture_key)
+        if capture_stats is not None:
+            response["capture_stats"] = capture_stats
         self.send_response(response)
 
     def _execute_vboxmanage(self, command):
@@ -30,6 +30,7 @@ import json
 import socket
 import time
 
+from ..id_allocator import IdAllocator
 from .virtualbox_error import VirtualBoxError
 from .adapters.ethernet_adapter import EthernetAdapter
 from ..attic import find_unused_port
@@ -59,7 +60,7 @@ class VirtualBoxVM(object):
     :param console_end_port_range: TCP console port range end
     """
 
-    _instances = []
+    _instances = IdAllocator(1, 1024)
     _allocated_console_ports = []
 
     def __init__(self,
@@ -75,20 +76,13 @@ class VirtualBoxVM(object):
                  console_end_port_range=5000):
 
         if not vbox_id:
-            self._id = 0
-            for identifier in range(1, 1024):
-                if identifier not in self._instances:
-                    self._id = identifier
-                    self._instances.append(self._id)
-                    break
-
-            if self._id == 0:
+            self._id = self._instances.allocate()
+            if self._id is None:
                 raise VirtualBoxError("Maximum number of VirtualBox VM instances reached")
         else:
-            if vbox_id in self._instances:
+            if not self._instances.reserve(vbox_id):
                 raise VirtualBoxError("VirtualBox identifier {} is already used by another VirtualBox VM instance".format(vbox_id))
             self._id = vbox_id
-            self._instances.append(self._id)
 
         self._name = name
         self._linked_clone = linked_clone
@@ -191,7 +185,7 @@ class VirtualBoxVM(object):
         Resets allocated instance list.
         """
 
-        cls._instances.clear()
+        cls._instances.reset()
         cls._allocated_console_ports.clear()
 
     @property
@@ -315,8 +309,7 @@ class VirtualBoxVM(object):
         """
 
         self.stop()
-        if self._id in self._instances:
-            self._instances.remove(self._id)
+        self._instances.release(self._id)
 
         if self.console and self.console in self._allocated_console_ports:
             self._allocated_console_ports.remove(self.console)
@@ -364,8 +357,7 @@ class VirtualBoxVM(object):
         """
 
         self.stop()
-        if self._id in self._instances:
-            self._instances.remove(self._id)
+        self._instances.release(self._id)
 
         if self.console:
             self._allocated_console_ports.remove(self.console)
@@ -890,6 +882,15 @@ class VirtualBoxVM(object):
         result = self._control_vm("reset")
         log.debug("VirtualBox VM has been reset: {}".format(result))
 
+    def is_running(self):
+        """
+        Checks if this VirtualBox VM is running.
+
+        :returns: True or False
+        """
+
+        return self._get_vm_state() == "running"
+
     def port_add_nio_binding(self, adapter_id, nio):
         """
         Adds a port NIO binding.
@@ -27,6 +27,9 @@ import shutil
 from gns3server.modules import IModule
 from gns3server.config import Config
 from .vpcs_device import VPCSDevice
+from .vpcs_group import VPCSGroup
+from .vpcs_group import MAX_PCS_PER_PROCESS
+from .vpcs_group import find_unused_port_block
 from .vpcs_error import VPCSError
 from .nios.nio_udp import NIO_UDP
 from .nios.nio_tap import NIO_TAP
@@ -56,6 +59,11 @@ class VPCS(IModule):
     :param kwargs: named arguments for the module
     """
 
+    shardable = True
+
+    # packed VPCS devices share the process of their group
+    exclusive_routes = IModule.exclusive_routes + (".start", ".stop", ".reload")
+
     def __init__(self, name, *args, **kwargs):
 
         # get the VPCS location
@@ -92,6 +100,11 @@ class VPCS(IModule):
         self._tempdir = kwargs["temp_dir"]
         self._working_dir = self._projects_dir
 
+        # packing mode: several VPCS devices share one VPCS process
+        self._packing = vpcs_config.getboolean("packing", fallback=False)
+        self._pcs_per_process = min(vpcs_config.getint("pcs_per_process", fallback=MAX_PCS_PER_PROCESS), MAX_PCS_PER_PROCESS)
+        self._vpcs_groups = {}
+
     def stop(self, signum=None):
         """
         Properly stops the module.
@@ -104,8 +117,27 @@ class VPCS(IModule):
             vpcs_instance = self._vpcs_instances[vpcs_id]
             vpcs_instance.delete()
 
+        for group in self._vpcs_groups.values():
+            group.stop()
+
         IModule.stop(self, signum)  # this will stop the I/O loop
 
+    def telemetry_nodes(self):
+        """
+        Returns the VPCS processes to sample for resource telemetry.
+
+        :returns: dictionary node ID -> {"name": node name, "pids": list of PIDs}
+        """
+
+        nodes = {}
+        for vpcs_id, vpcs_instance in self._vpcs_instances.items():
+            if not vpcs_instance.group:
+                nodes[vpcs_id] = {"name": vpcs_instance.name, "pids": vpcs_instance.pids()}
+        # packed VPCS devices share the process of their group
+        for group_id, group in self._vpcs_groups.items():
+            nodes["group-{}".format(group_id)] = {"name": "VPCS group {}".format(group_id), "pids": group.pids()}
+        return nodes
+
     def get_vpcs_instance(self, vpcs_id):
         """
         Returns a VPCS device instance.
@@ -121,6 +153,60 @@ class VPCS(IModule):
             return None
         return self._vpcs_instances[vpcs_id]
 
+    def _pack_vpcs_instance(self, vpcs_instance):
+        """
+        Packs a VPCS device into the shared VPCS process of its group.
+        The group is created (with its own block of UDP ports) if needed.
+
+        :param vpcs_instance: VPCSDevice instance
+        """
+
+        group_id, slot = VPCSGroup.locate(vpcs_instance.id,
+                                          self._pcs_per_process,
+                                          self._worker_index,
+                                          self._worker_count)
+        group = self._vpcs_groups.get(group_id)
+        if not group:
+            try:
+                udp_base = find_unused_port_block(self._pcs_per_process,
+                                                  self._udp_start_port_range,
+                                                  self._udp_end_port_range,
+                                                  host=self._host,
+                                                  ignore_ports=self._allocated_udp_ports)
+            except Exception as e:
+                raise VPCSError(e)
+            group = VPCSGroup(group_id,
+                              self._pcs_per_process,
+                              self._vpcs,
+                              self._working_dir,
+                              self._host,
+                              self._console_host,
+                              udp_base,
+                              self._console_start_port_range,
+                              self._console_end_port_range,
+                              VPCSDevice._allocated_console_ports)
+            self._allocated_udp_ports.extend(group.udp_ports)
+            self._vpcs_groups[group_id] = group
+            log.info("VPCS group {} created with UDP ports {}-{}".format(group_id,
+                                                                         group.udp_ports[0],
+                                                                         group.udp_ports[-1]))
+        vpcs_instance.pack(group, slot)
+
+    def _release_vpcs_group(self, group):
+        """
+        Deletes a VPCS group if it has no more members.
+
+        :param group: VPCSGroup instance
+        """
+
+        if group.is_empty():
+            group.stop()
+            for port in group.udp_ports:
+                if port in self._allocated_udp_ports:
+                    self._allocated_udp_ports.remove(port)
+            del self._vpcs_groups[group.id]
+            log.info("VPCS group {} has been deleted".format(group.id))
+
     @IModule.route("vpcs.reset")
     def reset(self, request):
         """
@@ -134,11 +220,16 @@ class VPCS(IModule):
             vpcs_instance = self._vpcs_instances[vpcs_id]
             vpcs_instance.delete()
 
+        for group in self._vpcs_groups.values():
+            group.stop()
+        self._vpcs_groups.clear()
+
         # resets the instance IDs
         VPCSDevice.reset()
 
         self._vpcs_instances.clear()
         self._allocated_udp_ports.clear()
+        self.link_impairments.close()
 
         self._working_dir = self._projects_dir
         log.info("VPCS module has been reset")
@@ -156,6 +247,7 @@ class VPCS(IModule):
         - console_end_port_range
         - udp_start_port_range
         - udp_end_port_range
+        - packing (share VPCS processes between devices)
 
         :param request: JSON request
         """
@@ -170,6 +262,8 @@ class VPCS(IModule):
             for vpcs_id in self._vpcs_instances:
                 vpcs_instance = self._vpcs_instances[vpcs_id]
                 vpcs_instance.path = self._vpcs
+            for group in self._vpcs_groups.values():
+                group.path = self._vpcs
 
         if "working_dir" in request:
             new_working_dir = request["working_dir"]
@@ -193,6 +287,8 @@ class VPCS(IModule):
             for vpcs_id in self._vpcs_instances:
                 vpcs_instance = self._vpcs_instances[vpcs_id]
                 vpcs_instance.working_dir = os.path.join(self._working_dir, "vpcs", "pc-{}".format(vpcs_instance.id))
+            for group in self._vpcs_groups.values():
+                group.working_dir = os.path.join(self._working_dir, "vpcs", "group-{}".format(group.id))
 
         if "console_start_port_range" in request and "console_end_port_range" in request:
             self._console_start_port_range = request["console_start_port_range"]
@@ -202,6 +298,11 @@ class VPCS(IModule):
             self._udp_start_port_range = request["udp_start_port_range"]
             self._udp_end_port_range = request["udp_end_port_range"]
 
+        if "packing" in request:
+            # only applies to VPCS devices created from now on
+            self._packing = request["packing"]
+            log.info("VPCS packing mode {}".format("enabled" if self._packing else "disabled"))
+
         log.debug("received request {}".format(request))
 
     @IModule.route("vpcs.create")
@@ -245,6 +346,13 @@ class VPCS(IModule):
                                        self._console_start_port_range,
                                        self._console_end_port_range)
 
+            if self._packing:
+                try:
+                    self._pack_vpcs_instance(vpcs_instance)
+                except VPCSError:
+                    vpcs_instance.delete()
+                    raise
+
         except VPCSError as e:
             self.send_custom_error(str(e))
             return
@@ -281,8 +389,11 @@ class VPCS(IModule):
             return
 
         try:
+            group = vpcs_instance.group
             vpcs_instance.clean_delete()
             del self._vpcs_instances[request["id"]]
+            if group:
+                self._release_vpcs_group(group)
         except VPCSError as e:
             self.send_custom_error(str(e))
             return
@@ -387,6 +498,8 @@ class VPCS(IModule):
             return
 
         try:
+            # frees the ports the link impairment relays reserved for the emulator
+            self.link_impairments.release_all(vpcs_instance.id)
             vpcs_instance.start()
         except VPCSError as e:
             self.send_custom_error(str(e))
@@ -449,6 +562,8 @@ class VPCS(IModule):
         try:
             if vpcs_instance.is_running():
                 vpcs_instance.stop()
+            # frees the ports the link impairment relays reserved for the emulator
+            self.link_impairments.release_all(vpcs_instance.id)
             vpcs_instance.start()
         except VPCSError as e:
             self.send_custom_error(str(e))
@@ -480,6 +595,17 @@ class VPCS(IModule):
         if not vpcs_instance:
             return
 
+        if vpcs_instance.group:
+            # packed VPCS devices use the UDP port reserved for their PC slot
+            port = vpcs_instance.group.udp_port(vpcs_instance.slot)
+            log.info("{} [id={}] uses UDP port {} of VPCS group {}".format(vpcs_instance.name,
+                                                                           vpcs_instance.id,
+                                                                           port,
+                                                                           vpcs_instance.group.id))
+            self.send_response({"lport": port,
+                                "port_id": request["port_id"]})
+            return
+
         try:
             port = find_unused_port(self._udp_start_port_range,
                                     self._udp_end_port_range,
@@ -545,6 +671,11 @@ class VPCS(IModule):
                         sock.connect((rhost, rport))
                 except OSError as e:
                     raise VPCSError("Could not create an UDP connection to {}:{}: {}".format(rhost, rport, e))
+                try:
+                    # a relay is inserted if an impairment has been set for this port
+                    lport, rhost, rport = self.link_impairments.attach(lport, rhost, rport, self._host, vpcs_instance.id)
+                except OSError as e:
+                    raise VPCSError("Could not relay UDP port {} for the link impairment: {}".format(lport, e))
                 nio = NIO_UDP(lport, rhost, rport)
             elif request["nio"]["type"] == "nio_tap":
                 tap_device = request["nio"]["tap_device"]
@@ -558,8 +689,13 @@ class VPCS(IModule):
             return
 
         try:
+            if isinstance(nio, NIO_UDP) and vpcs_instance.is_running():
+                # the running emulator binds the port right away
+                self.link_impairments.release(nio.lport)
             vpcs_instance.port_add_nio_binding(port, nio)
         except VPCSError as e:
+            if isinstance(nio, NIO_UDP):
+                self.link_impairments.detach(nio.lport)
             self.send_custom_error(str(e))
             return
 
@@ -592,14 +728,39 @@ class VPCS(IModule):
         port = request["port"]
         try:
             nio = vpcs_instance.port_remove_nio_binding(port)
-            if isinstance(nio, NIO_UDP) and nio.lport in self._allocated_udp_ports:
-                self._allocated_udp_ports.remove(nio.lport)
+            if isinstance(nio, NIO_UDP):
+                # the allocated port is the one taken over by the relay, if any
+                lport = self.link_impairments.detach(nio.lport)
+                if lport in self._allocated_udp_ports and not vpcs_instance.group:
+                    self._allocated_udp_ports.remove(lport)
         except VPCSError as e:
             self.send_custom_error(str(e))
             return
 
         self.send_response(True)
 
+    @IModule.route("vpcs.set_link_impairment")
+    def set_link_impairment(self, request):
+        """
+        Sets the impairment (latency, jitter, packet loss and rate)
+        of the packets sent on a UDP NIO.
+
+        Mandatory request parameters:
+        - lport (local port of the UDP NIO)
+
+        Optional request parameters:
+        - latency, jitter, loss, rate, burst, queue_limit
+
+        Response parameters:
+        - lport (local port of the UDP NIO)
+        - active (True if the impairment is applied, False until the NIO is added)
+        - stats (packets, forwarded packets and bytes, drops per reason)
+
+        :param request: JSON request
+        """
+
+        self.apply_link_impairment(request)
+
     @IModule.route("vpcs.export_config")
     def export_config(self, request):
         """
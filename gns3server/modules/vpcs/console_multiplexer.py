@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Console multiplexer for VPCS processes simulating several PCs.
+
+Each PC (slot) keeps its own TCP console port. All the console
+connections are relayed to the single console of the shared VPCS process,
+and VPCS is switched to the right PC (by sending the slot number)
+before forwarding anything typed by a client.
+"""
+
+import socket
+import select
+import threading
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class ConsoleMultiplexer(threading.Thread):
+    """
+    Relays per-PC console connections to a shared VPCS console.
+
+    :param name: name used in log messages
+    :param host: VPCS console host
+    :param port: VPCS console port
+    """
+
+    def __init__(self, name, host, port):
+
+        threading.Thread.__init__(self, daemon=True)
+        self._name = name
+        self._host = host
+        self._port = port
+        self._lock = threading.Lock()
+        self._upstream = None
+        self._listeners = {}  # listener socket fileno -> (slot, socket)
+        self._clients = {}  # client socket fileno -> (slot, socket)
+        self._active_slot = None
+        self._timeout = 0.5
+        self._alive = True
+
+    def connect(self, timeout=10):
+        """
+        Connects to the shared VPCS console.
+
+        :param timeout: connection timeout
+        """
+
+        host = self._host
+        if host == "0.0.0.0":
+            host = "127.0.0.1"
+        elif host == "::":
+            host = "::1"
+        self._upstream = socket.create_connection((host, self._port), timeout)
+        self._upstream.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._upstream.settimeout(None)
+        log.info("console multiplexer for {} connected to {}:{}".format(self._name, host, self._port))
+
+    def add_slot(self, slot, host, port):
+        """
+        Starts listening for console connections to a PC.
+
+        :param slot: PC slot number (1 to 9)
+        :param host: console host to bind
+        :param port: console port to bind
+        """
+
+        if ":" in host:
+            server_socket = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+        else:
+            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_socket.bind((host, port))
+        server_socket.listen(socket.SOMAXCONN)
+        with self._lock:
+            self._listeners[server_socket.fileno()] = (slot, server_socket)
+        log.info("console multiplexer for {}: PC {} available on {}:{}".format(self._name, slot, host, port))
+
+    def remove_slot(self, slot):
+        """
+        Stops listening for console connections to a PC
+        and disconnects its clients.
+
+        :param slot: PC slot number
+        """
+
+        with self._lock:
+            for fileno, (client_slot, sock) in list(self._listeners.items()) + list(self._clients.items()):
+                if client_slot == slot:
+                    self._listeners.pop(fileno, None)
+                    self._clients.pop(fileno, None)
+                    sock.close()
+            if self._active_slot == slot:
+                self._active_slot = None
+
+    def send(self, slot, lines):
+        """
+        Sends commands to a PC.
+
+        :param slot: PC slot number
+        :param lines: list of command lines
+        """
+
+        with self._lock:
+            self._select_slot(slot)
+            data = "".join("{}\n".format(line) for line in lines)
+            self._upstream.sendall(data.encode("utf-8"))
+
+    def _select_slot(self, slot):
+        """
+        Switches the VPCS console to a PC (lock must be held).
+
+        :param slot: PC slot number
+        """
+
+        if self._active_slot != slot:
+            self._upstream.sendall("{}\n".format(slot).encode("utf-8"))
+            self._active_slot = slot
+
+    def run(self):
+        """
+        Thread loop.
+        """
+
+        while self._alive:
+            with self._lock:
+                if self._upstream is None:
+                    return
+                recv_list = [self._upstream.fileno()] + list(self._listeners.keys()) + list(self._clients.keys())
+
+            try:
+                rlist, _, _ = select.select(recv_list, [], [], self._timeout)
+            except (OSError, ValueError):
+                # a socket has been closed by another thread
+                continue
+
+            for fileno in rlist:
+                with self._lock:
+                    if not self._alive:
+                        return
+                    if fileno == self._upstream.fileno():
+                        if not self._relay_upstream():
+                            log.info("VPCS console for {} has been closed".format(self._name))
+                            self._close_all()
+                            return
+                    elif fileno in self._listeners:
+                        self._accept(*self._listeners[fileno])
+                    elif fileno in self._clients:
+                        self._relay_client(fileno)
+
+    def _accept(self, slot, server_socket):
+        """
+        Accepts a new console client (lock must be held).
+        """
+
+        try:
+            sock, addr = server_socket.accept()
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError as e:
+            log.error("could not accept new console client: {}".format(e))
+            return
+        log.info("new console client {}:{} for PC {} of {}".format(addr[0], addr[1], slot, self._name))
+        self._clients[sock.fileno()] = (slot, sock)
+        # switch to the PC and get a fresh prompt
+        self._select_slot(slot)
+        self._upstream.sendall(b"\n")
+
+    def _relay_client(self, fileno):
+        """
+        Forwards data from a console client to VPCS (lock must be held).
+        """
+
+        slot, sock = self._clients[fileno]
+        try:
+            data = sock.recv(1024)
+        except OSError:
+            data = b""
+        if not data:
+            del self._clients[fileno]
+            sock.close()
+            return
+        self._select_slot(slot)
+        self._upstream.sendall(data)
+
+    def _relay_upstream(self):
+        """
+        Forwards VPCS output to the clients of the active PC (lock must be held).
+
+        :returns: False if the VPCS console has been closed
+        """
+
+        try:
+            data = self._upstream.recv(4096)
+        except OSError:
+            data = b""
+        if not data:
+            return False
+        for fileno, (slot, sock) in list(self._clients.items()):
+            if slot != self._active_slot:
+                continue
+            try:
+                sock.sendall(data)
+            except OSError as e:
+                log.debug("console client send: {}".format(e))
+                del self._clients[fileno]
+                sock.close()
+        return True
+
+    def _close_all(self):
+        """
+        Closes all sockets (lock must be held).
+        """
+
+        for _, sock in list(self._listeners.values()) + list(self._clients.values()):
+            sock.close()
+        self._listeners.clear()
+        self._clients.clear()
+        if self._upstream:
+            self._upstream.close()
+            self._upstream = None
+
+    def stop(self):
+        """
+        Stops the multiplexer.
+        """
+
+        self._alive = False
+        with self._lock:
+            self._close_all()
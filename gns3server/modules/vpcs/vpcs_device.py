@@ -28,6 +28,7 @@ import shutil
 import re
 
 from pkg_resources import parse_version
+from ..id_allocator import IdAllocator
 from .vpcs_error import VPCSError
 from .adapters.ethernet_adapter import EthernetAdapter
 from .nios.nio_udp import NIO_UDP
@@ -52,7 +53,7 @@ class VPCSDevice(object):
     :param console_end_port_range: TCP console port range end
     """
 
-    _instances = []
+    _instances = IdAllocator(1, 256)
     _allocated_console_ports = []
 
     def __init__(self,
@@ -70,20 +71,13 @@ class VPCSDevice(object):
             # find an instance identifier is none is provided (1 <= id <= 255)
             # This 255 limit is due to a restriction on the number of possible
             # MAC addresses given in VPCS using the -m option
-            self._id = 0
-            for identifier in range(1, 256):
-                if identifier not in self._instances:
-                    self._id = identifier
-                    self._instances.append(self._id)
-                    break
-
-            if self._id == 0:
+            self._id = self._instances.allocate()
+            if self._id is None:
                 raise VPCSError("Maximum number of VPCS instances reached")
         else:
-            if vpcs_id in self._instances:
+            if not self._instances.reserve(vpcs_id):
                 raise VPCSError("VPCS identifier {} is already used by another VPCS device".format(vpcs_id))
             self._id = vpcs_id
-            self._instances.append(self._id)
 
         self._name = name
         self._path = path
@@ -96,6 +90,8 @@ class VPCSDevice(object):
         self._started = False
         self._console_start_port_range = console_start_port_range
         self._console_end_port_range = console_end_port_range
+        self._group = None
+        self._slot = None
 
         # VPCS settings
         self._script_file = ""
@@ -149,13 +145,69 @@ class VPCSDevice(object):
 
         return self._id
 
+    @property
+    def group(self):
+        """
+        Returns the VPCS group (shared VPCS process) this device is packed into.
+
+        :returns: VPCSGroup instance or None
+        """
+
+        return self._group
+
+    @property
+    def slot(self):
+        """
+        Returns the PC slot of this device in its VPCS group.
+
+        :returns: slot number (1 to 9) or None
+        """
+
+        return self._slot
+
+    def pack(self, group, slot):
+        """
+        Packs this device into a shared VPCS process.
+
+        :param group: VPCSGroup instance
+        :param slot: PC slot number in the group
+        """
+
+        group.add_member(self, slot)
+        self._group = group
+        self._slot = slot
+        log.info("VPCS {name} [id={id}]: packed into PC slot {slot} of VPCS group {group}".format(name=self._name,
+                                                                                                  id=self._id,
+                                                                                                  slot=slot,
+                                                                                                  group=group.id))
+
+    def _unpack(self):
+        """
+        Removes this device from its shared VPCS process.
+        """
+
+        if self._group:
+            self._group.remove_member(self._slot)
+            self._group = None
+            self._slot = None
+
+    @property
+    def nio(self):
+        """
+        Returns the NIO connected to this VPCS device.
+
+        :returns: NIO instance or None
+        """
+
+        return self._ethernet_adapter.get_nio(0)
+
     @classmethod
     def reset(cls):
         """
         Resets allocated instance list.
         """
 
-        cls._instances.clear()
+        cls._instances.reset()
         cls._allocated_console_ports.clear()
 
     @property
@@ -290,8 +342,8 @@ class VPCSDevice(object):
         """
 
         self.stop()
-        if self._id in self._instances:
-            self._instances.remove(self._id)
+        self._unpack()
+        self._instances.release(self._id)
 
         if self.console and self.console in self._allocated_console_ports:
             self._allocated_console_ports.remove(self.console)
@@ -305,8 +357,8 @@ class VPCSDevice(object):
         """
 
         self.stop()
-        if self._id in self._instances:
-            self._instances.remove(self._id)
+        self._unpack()
+        self._instances.release(self._id)
 
         if self.console:
             self._allocated_console_ports.remove(self.console)
@@ -370,6 +422,11 @@ class VPCSDevice(object):
             if not self._ethernet_adapter.get_nio(0):
                 raise VPCSError("This VPCS instance must be connected in order to start")
 
+            if self._group:
+                self._group.start_member(self._slot)
+                self._started = True
+                return
+
             self._command = self._build_command()
             try:
                 log.info("starting VPCS: {}".format(self._command))
@@ -396,6 +453,12 @@ class VPCSDevice(object):
         Stops the VPCS process.
         """
 
+        if self._group:
+            # only this PC is stopped, the shared VPCS process may keep running
+            self._group.stop_member(self._slot)
+            self._started = False
+            return
+
         # stop the VPCS process
         if self.is_running():
             log.info("stopping VPCS instance {} PID={}".format(self._id, self._process.pid))
@@ -431,10 +494,23 @@ class VPCSDevice(object):
         :returns: True or False
         """
 
+        if self._group:
+            return self._group.is_member_running(self._slot)
         if self._process and self._process.poll() is None:
             return True
         return False
 
+    def pids(self):
+        """
+        Returns the PIDs of the running processes of this VPCS device.
+
+        :returns: list of PIDs
+        """
+
+        if not self._group and self.is_running():
+            return [self._process.pid]
+        return []
+
     def port_add_nio_binding(self, port_id, nio):
         """
         Adds a port NIO binding.
@@ -447,7 +523,17 @@ class VPCSDevice(object):
             raise VPCSError("Port {port_id} doesn't exist in adapter {adapter}".format(adapter=self._ethernet_adapter,
                                                                                        port_id=port_id))
 
+        if self._group:
+            if not isinstance(nio, NIO_UDP):
+                raise VPCSError("Only UDP NIOs are supported by packed VPCS devices")
+            if nio.lport != self._group.udp_port(self._slot):
+                raise VPCSError("UDP port {} is not the port allocated to PC slot {} of VPCS group {}".format(nio.lport,
+                                                                                                          self._slot,
+                                                                                                          self._group.id))
+
         self._ethernet_adapter.add_nio(port_id, nio)
+        if self._group:
+            self._group.update_member_nio(self._slot)
         log.info("VPCS {name} [id={id}]: {nio} added to port {port_id}".format(name=self._name,
                                                                                id=self._id,
                                                                                nio=nio,
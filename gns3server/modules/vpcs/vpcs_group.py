@@ -0,0 +1,492 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Packing of several VPCS devices into one VPCS process.
+
+VPCS can simulate up to 9 PCs per process (-i option). A group owns
+one VPCS process, one internal console port and a contiguous block of
+local UDP ports (one per PC slot). VPCS device IDs map to groups and slots
+in a deterministic way: group = (id - 1) // size and slot = (id - 1) % size + 1,
+so the MAC address of a packed PC is the same as when it runs on its own.
+When the VPCS module is sharded, groups are made of the IDs owned by the
+worker and group IDs are interleaved between workers so they stay unique.
+"""
+
+import os
+import sys
+import subprocess
+import signal
+import socket
+
+from .vpcs_error import VPCSError
+from .console_multiplexer import ConsoleMultiplexer
+from ..attic import find_unused_port
+from ..attic import wait_socket_is_ready
+from ...sharding import port_range
+
+import logging
+log = logging.getLogger(__name__)
+
+MAX_PCS_PER_PROCESS = 9
+
+
+def find_unused_port_block(count, start_port, end_port, host="127.0.0.1", ignore_ports=[]):
+    """
+    Finds a block of contiguous unused UDP ports in a range.
+
+    :param count: number of ports in the block
+    :param start_port: first port in the range
+    :param end_port: last port in the range
+    :param host: host/address for bind()
+    :param ignore_ports: list of port to ignore within the range
+
+    :returns: first port of the block
+    """
+
+    # a worker of a sharded module only uses its own slice of the range
+    start_port, end_port = port_range(start_port, end_port)
+    port = start_port
+    while port + count - 1 <= end_port:
+        for offset in range(count):
+            if port + offset in ignore_ports:
+                port += offset + 1
+                break
+            try:
+                with socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_DGRAM) as s:
+                    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                    s.bind((host, port + offset))
+            except OSError:
+                port += offset + 1
+                break
+        else:
+            return port
+
+    raise VPCSError("Could not find {} contiguous free UDP ports between {} and {} on host {}".format(count,
+                                                                                                    start_port,
+                                                                                                    end_port,
+                                                                                                    host))
+
+
+class VPCSGroup(object):
+    """
+    Shared VPCS process hosting several VPCS devices.
+
+    :param group_id: group identifier
+    :param size: maximum number of PCs in this group
+    :param path: path to VPCS executable
+    :param working_dir: path to the module working directory
+    :param host: host address for the UDP ports
+    :param console_host: IP address to bind for console connections
+    :param udp_base: first port of the UDP block reserved for this group
+    :param console_start_port_range: TCP console port range start
+    :param console_end_port_range: TCP console port range end
+    :param allocated_console_ports: console ports already allocated (shared list)
+    """
+
+    def __init__(self,
+                 group_id,
+                 size,
+                 path,
+                 working_dir,
+                 host,
+                 console_host,
+                 udp_base,
+                 console_start_port_range,
+                 console_end_port_range,
+                 allocated_console_ports):
+
+        self._id = group_id
+        self._size = size
+        self._path = path
+        self._host = host
+        self._console_host = console_host
+        self._udp_base = udp_base
+        self._console_start_port_range = console_start_port_range
+        self._console_end_port_range = console_end_port_range
+        self._allocated_console_ports = allocated_console_ports
+        self._console = None
+        self._process = None
+        self._multiplexer = None
+        self._vpcs_stdout_file = ""
+        self._members = {}  # slot -> VPCSDevice
+        self._running_slots = set()
+        self._working_dir = None
+        self.working_dir = os.path.join(working_dir, "vpcs", "group-{}".format(self._id))
+
+    @staticmethod
+    def locate(vpcs_id, size, worker_index=0, worker_count=1):
+        """
+        Returns the group ID and slot for a VPCS device ID.
+
+        :param vpcs_id: VPCS device identifier
+        :param size: number of PCs per group
+        :param worker_index: index of the worker owning the device (sharded module)
+        :param worker_count: number of workers
+
+        :returns: tuple (group ID, slot)
+        """
+
+        # position of the device among the IDs owned by the worker
+        index = (vpcs_id - 1) // worker_count
+        return (index // size) * worker_count + worker_index, index % size + 1
+
+    @property
+    def id(self):
+        """
+        Returns the group identifier.
+
+        :returns: group ID (integer)
+        """
+
+        return self._id
+
+    @property
+    def console(self):
+        """
+        Returns the internal console port of the VPCS process.
+
+        :returns: console port (integer)
+        """
+
+        return self._console
+
+    @property
+    def udp_ports(self):
+        """
+        Returns the UDP ports reserved for this group.
+
+        :returns: list of UDP ports
+        """
+
+        return list(range(self._udp_base, self._udp_base + self._size))
+
+    @property
+    def path(self):
+        """
+        Returns the path to the VPCS executable.
+
+        :returns: path to VPCS
+        """
+
+        return self._path
+
+    @path.setter
+    def path(self, path):
+        """
+        Sets the path to the VPCS executable.
+
+        :param path: path to VPCS
+        """
+
+        self._path = path
+
+    @property
+    def working_dir(self):
+        """
+        Returns the working directory of the shared VPCS process.
+
+        :returns: path to the working directory
+        """
+
+        return self._working_dir
+
+    @working_dir.setter
+    def working_dir(self, working_dir):
+        """
+        Sets the working directory of the shared VPCS process.
+
+        :param working_dir: path to the working directory
+        """
+
+        try:
+            os.makedirs(working_dir)
+        except FileExistsError:
+            pass
+        except OSError as e:
+            raise VPCSError("Could not create working directory {}: {}".format(working_dir, e))
+        self._working_dir = working_dir
+
+    def udp_port(self, slot):
+        """
+        Returns the local UDP port of a PC slot.
+
+        :param slot: PC slot number
+
+        :returns: UDP port
+        """
+
+        return self._udp_base + slot - 1
+
+    def add_member(self, vpcs_device, slot):
+        """
+        Adds a VPCS device to this group.
+
+        :param vpcs_device: VPCSDevice instance
+        :param slot: PC slot number
+        """
+
+        if slot in self._members:
+            raise VPCSError("PC slot {} of VPCS group {} is already used".format(slot, self._id))
+        self._members[slot] = vpcs_device
+
+    def remove_member(self, slot):
+        """
+        Removes a VPCS device from this group.
+
+        :param slot: PC slot number
+        """
+
+        self.stop_member(slot)
+        self._members.pop(slot, None)
+
+    def is_empty(self):
+        """
+        Returns either this group has members or not.
+
+        :returns: boolean
+        """
+
+        return not self._members
+
+    def is_member_running(self, slot):
+        """
+        Checks if a PC of this group is running.
+
+        :param slot: PC slot number
+
+        :returns: True or False
+        """
+
+        return slot in self._running_slots and self.is_running()
+
+    def is_running(self):
+        """
+        Checks if the shared VPCS process is running.
+
+        :returns: True or False
+        """
+
+        if self._process and self._process.poll() is None:
+            return True
+        return False
+
+    def pids(self):
+        """
+        Returns the PIDs of the running processes of this group.
+
+        :returns: list of PIDs
+        """
+
+        if self.is_running():
+            return [self._process.pid]
+        return []
+
+    def _slot_commands(self, slot):
+        """
+        Returns the VPCS commands to configure a PC slot.
+
+        :param slot: PC slot number
+
+        :returns: list of command lines
+        """
+
+        vpcs_device = self._members[slot]
+        nio = vpcs_device.nio
+        commands = ["set pcname {}".format(vpcs_device.name),
+                    "set rport {}".format(nio.rport),
+                    "set rhost {}".format(nio.rhost)]
+
+        if vpcs_device.script_file:
+            script_path = os.path.join(vpcs_device.working_dir, vpcs_device.script_file)
+            try:
+                with open(script_path, "r", errors="replace") as f:
+                    for line in f.read().splitlines():
+                        line = line.strip()
+                        # do not let the script switch to another PC
+                        if line and not line.startswith("#") and not line.isdigit():
+                            commands.append(line)
+            except OSError as e:
+                raise VPCSError("Could not read the script file {}: {}".format(script_path, e))
+        return commands
+
+    def _write_startup_script(self, slots):
+        """
+        Writes the startup script of the shared VPCS process.
+
+        :param slots: PC slots to configure
+
+        :returns: path to the startup script
+        """
+
+        script_path = os.path.join(self._working_dir, "startup.vpc")
+        lines = []
+        for slot in sorted(slots):
+            lines.append(str(slot))
+            lines.extend(self._slot_commands(slot))
+        if slots:
+            lines.append(str(min(slots)))
+        try:
+            with open(script_path, "w") as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError as e:
+            raise VPCSError("Could not write the startup script {}: {}".format(script_path, e))
+        return script_path
+
+    def build_command(self):
+        """
+        Command to start the shared VPCS process.
+        (to be passed to subprocess.Popen())
+
+        :returns: VPCS command line (list)
+        """
+
+        command = [self._path]
+        command.extend(["-p", str(self._console)])  # listen to the internal console port
+        command.extend(["-s", str(self._udp_base)])  # UDP base port, one port per PC
+        command.extend(["-m", str(self._id * self._size + 1)])  # MAC offset of the first PC
+        command.extend(["-i", str(self._size)])  # number of PCs
+        command.extend(["-F"])  # option to avoid the daemonization of VPCS
+        command.extend(["startup.vpc"])
+        return command
+
+    def start_member(self, slot):
+        """
+        Starts a PC of this group, starting the shared process if needed.
+
+        :param slot: PC slot number
+        """
+
+        vpcs_device = self._members[slot]
+        if not self.is_running():
+            if self._process:
+                log.warning("VPCS group {} process has exited with code {}".format(self._id, self._process.returncode))
+            # release what is left from a process that has exited (console port, slots, multiplexer)
+            self.stop()
+            self._start_process([slot])
+        elif slot not in self._running_slots:
+            self._multiplexer.send(slot, self._slot_commands(slot))
+
+        if slot not in self._running_slots:
+            self._multiplexer.add_slot(slot, self._console_host, vpcs_device.console)
+            self._running_slots.add(slot)
+        log.info("VPCS {} started in PC slot {} of group {} PID={}".format(vpcs_device.name,
+                                                                         slot,
+                                                                         self._id,
+                                                                         self._process.pid))
+
+    def _start_process(self, slots):
+        """
+        Starts the shared VPCS process.
+
+        :param slots: PC slots to configure at startup
+        """
+
+        try:
+            self._console = find_unused_port(self._console_start_port_range,
+                                             self._console_end_port_range,
+                                             self._console_host,
+                                             ignore_ports=self._allocated_console_ports)
+        except Exception as e:
+            raise VPCSError(e)
+        self._allocated_console_ports.append(self._console)
+
+        self._write_startup_script(slots)
+        command = self.build_command()
+        try:
+            log.info("starting shared VPCS process: {}".format(command))
+            self._vpcs_stdout_file = os.path.join(self._working_dir, "vpcs.log")
+            flags = 0
+            if sys.platform.startswith("win32"):
+                flags = subprocess.CREATE_NEW_PROCESS_GROUP
+            with open(self._vpcs_stdout_file, "w") as fd:
+                self._process = subprocess.Popen(command,
+                                                 stdout=fd,
+                                                 stderr=subprocess.STDOUT,
+                                                 cwd=self._working_dir,
+                                                 creationflags=flags)
+        except (OSError, subprocess.SubprocessError) as e:
+            raise VPCSError("could not start VPCS {}: {}".format(self._path, e))
+
+        ready, last_exception = wait_socket_is_ready(self._console_host, self._console, wait=5.0)
+        if not ready:
+            self.stop()
+            raise VPCSError("VPCS group {} console is not reachable: {}".format(self._id, last_exception))
+
+        self._multiplexer = ConsoleMultiplexer("VPCS group {}".format(self._id), self._console_host, self._console)
+        try:
+            self._multiplexer.connect()
+        except OSError as e:
+            self.stop()
+            raise VPCSError("Could not connect to the VPCS group {} console: {}".format(self._id, e))
+        self._multiplexer.start()
+        log.info("VPCS group {} started PID={}".format(self._id, self._process.pid))
+
+    def stop_member(self, slot):
+        """
+        Stops a PC of this group, stopping the shared process
+        if no other PC is running.
+
+        :param slot: PC slot number
+        """
+
+        if slot not in self._running_slots:
+            return
+
+        self._running_slots.discard(slot)
+        if not self._running_slots:
+            self.stop()
+        elif self.is_running():
+            self._multiplexer.remove_slot(slot)
+            # VPCS cannot stop a single PC, unconfigure it instead
+            self._multiplexer.send(slot, ["clear ip", "clear ipv6"])
+        log.info("PC slot {} of VPCS group {} has been stopped".format(slot, self._id))
+
+    def update_member_nio(self, slot):
+        """
+        Pushes the NIO settings of a running PC.
+
+        :param slot: PC slot number
+        """
+
+        if self.is_member_running(slot):
+            nio = self._members[slot].nio
+            self._multiplexer.send(slot, ["set rport {}".format(nio.rport),
+                                          "set rhost {}".format(nio.rhost)])
+
+    def stop(self):
+        """
+        Stops the shared VPCS process.
+        """
+
+        if self._multiplexer:
+            self._multiplexer.stop()
+            self._multiplexer = None
+
+        if self.is_running():
+            log.info("stopping VPCS group {} PID={}".format(self._id, self._process.pid))
+            if sys.platform.startswith("win32"):
+                self._process.send_signal(signal.CTRL_BREAK_EVENT)
+            else:
+                self._process.terminate()
+            self._process.wait()
+
+        if self._console in self._allocated_console_ports:
+            self._allocated_console_ports.remove(self._console)
+        self._console = None
+        self._process = None
+        self._running_slots.clear()
@@ -0,0 +1,498 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Project archives (zip files) streamed without temporary files.
+
+The files are cut in chunks compressed by several threads, each chunk is an
+independent raw deflate stream ending with a full flush so the chunks can
+simply be concatenated (like pigz does). The sizes and CRC are written in data
+descriptors after the compressed data. The holes of sparse files (disk images)
+are not read: they are represented by compressed zero chunks computed once and
+their CRC is computed with crc32_combine.
+"""
+
+import io
+import os
+import stat
+import time
+import errno
+import struct
+import shutil
+import zipfile
+import zlib
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import logging
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+ZIP64_LIMIT = 0xFFFFFFFF
+
+# end of the deflate stream: empty final block
+DEFLATE_END = b"\x03\x00"
+
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+DATA_DESCRIPTOR = struct.Struct("<4s3L")
+DATA_DESCRIPTOR64 = struct.Struct("<4sL2Q")
+CENTRAL_DIRECTORY = struct.Struct("<4s4B4H3L5H2L")
+END_OF_CENTRAL_DIRECTORY = struct.Struct("<4s4H2LH")
+END_OF_CENTRAL_DIRECTORY64 = struct.Struct("<4sQ2H2L4Q")
+END_OF_CENTRAL_DIRECTORY64_LOCATOR = struct.Struct("<4sLQL")
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+
+# CRC-32 of concatenated data (port of zlib's crc32_combine): appending n zero
+# bits to a CRC register is a linear operator, the operators for 2^k zero bytes
+# are computed once.
+
+def _gf2_times(matrix, vector):
+
+    result = 0
+    index = 0
+    while vector:
+        if vector & 1:
+            result ^= matrix[index]
+        vector >>= 1
+        index += 1
+    return result
+
+
+def _gf2_square(matrix):
+
+    return [_gf2_times(matrix, matrix[n]) for n in range(32)]
+
+
+def _zero_operators():
+
+    operator = [0xEDB88320] + [1 << n for n in range(31)]  # one zero bit
+    for _ in range(3):
+        operator = _gf2_square(operator)  # one zero byte
+    operators = [operator]
+    for _ in range(63):
+        operators.append(_gf2_square(operators[-1]))
+    return operators
+
+_ZERO_OPERATORS = _zero_operators()
+
+
+def _crc32_shift(crc, length):
+
+    bit = 0
+    while length:
+        if length & 1:
+            crc = _gf2_times(_ZERO_OPERATORS[bit], crc)
+        length >>= 1
+        bit += 1
+    return crc
+
+
+def crc32_combine(crc1, crc2, length2):
+    """
+    Computes the CRC-32 of the concatenation of two blocks.
+
+    :param crc1: CRC-32 of the first block
+    :param crc2: CRC-32 of the second block
+    :param length2: length of the second block
+
+    :returns: CRC-32
+    """
+
+    return _crc32_shift(crc1, length2) ^ crc2
+
+
+def crc32_zeros(crc, length):
+    """
+    Computes the CRC-32 of a block followed by zero bytes.
+
+    :param crc: CRC-32 of the block
+    :param length: number of zero bytes
+
+    :returns: CRC-32
+    """
+
+    return _crc32_shift(crc ^ 0xFFFFFFFF, length) ^ 0xFFFFFFFF
+
+
+def file_regions(fd, size):
+    """
+    Finds the data regions and holes of a file.
+
+    :param fd: file descriptor
+    :param size: file size
+
+    :returns: generator of tuples (data, offset, length), data is False for holes
+    """
+
+    if not hasattr(os, "SEEK_DATA"):
+        yield True, 0, size
+        return
+    offset = 0
+    while offset < size:
+        try:
+            data = os.lseek(fd, offset, os.SEEK_DATA)
+            hole = os.lseek(fd, data, os.SEEK_HOLE)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # no data after offset
+                yield False, offset, size - offset
+            else:
+                # holes are not supported by the filesystem
+                yield True, offset, size - offset
+            return
+        data = min(data, size)
+        hole = min(hole, size)
+        if data > offset:
+            yield False, offset, data - offset
+        if hole > data:
+            yield True, data, hole - data
+        offset = max(hole, data)
+
+
+def _compress(data, level):
+    """
+    Compresses a chunk as an independent raw deflate stream.
+
+    :returns: compressed data
+    """
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FULL_FLUSH)
+
+
+def _compress_chunk(fd, offset, length, level):
+    """
+    Reads and compresses a chunk of a file (runs in a worker thread).
+
+    :returns: tuple (compressed data, CRC-32, length)
+    """
+
+    data = os.pread(fd, length, offset)
+    return _compress(data, level), zlib.crc32(data), len(data)
+
+
+def _dos_time(timestamp):
+
+    t = time.localtime(timestamp)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+class _Entry(object):
+
+    def __init__(self, name, st):
+
+        self.name = name.encode("utf-8")
+        self.is_dir = stat.S_ISDIR(st.st_mode)
+        self.mode = st.st_mode
+        self.time, self.date = _dos_time(st.st_mtime)
+        self.zip64 = not self.is_dir and st.st_size >= ZIP64_LIMIT // 2
+        self.offset = 0
+        self.crc = 0
+        self.size = 0
+        self.compressed_size = 0
+        self.fd = None
+
+
+class ProjectArchiveWriter(object):
+    """
+    Generates a zip archive of a project directory.
+
+    :param project_dir: project directory
+    :param workers: number of compression threads
+    :param chunk_size: size of the chunks compressed in parallel
+    :param level: compression level
+    :param exclude: names of the project subdirectories not archived
+    """
+
+    def __init__(self, project_dir, workers=None, chunk_size=CHUNK_SIZE, level=6, exclude=()):
+
+        self._project_dir = project_dir
+        self._exclude = exclude
+        self._workers = workers or os.cpu_count() or 1
+        self._chunk_size = chunk_size
+        self._level = level
+        self._entries = []
+        self._offset = 0
+        self._zero_chunk = None
+
+    def __iter__(self):
+
+        executor = ThreadPoolExecutor(max_workers=self._workers)
+        pending = collections.deque()
+        try:
+            # the chunks are compressed ahead, up to a few per worker
+            window = self._workers * 4
+            for item in self._plan(executor):
+                pending.append(item)
+                while len(pending) > window:
+                    yield from self._emit(*pending.popleft())
+            while pending:
+                yield from self._emit(*pending.popleft())
+        finally:
+            # the chunks not compressed yet are dropped (e.g. the client
+            # has disconnected), the files are closed once no worker reads them
+            for kind, entry, value in pending:
+                if kind == "data":
+                    value.cancel()
+            executor.shutdown(wait=True)
+            for entry in self._entries:
+                if entry.fd is not None:
+                    os.close(entry.fd)
+                    entry.fd = None
+        yield self._central_directory()
+
+    def _walk(self):
+        """
+        Lists the directories and regular files of the project.
+
+        :returns: generator of tuples (archive name, path)
+        """
+
+        for root, dirs, files in os.walk(self._project_dir):
+            if root == self._project_dir:
+                dirs[:] = [name for name in dirs if name not in self._exclude]
+            dirs.sort()
+            relative = os.path.relpath(root, self._project_dir)
+            prefix = "" if relative == "." else relative.replace(os.sep, "/") + "/"
+            if prefix:
+                yield prefix, root
+            for name in sorted(files):
+                yield prefix + name, os.path.join(root, name)
+
+    def _plan(self, executor):
+        """
+        Submits the compression of the chunks.
+
+        :returns: generator of items emitted in order
+        """
+
+        for name, path in self._walk():
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            if not stat.S_ISDIR(st.st_mode) and not stat.S_ISREG(st.st_mode):
+                continue
+            entry = _Entry(name, st)
+            self._entries.append(entry)
+            yield "header", entry, None
+            if entry.is_dir:
+                continue
+            try:
+                entry.fd = os.open(path, os.O_RDONLY)
+            except OSError as e:
+                log.warning("cannot read {}: {}".format(path, e))
+                yield "end", entry, None
+                continue
+            for data, offset, length in file_regions(entry.fd, st.st_size):
+                if not data:
+                    yield "hole", entry, length
+                    continue
+                end = offset + length
+                while offset < end:
+                    size = min(self._chunk_size, end - offset)
+                    yield "data", entry, executor.submit(_compress_chunk, entry.fd, offset, size, self._level)
+                    offset += size
+            yield "end", entry, None
+
+    def _emit(self, kind, entry, value):
+        """
+        Generates the bytes of an item.
+        """
+
+        if kind == "header":
+            entry.offset = self._offset
+            yield self._write(self._local_header(entry))
+        elif kind == "data":
+            compressed, crc, length = value.result()
+            entry.crc = crc32_combine(entry.crc, crc, length)
+            entry.size += length
+            entry.compressed_size += len(compressed)
+            yield self._write(compressed)
+        elif kind == "hole":
+            entry.crc = crc32_zeros(entry.crc, value)
+            entry.size += value
+            if self._zero_chunk is None:
+                self._zero_chunk = _compress(bytes(self._chunk_size), self._level)
+            full_chunks, remainder = divmod(value, self._chunk_size)
+            for _ in range(full_chunks):
+                entry.compressed_size += len(self._zero_chunk)
+                yield self._write(self._zero_chunk)
+            if remainder:
+                compressed = _compress(bytes(remainder), self._level)
+                entry.compressed_size += len(compressed)
+                yield self._write(compressed)
+        elif kind == "end":
+            if entry.fd is not None:
+                os.close(entry.fd)
+                entry.fd = None
+            entry.compressed_size += len(DEFLATE_END)
+            if entry.zip64:
+                descriptor = DATA_DESCRIPTOR64.pack(b"PK\x07\x08", entry.crc, entry.compressed_size, entry.size)
+            else:
+                descriptor = DATA_DESCRIPTOR.pack(b"PK\x07\x08", entry.crc, entry.compressed_size, entry.size)
+            yield self._write(DEFLATE_END + descriptor)
+
+    def _write(self, data):
+
+        self._offset += len(data)
+        return data
+
+    def _local_header(self, entry):
+
+        if entry.is_dir:
+            return LOCAL_HEADER.pack(b"PK\x03\x04", 20, FLAG_UTF8, zipfile.ZIP_STORED, entry.time, entry.date,
+                                     0, 0, 0, len(entry.name), 0) + entry.name
+        extra = b""
+        sizes = 0
+        version = 20
+        if entry.zip64:
+            extra = struct.pack("<2H2Q", 1, 16, 0, 0)
+            sizes = ZIP64_LIMIT
+            version = 45
+        return LOCAL_HEADER.pack(b"PK\x03\x04", version, FLAG_UTF8 | FLAG_DATA_DESCRIPTOR, zipfile.ZIP_DEFLATED,
+                                 entry.time, entry.date, 0, sizes, sizes, len(entry.name), len(extra)) + entry.name + extra
+
+    def _central_directory(self):
+
+        start = self._offset
+        records = []
+        for entry in self._entries:
+            zip64_fields = []
+            size, compressed_size, offset = entry.size, entry.compressed_size, entry.offset
+            if size >= ZIP64_LIMIT:
+                zip64_fields.append(size)
+                size = ZIP64_LIMIT
+            if compressed_size >= ZIP64_LIMIT:
+                zip64_fields.append(compressed_size)
+                compressed_size = ZIP64_LIMIT
+            if offset >= ZIP64_LIMIT:
+                zip64_fields.append(offset)
+                offset = ZIP64_LIMIT
+            extra = b""
+            if zip64_fields:
+                extra = struct.pack("<2H{}Q".format(len(zip64_fields)), 1, 8 * len(zip64_fields), *zip64_fields)
+            version = 45 if zip64_fields or entry.zip64 else 20
+            if entry.is_dir:
+                flags, method = FLAG_UTF8, zipfile.ZIP_STORED
+                external_attr = ((entry.mode & 0xFFFF) << 16) | 0x10
+            else:
+                flags, method = FLAG_UTF8 | FLAG_DATA_DESCRIPTOR, zipfile.ZIP_DEFLATED
+                external_attr = (entry.mode & 0xFFFF) << 16
+            records.append(CENTRAL_DIRECTORY.pack(b"PK\x01\x02", version, 3, version, 0, flags, method,
+                                                  entry.time, entry.date, entry.crc, compressed_size, size,
+                                                  len(entry.name), len(extra), 0, 0, 0, external_attr, offset))
+            records.append(entry.name + extra)
+
+        directory = b"".join(records)
+        count = len(self._entries)
+        end = []
+        if count >= 0xFFFF or start >= ZIP64_LIMIT or len(directory) >= ZIP64_LIMIT:
+            zip64_end_offset = start + len(directory)
+            end.append(END_OF_CENTRAL_DIRECTORY64.pack(b"PK\x06\x06", END_OF_CENTRAL_DIRECTORY64.size - 12, 45, 45,
+                                                       0, 0, count, count, len(directory), start))
+            end.append(END_OF_CENTRAL_DIRECTORY64_LOCATOR.pack(b"PK\x06\x07", 0, zip64_end_offset, 1))
+        end.append(END_OF_CENTRAL_DIRECTORY.pack(b"PK\x05\x06", 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                                                 min(len(directory), ZIP64_LIMIT), min(start, ZIP64_LIMIT), 0))
+        return self._write(directory + b"".join(end))
+
+
+def _member_path(destination, name):
+    """
+    Returns the path of an archive member, refuses the names going
+    outside the destination directory.
+    """
+
+    path = os.path.normpath(os.path.join(destination, *name.split("/")))
+    if os.path.isabs(name) or os.path.commonprefix([destination + os.sep, path + os.sep]) != destination + os.sep:
+        raise ValueError("invalid file name in the archive: {}".format(name))
+    return path
+
+
+def _extract_member(data, info, path, chunk_size, local):
+    """
+    Extracts a file (runs in a worker thread), the zero chunks
+    are skipped so the disk images are sparse again.
+    """
+
+    archive = getattr(local, "archive", None)
+    if archive is None:
+        archive = local.archive = zipfile.ZipFile(io.BytesIO(data))
+    zero = bytes(chunk_size)
+    with archive.open(info) as source, open(path, "wb") as destination:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            if chunk == zero[:len(chunk)]:
+                destination.seek(len(chunk), os.SEEK_CUR)
+            else:
+                destination.write(chunk)
+        destination.truncate(info.file_size)
+    mode = (info.external_attr >> 16) & 0o777
+    if mode:
+        os.chmod(path, mode)
+
+
+def extract_archive(data, destination, workers=None, chunk_size=CHUNK_SIZE):
+    """
+    Extracts a project archive, the files are extracted in parallel in a
+    temporary directory renamed to the destination once complete.
+
+    :param data: zip archive (bytes)
+    :param destination: project directory (must not exist)
+    :param workers: number of threads
+    :param chunk_size: size of the chunks checked for zeros
+
+    :returns: number of files extracted
+    """
+
+    destination = os.path.abspath(destination)
+    if os.path.exists(destination):
+        raise FileExistsError(errno.EEXIST, "{} already exists".format(destination))
+
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    temporary = "{}.import-{}".format(destination, os.getpid())
+    os.makedirs(temporary)
+    try:
+        files = []
+        for info in archive.infolist():
+            path = _member_path(temporary, info.filename)
+            if info.filename.endswith("/"):
+                os.makedirs(path, exist_ok=True)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                files.append((info, path))
+
+        # biggest files first
+        files.sort(key=lambda item: item[0].file_size, reverse=True)
+        local = threading.local()
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+            futures = [executor.submit(_extract_member, data, info, path, chunk_size, local) for info, path in files]
+            for future in futures:
+                future.result()
+        os.rename(temporary, destination)
+    except:
+        shutil.rmtree(temporary, ignore_errors=True)
+        raise
+    return len(files)
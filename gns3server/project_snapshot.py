@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Project snapshots (checkpoint & restore of the node files).
+
+The snapshots are stored in the "snapshots" directory of the project, the
+cost of a snapshot doesn't depend on the size of the disk images:
+
+- qcow2 disks (QEMU overlays) get an internal snapshot (qemu-img snapshot).
+- other files are cloned with a reflink (copy-on-write) when the filesystem
+  supports it (btrfs, XFS...), otherwise copied skipping the holes.
+- files unchanged since the previous snapshot are hard links to the
+  previous snapshot copy (the snapshot copies are never modified).
+
+A restore only replaces the files that have changed since the snapshot.
+
+The nodes must be stopped: a running or suspended node keeps its disks and
+NVRAM open and qemu-img would corrupt a qcow2 disk in use (there is no image
+locking), so the snapshots are refused while a process has a file of the
+project open for reading and writing (checked with /proc, Linux only).
+"""
+
+import os
+import sys
+import json
+import time
+import stat
+import errno
+import fcntl
+import shutil
+import subprocess
+
+from .project_archive import file_regions
+
+import logging
+log = logging.getLogger(__name__)
+
+SNAPSHOTS_DIR = "snapshots"
+MANIFEST = "snapshot.json"
+QCOW2_MAGIC = b"QFI\xfb"
+
+# ioctl cloning a file on Linux (btrfs, XFS, OCFS2...)
+FICLONE = 0x40049409
+
+
+class SnapshotError(Exception):
+
+    pass
+
+
+def reflink(source, destination):
+    """
+    Clones a file with a reflink (the data blocks are shared until modified).
+
+    :param source: source path
+    :param destination: destination path
+
+    :returns: True if the file has been cloned, False if not supported
+    """
+
+    if not sys.platform.startswith("linux"):
+        return False
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return True
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EPERM):
+                raise
+    os.remove(destination)
+    return False
+
+
+def sparse_copy(source, destination, chunk_size=1024 * 1024):
+    """
+    Copies a file, the holes are not read nor written.
+
+    :param source: source path
+    :param destination: destination path
+    """
+
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        size = os.fstat(src.fileno()).st_size
+        for data, offset, length in file_regions(src.fileno(), size):
+            if not data:
+                continue
+            dst.seek(offset)
+            end = offset + length
+            while offset < end:
+                chunk = os.pread(src.fileno(), min(chunk_size, end - offset), offset)
+                if not chunk:
+                    break
+                dst.write(chunk)
+                offset += len(chunk)
+        dst.truncate(size)
+
+
+def clone_file(source, destination):
+    """
+    Clones a file with a reflink or copies it.
+
+    :returns: method used ("reflink" or "copy")
+    """
+
+    if reflink(source, destination):
+        return "reflink"
+    sparse_copy(source, destination)
+    return "copy"
+
+
+def is_qcow2(path):
+    """
+    Checks if a file is a qcow2 disk image.
+    """
+
+    try:
+        with open(path, "rb") as f:
+            return f.read(4) == QCOW2_MAGIC
+    except OSError:
+        return False
+
+
+def files_in_use(directory):
+    """
+    Lists the files of a directory other processes have open
+    for reading and writing (e.g. disks and NVRAM of running nodes).
+
+    :param directory: directory path
+
+    :returns: list of paths or None if it cannot be checked (no /proc)
+    """
+
+    if not os.path.isdir("/proc/self/fdinfo"):
+        return None
+
+    directory = os.path.join(os.path.realpath(directory), "")
+    in_use = []
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit() or int(pid) == os.getpid():
+            continue
+        fd_dir = os.path.join("/proc", pid, "fd")
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            # process that has exited or belongs to another user
+            continue
+        for fd in fds:
+            try:
+                path = os.readlink(os.path.join(fd_dir, fd))
+                if not path.startswith(directory):
+                    continue
+                with open(os.path.join("/proc", pid, "fdinfo", fd)) as f:
+                    flags = int(f.read().split("flags:", 1)[1].split()[0], 8)
+            except (OSError, IndexError, ValueError):
+                continue
+            # log files are only open for writing
+            if flags & os.O_ACCMODE == os.O_RDWR:
+                in_use.append(path)
+    return in_use
+
+
+def _check_name(name):
+
+    if not name or name in (".", "..") or "/" in name or "\\" in name:
+        raise SnapshotError("invalid snapshot name {}".format(name))
+
+
+class ProjectSnapshots(object):
+    """
+    Snapshots of a project directory.
+
+    :param project_dir: project directory
+    :param qemu_img: path to qemu-img (None to clone the qcow2 disks like the other files)
+    """
+
+    def __init__(self, project_dir, qemu_img=None):
+
+        self._project_dir = project_dir
+        self._snapshots_dir = os.path.join(project_dir, SNAPSHOTS_DIR)
+        self._qemu_img = qemu_img
+
+    def _qcow2_tag(self, name):
+
+        return "gns3-{}".format(name)
+
+    def _qemu_img_snapshot(self, option, tag, path):
+        """
+        Runs qemu-img snapshot.
+
+        :returns: True if successful
+        """
+
+        try:
+            output = subprocess.check_output([self._qemu_img, "snapshot", option, tag, path], stderr=subprocess.STDOUT)
+        except (OSError, subprocess.CalledProcessError) as e:
+            output = getattr(e, "output", None)
+            log.warning("qemu-img snapshot {} {} {} failed: {}".format(option, tag, path, output.decode("utf-8", "replace").strip() if output else e))
+            return False
+        return True
+
+    def _walk(self):
+        """
+        Lists the directories and regular files of the project (except the snapshots).
+
+        :returns: generator of tuples (relative path, stat result)
+        """
+
+        for root, dirs, files in os.walk(self._project_dir):
+            if root == self._project_dir and SNAPSHOTS_DIR in dirs:
+                dirs.remove(SNAPSHOTS_DIR)
+            dirs.sort()
+            for name in dirs + sorted(files):
+                path = os.path.join(root, name)
+                try:
+                    st = os.lstat(path)
+                except OSError:
+                    continue
+                if stat.S_ISDIR(st.st_mode) or stat.S_ISREG(st.st_mode):
+                    yield os.path.relpath(path, self._project_dir), st
+
+    def _check_stopped(self):
+        """
+        Checks that no node uses the files of the project.
+        """
+
+        in_use = files_in_use(self._project_dir)
+        if in_use is None:
+            raise SnapshotError("cannot check that the nodes are stopped on this platform")
+        if in_use:
+            raise SnapshotError("the nodes must be stopped, files in use: {}".format(", ".join(sorted(set(in_use)))))
+
+    def _load(self, name):
+
+        try:
+            with open(os.path.join(self._snapshots_dir, name, MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise SnapshotError("snapshot {} doesn't exist".format(name))
+
+    def list(self):
+        """
+        Lists the snapshots.
+
+        :returns: list of dictionaries (name, created), oldest first
+        """
+
+        snapshots = []
+        if os.path.isdir(self._snapshots_dir):
+            for name in os.listdir(self._snapshots_dir):
+                try:
+                    manifest = self._load(name)
+                except SnapshotError:
+                    continue
+                snapshots.append({"name": name, "created": manifest["created"]})
+        return sorted(snapshots, key=lambda snapshot: snapshot["created"])
+
+    def create(self, name):
+        """
+        Creates a snapshot.
+
+        :param name: snapshot name
+
+        :returns: dictionary with the number of files per method
+        """
+
+        _check_name(name)
+        snapshot_dir = os.path.join(self._snapshots_dir, name)
+        if os.path.exists(snapshot_dir):
+            raise SnapshotError("snapshot {} already exists".format(name))
+        self._check_stopped()
+
+        # unchanged files are hard links to the copies of the last snapshot
+        previous = None
+        snapshots = self.list()
+        if snapshots:
+            previous_name = snapshots[-1]["name"]
+            previous = (os.path.join(self._snapshots_dir, previous_name), self._load(previous_name)["files"])
+
+        temporary_dir = os.path.join(self._snapshots_dir, ".{}.tmp".format(name))
+        shutil.rmtree(temporary_dir, ignore_errors=True)
+        os.makedirs(temporary_dir)
+        manifest = {"name": name, "created": time.time(), "directories": [], "files": {}}
+        tag = self._qcow2_tag(name)
+        try:
+            for relative_path, st in self._walk():
+                path = os.path.join(self._project_dir, relative_path)
+                destination = os.path.join(temporary_dir, relative_path)
+                if stat.S_ISDIR(st.st_mode):
+                    manifest["directories"].append(relative_path)
+                    os.makedirs(destination, exist_ok=True)
+                    continue
+                entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "mode": stat.S_IMODE(st.st_mode)}
+                if self._qemu_img and is_qcow2(path) and self._qemu_img_snapshot("-c", tag, path):
+                    entry["method"] = "qcow2"
+                else:
+                    previous_entry = previous[1].get(relative_path) if previous else None
+                    previous_copy = os.path.join(previous[0], relative_path) if previous else None
+                    if previous_entry and previous_entry["method"] != "qcow2" and \
+                            previous_entry["size"] == st.st_size and previous_entry["mtime_ns"] == st.st_mtime_ns and \
+                            os.path.isfile(previous_copy):
+                        os.link(previous_copy, destination)
+                        entry["method"] = "hardlink"
+                    else:
+                        entry["method"] = clone_file(path, destination)
+                        os.utime(destination, ns=(st.st_atime_ns, st.st_mtime_ns))
+                manifest["files"][relative_path] = entry
+
+            with open(os.path.join(temporary_dir, MANIFEST), "w") as f:
+                json.dump(manifest, f)
+            os.rename(temporary_dir, snapshot_dir)
+        except:
+            for relative_path, entry in manifest["files"].items():
+                if entry["method"] == "qcow2":
+                    self._qemu_img_snapshot("-d", tag, os.path.join(self._project_dir, relative_path))
+            shutil.rmtree(temporary_dir, ignore_errors=True)
+            raise
+
+        stats = self._stats(manifest)
+        log.info("snapshot {} of {} created: {}".format(name, self._project_dir, stats))
+        return stats
+
+    def restore(self, name):
+        """
+        Restores a snapshot, the files changed since the snapshot
+        are replaced and the files created since are deleted.
+
+        :param name: snapshot name
+
+        :returns: dictionary with the number of files per method
+        """
+
+        _check_name(name)
+        manifest = self._load(name)
+        self._check_stopped()
+        snapshot_dir = os.path.join(self._snapshots_dir, name)
+        tag = self._qcow2_tag(name)
+        stats = {}
+
+        # delete the files and directories created since the snapshot
+        for relative_path, st in sorted(self._walk(), reverse=True):
+            if relative_path in manifest["files"] or relative_path in manifest["directories"]:
+                continue
+            path = os.path.join(self._project_dir, relative_path)
+            if stat.S_ISDIR(st.st_mode):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+            stats["deleted"] = stats.get("deleted", 0) + 1
+
+        for relative_path in manifest["directories"]:
+            os.makedirs(os.path.join(self._project_dir, relative_path), exist_ok=True)
+
+        for relative_path, entry in manifest["files"].items():
+            path = os.path.join(self._project_dir, relative_path)
+            if entry["method"] == "qcow2":
+                if not self._qemu_img or not self._qemu_img_snapshot("-a", tag, path):
+                    raise SnapshotError("could not restore the snapshot of {}".format(relative_path))
+                method = "qcow2"
+            else:
+                try:
+                    st = os.stat(path)
+                    unchanged = st.st_size == entry["size"] and st.st_mtime_ns == entry["mtime_ns"]
+                except OSError:
+                    unchanged = False
+                if unchanged:
+                    method = "unchanged"
+                else:
+                    # the copy is replaced atomically
+                    temporary_path = "{}.restore".format(path)
+                    method = clone_file(os.path.join(snapshot_dir, relative_path), temporary_path)
+                    os.chmod(temporary_path, entry["mode"])
+                    os.utime(temporary_path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+                    os.replace(temporary_path, path)
+            stats[method] = stats.get(method, 0) + 1
+
+        log.info("snapshot {} of {} restored: {}".format(name, self._project_dir, stats))
+        return stats
+
+    def delete(self, name):
+        """
+        Deletes a snapshot.
+
+        :param name: snapshot name
+        """
+
+        _check_name(name)
+        manifest = self._load(name)
+        if any(entry["method"] == "qcow2" for entry in manifest["files"].values()):
+            # qemu-img deletes the internal snapshots of the qcow2 disks
+            self._check_stopped()
+        tag = self._qcow2_tag(name)
+        for relative_path, entry in manifest["files"].items():
+            path = os.path.join(self._project_dir, relative_path)
+            if entry["method"] == "qcow2" and self._qemu_img and os.path.exists(path):
+                self._qemu_img_snapshot("-d", tag, path)
+        shutil.rmtree(os.path.join(self._snapshots_dir, name))
+        log.info("snapshot {} of {} deleted".format(name, self._project_dir))
+
+    @staticmethod
+    def _stats(manifest):
+
+        stats = {}
+        for entry in manifest["files"].values():
+            stats[entry["method"]] = stats.get(entry["method"], 0) + 1
+        return stats
@@ -36,26 +36,52 @@ import pkg_resources
 import ipaddress
 import base64
 import uuid
+import functools
 
 from pkg_resources import parse_version
 from .config import Config
 from .handlers.jsonrpc_websocket import JSONRPCWebSocket
+from .handlers.jsonrpc_websocket import server_metrics
 from .handlers.version_handler import VersionHandler
+from .handlers.metrics_handler import MetricsHandler
+from .handlers.capture_handler import CaptureStreamHandler
+from .handlers.capture_handler import CaptureWebSocket
 from .handlers.file_upload_handler import FileUploadHandler
+from .handlers.project_handler import ProjectExportHandler
+from .handlers.project_handler import ProjectImportHandler
+from .handlers.project_handler import ProjectSnapshotsHandler
+from .handlers.project_handler import ProjectSnapshotHandler
+from .handlers.project_handler import ProjectSnapshotRestoreHandler
 from .handlers.auth_handler import LoginHandler
 from .builtins.server_version import server_version
 from .builtins.interfaces import interfaces
+from .builtins.stats import stats
+from .builtins.stats import telemetry
 from .modules import MODULES
+from .module_spawner import ModuleSpawner
+from . import envelope
 
 import logging
 log = logging.getLogger(__name__)
 
+MODULE_STARTUP = server_metrics.gauge("gns3_module_startup_seconds",
+                                      "Time between spawning a module process and the process being ready",
+                                      ("module",))
+
 
 class Server(object):
 
     # built-in handlers
     handlers = [(r"/version", VersionHandler),
+                (r"/metrics", MetricsHandler),
+                (r"/capture/stream", CaptureStreamHandler),
+                (r"/capture/websocket", CaptureWebSocket),
                 (r"/upload", FileUploadHandler),
+                (r"/projects/([^/]+)/export", ProjectExportHandler),
+                (r"/projects/([^/]+)/import", ProjectImportHandler),
+                (r"/projects/([^/]+)/snapshots", ProjectSnapshotsHandler),
+                (r"/projects/([^/]+)/snapshots/([^/]+)", ProjectSnapshotHandler),
+                (r"/projects/([^/]+)/snapshots/([^/]+)/restore", ProjectSnapshotRestoreHandler),
                 (r"/login", LoginHandler)]
 
     def __init__(self, host, port, ipc, console_bind_to_any):
@@ -87,11 +113,27 @@ class Server(object):
                 log.critical("server cannot listen to {}: {}".format(self._host, e))
                 raise SystemExit
         self._ipc = ipc
-        self._modules = []
+        self._reap_callback = None
 
         # get the projects and temp directories from the configuration file (passed to the modules)
         config = Config.instance()
         server_config = config.get_default_section()
+        self._spawner = ModuleSpawner(idle_timeout=server_config.getint("module_idle_timeout", fallback=0))
+        JSONRPCWebSocket.module_spawner = self._spawner
+        # messages are queued when a client is slower than the modules (backpressure)
+        JSONRPCWebSocket.high_water_mark = server_config.getint("websocket_high_water_mark", fallback=1024 * 1024)
+        JSONRPCWebSocket.max_queue_size = server_config.getint("websocket_max_queue_size", fallback=16 * 1024 * 1024)
+        # codec of the requests sent to the modules (msgpack if installed and configured)
+        JSONRPCWebSocket.module_codec = envelope.available_codec(server_config.get("module_codec", envelope.JSON))
+        if server_config.get("module_codec", envelope.JSON) != JSONRPCWebSocket.module_codec:
+            log.warning("module codec {} is not available, using {}".format(server_config.get("module_codec"),
+                                                                             JSONRPCWebSocket.module_codec))
+        # permessage-deflate compression of the large messages (when the client supports it)
+        if server_config.getboolean("websocket_compression", fallback=True):
+            JSONRPCWebSocket.compression_level = server_config.getint("websocket_compression_level", fallback=6)
+            JSONRPCWebSocket.compression_threshold = server_config.getint("websocket_compression_threshold", fallback=1024)
+        else:
+            JSONRPCWebSocket.compression_level = None
         # default projects directory is "~/GNS3/projects"
         self._projects_dir = os.path.expandvars(os.path.expanduser(server_config.get("projects_directory", "~/GNS3/projects")))
         self._temp_dir = server_config.get("temporary_directory", tempfile.gettempdir())
@@ -134,21 +176,71 @@ class Server(object):
         JSONRPCWebSocket.register_destination("builtin.version", server_version)
         # special built-in to return the available interfaces on this host
         JSONRPCWebSocket.register_destination("builtin.interfaces", interfaces)
-
+        # special built-in to return the resource usage of nodes and modules
+        JSONRPCWebSocket.register_destination("builtin.stats", stats)
+        JSONRPCWebSocket.register_module_notification("builtin.telemetry", telemetry)
+        # only the latest threshold breach of a node is kept for slow clients
+        JSONRPCWebSocket.register_coalesced_notification("builtin.stats_threshold", ("module", "id", "field"))
+        # only the latest NIO statistics of each worker are kept for slow clients
+        JSONRPCWebSocket.register_coalesced_notification("dynamips.nio_stats", ("worker",))
+        JSONRPCWebSocket.register_module_notification("builtin.metrics", MetricsHandler.update_module_metrics)
+        JSONRPCWebSocket.register_module_notification("builtin.module_ready", self._module_ready)
+
+        server_config = Config.instance().get_default_section()
+        lazy_modules = server_config.getboolean("lazy_modules", fallback=True)
         for module in MODULES:
-            instance = module(module.__name__.lower(),
-                              "127.0.0.1",  # ZeroMQ server address
-                              self._zmq_port,  # ZeroMQ server port
-                              host=self._host,  # server host address
-                              console_host=self._console_host,
-                              projects_dir=self._projects_dir,
-                              temp_dir=self._temp_dir)
-
-            self._modules.append(instance)
-            destinations = instance.destinations()
-            for destination in destinations:
-                JSONRPCWebSocket.register_destination(destination, instance.name)
-            instance.start()  # starts the new process
+            name = module.__name__.lower()
+            workers = 1
+            if module.shardable:
+                # number of worker processes sharing the devices of this module
+                workers = max(1, Config.instance().get_section_config(name.upper()).getint("workers", fallback=1))
+                if workers > 1:
+                    log.info("{} module configured with {} workers".format(name, workers))
+            JSONRPCWebSocket.worker_router.register(name, workers)
+
+            # destinations are registered from the module routes,
+            # the module processes are spawned on the first request
+            for destination in module.modules.get(name, {}):
+                JSONRPCWebSocket.register_destination(destination, name)
+            self._spawner.register(name,
+                                   functools.partial(self._create_module_instances, module, name, workers),
+                                   lazy=lazy_modules and module.lazy)
+
+    def _create_module_instances(self, module, name, workers):
+        """
+        Creates the instances (processes) of a module.
+
+        :param module: module class
+        :param name: module name
+        :param workers: number of worker processes
+
+        :returns: list of module instances
+        """
+
+        instances = []
+        for index in range(workers):
+            instances.append(module(name,
+                                    "127.0.0.1",  # ZeroMQ server address
+                                    self._zmq_port,  # ZeroMQ server port
+                                    host=self._host,  # server host address
+                                    console_host=self._console_host,
+                                    projects_dir=self._projects_dir,
+                                    temp_dir=self._temp_dir,
+                                    worker=(index, workers)))
+        return instances
+
+    def _module_ready(self, handler_class, module, params):
+        """
+        Module notification sent when a module process is ready.
+
+        :param handler_class: JSONRPCWebSocket class
+        :param module: module name (or worker identity)
+        :param params: JSON-RPC notification params
+        """
+
+        self._spawner.module_ready(module)
+        if module in self._spawner.startup_times:
+            MODULE_STARTUP.set(self._spawner.startup_times[module], module)
 
     def run(self):
         """
@@ -185,6 +277,7 @@ class Server(object):
            log.info("Missing cloud.conf - disabling HTTP auth and SSL")
 
         router = self._create_zmq_router()
+        self._spawner.router = router
         # Add our JSON-RPC Websocket handler to Tornado
         self.handlers.extend([(r"/", JSONRPCWebSocket, dict(zmq_router=router))])
         if hasattr(sys, "frozen"):
@@ -219,6 +312,12 @@ class Server(object):
         self._stream.on_recv_stream(JSONRPCWebSocket.dispatch_message)
         tornado.autoreload.add_reload_hook(self._reload_callback)
 
+        # stops the idle modules and forgets the stopped ones
+        self._reap_callback = tornado.ioloop.PeriodicCallback(lambda: self._spawner.reap(bool(JSONRPCWebSocket.clients)),
+                                                              5000,
+                                                              ioloop)
+        self._reap_callback.start()
+
         def signal_handler(signum=None, frame=None):
             try:
                 log.warning("Server got signal {}, exiting...".format(signum))
@@ -274,7 +373,7 @@ class Server(object):
         """
         Stop a given module.
 
-        :param module: module name
+        :param module: module name (or worker identity)
         """
 
         if not self._router.closed:
@@ -286,7 +385,7 @@ class Server(object):
         Callback for the Tornado reload hook.
         """
 
-        for module in self._modules:
+        for module in self._spawner.instances():
             if module.is_alive():
                 module.terminate()
                 module.join(timeout=1)
@@ -317,10 +416,12 @@ class Server(object):
         """
 
         # terminate all modules
-        for module in self._modules:
+        if self._reap_callback:
+            self._reap_callback.stop()
+        for module in self._spawner.instances():
             if module.is_alive() and graceful:
-                log.info("stopping {}".format(module.name))
-                self.stop_module(module.name)
+                log.info("stopping {}".format(module.identity))
+                self.stop_module(module.identity)
                 module.join(timeout=3)
             if module.is_alive():
                 # just kill the module if it is still alive.
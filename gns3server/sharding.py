@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Sharding of a module across several worker processes.
+
+Worker N of a module owns the device identifiers equal to N modulo the
+number of workers and a contiguous slice of each port range, so workers
+never allocate the same identifiers or ports. The server routes requests
+to the worker owning the device given by the "id" parameter, module-wide
+requests (settings, reset) are broadcast to all the workers. The results
+of some broadcast requests are merged into one response (see BROADCAST_MERGES).
+"""
+
+import itertools
+
+# worker running in this process (set by the module process)
+_worker_index = 0
+_worker_count = 1
+
+# requests sent to all the workers of a module
+BROADCAST_SUFFIXES = (".settings", ".reset", ".set_link_impairment", ".nio_stats", ".session_closed")
+
+# create request parameters used to choose a device identifier
+CREATE_ID_PARAMS = ("router_id", "iou_id", "vpcs_id", "qemu_id", "vbox_id")
+
+
+def set_worker(index, count):
+    """
+    Sets the worker running in this process.
+
+    :param index: worker index (0 to count - 1)
+    :param count: number of workers for the module
+    """
+
+    global _worker_index, _worker_count
+    _worker_index = index
+    _worker_count = count
+
+
+def worker_identity(module, index, count):
+    """
+    Returns the ZeroMQ identity of a worker.
+
+    :param module: module name
+    :param index: worker index
+    :param count: number of workers for the module
+
+    :returns: identity string
+    """
+
+    if count == 1:
+        return module
+    return "{}:{}".format(module, index)
+
+
+def module_name(identity):
+    """
+    Returns the module name of a worker identity.
+
+    :param identity: module name or worker identity
+
+    :returns: module name
+    """
+
+    return identity.split(":", 1)[0]
+
+
+def owned_ids(start, end):
+    """
+    Returns the device identifiers in [start, end) this worker can allocate.
+
+    :param start: first identifier
+    :param end: end of the range (excluded)
+
+    :returns: range of identifiers
+    """
+
+    first = start + (_worker_index - start) % _worker_count
+    return range(first, end, _worker_count)
+
+
+def port_range(start_port, end_port):
+    """
+    Returns the slice of a port range this worker can allocate from.
+
+    :param start_port: first port in the range
+    :param end_port: last port in the range
+
+    :returns: tuple (first port, last port)
+    """
+
+    start_port = int(start_port)
+    end_port = int(end_port)
+    size = (end_port - start_port + 1) // _worker_count
+    if _worker_count == 1 or size < 1:
+        return start_port, end_port
+    first = start_port + _worker_index * size
+    if _worker_index == _worker_count - 1:
+        return first, end_port
+    return first, first + size - 1
+
+
+def merge_link_impairments(results):
+    """
+    Merges the results of a set_link_impairment request: the impairment
+    is pending on every worker and only applied by the worker owning the UDP NIO.
+
+    :param results: list of results (one per worker)
+
+    :returns: result of the worker owning the NIO, if any
+    """
+
+    for result in results:
+        if result.get("active"):
+            return result
+    return results[0]
+
+
+def merge_nio_stats(results):
+    """
+    Merges the results of a nio_stats request: each worker
+    returns the statistics of the NIOs of its own nodes.
+
+    :param results: list of results (one per worker)
+
+    :returns: statistics of the NIOs of all the workers
+    """
+
+    timestamps = [result["timestamp"] for result in results if result["timestamp"] is not None]
+    nios = []
+    for result in results:
+        nios.extend(result["nios"])
+    return {"timestamp": max(timestamps) if timestamps else None,
+            "interval": results[0]["interval"],
+            "nios": sorted(nios, key=lambda nio: nio["nio"])}
+
+
+# broadcast requests answered with the results of the workers merged
+BROADCAST_MERGES = {".set_link_impairment": merge_link_impairments,
+                    ".nio_stats": merge_nio_stats}
+
+
+def broadcast_merge(method):
+    """
+    Returns the function merging the results of a broadcast request.
+
+    :param method: JSON-RPC method
+
+    :returns: function taking the list of results or None
+    (the response of the last worker is sent)
+    """
+
+    for suffix, merge in BROADCAST_MERGES.items():
+        if method.endswith(suffix):
+            return merge
+    return None
+
+
+class WorkerRouter(object):
+    """
+    Routes requests to the workers of sharded modules.
+    """
+
+    def __init__(self):
+
+        self._workers = {}
+        self._round_robin = {}
+
+    def register(self, module, count):
+        """
+        Registers the workers of a module.
+
+        :param module: module name
+        :param count: number of workers
+        """
+
+        self._workers[module] = [worker_identity(module, index, count) for index in range(count)]
+        self._round_robin[module] = itertools.cycle(range(count))
+
+    def workers(self, module):
+        """
+        Returns the worker identities of a module.
+
+        :param module: module name
+
+        :returns: list of identities
+        """
+
+        return self._workers.get(module, [module])
+
+    def route(self, module, method, params):
+        """
+        Returns the workers a request must be sent to.
+
+        :param module: module name
+        :param method: JSON-RPC method
+        :param params: JSON-RPC params
+
+        :returns: list of worker identities
+        """
+
+        workers = self.workers(module)
+        count = len(workers)
+        if count == 1:
+            return workers
+        if method.endswith(BROADCAST_SUFFIXES):
+            return workers
+        if isinstance(params, dict):
+            device_id = params.get("id")
+            if isinstance(device_id, int):
+                return [workers[device_id % count]]
+            if method.endswith(".create"):
+                for name in CREATE_ID_PARAMS:
+                    if isinstance(params.get(name), int):
+                        return [workers[params[name] % count]]
+                return [workers[next(self._round_robin[module])]]
+        # other module-wide requests (echo, lists...) are answered by the first worker
+        return workers[:1]
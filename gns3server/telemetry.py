@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Resource telemetry for emulator processes.
+
+Modules sample /proc/<pid>/stat, statm and io for the processes they manage
+(ProcessSampler) and push one sample per node to the server, which keeps
+the history in fixed size ring buffers (TelemetryStore).
+"""
+
+import os
+import time
+import array
+
+import logging
+log = logging.getLogger(__name__)
+
+try:
+    CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+    PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    CLOCK_TICKS = 100
+    PAGE_SIZE = 4096
+
+FIELDS = ("cpu", "rss", "read_rate", "write_rate")
+
+
+def read_process_stats(pid):
+    """
+    Reads the resource counters of a process from /proc.
+
+    :param pid: process identifier
+
+    :returns: tuple (CPU ticks, RSS in bytes, bytes read, bytes written) or None
+    if the process doesn't exist
+    """
+
+    try:
+        with open("/proc/{}/stat".format(pid), "rb") as f:
+            stat = f.read()
+        with open("/proc/{}/statm".format(pid), "rb") as f:
+            statm = f.read()
+    except OSError:
+        return None
+
+    # the process name (2nd field) may contain spaces, skip it
+    fields = stat[stat.rfind(b")") + 2:].split()
+    # utime and stime are the 14th and 15th fields of the file
+    cpu_ticks = int(fields[11]) + int(fields[12])
+    rss = int(statm.split()[1]) * PAGE_SIZE
+
+    read_bytes = write_bytes = 0
+    try:
+        # only readable by the process owner
+        with open("/proc/{}/io".format(pid), "rb") as f:
+            for line in f:
+                if line.startswith(b"read_bytes:"):
+                    read_bytes = int(line.split()[1])
+                elif line.startswith(b"write_bytes:"):
+                    write_bytes = int(line.split()[1])
+    except OSError:
+        pass
+
+    return cpu_ticks, rss, read_bytes, write_bytes
+
+
+class ProcessSampler(object):
+    """
+    Computes CPU usage and I/O rates of processes between two samples.
+    """
+
+    def __init__(self):
+
+        self._previous = {}  # pid -> (timestamp, cpu ticks, bytes read, bytes written)
+
+    def sample(self, nodes):
+        """
+        Samples the processes of the given nodes.
+
+        :param nodes: dictionary node ID -> {"name": name, "pids": [pids]}
+
+        :returns: dictionary node ID -> {"name", "cpu" (percent), "rss" (bytes),
+        "read_rate" and "write_rate" (bytes per second)}
+        """
+
+        now = time.time()
+        previous = self._previous
+        self._previous = {}
+        samples = {}
+        for node_id, node in nodes.items():
+            cpu = rss = read_rate = write_rate = 0.0
+            for pid in node["pids"]:
+                stats = read_process_stats(pid)
+                if stats is None:
+                    continue
+                cpu_ticks, process_rss, read_bytes, write_bytes = stats
+                rss += process_rss
+                self._previous[pid] = (now, cpu_ticks, read_bytes, write_bytes)
+                if pid in previous:
+                    last_time, last_ticks, last_read, last_write = previous[pid]
+                    elapsed = now - last_time
+                    if elapsed > 0:
+                        cpu += (cpu_ticks - last_ticks) * 100.0 / CLOCK_TICKS / elapsed
+                        read_rate += max(read_bytes - last_read, 0) / elapsed
+                        write_rate += max(write_bytes - last_write, 0) / elapsed
+            samples[str(node_id)] = {"name": node["name"],
+                                     "cpu": round(cpu, 2),
+                                     "rss": int(rss),
+                                     "read_rate": int(read_rate),
+                                     "write_rate": int(write_rate)}
+        return samples
+
+
+class RingBuffer(object):
+    """
+    Fixed size circular buffer backed by an array.
+
+    :param capacity: maximum number of values
+    :param typecode: array type code
+    """
+
+    def __init__(self, capacity, typecode="d"):
+
+        self._values = array.array(typecode, [0]) * capacity
+        self._capacity = capacity
+        self._index = 0
+        self._count = 0
+
+    def __len__(self):
+
+        return self._count
+
+    def append(self, value):
+        """
+        Appends a value, overwriting the oldest one when full.
+
+        :param value: value to append
+        """
+
+        self._values[self._index] = value
+        self._index = (self._index + 1) % self._capacity
+        if self._count < self._capacity:
+            self._count += 1
+
+    def last(self):
+        """
+        Returns the most recent value.
+
+        :returns: value or None if empty
+        """
+
+        if not self._count:
+            return None
+        return self._values[self._index - 1]
+
+    def values(self, count=None):
+        """
+        Returns the values from the oldest to the most recent.
+
+        :param count: only return the most recent values (optional)
+
+        :returns: list of values
+        """
+
+        if count is None or count > self._count:
+            count = self._count
+        start = (self._index - count) % self._capacity
+        if start + count <= self._capacity:
+            return self._values[start:start + count].tolist()
+        return self._values[start:].tolist() + self._values[:self._index].tolist()
+
+
+class History(object):
+    """
+    Resource history (timestamps, CPU, RSS and I/O rates).
+
+    :param capacity: number of samples to keep
+    """
+
+    def __init__(self, capacity):
+
+        self.name = ""
+        self._timestamps = RingBuffer(capacity)
+        self._fields = {field: RingBuffer(capacity) for field in FIELDS}
+
+    def append(self, timestamp, sample):
+        """
+        Records a sample.
+
+        :param timestamp: sample time
+        :param sample: dictionary with a value for each field
+        """
+
+        self._timestamps.append(timestamp)
+        for field, buffer in self._fields.items():
+            buffer.append(sample.get(field, 0))
+
+    def last(self, field):
+        """
+        Returns the most recent value of a field.
+
+        :param field: field name
+        """
+
+        return self._fields[field].last()
+
+    def to_json(self, count=None):
+        """
+        Returns the history as a JSON serializable dictionary.
+
+        :param count: only return the most recent samples (optional)
+        """
+
+        history = {"name": self.name, "timestamps": self._timestamps.values(count)}
+        for field, buffer in self._fields.items():
+            history[field] = buffer.values(count)
+        return history
+
+
+class TelemetryStore(object):
+    """
+    Keeps the resource history of each node and module.
+
+    :param capacity: number of samples to keep per node
+    :param cpu_threshold: CPU usage (percent) triggering a notification (0 to disable)
+    :param rss_threshold: resident memory (bytes) triggering a notification (0 to disable)
+    """
+
+    def __init__(self, capacity=120, cpu_threshold=0, rss_threshold=0):
+
+        self._capacity = capacity
+        self._thresholds = {"cpu": cpu_threshold, "rss": rss_threshold}
+        self._modules = {}  # module name -> (module History, {node ID -> History}, {worker -> (total, node IDs)})
+        self._breaches = set()
+
+    def add_samples(self, module, timestamp, samples, worker=None):
+        """
+        Records samples pushed by a module.
+
+        :param module: module name
+        :param timestamp: sample time
+        :param samples: dictionary node ID -> sample
+        :param worker: worker identity if the module is sharded
+        (each worker pushes the samples of its own nodes)
+
+        :returns: list of threshold breaches (dictionaries)
+        """
+
+        if module not in self._modules:
+            self._modules[module] = (History(self._capacity), {}, {})
+        module_history, nodes, workers = self._modules[module]
+
+        total = dict.fromkeys(FIELDS, 0)
+        breaches = []
+        for node_id, sample in samples.items():
+            if node_id not in nodes:
+                nodes[node_id] = History(self._capacity)
+            nodes[node_id].name = sample.get("name", "")
+            nodes[node_id].append(timestamp, sample)
+            for field in FIELDS:
+                total[field] += sample.get(field, 0)
+            for field, threshold in self._thresholds.items():
+                key = (module, node_id, field)
+                if threshold and sample.get(field, 0) > threshold:
+                    if key not in self._breaches:
+                        # only notify when the threshold is crossed
+                        self._breaches.add(key)
+                        breaches.append({"module": module,
+                                         "id": node_id,
+                                         "name": sample.get("name", ""),
+                                         "field": field,
+                                         "value": sample[field],
+                                         "threshold": threshold})
+                else:
+                    self._breaches.discard(key)
+
+        # forget the nodes of this worker that have gone
+        previous_nodes = workers[worker][1] if worker in workers else set()
+        for node_id in previous_nodes:
+            if node_id not in samples:
+                nodes.pop(node_id, None)
+                for field in FIELDS:
+                    self._breaches.discard((module, node_id, field))
+        workers[worker] = (total, set(samples.keys()))
+
+        # the module total adds up the latest total of each worker
+        module_total = dict.fromkeys(FIELDS, 0)
+        for worker_total, _ in workers.values():
+            for field in FIELDS:
+                module_total[field] += worker_total[field]
+        module_history.name = module
+        module_history.append(timestamp, module_total)
+        return breaches
+
+    def to_json(self, module=None, node_id=None, count=None):
+        """
+        Returns the resource history.
+
+        :param module: only return this module (optional)
+        :param node_id: only return this node (optional, requires module)
+        :param count: only return the most recent samples (optional)
+
+        :returns: dictionary module name -> {"total": history, "nodes": {node ID -> history}}
+        """
+
+        result = {}
+        for name, (module_history, nodes, _) in self._modules.items():
+            if module and name != module:
+                continue
+            result[name] = {"total": module_history.to_json(count),
+                            "nodes": {node: history.to_json(count) for node, history in nodes.items()
+                                      if node_id is None or node == str(node_id)}}
+        return result
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of the device identifier allocation: creates then deletes
+4000 devices (in random order) and creates them again.
+
+Compares the previous list scan (range(1, 4097) checked against the list of
+identifiers in use) with IdAllocator, then runs the same scenario with
+Dynamips Ethernet hubs (the hypervisor is simulated). The list scan is cubic
+in the number of devices, it is compared with fewer devices by default.
+
+python3 scripts/bench_id_allocation.py --devices 4000 --legacy-devices 500
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from gns3server.modules.id_allocator import IdAllocator
+from gns3server.modules.dynamips.nodes.hub import Hub
+
+
+class LegacyIds(object):
+
+    def __init__(self):
+        self._instances = []
+
+    def allocate(self):
+        for identifier in range(1, 4097):
+            if identifier not in self._instances:
+                self._instances.append(identifier)
+                return identifier
+        return None
+
+    def release(self, identifier):
+        if identifier in self._instances:
+            self._instances.remove(identifier)
+
+
+class FakeHypervisor(object):
+
+    def __init__(self):
+        self.devices = []
+
+    def send(self, command):
+        return []
+
+
+def scenario(allocate, release, devices):
+    """
+    Creates, deletes and re-creates devices.
+
+    :returns: elapsed time in seconds
+    """
+
+    start = time.time()
+    created = [allocate() for _ in range(devices)]
+    random.shuffle(created)
+    for device in created:
+        release(device)
+    for _ in range(devices):
+        allocate()
+    return time.time() - start
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Device identifier allocation benchmark")
+    parser.add_argument("--devices", type=int, default=4000, help="number of devices (max 4096)")
+    parser.add_argument("--legacy-devices", type=int, default=500, help="number of devices for the list scan")
+    args = parser.parse_args()
+
+    random.seed(0)
+    legacy = LegacyIds()
+    before = scenario(legacy.allocate, legacy.release, args.legacy_devices)
+    allocator = IdAllocator(1, 4097)
+    after = scenario(allocator.allocate, allocator.release, args.legacy_devices)
+    print("{} identifiers  before: {:.3f} s  after: {:.4f} s  ({:.0f}x)".format(args.legacy_devices,
+                                                                                 before,
+                                                                                 after,
+                                                                                 before / after))
+    allocator = IdAllocator(1, 4097)
+    elapsed = scenario(allocator.allocate, allocator.release, args.devices)
+    print("{} identifiers  after: {:.4f} s".format(args.devices, elapsed))
+
+    hypervisor = FakeHypervisor()
+    counter = iter(range(10 * args.devices))
+    elapsed = scenario(lambda: Hub(hypervisor, "HUB{}".format(next(counter))),
+                       lambda hub: hub.delete(),
+                       args.devices)
+    print("ethernet hubs {} created, deleted and re-created in {:.3f} s".format(args.devices, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of JSON-RPC batches against one request per round trip.
+
+Start a server first (e.g. gns3server --port=8000) then run:
+python3 scripts/bench_jsonrpc_batch.py --requests 2000 --batch-size 100
+"""
+
+import sys
+import time
+import uuid
+import argparse
+import tornado.ioloop
+import tornado.websocket
+from tornado import gen
+from tornado.escape import json_encode, json_decode
+
+
+def make_request(method):
+
+    return {"jsonrpc": 2.0, "method": method, "id": str(uuid.uuid4()), "params": {"echo": "benchmark"}}
+
+
+@gen.coroutine
+def run(url, method, count, batch_size):
+
+    connection = yield tornado.websocket.websocket_connect(url)
+
+    # one request per round trip
+    start = time.time()
+    for _ in range(count):
+        connection.write_message(json_encode(make_request(method)))
+        response = yield connection.read_message()
+        assert "result" in json_decode(response), response
+    single_time = time.time() - start
+
+    # batches of requests
+    start = time.time()
+    round_trips = 0
+    for offset in range(0, count, batch_size):
+        batch = [make_request(method) for _ in range(min(batch_size, count - offset))]
+        connection.write_message(json_encode(batch))
+        response = yield connection.read_message()
+        assert len(json_decode(response)) == len(batch), response
+        round_trips += 1
+    batch_time = time.time() - start
+
+    connection.close()
+    print("{} x {}".format(count, method))
+    print("single requests: {} round trips, {:.3f}s ({:.0f} requests/s)".format(count, single_time, count / single_time))
+    print("batches of {}: {} round trips, {:.3f}s ({:.0f} requests/s)".format(batch_size,
+                                                                          round_trips,
+                                                                          batch_time,
+                                                                          count / batch_time))
+    print("speedup: {:.1f}x".format(single_time / batch_time))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="JSON-RPC batch benchmark")
+    parser.add_argument("--url", default="ws://127.0.0.1:8000/", help="server Websocket URL")
+    parser.add_argument("--method", default="dynamips.echo", help="method to call")
+    parser.add_argument("--requests", type=int, default=2000, help="number of requests")
+    parser.add_argument("--batch-size", type=int, default=100, help="requests per batch")
+    args = parser.parse_args()
+
+    io_loop = tornado.ioloop.IOLoop.instance()
+    try:
+        io_loop.run_sync(lambda: run(args.url, args.method, args.requests, args.batch_size))
+    except Exception as e:
+        print("Benchmark failed: {}".format(e))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
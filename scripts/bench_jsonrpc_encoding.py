@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Micro-benchmark of JSON-RPC message construction and encoding.
+
+Compares the previous reflection based messages (dir() + getattr() for
+each public attribute) with the dictionary based ones of gns3server.jsonrpc.
+
+python3 scripts/bench_jsonrpc_encoding.py --messages 100000
+"""
+
+import os
+import sys
+import json
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from gns3server import jsonrpc
+
+
+class LegacyJSONRPCObject(object):
+
+    def __init__(self):
+        LegacyJSONRPCEncoder().default(self)
+
+    def __str__(self):
+        return json.dumps(self, cls=LegacyJSONRPCEncoder)
+
+    def __call__(self):
+        return LegacyJSONRPCEncoder().default(self)
+
+
+class LegacyJSONRPCEncoder(json.JSONEncoder):
+
+    def default(self, obj):
+        if isinstance(obj, LegacyJSONRPCObject):
+            message = {"jsonrpc": 2.0}
+            for field in dir(obj):
+                if not field.startswith('_'):
+                    message[field] = getattr(obj, field)
+            return message
+        return json.JSONEncoder.default(self, obj)
+
+
+class LegacyJSONRPCResponse(LegacyJSONRPCObject):
+
+    def __init__(self, result, request_id):
+        LegacyJSONRPCObject.__init__(self)
+        self.id = request_id
+        self.result = result
+
+
+class LegacyJSONRPCNotification(LegacyJSONRPCObject):
+
+    def __init__(self, method, params=None):
+        LegacyJSONRPCObject.__init__(self)
+        self.method = method
+        if params:
+            self.params = params
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="JSON-RPC message encoding benchmark")
+    parser.add_argument("--messages", type=int, default=100000, help="number of messages")
+    args = parser.parse_args()
+
+    result = {"id": 1, "name": "R1", "console": 2001, "status": "started"}
+    cases = [("response", lambda: LegacyJSONRPCResponse(result, 42)(), lambda: jsonrpc.JSONRPCResponse(result, 42)()),
+             ("notification", lambda: LegacyJSONRPCNotification("dynamips.vm.status", result)(),
+                              lambda: jsonrpc.JSONRPCNotification("dynamips.vm.status", result)()),
+             ("response to JSON", lambda: json.dumps([None, LegacyJSONRPCResponse(result, 42)()]),
+                                  lambda: json.dumps([None, jsonrpc.JSONRPCResponse(result, 42)()]))]
+
+    for name, legacy, current in cases:
+        assert legacy() == current()
+        before = timeit.timeit(legacy, number=args.messages)
+        after = timeit.timeit(current, number=args.messages)
+        print("{:<18} before: {:.2f} us/msg  after: {:.2f} us/msg  ({:.1f}x)".format(name,
+                                                                                    before * 1e6 / args.messages,
+                                                                                    after * 1e6 / args.messages,
+                                                                                    before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Throughput benchmark of the link impairment relay.
+
+An emulator sends UDP packets to its peer (both in another process) with
+a window of packets in flight, the relay runs in this process like in a
+module. Compares the direct link with the relay without impairment, with
+latency/jitter, with packet loss and with a rate limit.
+
+python3 scripts/bench_link_impairment.py --packets 100000 --size 512
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from gns3server.modules.link_impairment import LinkImpairments
+
+
+def unused_port():
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def emulator_process(lport, rhost, rport, peer_port, packets, size, window):
+
+    emulator = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    emulator.bind(("127.0.0.1", lport))
+    peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    peer.bind(("127.0.0.1", peer_port))
+    peer.settimeout(0.1)
+    payload = b"\x00" * size
+
+    # at most window packets are in flight so the socket buffers don't overflow
+    sent = received = lost = 0
+    start = end = time.time()
+    while sent < packets:
+        if sent - received - lost < window:
+            emulator.sendto(payload, (rhost, rport))
+            sent += 1
+            continue
+        try:
+            peer.recv(65535)
+            received += 1
+            end = time.time()
+        except socket.timeout:
+            # the packets in flight have been dropped
+            lost = sent - received
+    try:
+        while received + lost < sent:
+            peer.recv(65535)
+            received += 1
+            end = time.time()
+    except socket.timeout:
+        pass
+
+    elapsed = max(end - start, 1e-9)
+    print("{:>8.0f} packets/s  {:>7.1f} Mbit/s  {:>5.1f}% received".format(received / elapsed,
+                                                                         received * size * 8 / elapsed / 1e6,
+                                                                         received * 100 / packets), flush=True)
+
+
+def run(name, settings, packets, size, window):
+    """
+    Sends packets through a link.
+
+    :param settings: impairment settings (None for a direct link)
+    """
+
+    peer_port = unused_port()
+    lport = unused_port()
+    link_impairments = LinkImpairments()
+    if settings is None:
+        emulator_port, rhost, rport = lport, "127.0.0.1", peer_port
+    else:
+        link_impairments.set(lport, **settings)
+        emulator_port, rhost, rport = link_impairments.attach(lport, "127.0.0.1", peer_port, "127.0.0.1")
+    print("{:<28}".format(name), end="", flush=True)
+    process = multiprocessing.Process(target=emulator_process, args=(emulator_port, rhost, rport, peer_port, packets, size, window))
+    process.start()
+    process.join()
+    link_impairments.close()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Link impairment relay benchmark")
+    parser.add_argument("--packets", type=int, default=100000, help="number of packets per run")
+    parser.add_argument("--size", type=int, default=512, help="packet size in bytes")
+    parser.add_argument("--window", type=int, default=256, help="maximum number of packets in flight")
+    args = parser.parse_args()
+
+    cases = [("direct", None),
+             ("relay", {}),
+             ("relay latency 20 ms", {"latency": 20, "jitter": 5}),
+             ("relay loss 10%", {"loss": 10}),
+             ("relay rate 10 Mbit/s", {"rate": 10000, "queue_limit": 100})]
+    for name, settings in cases:
+        run(name, settings, args.packets, args.size, args.window)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Throughput benchmark of the messages sent by a module to the server.
+
+A ZeroMQ dealer in a separate process (the module) sends JSON-RPC responses
+to a router (the server) which prepares them for the Websocket client, the
+server throughput is measured. Compares the previous JSON array
+[session ID, response] (decoded then re-encoded by the server) with the
+envelope (only the header is decoded, the payload is forwarded as it is). Notifications
+to the server itself are also compared with the msgpack codec if it is installed.
+
+python3 scripts/bench_module_envelope.py --messages 20000
+"""
+
+import os
+import sys
+import time
+import base64
+import argparse
+import multiprocessing
+import zmq
+from tornado.escape import json_decode, json_encode
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from gns3server import envelope
+import gns3server.jsonrpc as jsonrpc
+
+
+def legacy_send(dealer, session, message):
+
+    dealer.send_json([session, message])
+
+
+def legacy_receive(router):
+
+    identity, message = router.recv_multipart()
+    json_message = json_decode(message)
+    return json_encode(json_message[1])
+
+
+class EnvelopeSender(object):
+
+    def __init__(self, codec):
+        self._codec = codec
+
+    def __call__(self, dealer, session, message):
+        dealer.send_multipart(envelope.encode_module_message(session, message, self._codec))
+
+
+def legacy_notification_receive(router):
+
+    return json_decode(router.recv_multipart()[1])[1]
+
+
+def envelope_receive(router):
+
+    frames = router.recv_multipart()
+    session, codec, request_id, method, error_code, payload = envelope.decode_module_header(frames[1:])
+    if session is None:
+        return envelope.decode(codec, payload)
+    return payload
+
+
+def module_process(port, send, session, message, count):
+
+    context = zmq.Context()
+    dealer = context.socket(zmq.DEALER)
+    dealer.setsockopt(zmq.IDENTITY, b"module")
+    dealer.connect("tcp://127.0.0.1:{}".format(port))
+    # the messages are encoded before being sent to only measure the server
+    for _ in range(count + 1):
+        send(dealer, session, message)
+    dealer.close(linger=-1)
+    context.term()
+
+
+def run(context, send, receive, session, message, count):
+    """
+    Sends messages from a dealer (in another process) to a router.
+
+    :returns: messages per second processed by the router
+    """
+
+    router = context.socket(zmq.ROUTER)
+    router.setsockopt(zmq.RCVHWM, 0)
+    port = router.bind_to_random_port("tcp://127.0.0.1")
+    process = multiprocessing.Process(target=module_process, args=(port, send, session, message, count))
+    process.start()
+
+    # the timer starts once the first message has arrived
+    receive(router)
+    start = time.time()
+    for _ in range(count):
+        receive(router)
+    elapsed = time.time() - start
+    process.join()
+    router.close()
+    return count / elapsed
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Module message envelope benchmark")
+    parser.add_argument("--messages", type=int, default=20000, help="number of messages per run")
+    args = parser.parse_args()
+
+    context = zmq.Context()
+    context.linger = 0
+
+    config = base64.encodebytes(os.urandom(48 * 1024)).decode("ascii")
+    cases = [("echo response", "session", jsonrpc.JSONRPCResponse({"echo": "test"}, 1)()),
+             ("64 KB config response", "session", jsonrpc.JSONRPCResponse({"startup_config_base64": config}, 1)())]
+    for name, session, message in cases:
+        before = run(context, legacy_send, legacy_receive, session, message, args.messages)
+        after = run(context, EnvelopeSender(envelope.JSON), envelope_receive, session, message, args.messages)
+        print("{:<24} JSON array: {:>8.0f} msg/s  envelope: {:>8.0f} msg/s  ({:.2f}x)".format(name, before, after, after / before))
+
+    samples = {str(node): {"name": "R{}".format(node), "cpu": 1.5, "rss": 123456789, "io": 4096} for node in range(50)}
+    telemetry = jsonrpc.JSONRPCNotification("builtin.telemetry", {"timestamp": time.time(), "nodes": samples})()
+    legacy = run(context, legacy_send, legacy_notification_receive, None, telemetry, args.messages)
+    json_rate = run(context, EnvelopeSender(envelope.JSON), envelope_receive, None, telemetry, args.messages)
+    line = "{:<24} JSON array: {:>8.0f} msg/s  envelope: {:>8.0f} msg/s".format("telemetry notification", legacy, json_rate)
+    if envelope.available_codec(envelope.MSGPACK) == envelope.MSGPACK:
+        msgpack_rate = run(context, EnvelopeSender(envelope.MSGPACK), envelope_receive, None, telemetry, args.messages)
+        line += "  msgpack: {:>8.0f} msg/s".format(msgpack_rate)
+    else:
+        line += "  (msgpack not installed)"
+    print(line)
+    context.term()
+
+
+if __name__ == '__main__':
+    main()
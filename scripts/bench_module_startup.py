@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of the module startup: time for the module processes to be ready
+and their resident memory, when all the modules are spawned at boot (eager)
+compared to spawning only the modules that receive requests (lazy).
+
+python3 scripts/bench_module_startup.py --used vpcs dynamips
+"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+import zmq
+from zmq.eventloop import ioloop, zmqstream
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from gns3server.modules import MODULES
+from gns3server import envelope
+
+
+def rss(pid):
+    """
+    Returns the resident memory of a process in kB (Linux only).
+    """
+
+    try:
+        with open("/proc/{}/status".format(pid)) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def spawn(router, port, module_classes, temp_dir):
+    """
+    Spawns modules and waits for their builtin.module_ready notification.
+
+    :returns: (seconds until all the modules are ready, total RSS in kB)
+    """
+
+    start = time.time()
+    instances = []
+    for module in module_classes:
+        instance = module(module.__name__.lower(),
+                          "127.0.0.1",
+                          port,
+                          host="127.0.0.1",
+                          console_host="127.0.0.1",
+                          projects_dir=temp_dir,
+                          temp_dir=temp_dir)
+        instance.start()
+        instances.append(instance)
+
+    waiting = set(instance.identity for instance in instances)
+    while waiting:
+        if not router.poll(10000):
+            raise SystemExit("modules {} are not ready".format(", ".join(sorted(waiting))))
+        frames = router.recv_multipart()
+        if envelope.decode_module_header(frames[1:])[3] == "builtin.module_ready":
+            waiting.discard(frames[0].decode("utf-8"))
+    elapsed = time.time() - start
+    memory = sum(rss(instance.pid) for instance in instances)
+
+    for instance in instances:
+        router.send_string(instance.identity, zmq.SNDMORE)
+        router.send_string("stop")
+    for instance in instances:
+        instance.join(timeout=3)
+        if instance.is_alive():
+            instance.terminate()
+    return elapsed, memory
+
+
+def main():
+
+    # like the server, the modules use the PyZMQ I/O loop
+    ioloop.install()
+
+    names = [module.__name__.lower() for module in MODULES if module.lazy]
+    parser = argparse.ArgumentParser(description="Module startup benchmark")
+    parser.add_argument("--used", nargs="*", default=["dynamips"], choices=names,
+                        help="modules receiving requests (spawned in lazy mode)")
+    args = parser.parse_args()
+
+    context = zmq.Context()
+    context.linger = 0
+    router = context.socket(zmq.ROUTER)
+    port = router.bind_to_random_port("tcp://127.0.0.1")
+    temp_dir = tempfile.mkdtemp()
+
+    # the dead man switch doesn't run in its own process
+    all_modules = [module for module in MODULES if module.lazy]
+    used_modules = [module for module in all_modules if module.__name__.lower() in args.used]
+    for mode, modules in (("eager", all_modules), ("lazy", used_modules)):
+        elapsed, memory = spawn(router, port, modules, temp_dir)
+        print("{:<6} {} module processes ready in {:.3f} s, {:.1f} MB resident".format(mode,
+                                                                                     len(modules),
+                                                                                     elapsed,
+                                                                                     memory / 1024))
+    router.close()
+    context.term()
+
+
+if __name__ == '__main__':
+    main()
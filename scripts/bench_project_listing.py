@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 GNS3 Technologies Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of the cloud project listing.
+
+A local stand-in for the storage holds a container with many objects (mostly
+images, some projects) and returns them by pages of 10000 like Cloud Files.
+Compares the full container listing filtered in Python (previous behavior),
+the listing of the projects prefix and the cached listing.
+
+python3 scripts/bench_project_listing.py --objects 50000 --projects 500
+"""
+
+import os
+import sys
+import time
+import bisect
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from libcloud.storage.base import Container, Object
+from gns3dms.cloud.base_cloud_ctrl import BaseCloudCtrl
+
+PAGE_SIZE = 10000
+
+
+class LocalStorage(object):
+    """
+    In-memory storage returning the objects by pages.
+    """
+
+    def __init__(self, names):
+
+        self.names = sorted(names)
+        self.container = Container("GNS3", {"object_count": len(names), "size": 0}, self)
+        self.objects_returned = 0
+        self.requests = 0
+
+    def get_container(self, container_name):
+
+        self.requests += 1
+        return self.container
+
+    def iterate_container_objects(self, container, prefix=None):
+
+        start = bisect.bisect_left(self.names, prefix or "")
+        while True:
+            self.requests += 1
+            page = self.names[start:start + PAGE_SIZE]
+            if prefix:
+                page = [name for name in page if name.startswith(prefix)]
+            for name in page:
+                self.objects_returned += 1
+                yield Object(name, 0, "etag", {"last_modified": None}, {}, container, self)
+            if len(page) < PAGE_SIZE:
+                return
+            start += PAGE_SIZE
+
+    def list_container_objects(self, container, prefix=None):
+
+        return list(self.iterate_container_objects(container, prefix))
+
+
+class CloudCtrl(BaseCloudCtrl):
+
+    def __init__(self, storage_driver):
+        BaseCloudCtrl.__init__(self, "user", "key")
+        self.storage_driver = storage_driver
+
+
+def full_listing(ctrl):
+    """
+    Previous implementation: lists the whole container.
+    """
+
+    gns3_container = ctrl.storage_driver.get_container(ctrl.GNS3_CONTAINER_NAME)
+    return [
+        (obj.name.replace('projects/', '').replace('.zip', ''), obj.name)
+        for obj in ctrl.storage_driver.list_container_objects(gns3_container)
+        if obj.name.startswith('projects/') and obj.name[-4:] == '.zip'
+    ]
+
+
+def run(name, function, storage, iterations):
+
+    storage.objects_returned = storage.requests = 0
+    start = time.time()
+    for _ in range(iterations):
+        projects = function()
+    elapsed = (time.time() - start) / iterations
+    print("{:<20} {:>9.3f} ms  {:>8} objects returned  {:>4} requests  {} projects".format(name,
+                                                                                         elapsed * 1000,
+                                                                                         storage.objects_returned // iterations,
+                                                                                         storage.requests // iterations,
+                                                                                         len(projects)))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Cloud project listing benchmark")
+    parser.add_argument("--objects", type=int, default=50000, help="number of objects in the container")
+    parser.add_argument("--projects", type=int, default=500, help="number of projects among the objects")
+    parser.add_argument("--iterations", type=int, default=20, help="number of listings per case")
+    args = parser.parse_args()
+
+    names = ["projects/project{}.zip".format(i) for i in range(args.projects)]
+    names += ["images/image{}.bin".format(i) for i in range(args.objects - args.projects)]
+    storage = LocalStorage(names)
+    ctrl = CloudCtrl(storage)
+
+    run("full listing", lambda: full_listing(ctrl), storage, args.iterations)
+    run("prefix listing", lambda: ctrl.list_projects(refresh=True), storage, args.iterations)
+    run("cached listing", lambda: ctrl.list_projects(), storage, args.iterations)
+    run("cached page of 50", lambda: ctrl.list_projects(marker="projects/project250.zip", limit=50), storage, args.iterations)
+
+
+if __name__ == '__main__':
+    main()
@@ -81,3 +81,39 @@ def test_pvc(atmsw):
     atmsw.remove_nio(1)
     nio1.delete()
     nio2.delete()
+
+
+def test_map_connections(atmsw):
+
+    nio1 = NIO_Null(atmsw.hypervisor)
+    atmsw.add_nio(nio1, 0)  # add NIO on port 0
+    nio2 = NIO_Null(atmsw.hypervisor)
+    atmsw.add_nio(nio2, 1)  # add NIO on port 1
+    connections = [((0, 10), (1, 20)), ((1, 20), (0, 10)),  # VP
+                   ((0, 11, 11), (1, 21, 21)), ((1, 21, 21), (0, 11, 11))]  # VC
+    assert atmsw.map_connections(connections) == connections
+    assert atmsw.map_connections(connections) == []  # the connections already exist
+    assert atmsw.mapping[(0, 11, 11)] == (1, 21, 21)
+    assert len(atmsw.unmap_port(0)) == 4
+    assert not atmsw.mapping
+    atmsw.remove_nio(0)
+    atmsw.remove_nio(1)
+    nio1.delete()
+    nio2.delete()
+
+
+def test_map_connections_replaces_connection(atmsw):
+
+    nio1 = NIO_Null(atmsw.hypervisor)
+    atmsw.add_nio(nio1, 0)  # add NIO on port 0
+    nio2 = NIO_Null(atmsw.hypervisor)
+    atmsw.add_nio(nio2, 1)  # add NIO on port 1
+    atmsw.map_connections([((0, 10), (1, 20))])
+    # the previous VP from port 0 VPI 10 is deleted before the new one is created
+    assert atmsw.map_connections([((0, 10), (1, 30))]) == [((0, 10), (1, 30))]
+    assert atmsw.mapping == {(0, 10): (1, 30)}
+    assert atmsw.unmap_port(0) == [((0, 10), (1, 30))]
+    atmsw.remove_nio(0)
+    atmsw.remove_nio(1)
+    nio1.delete()
+    nio2.delete()
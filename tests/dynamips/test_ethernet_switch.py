@@ -85,3 +85,27 @@ def test_get_mac_addr_table(ethsw):
 def test_clear_mac_addr_table(ethsw):
 
     ethsw.clear_mac_addr_table()
+
+
+def test_update_ports(ethsw):
+
+    nio1 = NIO_Null(ethsw.hypervisor)
+    ethsw.add_nio(nio1, 0)  # add NIO on port 0
+    nio2 = NIO_Null(ethsw.hypervisor)
+    ethsw.add_nio(nio2, 1)  # add NIO on port 1
+    assert ethsw.update_ports({0: ("access", 10), 1: ("dot1q", 1)}) == [0, 1]
+    # only the changed port is reconfigured
+    assert ethsw.update_ports({0: ("access", 10), 1: ("qinq", 100)}) == [1]
+    assert ethsw.mapping[0] == ("access", 10)
+    assert ethsw.mapping[1] == ("qinq", 100)
+    ethsw.remove_nio(0)
+    ethsw.remove_nio(1)
+    nio1.delete()
+    nio2.delete()
+
+
+def test_refresh_mac_table(ethsw):
+
+    version, learned, aged = ethsw.refresh_mac_table()
+    assert not learned and not aged  # MAC address table should be empty
+    assert ethsw.mac_table.changes_since(version) == {"version": version, "full": False, "learned": [], "aged": []}
@@ -63,3 +63,39 @@ def test_vc(frsw):
     frsw.remove_nio(1)
     nio1.delete()
     nio2.delete()
+
+
+def test_map_vcs(frsw):
+
+    nio1 = NIO_Null(frsw.hypervisor)
+    frsw.add_nio(nio1, 0)  # add NIO on port 0
+    nio2 = NIO_Null(frsw.hypervisor)
+    frsw.add_nio(nio2, 1)  # add NIO on port 1
+    vcs = [(0, 10, 1, 20), (1, 20, 0, 10)]
+    assert frsw.map_vcs(vcs) == vcs
+    assert frsw.map_vcs(vcs) == []  # the VCs already exist
+    assert frsw.mapping[(0, 10)] == (1, 20)
+    assert frsw.mapping[(1, 20)] == (0, 10)
+    assert len(frsw.unmap_port(1)) == 2
+    assert not frsw.mapping
+    frsw.remove_nio(0)
+    frsw.remove_nio(1)
+    nio1.delete()
+    nio2.delete()
+
+
+def test_map_vcs_replaces_vc(frsw):
+
+    nio1 = NIO_Null(frsw.hypervisor)
+    frsw.add_nio(nio1, 0)  # add NIO on port 0
+    nio2 = NIO_Null(frsw.hypervisor)
+    frsw.add_nio(nio2, 1)  # add NIO on port 1
+    frsw.map_vcs([(0, 10, 1, 20)])
+    # the previous VC from port 0 DLCI 10 is deleted before the new one is created
+    assert frsw.map_vcs([(0, 10, 1, 30)]) == [(0, 10, 1, 30)]
+    assert frsw.mapping == {(0, 10): (1, 30)}
+    assert frsw.unmap_port(0) == [(0, 10, 1, 30)]
+    frsw.remove_nio(0)
+    frsw.remove_nio(1)
+    nio1.delete()
+    nio2.delete()
@@ -0,0 +1,86 @@
+from gns3server.modules.capture_session import CaptureSession
+from gns3server.modules.capture_session import CaptureSessions
+import struct
+import sys
+import os
+import pytest
+
+"""
+Tests for the capture sessions (ring buffer of capture files)
+"""
+
+pytestmark = pytest.mark.skipif(sys.platform.startswith("win"), reason="named pipes are required")
+
+PCAP_HEADER = struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1)
+
+
+def pcap_record(payload):
+
+    return struct.pack("<IIII", 0, 0, len(payload), len(payload)) + payload
+
+
+def emulate_capture(path, records):
+    """
+    Writes a capture to the named pipe like an emulator would.
+    """
+
+    with open(path, "wb") as f:
+        f.write(PCAP_HEADER)
+        for record in records:
+            f.write(record)
+
+
+def test_capture_rotation_and_pruning(tmpdir):
+
+    output_file = str(tmpdir / "captures" / "R1_0-0.pcap")
+    # 24 bytes header + 2 records of 116 bytes per file
+    session = CaptureSession(output_file, max_file_size=300, max_files=2)
+    session.start()
+    assert session.writer_path != output_file
+    emulate_capture(session.writer_path, [pcap_record(bytes([i]) * 100) for i in range(7)])
+    stats = session.stop()
+
+    assert stats["packets"] == 7
+    assert stats["bytes"] == 7 * 116
+    assert stats["drops"] == 0
+    assert stats["rotations"] == 3
+    assert stats["pruned"] == 2
+    assert stats["files"] == ["R1_0-0_00003.pcap", "R1_0-0.pcap"]
+    assert sorted(os.listdir(str(tmpdir / "captures"))) == ["R1_0-0.pcap", "R1_0-0_00003.pcap"]
+
+    with open(output_file, "rb") as f:
+        assert f.read() == PCAP_HEADER + pcap_record(b"\x06" * 100)
+    with open(str(tmpdir / "captures" / "R1_0-0_00003.pcap"), "rb") as f:
+        assert f.read() == PCAP_HEADER + pcap_record(b"\x04" * 100) + pcap_record(b"\x05" * 100)
+
+
+def test_capture_stop_without_writer(tmpdir):
+
+    output_file = str(tmpdir / "captures" / "R1_0-0.pcap")
+    session = CaptureSession(output_file)
+    session.start()
+    stats = session.stop()
+    assert stats["packets"] == 0
+    assert os.listdir(str(tmpdir / "captures")) == []
+
+
+def test_capture_sessions_rollback(tmpdir):
+
+    output_file = str(tmpdir / "captures" / "R1_0-0.pcap")
+    sessions = CaptureSessions("dynamips")
+    writer_paths = []
+
+    def start_capture(writer_path):
+        writer_paths.append(writer_path)
+        raise RuntimeError("Port 0 has already a filter applied")
+
+    with pytest.raises(RuntimeError):
+        sessions.start(("vm", 1, 0, 0), output_file, {}, start_capture)
+    assert not os.path.exists(writer_paths[0])
+    assert sessions.stop(("vm", 1, 0, 0)) is None
+
+    session = sessions.start(("vm", 1, 0, 0), output_file, {"max_files": 3}, writer_paths.append)
+    assert session._max_files == 3
+    assert session._max_file_size == 100 * 1048576
+    emulate_capture(session.writer_path, [pcap_record(b"\x01" * 10)])
+    assert sessions.stop(("vm", 1, 0, 0))["packets"] == 1
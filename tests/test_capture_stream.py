@@ -0,0 +1,144 @@
+from tornado.testing import AsyncHTTPTestCase
+from gns3server.capture_stream import PcapTail
+from gns3server.capture_stream import CaptureSource
+from gns3server.capture_stream import CaptureSubscriber
+from gns3server.capture_stream import CaptureStreamer
+from gns3server.handlers import capture_handler
+from gns3server.handlers.capture_handler import CaptureStreamHandler
+import tornado.web
+import tornado.httpclient
+import tempfile
+import struct
+import os
+
+"""
+Tests for the live packet capture streaming
+"""
+
+PCAP_HEADER = struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1)
+
+
+def pcap_record(payload, timestamp=0):
+
+    return struct.pack("<IIII", timestamp, 0, len(payload), len(payload)) + payload
+
+
+def test_pcap_tail(tmpdir):
+
+    path = str(tmpdir / "capture.pcap")
+    tail = PcapTail(path)
+    assert tail.read() == []  # the file doesn't exist yet
+    with open(path, "wb") as f:
+        f.write(PCAP_HEADER[:10])
+        f.flush()
+        assert tail.read() == []
+        record = pcap_record(b"\x01" * 60)
+        f.write(PCAP_HEADER[10:] + record + record[:20])
+        f.flush()
+        assert tail.read() == [record]
+        assert tail.header == PCAP_HEADER
+        f.write(record[20:])
+        f.flush()
+        assert tail.read() == [record]
+    tail.close()
+
+
+def test_pcap_tail_replaced_file(tmpdir):
+
+    path = str(tmpdir / "capture.pcap")
+    with open(path, "wb") as f:
+        f.write(PCAP_HEADER + pcap_record(b"\x01" * 100) + pcap_record(b"\x02" * 100))
+    tail = PcapTail(path)
+    assert len(tail.read()) == 2
+    # a new capture truncates the file
+    record = pcap_record(b"\x03" * 10)
+    with open(path, "wb") as f:
+        f.write(PCAP_HEADER + record)
+    assert tail.read() == [record]
+    tail.close()
+
+
+def test_subscriber_backpressure():
+
+    written = []
+    callbacks = []
+
+    def writer(data, callback):
+        written.append(data)
+        callbacks.append(callback)
+
+    subscriber = CaptureSubscriber(writer, max_pending=100)
+    assert subscriber.push(PCAP_HEADER, droppable=False)
+    # the client is still receiving the header: records are queued then dropped
+    assert subscriber.push(b"a" * 60)
+    assert not subscriber.push(b"b" * 60)
+    assert subscriber.records_dropped == 1
+    assert written == [PCAP_HEADER]
+    callbacks.pop()()
+    assert written[-1] == b"a" * 60
+    callbacks.pop()()
+    assert subscriber.push(b"c" * 60)
+    assert written[-1] == b"c" * 60
+    assert subscriber.stats()["records_sent"] == 2
+
+
+def test_source_starts_live(tmpdir):
+
+    path = str(tmpdir / "capture.pcap")
+    old_record = pcap_record(b"\x01" * 10)
+    with open(path, "wb") as f:
+        f.write(PCAP_HEADER + old_record)
+
+    written = []
+    source = CaptureSource(path)
+    source.subscribe(CaptureSubscriber(lambda data, callback: (written.append(data), callback())))
+    new_record = pcap_record(b"\x02" * 10)
+    with open(path, "ab") as f:
+        f.write(new_record)
+    source.poll()
+    assert b"".join(written) == PCAP_HEADER + new_record
+    source.close()
+
+
+class TestCaptureStreamHandler(AsyncHTTPTestCase):
+
+    def get_app(self):
+
+        # captures below the temporary directory can be streamed
+        self._working_dir = tempfile.mkdtemp()
+        capture_handler._streamer = CaptureStreamer(poll_interval=10, io_loop=self.io_loop)
+        return tornado.web.Application([(r"/capture/stream", CaptureStreamHandler)])
+
+    def test_stream(self):
+
+        captures_dir = os.path.join(self._working_dir, "captures")
+        os.makedirs(captures_dir)
+        path = os.path.join(captures_dir, "R1_0-0.pcap")
+        record = pcap_record(b"\x01" * 64)
+        with open(path, "wb") as f:
+            f.write(PCAP_HEADER)
+
+        received = []
+
+        def on_chunk(chunk):
+            received.append(chunk)
+            if len(b"".join(received)) >= len(PCAP_HEADER) + len(record):
+                self.stop()
+
+        def write_record():
+            with open(path, "ab") as f:
+                f.write(record)
+
+        request = tornado.httpclient.HTTPRequest(self.get_url("/capture/stream?path=" + path),
+                                                 streaming_callback=on_chunk,
+                                                 request_timeout=5)
+        self.http_client.fetch(request, lambda response: None)
+        self.io_loop.add_timeout(self.io_loop.time() + 0.2, write_record)
+        self.wait(timeout=5)
+        assert b"".join(received) == PCAP_HEADER + record
+
+    def test_forbidden_path(self):
+
+        self.http_client.fetch(self.get_url("/capture/stream?path=/etc/passwd"), self.stop)
+        response = self.wait()
+        assert response.code == 403
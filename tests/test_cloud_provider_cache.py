@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import datetime
+import threading
+import socketserver
+import pytest
+
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from gns3dms.cloud.rackspace_ctrl import ProviderCache
+
+"""
+Tests for the cloud provider cache, against a local stand-in for the identity
+and the object storage APIs
+"""
+
+
+class IdentityServer(socketserver.ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+
+class IdentityHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8"))
+        credentials = body["auth"]["RAX-KSKEY:apiKeyCredentials"]
+        self.server.requests.append(credentials["username"])
+        self.server.connections.add(self.client_address)
+        if credentials["apiKey"] != "secret":
+            response, status = {"unauthorized": {"code": 401}}, 401
+        else:
+            expires = datetime.datetime.utcfromtimestamp(time.time() + self.server.token_lifetime)
+            response = {"access": {"token": {"id": "token{}".format(len(self.server.requests)),
+                                             "expires": expires.strftime("%Y-%m-%dT%H:%M:%S.000Z")},
+                                   "serviceCatalog": [{"name": "cloudServersOpenStack",
+                                                       "type": "compute",
+                                                       "endpoints": [{"region": "DFW", "versionId": "2"}]},
+                                                      {"name": "cloudFiles",
+                                                       "type": "object-store",
+                                                       "endpoints": [{"region": "DFW",
+                                                                      "publicURL": self.storage_url()}]}],
+                                   "user": {"roles": [{"name": "compute:default", "tenantId": "42"}]}}}
+            status = 200
+        data = json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def storage_url(self):
+
+        return "http://127.0.0.1:{}/v1/MossoCloudFS_42".format(self.server.server_port)
+
+    def _storage_request(self, send_body):
+
+        self.server.storage_requests.append((threading.current_thread().name, self.headers["X-Auth-Token"]))
+        path = self.path.split("?")[0][len("/v1/MossoCloudFS_42/"):]
+        if "/" not in path:
+            # container
+            self.send_response(204)
+            self.send_header("X-Container-Object-Count", str(len(self.server.objects)))
+            self.send_header("X-Container-Bytes-Used", str(sum(len(data) for data in self.server.objects.values())))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        data = self.server.objects.get(path)
+        if data is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data)
+
+    def do_HEAD(self):
+
+        self._storage_request(send_body=False)
+
+    def do_GET(self):
+
+        self._storage_request(send_body=True)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def identity_server(request):
+
+    server = IdentityServer(("127.0.0.1", 0), IdentityHandler)
+    server.requests = []
+    server.connections = set()
+    server.storage_requests = []
+    server.objects = {}
+    server.token_lifetime = 3600
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    request.addfinalizer(server.shutdown)
+    return server
+
+
+def settings(api_key="secret"):
+
+    return {"cloud_user_name": "user",
+            "cloud_api_key": api_key,
+            "cloud_region": "dfw"}
+
+
+def test_provider_reused(identity_server):
+
+    cache = ProviderCache(identity_ep="http://127.0.0.1:{}/v2.0/tokens".format(identity_server.server_port))
+    provider = cache.get(settings())
+    assert provider.authenticated
+    assert provider.tenant_id == "42"
+    assert provider.token_expires_in() > 3000
+    assert cache.get(settings()) is provider
+    assert len(identity_server.requests) == 1
+    cache.clear()
+
+
+def test_token_refresh(identity_server):
+
+    identity_server.token_lifetime = 60  # expires within the refresh margin
+    cache = ProviderCache(identity_ep="http://127.0.0.1:{}/v2.0/tokens".format(identity_server.server_port))
+    provider = cache.get(settings())
+    assert provider.token == "token1"
+    assert cache.get(settings()) is provider
+    assert provider.token == "token2"
+    assert len(identity_server.requests) == 2
+    # the connection to the identity API has been reused
+    assert len(identity_server.connections) == 1
+    cache.clear()
+
+
+def test_authentication_failure(identity_server):
+
+    cache = ProviderCache(identity_ep="http://127.0.0.1:{}/v2.0/tokens".format(identity_server.server_port))
+    assert cache.get(settings(api_key="wrong")) is None
+    assert cache.get(settings(api_key="wrong")) is None
+    assert len(identity_server.requests) == 2  # failures are not cached
+
+    provider = cache.get(settings())
+    cache.invalidate(settings())
+    assert cache.get(settings()) is not provider
+    cache.clear()
+
+
+def test_concurrent_downloads(identity_server, tmpdir):
+
+    for index in range(4):
+        identity_server.objects["GNS3/images/disk{}.img".format(index)] = os.urandom(100000 + index)
+    cache = ProviderCache(identity_ep="http://127.0.0.1:{}/v2.0/tokens".format(identity_server.server_port))
+    barrier = threading.Barrier(4)
+    drivers = {}
+    errors = []
+
+    def download(index):
+        try:
+            barrier.wait()
+            provider = cache.get(settings())
+            provider.download_file("images/disk{}.img".format(index), str(tmpdir.join("disk{}.img".format(index))))
+            drivers[index] = provider.storage_driver
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=download, args=(index,)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    assert errors == []
+    for index in range(4):
+        assert tmpdir.join("disk{}.img".format(index)).read_binary() == identity_server.objects["GNS3/images/disk{}.img".format(index)]
+    # one authentication, the storage drivers reuse the token but not the connections
+    assert len(identity_server.requests) == 1
+    assert set(token for _, token in identity_server.storage_requests) == {"token1"}
+    assert len(set(id(driver) for driver in drivers.values())) == 4
+    cache.clear()
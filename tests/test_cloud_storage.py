@@ -0,0 +1,182 @@
+import hashlib
+import threading
+import pytest
+
+from libcloud.storage.base import Object
+from libcloud.storage.drivers.dummy import DummyStorageDriver
+from gns3dms.cloud.base_cloud_ctrl import BaseCloudCtrl
+from gns3dms.cloud.base_cloud_ctrl import file_md5
+
+"""
+Tests for the cloud storage uploads and project listing, against the
+libcloud dummy storage driver keeping the contents of the objects
+"""
+
+
+class StorageDriver(DummyStorageDriver):
+
+    def __init__(self):
+        DummyStorageDriver.__init__(self, "key", "secret")
+        self.contents = {}
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def get_container(self, container_name):
+        container = DummyStorageDriver.get_container(self, container_name)
+        objects = self._containers[container_name]["objects"].values()
+        container.extra["object_count"] = len(objects)
+        container.extra["size"] = sum(obj.size for obj in objects)
+        return container
+
+    # like the CloudFiles driver of libcloud 0.14, the prefix is only an extension argument
+    def iterate_container_objects(self, container, ex_prefix=None):
+        self.requests.append(("LIST", ex_prefix))
+        objects = self._containers[container.name]["objects"]
+        return (objects[name] for name in sorted(objects) if name.startswith(ex_prefix or ""))
+
+    def get_object(self, container_name, object_name):
+        self.requests.append(("HEAD", object_name))
+        return DummyStorageDriver.get_object(self, container_name, object_name)
+
+    def list_container_objects(self, container, ex_prefix=None):
+        self.requests.append(("LIST", ex_prefix))
+        objects = self._containers[container.name]["objects"]
+        return [objects[name] for name in sorted(objects) if name.startswith(ex_prefix or "")]
+
+    def upload_object_via_stream(self, iterator, container, object_name, extra=None, headers=None):
+        if hasattr(iterator, "read"):
+            iterator = [iterator.read()]
+        data = b"".join(chunk.encode("utf-8") if isinstance(chunk, str) else chunk for chunk in iterator)
+        with self._lock:
+            self.requests.append(("PUT", object_name))
+            self.contents[object_name] = data
+            obj = self._add_object(container, object_name, len(data))
+            obj.hash = hashlib.md5(data).hexdigest()
+        return obj
+
+    def download_object_as_stream(self, obj, chunk_size=None):
+        yield self.contents[obj.name]
+
+    def delete_object(self, obj):
+        del self.contents[obj.name]
+        return DummyStorageDriver.delete_object(self, obj)
+
+    def _upload_object_manifest(self, container, object_name, extra=None, verify_hash=True):
+        # the content of a manifest is the concatenation of the segments
+        segments = sorted(name for name in self.contents if name.startswith(object_name + "/"))
+        self.contents[object_name] = b"".join(self.contents[name] for name in segments)
+        obj = self._add_object(container, object_name, len(self.contents[object_name]))
+        obj.hash = hashlib.md5(b"").hexdigest()
+        return obj
+
+
+class CloudCtrl(BaseCloudCtrl):
+
+    UPLOAD_SEGMENT_SIZE = 1000
+    UPLOAD_CHUNK_SIZE = 128
+
+    def __init__(self):
+        BaseCloudCtrl.__init__(self, "user", "secret")
+        self.storage_driver = StorageDriver()
+
+
+@pytest.fixture
+def ctrl():
+    return CloudCtrl()
+
+
+def test_file_md5(tmpdir):
+
+    path = tmpdir / "image"
+    path.write_binary(b"x" * 10000)
+    assert file_md5(str(path), chunk_size=100) == hashlib.md5(b"x" * 10000).hexdigest()
+
+
+def test_upload_file(tmpdir, ctrl):
+
+    path = tmpdir / "image"
+    path.write_binary(b"x" * 500)
+    progress = []
+    assert ctrl.upload_file(str(path), "images", progress_callback=lambda done, total: progress.append((done, total)))
+    contents = ctrl.storage_driver.contents
+    assert contents["images/image"] == b"x" * 500
+    assert contents["images/image.md5"] == hashlib.md5(b"x" * 500).hexdigest().encode("utf-8")
+    assert progress[-1] == (500, 500)
+
+    # identical file, found with a lookup instead of listing the container
+    ctrl.storage_driver.requests = []
+    assert not ctrl.upload_file(str(path), "images")
+    assert ctrl.storage_driver.requests == [("HEAD", "images/image")]
+
+    path.write_binary(b"y" * 500)
+    assert ctrl.upload_file(str(path), "images")
+    assert contents["images/image"] == b"y" * 500
+
+
+def test_upload_segments(tmpdir, ctrl):
+
+    data = bytes(range(256)) * 20  # 5120 bytes, 6 segments
+    path = tmpdir / "image"
+    path.write_binary(data)
+    progress = []
+    assert ctrl.upload_file(str(path), "images", progress_callback=lambda done, total: progress.append(done))
+    contents = ctrl.storage_driver.contents
+    assert len([name for name in contents if name.startswith("images/image/")]) == 6
+    assert contents["images/image"] == data
+    assert progress[-1] == len(data)
+
+    # the ETag of the manifest isn't the hash of the file, the hash object is used
+    assert not ctrl.upload_file(str(path), "images")
+
+    # the segments of the previous upload are deleted
+    path.write_binary(data[:2500])
+    assert ctrl.upload_file(str(path), "images")
+    assert len([name for name in contents if name.startswith("images/image/")]) == 3
+    assert contents["images/image"] == data[:2500]
+
+
+def test_list_projects(tmpdir, ctrl):
+
+    assert ctrl.list_projects() == []
+    for name in ("b", "a", "c"):
+        path = tmpdir / "{}.zip".format(name)
+        path.write_binary(name.encode("utf-8"))
+        ctrl.upload_file(str(path), "projects")
+    path = tmpdir / "image"
+    path.write_binary(b"image")
+    ctrl.upload_file(str(path), "images")
+
+    driver = ctrl.storage_driver
+    driver.requests = []
+    assert ctrl.list_projects() == [("a", "projects/a.zip"), ("b", "projects/b.zip"), ("c", "projects/c.zip")]
+    assert driver.requests == [("LIST", "projects/")]  # only the projects are listed
+
+    # pagination
+    assert ctrl.list_projects(limit=2) == [("a", "projects/a.zip"), ("b", "projects/b.zip")]
+    assert ctrl.list_projects(marker="projects/b.zip", limit=2) == [("c", "projects/c.zip")]
+
+    # cached until the container changes
+    driver.requests = []
+    ctrl.list_projects()
+    assert driver.requests == []
+    driver.upload_object_via_stream([b"d"], driver.get_container("GNS3"), "projects/d.zip")
+    driver.requests = []
+    assert len(ctrl.list_projects()) == 4
+    assert driver.requests == [("LIST", "projects/")]
+
+
+def test_list_projects_updated_by_upload(tmpdir, ctrl):
+
+    path = tmpdir / "a.zip"
+    path.write_binary(b"a")
+    ctrl.upload_file(str(path), "projects")
+    assert len(ctrl.list_projects()) == 1
+
+    # the projects uploaded by the controller are added to the cache
+    path = tmpdir / "b.zip"
+    path.write_binary(b"b")
+    ctrl.upload_file(str(path), "projects")
+    ctrl.storage_driver.requests = []
+    assert ctrl.list_projects() == [("a", "projects/a.zip"), ("b", "projects/b.zip")]
+    assert ("LIST", "projects/") not in ctrl.storage_driver.requests
+    assert ctrl._project_cache.metadata("projects/b.zip")[0] == hashlib.md5(b"b").hexdigest()
@@ -0,0 +1,47 @@
+from gns3server.modules.attic import write_config_file
+import os
+
+"""
+Tests for the incremental config saving
+"""
+
+
+def test_write_config(tmpdir):
+
+    path = str(tmpdir.join("startup-config.cfg"))
+    assert write_config_file(path, "hostname R1\n")
+    with open(path) as f:
+        assert f.read() == "hostname R1\n"
+    # no temporary file is left behind
+    assert os.listdir(str(tmpdir)) == ["startup-config.cfg"]
+
+
+def test_unchanged_config_not_written(tmpdir):
+
+    path = str(tmpdir.join("startup-config.cfg"))
+    assert write_config_file(path, "hostname R1\n")
+    mtime = os.stat(path).st_mtime_ns
+    assert not write_config_file(path, "hostname R1\n")
+    assert os.stat(path).st_mtime_ns == mtime
+    assert write_config_file(path, "hostname R2\n")
+    with open(path) as f:
+        assert f.read() == "hostname R2\n"
+
+
+def test_externally_modified_config(tmpdir):
+
+    path = str(tmpdir.join("startup-config.cfg"))
+    assert write_config_file(path, "hostname R1\n")
+    with open(path, "w") as f:
+        f.write("hostname R3\nend\n")
+    # the file has been changed by someone else, it must be rewritten
+    assert write_config_file(path, "hostname R1\n")
+    with open(path) as f:
+        assert f.read() == "hostname R1\n"
+
+
+def test_existing_identical_config(tmpdir):
+
+    path = tmpdir.join("initial-config.cfg")
+    path.write("hostname IOU1\n")
+    assert not write_config_file(str(path), "hostname IOU1\n")
@@ -0,0 +1,135 @@
+import os
+import socket
+import pytest
+
+from gns3dms.monitor import DeadManSwitch
+from gns3dms.monitor import InotifyWatcher
+
+"""
+Tests for the event driven dead man switch, with a fake cloud provider
+"""
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeCloud(object):
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.terminations = 0
+
+    def terminate(self):
+        self.terminations += 1
+        if self.terminations <= self.failures:
+            raise Exception("API error")
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_terminate_after_deadtime(clock):
+
+    cloud = FakeCloud()
+    switch = DeadManSwitch(cloud.terminate, 60, init_wait=10, clock=clock)
+    clock.now += 30
+    switch.heartbeat()
+    clock.now += 59
+    switch.run_once(timeout=0)
+    assert cloud.terminations == 0
+    clock.now += 1
+    switch.run_once(timeout=0)
+    assert cloud.terminations == 1
+    switch.close()
+
+
+def test_init_wait(clock):
+
+    cloud = FakeCloud()
+    switch = DeadManSwitch(cloud.terminate, 60, init_wait=300, clock=clock)
+    clock.now += 200
+    switch.run_once(timeout=0)
+    assert cloud.terminations == 0
+    clock.now += 100
+    switch.run_once(timeout=0)
+    assert cloud.terminations == 1
+    switch.close()
+
+
+def test_retry_backoff(clock):
+
+    cloud = FakeCloud(failures=10)
+    switch = DeadManSwitch(cloud.terminate, 60, retry_delay=30, max_retry_delay=100, clock=clock)
+    attempts = []
+    for _ in range(400):
+        clock.now += 1
+        switch.run_once(timeout=0)
+        if switch.terminate_attempts > len(attempts):
+            attempts.append(clock.now)
+    # 30, 60, 100, 100 seconds between the attempts
+    assert [b - a for a, b in zip(attempts, attempts[1:])] == [30, 60, 100, 100]
+
+    # a heartbeat cancels the retries
+    switch.heartbeat()
+    assert switch.terminate_attempts == 0
+    terminations = cloud.terminations
+    clock.now += 59
+    switch.run_once(timeout=0)
+    assert cloud.terminations == terminations
+    switch.close()
+
+
+def test_socket_heartbeat(tmpdir, clock):
+
+    cloud = FakeCloud()
+    socket_path = str(tmpdir / "gns3dms.sock")
+    switch = DeadManSwitch(cloud.terminate, 60, socket_path=socket_path, clock=clock)
+    clock.now += 50
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+        sender.sendto(b"\x01", socket_path)
+    switch.run_once(timeout=1)
+    assert switch.last_heartbeat == clock.now
+    clock.now += 50
+    switch.run_once(timeout=0)
+    assert cloud.terminations == 0
+    switch.close()
+    assert not os.path.exists(socket_path)
+
+
+def test_file_heartbeat(tmpdir, clock):
+
+    cloud = FakeCloud()
+    heartbeat_file = str(tmpdir / "heartbeat")
+    with open(heartbeat_file, "w") as f:
+        f.write("0")
+    switch = DeadManSwitch(cloud.terminate, 60, heartbeat_file=heartbeat_file, poll_interval=1, clock=clock)
+    clock.now += 50
+    with open(heartbeat_file, "w") as f:
+        f.write("1")
+    os.utime(heartbeat_file, (0, 0))  # the polling watcher compares the modification times
+    clock.now += 1
+    switch.run_once(timeout=1)
+    assert switch.last_heartbeat == clock.now
+    switch.close()
+
+
+def test_inotify_watcher(tmpdir):
+
+    try:
+        watcher = InotifyWatcher(str(tmpdir / "heartbeat"))
+    except OSError:
+        pytest.skip("inotify is not available")
+    assert not watcher.read_events()
+    (tmpdir / "other").write("1")
+    assert not watcher.read_events()
+    (tmpdir / "heartbeat").write("1")
+    assert watcher.read_events()
+    watcher.close()
@@ -0,0 +1,66 @@
+from gns3server import envelope
+import gns3server.jsonrpc as jsonrpc
+import json
+import pytest
+
+"""
+Tests for the envelope of the messages between the server and the modules
+"""
+
+
+def test_request():
+
+    request = jsonrpc.JSONRPCRequest("vpcs.start", {"id": 1})()
+    frames = envelope.encode_request("session", request)
+    assert len(frames) == 1
+    session, decoded, sent = envelope.decode_request(frames)
+    assert session == "session"
+    assert decoded == request
+    assert sent > 0
+
+
+def test_request_without_session():
+
+    frames = envelope.encode_request(None, jsonrpc.JSONRPCNotification("vpcs.reset")())
+    assert envelope.decode_request(frames)[0] is None
+
+
+def test_module_response_forwarded_as_json():
+
+    response = jsonrpc.JSONRPCResponse({"name": "PC1"}, 42)()
+    # messages for the clients are always in JSON
+    frames = envelope.encode_module_message("session", response, envelope.MSGPACK)
+    session, codec, request_id, method, error_code, payload = envelope.decode_module_header(frames)
+    assert (session, codec, request_id, method, error_code) == ("session", envelope.JSON, 42, None, None)
+    # the payload is forwarded as it is
+    assert json.loads(payload.decode("utf-8")) == response
+
+
+def test_module_error_and_notification():
+
+    error = jsonrpc.JSONRPCCustomError(-3200, "failure", 7)()
+    assert envelope.decode_module_header(envelope.encode_module_message("session", error))[2:5] == (7, None, -3200)
+    notification = jsonrpc.JSONRPCNotification("dynamips.dynamips_stopped", {"module": "dynamips"})()
+    header = envelope.decode_module_header(envelope.encode_module_message("session", notification))
+    assert header[2:5] == (None, "dynamips.dynamips_stopped", None)
+
+
+def test_malformed_message():
+
+    with pytest.raises(ValueError):
+        envelope.decode_module_header([b'["session","json",1,null,null]'])
+    with pytest.raises(ValueError):
+        envelope.decode_module_header([b"session", b"[]"])
+    with pytest.raises(ValueError):
+        envelope.decode_request([b'[null,"json",0]\n{'])
+
+
+def test_msgpack_codec():
+
+    pytest.importorskip("msgpack")
+    assert envelope.available_codec(envelope.MSGPACK) == envelope.MSGPACK
+    notification = jsonrpc.JSONRPCNotification("builtin.telemetry", {"nodes": {}})()
+    frames = envelope.encode_module_message(None, notification, envelope.MSGPACK)
+    session, codec, request_id, method, error_code, payload = envelope.decode_module_header(frames)
+    assert codec == envelope.MSGPACK
+    assert envelope.decode(codec, payload) == notification
@@ -0,0 +1,49 @@
+from gns3server.modules.id_allocator import IdAllocator
+from gns3server import sharding
+
+"""
+Tests for the identifier allocator
+"""
+
+
+def test_allocate_and_release():
+
+    allocator = IdAllocator(1, 4)
+    assert [allocator.allocate() for _ in range(3)] == [1, 2, 3]
+    assert allocator.allocate() is None
+    allocator.release(2)
+    assert 2 not in allocator
+    assert allocator.allocate() == 2
+    assert len(allocator) == 3
+    allocator.reset()
+    assert len(allocator) == 0
+    assert allocator.allocate() == 1
+
+
+def test_reserve():
+
+    allocator = IdAllocator(1, 10)
+    assert allocator.reserve(2)
+    assert not allocator.reserve(2)
+    # reserved identifiers are skipped
+    assert [allocator.allocate() for _ in range(2)] == [1, 3]
+    allocator.release(3)
+    assert allocator.reserve(3)
+    assert allocator.allocate() == 4
+    # identifiers outside of the range can be reserved
+    assert allocator.reserve(5000)
+    allocator.release(5000)
+    assert allocator.allocate() == 5
+
+
+def test_sharded_allocation():
+
+    sharding.set_worker(1, 2)
+    try:
+        allocator = IdAllocator(1, 8)
+        assert [allocator.allocate() for _ in range(4)] == [1, 3, 5, 7]
+        assert allocator.allocate() is None
+        groups = IdAllocator(0, 3, sharded=False)
+        assert [groups.allocate() for _ in range(3)] == [0, 1, 2]
+    finally:
+        sharding.set_worker(0, 1)
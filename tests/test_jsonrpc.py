@@ -70,6 +70,29 @@ class JSONRPC(AsyncTestCase):
         assert json_response["id"] == request.id
         assert json_response["error"].get("code") == -32602
 
+    def test_batch_request(self):
+
+        params = {"echo": "test"}
+        first = jsonrpc.JSONRPCRequest("dynamips.echo", params)
+        second = jsonrpc.JSONRPCRequest("vpcs.echo", params)
+        notification = jsonrpc.JSONRPCNotification("dynamips.echo", params)
+        batch = "[{}, {}, {}, 42]".format(first, notification, second)
+        AsyncWSRequest(self.URL, self.io_loop, self.stop, batch)
+        response = self.wait()
+        json_response = json_decode(response)
+        assert len(json_response) == 3
+        results = {r["id"]: r.get("result") for r in json_response if "result" in r}
+        assert results == {first.id: params, second.id: params}
+        errors = [r for r in json_response if "error" in r]
+        assert errors[0]["error"].get("code") == -32600
+
+    def test_empty_batch_request(self):
+
+        AsyncWSRequest(self.URL, self.io_loop, self.stop, "[]")
+        response = self.wait()
+        json_response = json_decode(response)
+        assert json_response["error"].get("code") == -32600
+
 
 class AsyncWSRequest(TornadoWebSocketClient):
     """
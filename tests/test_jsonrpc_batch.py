@@ -0,0 +1,90 @@
+from tornado.escape import json_decode
+from tornado.escape import json_encode
+from gns3server.handlers.jsonrpc_websocket import JSONRPCBatch
+from gns3server.handlers.jsonrpc_websocket import JSONRPCWebSocket
+import gns3server.jsonrpc as jsonrpc
+
+"""
+Tests for JSON-RPC batch response collection
+"""
+
+
+class FakeHandler(object):
+
+    def __init__(self):
+        self.messages = []
+        self.forgotten = []
+
+    def write_message(self, message):
+        self.messages.append(message)
+
+    def forget_batch(self, batch):
+        self.forgotten.append(batch)
+
+
+def test_batch_waits_for_module_responses():
+
+    handler = FakeHandler()
+    batch = JSONRPCBatch(handler, 60)
+    batch.write_message(jsonrpc.JSONRPCMethodNotFound(1)())
+    batch.expect(2)
+    batch.seal()
+    assert handler.messages == []
+    batch.add_response(2, json_encode(jsonrpc.JSONRPCResponse(True, 2)()))
+    assert len(handler.messages) == 1
+    responses = json_decode(handler.messages[0])
+    assert [response["id"] for response in responses] == [1, 2]
+    assert handler.forgotten == [batch]
+
+
+def test_batch_of_notifications():
+
+    handler = FakeHandler()
+    batch = JSONRPCBatch(handler, 60)
+    batch.seal()
+    assert handler.messages == []
+
+
+def test_batch_expiration():
+
+    handler = FakeHandler()
+    batch = JSONRPCBatch(handler, 60)
+    batch.expect("a")
+    batch.seal()
+    batch._expire()
+    responses = json_decode(handler.messages[0])
+    assert responses[0]["id"] == "a"
+    assert responses[0]["error"]["code"] == -32603
+
+
+class FakeSpawner(object):
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, identity, message, spawn=True):
+        self.sent.append(identity)
+
+
+def test_duplicate_request_ids(request):
+
+    handler = JSONRPCWebSocket.__new__(JSONRPCWebSocket)
+    handler._session_id = "session"
+    handler._batches = {}
+    handler.module_spawner = FakeSpawner()
+    handler.destinations = {"dynamips.echo": "dynamips"}
+    request.addfinalizer(JSONRPCWebSocket.pending_requests.clear)
+
+    batch = JSONRPCBatch(handler, 60)
+    for request_id in (1, 2, 1):
+        handler._handle_request({"jsonrpc": 2.0, "method": "dynamips.echo", "id": request_id}, batch)
+    assert handler.module_spawner.sent == ["dynamips", "dynamips"]
+    # the duplicate ID is rejected, the first request keeps its response
+    assert [json_decode(response)["error"]["code"] for response in batch._responses] == [-32600]
+    assert handler._batches == {1: batch, 2: batch}
+
+    # an ID used by a batch in flight cannot be reused
+    other_batch = JSONRPCBatch(handler, 60)
+    handler._handle_request({"jsonrpc": 2.0, "method": "dynamips.echo", "id": 2}, other_batch)
+    assert len(other_batch._responses) == 1
+    assert handler._batches[2] is batch
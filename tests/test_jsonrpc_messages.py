@@ -0,0 +1,49 @@
+import json
+import gns3server.jsonrpc as jsonrpc
+
+"""
+Tests for JSON-RPC message construction
+"""
+
+
+def test_request():
+
+    request = jsonrpc.JSONRPCRequest("dynamips.echo", {"echo": "test"})
+    assert request.method == "dynamips.echo"
+    assert json.loads(str(request)) == {"jsonrpc": 2.0,
+                                        "id": request.id,
+                                        "method": "dynamips.echo",
+                                        "params": {"echo": "test"}}
+
+
+def test_request_without_params():
+
+    assert "params" not in jsonrpc.JSONRPCRequest("dynamips.echo", request_id=1)()
+
+
+def test_notification():
+
+    assert jsonrpc.JSONRPCNotification("vpcs.reset")() == {"jsonrpc": 2.0, "method": "vpcs.reset"}
+
+
+def test_response():
+
+    assert jsonrpc.JSONRPCResponse(True, 42)() == {"jsonrpc": 2.0, "id": 42, "result": True}
+
+
+def test_errors():
+
+    assert jsonrpc.JSONRPCParseError()()["error"]["code"] == -32700
+    assert jsonrpc.JSONRPCInvalidRequest()()["error"]["code"] == -32600
+    assert jsonrpc.JSONRPCMethodNotFound(1)()["error"]["code"] == -32601
+    assert jsonrpc.JSONRPCInvalidParams(1)()["error"]["code"] == -32602
+    assert jsonrpc.JSONRPCInternalError()() == {"jsonrpc": 2.0,
+                                                "id": None,
+                                                "error": {"code": -32603, "message": "Internal error"}}
+    assert jsonrpc.JSONRPCCustomError(-3200, "error", 1)()["error"] == {"code": -3200, "message": "error"}
+
+
+def test_encoder():
+
+    message = json.dumps([jsonrpc.JSONRPCResponse(True, 1)], cls=jsonrpc.JSONRPCEncoder)
+    assert json.loads(message) == [{"jsonrpc": 2.0, "id": 1, "result": True}]
@@ -0,0 +1,163 @@
+from gns3server.modules.link_impairment import TokenBucket
+from gns3server.modules.link_impairment import TimerWheel
+from gns3server.modules.link_impairment import LinkImpairments
+from gns3server.modules.link_impairment import ReadPoller
+import socket
+import time
+import pytest
+
+"""
+Tests for the link impairment of UDP NIOs
+"""
+
+
+@pytest.fixture
+def link_impairments(request):
+
+    link_impairments = LinkImpairments()
+    request.addfinalizer(link_impairments.close)
+    return link_impairments
+
+
+def udp_socket(port=0):
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", port))
+    sock.settimeout(2)
+    return sock
+
+
+def unused_port():
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_token_bucket():
+
+    bucket = TokenBucket(1000, 1500, queue_limit=1, now=0)
+    assert bucket.reserve(1500, 0) == 0  # burst
+    assert bucket.reserve(500, 0) == 0.5  # waits for the tokens
+    assert bucket.reserve(1000, 0) is None  # would wait longer than the queue limit
+    assert bucket.reserve(500, 1.5) == 0  # 1500 tokens added, 1000 owed
+
+
+def test_timer_wheel():
+
+    wheel = TimerWheel(tick=0.001, slots=8, now=0)
+    wheel.schedule(0.003, "b")
+    wheel.schedule(0.002, "a")
+    wheel.schedule(0.020, "c")  # due in a later revolution
+    assert len(wheel) == 3
+    assert wheel.next_deadline() == pytest.approx(0.002)
+    assert wheel.expire(0.001) == []
+    assert wheel.expire(0.005) == ["a", "b"]
+    assert wheel.expire(0.012) == []  # same slot as "c", one revolution earlier
+    assert wheel.expire(0.050) == ["c"]
+    assert not wheel
+
+
+@pytest.mark.parametrize("use_poll", [True, False])
+def test_read_poller(use_poll):
+
+    poller = ReadPoller()
+    if not use_poll:
+        # select() is used where poll() is not available
+        poller._poll = None
+    receiver = udp_socket()
+    sender = udp_socket()
+    poller.register(receiver, "receiver")
+    assert poller.poll(0) == []
+    sender.sendto(b"data", receiver.getsockname())
+    assert poller.poll(1) == [(receiver, "receiver")]
+    poller.unregister(receiver)
+    assert poller.poll(0) == []
+    poller.close()
+    receiver.close()
+    sender.close()
+
+
+def test_not_relayed(link_impairments):
+
+    assert link_impairments.attach(10000, "127.0.0.1", 10001, "127.0.0.1") == (10000, "127.0.0.1", 10001)
+    assert link_impairments.detach(10000) == 10000
+
+
+def test_relay(link_impairments):
+
+    peer = udp_socket()
+    lport = unused_port()
+    assert not link_impairments.set(lport, latency=50)
+    emulator_port, rhost, rport = link_impairments.attach(lport, "127.0.0.1", peer.getsockname()[1], "127.0.0.1")
+    assert emulator_port != lport
+    # the port is reserved until the emulator binds it
+    with pytest.raises(OSError):
+        udp_socket(emulator_port)
+    link_impairments.release(emulator_port)
+    emulator = udp_socket(emulator_port)
+
+    start = time.monotonic()
+    emulator.sendto(b"ping", (rhost, rport))
+    data, address = peer.recvfrom(1024)
+    assert data == b"ping"
+    assert address[1] == lport  # the peer receives from the NIO port
+    assert time.monotonic() - start >= 0.045
+
+    peer.sendto(b"pong", ("127.0.0.1", lport))
+    assert emulator.recvfrom(1024)[0] == b"pong"
+
+    # the impairment of a relayed link is applied immediately
+    assert link_impairments.set(lport, loss=100)
+    emulator.sendto(b"lost", (rhost, rport))
+    for _ in range(100):
+        if link_impairments.stats(lport)["drops"]["loss"]:
+            break
+        time.sleep(0.01)
+    stats = link_impairments.stats(lport)
+    assert stats["packets"] == 2
+    assert stats["forwarded"] == 1
+    assert stats["drops"]["loss"] == 1
+
+    assert link_impairments.detach(emulator_port) == lport
+    assert link_impairments.stats() == {}
+    emulator.close()
+    peer.close()
+
+
+def test_relink_keeps_impairment(link_impairments):
+
+    peer = udp_socket()
+    lport = unused_port()
+    link_impairments.set(lport, latency=10)
+    emulator_port = link_impairments.attach(lport, "127.0.0.1", peer.getsockname()[1], "127.0.0.1")[0]
+    assert link_impairments.detach(emulator_port) == lport
+
+    # the NIO is created again, e.g. when the link is reconnected
+    assert lport in link_impairments
+    emulator_port = link_impairments.attach(lport, "127.0.0.1", peer.getsockname()[1], "127.0.0.1")[0]
+    assert emulator_port != lport
+
+    # the relay forwards the packets unchanged once the impairment is cleared
+    assert link_impairments.clear(lport)
+    assert lport not in link_impairments
+    assert link_impairments.detach(emulator_port) == lport
+    assert link_impairments.attach(lport, "127.0.0.1", 10001, "127.0.0.1") == (lport, "127.0.0.1", 10001)
+    peer.close()
+
+
+def test_release_node_ports(link_impairments):
+
+    peer = udp_socket()
+    ports = []
+    for node_id in (1, 2):
+        lport = unused_port()
+        link_impairments.set(lport, latency=10)
+        ports.append(link_impairments.attach(lport, "127.0.0.1", peer.getsockname()[1], "127.0.0.1", node_id)[0])
+
+    # node 1 starts: its port is free, the port of node 2 is still reserved
+    link_impairments.release_all(1)
+    udp_socket(ports[0]).close()
+    with pytest.raises(OSError):
+        udp_socket(ports[1])
+    peer.close()
@@ -0,0 +1,120 @@
+from gns3server.modules.dynamips.mac_table import MacAddressTable
+from gns3server.modules.dynamips.mac_table import parse_mac_addr_table
+from gns3server.modules.dynamips.nio_stats import NIOStatsCollector
+from gns3server.modules.dynamips import Dynamips
+
+"""
+Tests for the MAC address table snapshots of the Ethernet switches
+"""
+
+
+class FakeEthernetSwitch(object):
+
+    id = 1
+    name = "SW1"
+    nios = {}
+
+    def __init__(self):
+        self.mac_table = MacAddressTable()
+        self.entries = {}
+
+    def refresh_mac_table(self):
+        return self.mac_table.update(self.entries)
+
+
+def dynamips_module(ethsw):
+    """
+    Returns a Dynamips module (without hypervisors) recording its messages.
+    """
+
+    module = Dynamips.__new__(Dynamips)
+    module._routers = {}
+    module._ethernet_switches = {1: ethsw}
+    module._frame_relay_switches = {}
+    module._atm_switches = {}
+    module._ethernet_hubs = {}
+    module._nio_stats = NIOStatsCollector()
+    module._nio_stats_interval = 10
+    module._nio_stats_subscribers = set()
+    module._mac_table_subscribers = {}
+    module._mac_table_pushed = {}
+    module.responses = []
+    module.notifications = []
+    module.send_response = module.responses.append
+    module._send_message = lambda session, message: module.notifications.append((session, message))
+    return module
+
+
+def handle(module, destination, params):
+
+    Dynamips.modules["dynamips"][destination](module, params)
+
+
+def test_parse_mac_addr_table():
+
+    lines = ["c2:00:12:34:00:00    1 nio_udp0",
+             "C2:01:12:34:00:00   10 nio_udp1",
+             "invalid line"]
+    entries = parse_mac_addr_table(lines, {"nio_udp0": 1, "nio_udp1": 2})
+    assert entries == {("c2:00:12:34:00:00", 1): 1, ("c2:01:12:34:00:00", 10): 2}
+
+
+def test_changes_since():
+
+    table = MacAddressTable()
+    assert table.changes_since() == {"version": 0, "full": True, "entries": []}
+
+    version, learned, aged = table.update({("00:00:00:00:00:01", 1): 1, ("00:00:00:00:00:02", 1): 2})
+    assert version == 1
+    assert len(learned) == 2
+    assert not aged
+
+    # no change, same version
+    assert table.update({("00:00:00:00:00:01", 1): 1, ("00:00:00:00:00:02", 1): 2})[0] == 1
+
+    # 00:01 moved to port 3, 00:02 aged, 00:03 learned
+    table.update({("00:00:00:00:00:01", 1): 3})
+    table.update({("00:00:00:00:00:01", 1): 3, ("00:00:00:00:00:03", 1): 2})
+    assert table.version == 3
+
+    changes = table.changes_since(1)
+    assert not changes["full"]
+    assert sorted(changes["learned"]) == [["00:00:00:00:00:01", 1, 3], ["00:00:00:00:00:03", 1, 2]]
+    assert changes["aged"] == [["00:00:00:00:00:02", 1]]
+    assert table.changes_since(3) == {"version": 3, "full": False, "learned": [], "aged": []}
+    assert table.changes_since(0)["learned"]
+    assert table.changes_since(42)["full"]  # unknown version
+
+
+def test_changes_too_old():
+
+    table = MacAddressTable(max_changes=2)
+    for port in range(5):
+        table.update({("00:00:00:00:00:01", 1): port})
+    assert not table.changes_since(3)["full"]
+    changes = table.changes_since(1)
+    assert changes["full"]
+    assert changes["entries"] == [["00:00:00:00:00:01", 1, 4]]
+
+
+def test_nio_stats_keeps_mac_table_subscription():
+
+    ethsw = FakeEthernetSwitch()
+    module = dynamips_module(ethsw)
+    module._current_session = "session"
+    handle(module, "dynamips.ethsw.mac_table", {"id": 1, "subscribe": True})
+    handle(module, "dynamips.nio_stats", {})
+    assert len(module.responses) == 2
+
+    ethsw.entries = {("00:00:00:00:00:01", 1): 1}
+    module._push_mac_table_changes()
+    assert len(module.notifications) == 1
+    session, notification = module.notifications[0]
+    assert session == "session"
+    assert notification["method"] == "dynamips.ethsw.mac_table_changed"
+    assert notification["params"]["learned"] == [["00:00:00:00:00:01", 1, 1]]
+
+    # the subscription ends with the session
+    handle(module, "dynamips.session_closed", None)
+    assert module._mac_table_subscribers == {}
+    module._current_session = None
@@ -0,0 +1,54 @@
+from tornado.testing import AsyncHTTPTestCase
+from gns3server.handlers.metrics_handler import MetricsHandler
+from gns3server.handlers.jsonrpc_websocket import LATENCY
+from gns3server.metrics import MetricsRegistry
+from gns3server.metrics import render
+import tornado.web
+
+"""
+Tests for the web server metrics handler
+"""
+
+
+class TestMetricsHandler(AsyncHTTPTestCase):
+
+    URL = "/metrics"
+
+    def get_app(self):
+
+        return tornado.web.Application([(self.URL, MetricsHandler)])
+
+    def test_endpoint(self):
+        """
+        Tests if the server and module metrics are exposed
+        in the Prometheus text format
+        """
+
+        LATENCY.observe(0.003, "dynamips.vm.start")
+        module_metrics = MetricsRegistry()
+        module_metrics.counter("gns3_module_requests_total", "Requests", ("method",)).inc("iou.start")
+        MetricsHandler.update_module_metrics(None, "iou", {"metrics": module_metrics.dump()})
+
+        self.http_client.fetch(self.get_url(self.URL), self.stop)
+        response = self.wait()
+        assert response.code == 200
+        assert response.headers['Content-Type'].startswith('text/plain')
+        body = response.body.decode("utf-8")
+        assert '# TYPE gns3_jsonrpc_request_duration_seconds histogram' in body
+        assert 'gns3_jsonrpc_request_duration_seconds_bucket{le="0.005",method="dynamips.vm.start"} 1' in body
+        assert 'gns3_module_requests_total{method="iou.start",module="iou"} 1' in body
+
+
+def test_histogram_rendering():
+
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency", "Latency", ("method",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, "a")
+    histogram.observe(0.5, "a")
+    histogram.observe(5, "a")
+    lines = render(registry.metrics()).splitlines()
+    assert 'latency_bucket{le="0.1",method="a"} 1' in lines
+    assert 'latency_bucket{le="1.0",method="a"} 2' in lines
+    assert 'latency_bucket{le="+Inf",method="a"} 3' in lines
+    assert 'latency_count{method="a"} 3' in lines
+    assert 'latency_sum{method="a"} 5.55' in lines
@@ -0,0 +1,83 @@
+from gns3server.modules.base import IModule
+from tornado.ioloop import IOLoop
+import tornado.httpserver
+import tornado.netutil
+import tornado.web
+import pytest
+import zmq
+import os
+
+"""
+Tests for the I/O loop of module processes spawned by the running server
+"""
+
+
+class DummyModule(IModule):
+
+    def __init__(self, name, *args, **kwargs):
+
+        IModule.__init__(self, name, *args, **kwargs)
+        self._telemetry_interval = 0
+        self._metrics_interval = 0
+
+
+def clear_ioloop_instance():
+
+    if hasattr(IOLoop, "clear_instance"):
+        IOLoop.clear_instance()
+    elif IOLoop.initialized():
+        del IOLoop._instance
+
+
+def socket_inodes(pid):
+
+    inodes = set()
+    fd_dir = "/proc/{}/fd".format(pid)
+    for fd in os.listdir(fd_dir):
+        try:
+            target = os.readlink(os.path.join(fd_dir, fd))
+        except OSError:
+            continue
+        if target.startswith("socket:["):
+            inodes.add(int(target[8:-1]))
+    return inodes
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc"), reason="procfs is required")
+def test_lazy_spawn_does_not_inherit_http_socket():
+
+    context = zmq.Context()
+    router = context.socket(zmq.ROUTER)
+    zmq_port = router.bind_to_random_port("tcp://127.0.0.1")
+
+    # the server loop is the singleton
+    previous_io_loop = IOLoop.instance() if IOLoop.initialized() else None
+    clear_ioloop_instance()
+    io_loop = IOLoop()
+    io_loop.install()
+    sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+    http_server = tornado.httpserver.HTTPServer(tornado.web.Application([]), io_loop=io_loop)
+    http_server.add_sockets(sockets)
+    http_inode = os.fstat(sockets[0].fileno()).st_ino
+
+    # the module is spawned from a callback of the running loop, like on the first request
+    module = DummyModule("dummy", "127.0.0.1", zmq_port)
+    io_loop.add_callback(module.start)
+    io_loop.add_callback(io_loop.stop)
+    io_loop.start()
+    try:
+        assert router.poll(10000), "the module is not ready"
+        identity, message = router.recv_multipart()[:2]
+        assert identity == b"dummy"
+        assert http_inode in socket_inodes(os.getpid())
+        assert http_inode not in socket_inodes(module.pid)
+    finally:
+        module.terminate()
+        module.join(5)
+        http_server.stop()
+        clear_ioloop_instance()
+        io_loop.close(all_fds=True)
+        if previous_io_loop is not None:
+            previous_io_loop.install()
+        router.close()
+        context.term()
@@ -0,0 +1,104 @@
+from gns3server.module_spawner import ModuleSpawner
+import time
+
+"""
+Tests for the on-demand module spawning
+"""
+
+
+class FakeRouter(object):
+
+    def __init__(self):
+        self.sent = []
+        self._identity = None
+
+    def send_string(self, string, flags=0):
+        if self._identity is None:
+            self._identity = string
+        else:
+            self.sent.append((self._identity, string))
+            self._identity = None
+
+    def send_multipart(self, frames):
+        self.sent.append((frames[0].decode("utf-8"), frames[1:]))
+
+
+class FakeModule(object):
+
+    def __init__(self, identity):
+        self.identity = identity
+        self.started = False
+        self.alive = False
+
+    def start(self):
+        self.started = True
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+    def join(self, timeout=None):
+        pass
+
+
+def test_spawn_on_first_request():
+
+    spawned = []
+
+    def factory():
+        spawned.append(FakeModule("vpcs"))
+        return spawned[-1:]
+
+    spawner = ModuleSpawner()
+    spawner.router = FakeRouter()
+    spawner.register("vpcs", factory)
+    assert spawned == []
+    # nothing to reset if the module hasn't been spawned
+    assert not spawner.send("vpcs", ["session", "reset"], spawn=False)
+    assert spawned == []
+
+    assert spawner.send("vpcs", ["session", "request 1"])
+    assert spawner.send("vpcs", ["session", "request 2"])
+    assert len(spawned) == 1 and spawned[0].started
+    assert spawner.router.sent == []
+
+    spawner.module_ready("vpcs")
+    assert spawner.router.sent == [("vpcs", ["session", "request 1"]), ("vpcs", ["session", "request 2"])]
+    assert "vpcs" in spawner.startup_times
+    spawner.send("vpcs", ["session", "request 3"])
+    assert spawner.router.sent[-1] == ("vpcs", ["session", "request 3"])
+
+
+def test_eager_module():
+
+    spawner = ModuleSpawner()
+    spawner.router = FakeRouter()
+    spawner.register("deadman", lambda: [FakeModule("deadman")], lazy=False)
+    assert spawner.is_spawned("deadman")
+    spawner.send("deadman", ["session", "heartbeat"])
+    assert spawner.router.sent == [("deadman", ["session", "heartbeat"])]
+
+
+def test_reap_idle_module():
+
+    spawner = ModuleSpawner(idle_timeout=0.01)
+    spawner.router = FakeRouter()
+    modules = []
+    spawner.register("iou", lambda: modules.append(FakeModule("iou")) or modules[-1:])
+    spawner.send("iou", ["session", "request"])
+    spawner.module_ready("iou")
+
+    # clients are connected, the module may have devices
+    spawner.reap(clients_connected=True)
+    assert spawner.router.sent[-1] == ("iou", ["session", "request"])
+
+    time.sleep(0.02)
+    spawner.reap(clients_connected=False)
+    assert spawner.router.sent[-1] == ("iou", "stop")
+    # a request received while the module is stopping spawns a new process
+    spawner.send("iou", ["session", "request 2"])
+    modules[0].alive = False
+    spawner.reap(clients_connected=False)
+    assert len(modules) == 2
+    spawner.module_ready("iou")
+    assert spawner.router.sent[-1] == ("iou", ["session", "request 2"])
@@ -0,0 +1,79 @@
+from gns3server.modules.dynamips.nio_stats import CounterSeries
+from gns3server.modules.dynamips.nio_stats import NIOStatsCollector
+from gns3server.modules.dynamips import DynamipsError
+
+"""
+Tests for the collection of the Dynamips NIO statistics
+"""
+
+
+class FakeHypervisor(object):
+
+    host = "127.0.0.1"
+    port = 7200
+
+    def __init__(self):
+        self.counters = {}
+        self.batches = []
+
+    def send_batch(self, commands):
+        self.batches.append(commands)
+        results = []
+        for command in commands:
+            name = command.split()[-1]
+            if name in self.counters:
+                results.append([" ".join(str(value) for value in self.counters[name])])
+            else:
+                results.append(DynamipsError("unable to find NIO '{}'".format(name)))
+        return results
+
+
+class FakeNIO(object):
+
+    def __init__(self, hypervisor, name):
+        self.hypervisor = hypervisor
+        self.name = name
+
+
+def test_counter_series():
+
+    series = CounterSeries(3)
+    assert series.rates() is None
+    for second in range(5):
+        series.append(second, [second * 10, 0, second * 1000, 0])
+    assert len(series) == 3
+    assert series.sample() == (4, [40, 0, 4000, 0])
+    assert series.rates() == [10, 0, 1000, 0]
+    assert [sample[0] for sample in series.history()] == [2, 3, 4]
+
+    series.append(5, [5, 0, 500, 0])  # the counters have been reset
+    assert series.rates() == [5, 0, 500, 0]
+
+
+def test_collect():
+
+    hypervisor = FakeHypervisor()
+    nio1 = FakeNIO(hypervisor, "nio_udp0")
+    nio2 = FakeNIO(hypervisor, "nio_udp1")
+    endpoints = [(nio1, {"type": "ethsw", "id": 1, "port": 1}),
+                 (nio2, {"type": "ethsw", "id": 1, "port": 2})]
+
+    collector = NIOStatsCollector(history=10)
+    hypervisor.counters = {"nio_udp0": [1, 2, 100, 200], "nio_udp1": [0, 0, 0, 0]}
+    collector.collect(endpoints, now=100)
+    hypervisor.counters = {"nio_udp0": [11, 22, 1100, 2200], "nio_udp1": [0, 0, 0, 0]}
+    collector.collect(endpoints, now=110)
+    assert len(hypervisor.batches) == 2  # one batch per hypervisor and collection
+    assert len(hypervisor.batches[0]) == 2
+
+    nios = collector.snapshot(history=True)
+    assert nios[0]["nio"] == "nio_udp0"
+    assert nios[0]["port"] == 1
+    assert nios[0]["packets_in"] == 11
+    assert nios[0]["rates"] == {"packets_in": 1, "packets_out": 2, "bytes_in": 100, "bytes_out": 200}
+    assert len(nios[0]["history"]) == 2
+
+    # deleted NIOs are forgotten
+    hypervisor.counters = {"nio_udp0": [12, 23, 1200, 2300]}
+    collector.collect(endpoints, now=120)
+    assert [nio["nio"] for nio in collector.snapshot()] == ["nio_udp0"]
@@ -0,0 +1,144 @@
+from gns3server.handlers.jsonrpc_websocket import OutboundQueue
+from gns3server.handlers.jsonrpc_websocket import COALESCED
+from gns3server.handlers.jsonrpc_websocket import DROPPED
+
+"""
+Tests for the Websocket outbound queue
+"""
+
+
+class FakeIOLoop(object):
+
+    def __init__(self):
+        self.timeouts = []
+
+    def time(self):
+        return 0
+
+    def add_timeout(self, deadline, callback):
+        self.timeouts.append(callback)
+        return callback
+
+    def remove_timeout(self, handle):
+        self.timeouts.remove(handle)
+
+
+class FakeClient(object):
+
+    def __init__(self):
+        self.written = []
+        self.flush_callback = None
+        self.overflows = 0
+
+    def write(self, message, binary):
+        self.written.append(message)
+
+    def wait_flush(self, callback):
+        self.flush_callback = callback
+
+    def flush(self):
+        self.flush_callback()
+
+    def overflow(self):
+        self.overflows += 1
+
+
+def create_queue(client, max_size=100):
+
+    io_loop = FakeIOLoop()
+    queue = OutboundQueue(client.write, client.wait_flush, 10, max_size, on_overflow=client.overflow, io_loop=io_loop)
+    return queue, io_loop
+
+
+def fill(client, queue):
+    """
+    Writes a message reaching the high-water mark, the next ones are queued.
+    """
+
+    queue.put("0123456789")
+    client.written.remove("0123456789")
+
+
+def test_written_below_high_water_mark():
+
+    client = FakeClient()
+    queue, io_loop = create_queue(client)
+    queue.put("a")
+    queue.put("b")
+    assert client.written == ["a", "b"]
+    assert len(queue) == 0
+    assert queue.unflushed == 2
+    assert io_loop.timeouts == []
+    client.flush()
+    assert queue.unflushed == 0
+
+
+def test_queued_above_high_water_mark():
+
+    client = FakeClient()
+    queue, io_loop = create_queue(client)
+    fill(client, queue)
+    queue.put("a")
+    queue.put("b")
+    assert client.written == []
+    assert queue.size == 2
+    assert len(io_loop.timeouts) == 1
+    # buffer still full: the drain is scheduled again
+    client.flush_callback = None
+    io_loop.timeouts.pop()()
+    assert client.written == []
+    assert client.flush_callback is not None
+    client.flush()
+    assert client.written == ["a", "b"]
+    assert queue.size == 0
+    io_loop.timeouts.pop()()
+    assert io_loop.timeouts == []
+    # order is kept when the queue is not empty
+    queue.put("c")
+    assert client.written == ["a", "b", "c"]
+
+
+def test_coalesced_notifications():
+
+    client = FakeClient()
+    queue, io_loop = create_queue(client)
+    fill(client, queue)
+    coalesced = COALESCED.samples()
+    queue.put("status 1 up", method="status", coalesce_key=("status", 1))
+    queue.put("response")
+    queue.put("status 2 up", method="status", coalesce_key=("status", 2))
+    queue.put("status 1 down", method="status", coalesce_key=("status", 1))
+    assert len(queue) == 3
+    assert COALESCED.samples() != coalesced
+    while len(queue):
+        client.flush()
+    # the superseded notification is replaced and moved after the messages sent before it
+    assert client.written == ["response", "status 2 up", "status 1 down"]
+
+
+def test_notifications_dropped_when_full():
+
+    client = FakeClient()
+    queue, io_loop = create_queue(client, max_size=10)
+    fill(client, queue)
+    dropped = DROPPED.samples()
+    queue.put("12345", method="event")
+    queue.put("abcde")
+    queue.put("xyz", method="event")
+    assert queue.size == 8
+    assert DROPPED.samples() != dropped
+    client.flush()
+    assert client.written == ["abcde", "xyz"]
+    assert client.overflows == 0
+
+
+def test_overflow():
+
+    client = FakeClient()
+    queue, io_loop = create_queue(client, max_size=10)
+    fill(client, queue)
+    queue.put("12345")
+    queue.put("abcdef")
+    assert client.overflows == 1
+    assert queue.size == 0
+    assert io_loop.timeouts == []
@@ -0,0 +1,160 @@
+from tornado.testing import AsyncHTTPTestCase
+from gns3server.config import Config
+from gns3server.project_archive import ProjectArchiveWriter
+from gns3server.project_archive import extract_archive
+from gns3server.project_archive import crc32_combine
+from gns3server.project_archive import crc32_zeros
+from gns3server.handlers.project_handler import ProjectExportHandler
+from gns3server.handlers.project_handler import ProjectImportHandler
+from gns3server.handlers.project_handler import ProjectSnapshotsHandler
+from gns3server.handlers.project_handler import ProjectSnapshotRestoreHandler
+import tornado.web
+import tempfile
+import zipfile
+import shutil
+import zlib
+import json
+import io
+import os
+import pytest
+
+"""
+Tests for the project archives export & import (and the snapshot handlers)
+"""
+
+
+def create_project(path):
+
+    os.makedirs(os.path.join(path, "dynamips", "configs"))
+    os.makedirs(os.path.join(path, "iou", "device-1"))
+    with open(os.path.join(path, "dynamips", "configs", "i1_startup-config.cfg"), "w") as f:
+        f.write("hostname R1\n" * 100)
+    with open(os.path.join(path, "random.bin"), "wb") as f:
+        f.write(os.urandom(300000))
+    with open(os.path.join(path, "disk.qcow2"), "wb") as f:
+        # sparse file
+        f.write(b"QFI\xfb")
+        f.seek(10 * 1024 * 1024)
+        f.write(b"end")
+
+
+def test_crc32_combine():
+
+    a = os.urandom(1000)
+    b = os.urandom(3000)
+    assert crc32_combine(zlib.crc32(a), zlib.crc32(b), len(b)) == zlib.crc32(a + b)
+    assert crc32_zeros(zlib.crc32(a), 70000) == zlib.crc32(a + bytes(70000))
+    assert crc32_zeros(0, 0) == 0
+
+
+def test_export_import(tmpdir):
+
+    project_dir = str(tmpdir / "project")
+    create_project(project_dir)
+    data = b"".join(ProjectArchiveWriter(project_dir, workers=4, chunk_size=65536))
+
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    assert archive.testzip() is None
+    names = archive.namelist()
+    assert "dynamips/configs/i1_startup-config.cfg" in names
+    assert "iou/device-1/" in names
+    assert archive.getinfo("disk.qcow2").file_size == 10 * 1024 * 1024 + 3
+
+    destination = str(tmpdir / "imported")
+    assert extract_archive(data, destination, workers=4, chunk_size=65536) == 3
+    for name in ("random.bin", "disk.qcow2", os.path.join("dynamips", "configs", "i1_startup-config.cfg")):
+        with open(os.path.join(project_dir, name), "rb") as f1, open(os.path.join(destination, name), "rb") as f2:
+            assert f1.read() == f2.read()
+    assert os.path.isdir(os.path.join(destination, "iou", "device-1"))
+
+    with pytest.raises(FileExistsError):
+        extract_archive(data, destination)
+
+
+def test_import_invalid_name(tmpdir):
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("../evil.txt", "evil")
+    with pytest.raises(ValueError):
+        extract_archive(buffer.getvalue(), str(tmpdir / "project"))
+    assert not os.path.exists(str(tmpdir / "evil.txt"))
+    assert os.listdir(str(tmpdir)) == []
+
+
+class TestProjectHandlers(AsyncHTTPTestCase):
+
+    def get_app(self):
+
+        self._projects_dir = tempfile.mkdtemp()
+        server_config = Config.instance().get_default_section()
+        self._previous_projects_dir = server_config.get("projects_directory")
+        server_config["projects_directory"] = self._projects_dir
+        return tornado.web.Application([(r"/projects/([^/]+)/export", ProjectExportHandler),
+                                        (r"/projects/([^/]+)/import", ProjectImportHandler),
+                                        (r"/projects/([^/]+)/snapshots", ProjectSnapshotsHandler),
+                                        (r"/projects/([^/]+)/snapshots/([^/]+)/restore", ProjectSnapshotRestoreHandler)])
+
+    def tearDown(self):
+
+        server_config = Config.instance().get_default_section()
+        if self._previous_projects_dir is None:
+            del server_config["projects_directory"]
+        else:
+            server_config["projects_directory"] = self._previous_projects_dir
+        shutil.rmtree(self._projects_dir, ignore_errors=True)
+        super().tearDown()
+
+    def test_export_import(self):
+
+        create_project(os.path.join(self._projects_dir, "project1"))
+        self.http_client.fetch(self.get_url("/projects/project1/export"), self.stop, request_timeout=10)
+        response = self.wait(timeout=10)
+        assert response.code == 200
+        assert response.headers["Content-Type"] == "application/zip"
+        archive = response.body
+        assert zipfile.ZipFile(io.BytesIO(archive)).testzip() is None
+
+        self.http_client.fetch(self.get_url("/projects/project2/import"), self.stop, method="POST", body=archive)
+        response = self.wait(timeout=10)
+        assert response.code == 200
+        assert json.loads(response.body.decode("utf-8")) == {"project": "project2", "files": 3}
+        with open(os.path.join(self._projects_dir, "project2", "random.bin"), "rb") as f:
+            with open(os.path.join(self._projects_dir, "project1", "random.bin"), "rb") as f2:
+                assert f.read() == f2.read()
+
+        # the project already exists
+        self.http_client.fetch(self.get_url("/projects/project2/import"), self.stop, method="POST", body=archive)
+        assert self.wait().code == 409
+
+    def test_export_unknown_project(self):
+
+        self.http_client.fetch(self.get_url("/projects/unknown/export"), self.stop)
+        assert self.wait().code == 404
+        self.http_client.fetch(self.get_url("/projects/../export"), self.stop)
+        assert self.wait().code in (400, 404)
+
+    def test_snapshots(self):
+
+        create_project(os.path.join(self._projects_dir, "project1"))
+        self.http_client.fetch(self.get_url("/projects/project1/snapshots?name=snap1"), self.stop, method="POST", body="")
+        response = self.wait(timeout=10)
+        assert response.code == 200
+        assert sum(json.loads(response.body.decode("utf-8")).values()) == 3
+
+        self.http_client.fetch(self.get_url("/projects/project1/snapshots"), self.stop)
+        snapshots = json.loads(self.wait().body.decode("utf-8"))["snapshots"]
+        assert [snapshot["name"] for snapshot in snapshots] == ["snap1"]
+
+        path = os.path.join(self._projects_dir, "project1", "random.bin")
+        with open(path, "wb") as f:
+            f.write(b"changed")
+        self.http_client.fetch(self.get_url("/projects/project1/snapshots/snap1/restore"), self.stop, method="POST", body="")
+        response = self.wait(timeout=10)
+        assert response.code == 200
+        assert os.path.getsize(path) == 300000
+
+        # the snapshots are not exported
+        self.http_client.fetch(self.get_url("/projects/project1/export"), self.stop)
+        names = zipfile.ZipFile(io.BytesIO(self.wait(timeout=10).body)).namelist()
+        assert not [name for name in names if name.startswith("snapshots")]
@@ -0,0 +1,153 @@
+from gns3server.project_snapshot import ProjectSnapshots
+from gns3server.project_snapshot import SnapshotError
+from gns3server.project_snapshot import sparse_copy
+import subprocess
+import sys
+import shutil
+import os
+import pytest
+
+"""
+Tests for the project snapshots
+"""
+
+
+def write(path, data, mode="w"):
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode) as f:
+        f.write(data)
+
+
+def read(path):
+
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.fixture
+def project(tmpdir):
+
+    path = str(tmpdir / "project")
+    write(os.path.join(path, "dynamips", "c7200_i1_nvram"), b"\x01" * 4096, "wb")
+    write(os.path.join(path, "dynamips", "configs", "i1_startup-config.cfg"), "hostname R1\n")
+    write(os.path.join(path, "iou", "device-1", "nvram"), b"\x02" * 1024, "wb")
+    return path
+
+
+def test_sparse_copy(tmpdir):
+
+    source = str(tmpdir / "disk.img")
+    with open(source, "wb") as f:
+        f.write(b"start")
+        f.seek(20 * 1024 * 1024)
+        f.write(b"end")
+    destination = str(tmpdir / "copy.img")
+    sparse_copy(source, destination)
+    assert read(source) == read(destination)
+    assert os.stat(destination).st_blocks <= os.stat(source).st_blocks
+
+
+def test_snapshot_restore(project):
+
+    snapshots = ProjectSnapshots(project)
+    stats = snapshots.create("snap1")
+    assert sum(stats.values()) == 3
+    assert [snapshot["name"] for snapshot in snapshots.list()] == ["snap1"]
+
+    # the project changes
+    nvram = os.path.join(project, "dynamips", "c7200_i1_nvram")
+    write(nvram, b"\x03" * 8192, "wb")
+    write(os.path.join(project, "iou", "device-2", "nvram"), b"\x04", "wb")
+    os.remove(os.path.join(project, "dynamips", "configs", "i1_startup-config.cfg"))
+
+    stats = snapshots.restore("snap1")
+    assert stats["unchanged"] == 1  # the IOU nvram
+    assert stats["deleted"] == 2  # device-2 and its nvram
+    assert read(nvram) == b"\x01" * 4096
+    assert read(os.path.join(project, "dynamips", "configs", "i1_startup-config.cfg")) == b"hostname R1\n"
+    assert not os.path.exists(os.path.join(project, "iou", "device-2"))
+    # the snapshot is not modified by changes made after a restore
+    write(nvram, b"\x05", "wb")
+    snapshots.restore("snap1")
+    assert read(nvram) == b"\x01" * 4096
+
+
+def test_unchanged_files_hardlinked(project):
+
+    snapshots = ProjectSnapshots(project)
+    snapshots.create("snap1")
+    write(os.path.join(project, "iou", "device-1", "nvram"), b"\x06" * 1024, "wb")
+    stats = snapshots.create("snap2")
+    assert stats["hardlink"] == 2
+    snapshots_dir = os.path.join(project, "snapshots")
+    nvram1 = os.stat(os.path.join(snapshots_dir, "snap1", "dynamips", "c7200_i1_nvram"))
+    nvram2 = os.stat(os.path.join(snapshots_dir, "snap2", "dynamips", "c7200_i1_nvram"))
+    assert nvram1.st_ino == nvram2.st_ino
+
+    snapshots.delete("snap1")
+    assert [snapshot["name"] for snapshot in snapshots.list()] == ["snap2"]
+    snapshots.restore("snap2")
+    assert read(os.path.join(project, "dynamips", "c7200_i1_nvram")) == b"\x01" * 4096
+
+
+def test_invalid_snapshots(project):
+
+    snapshots = ProjectSnapshots(project)
+    snapshots.create("snap1")
+    with pytest.raises(SnapshotError):
+        snapshots.create("snap1")
+    with pytest.raises(SnapshotError):
+        snapshots.create("../snap")
+    with pytest.raises(SnapshotError):
+        snapshots.restore("unknown")
+
+
+def test_qcow2_internal_snapshot(project):
+
+    qemu_img = shutil.which("qemu-img")
+    if qemu_img is None:
+        pytest.skip("qemu-img is not available")
+    disk = os.path.join(project, "qemu", "vm-1", "hda_disk.qcow2")
+    os.makedirs(os.path.dirname(disk))
+    subprocess.check_call([qemu_img, "create", "-f", "qcow2", disk, "64M"])
+    snapshots = ProjectSnapshots(project, qemu_img=qemu_img)
+    assert snapshots.create("snap1")["qcow2"] == 1
+    assert b"gns3-snap1" in subprocess.check_output([qemu_img, "snapshot", "-l", disk])
+    assert snapshots.restore("snap1")["qcow2"] == 1
+    snapshots.delete("snap1")
+    assert b"gns3-snap1" not in subprocess.check_output([qemu_img, "snapshot", "-l", disk])
+
+
+def test_nodes_must_be_stopped(project):
+
+    snapshots = ProjectSnapshots(project)
+    snapshots.create("before")
+    nvram = os.path.join(project, "dynamips", "c7200_i1_nvram")
+    # stands in for a running node keeping its NVRAM open
+    node = subprocess.Popen([sys.executable, "-c", "import sys; f = open(sys.argv[1], 'r+b'); print(flush=True); sys.stdin.read()", nvram],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        node.stdout.readline()
+        with pytest.raises(SnapshotError):
+            snapshots.create("running")
+        with pytest.raises(SnapshotError):
+            snapshots.restore("before")
+    finally:
+        node.communicate()
+    snapshots.restore("before")
+    snapshots.create("stopped")
+
+
+def test_log_files_do_not_block_snapshots(project):
+
+    log_file = os.path.join(project, "dynamips", "dynamips_log_7200.txt")
+    write(log_file, "")
+    # a hypervisor keeps its log file open for writing
+    hypervisor = subprocess.Popen([sys.executable, "-c", "import sys; f = open(sys.argv[1], 'a'); print(flush=True); sys.stdin.read()", log_file],
+                                  stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        hypervisor.stdout.readline()
+        ProjectSnapshots(project).create("snap")
+    finally:
+        hypervisor.communicate()
@@ -0,0 +1,63 @@
+from gns3server.modules.base import RequestDispatcher
+from tornado.ioloop import IOLoop
+import threading
+import time
+
+"""
+Tests for the dispatcher running module handlers in a thread pool
+"""
+
+
+def run_requests(requests, max_workers=4):
+    """
+    Submits requests (key, duration) and returns the (event, key, index) log.
+    """
+
+    io_loop = IOLoop()
+    dispatcher = RequestDispatcher(io_loop, max_workers)
+    events = []
+    lock = threading.Lock()
+    done = []
+
+    def handler(index, key, duration):
+        with lock:
+            events.append(("start", key, index))
+        time.sleep(duration)
+        with lock:
+            events.append(("end", key, index))
+        done.append(index)
+        if len(done) == len(requests):
+            io_loop.add_callback(io_loop.stop)
+
+    for index, (key, duration) in enumerate(requests):
+        dispatcher.submit(key, lambda index=index, key=key, duration=duration: handler(index, key, duration))
+    io_loop.add_timeout(io_loop.time() + 5, io_loop.stop)
+    if len(done) < len(requests):
+        io_loop.start()
+    dispatcher.shutdown()
+    io_loop.close()
+    return events
+
+
+def test_per_device_order():
+
+    events = run_requests([("R1", 0.1), ("R2", 0.01), ("R1", 0.01), ("R2", 0.01)])
+    starts = [index for event, key, index in events if event == "start"]
+    assert sorted(starts) == [0, 1, 2, 3]
+    # R2 requests do not wait for the slow R1 request
+    assert events.index(("end", "R2", 3)) < events.index(("end", "R1", 0))
+    # R1 requests are handled one after the other
+    assert events.index(("end", "R1", 0)) < events.index(("start", "R1", 2))
+
+
+def test_module_level_barrier():
+
+    events = run_requests([("R1", 0.05), (None, 0), ("R2", 0)])
+    assert events.index(("end", "R1", 0)) < events.index(("start", None, 1))
+    assert events.index(("end", None, 1)) < events.index(("start", "R2", 2))
+
+
+def test_no_threads():
+
+    events = run_requests([("R1", 0), ("R2", 0)], max_workers=0)
+    assert events == [("start", "R1", 0), ("end", "R1", 0), ("start", "R2", 1), ("end", "R2", 1)]
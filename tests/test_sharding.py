@@ -0,0 +1,151 @@
+from gns3server import sharding
+from gns3server.sharding import WorkerRouter
+from gns3server.modules.vpcs.vpcs_group import VPCSGroup
+from gns3server.handlers.jsonrpc_websocket import JSONRPCWebSocket
+from gns3server.handlers.jsonrpc_websocket import OutboundQueue
+from gns3server import envelope
+from tornado.escape import json_decode
+import gns3server.jsonrpc as jsonrpc
+import pytest
+
+"""
+Tests for the sharding of modules across worker processes
+"""
+
+
+@pytest.fixture
+def worker():
+
+    yield sharding.set_worker
+    sharding.set_worker(0, 1)
+
+
+def test_owned_ids(worker):
+
+    assert list(sharding.owned_ids(1, 8)) == list(range(1, 8))
+    ids = set()
+    for index in range(3):
+        worker(index, 3)
+        owned = list(sharding.owned_ids(1, 100))
+        assert all(device_id % 3 == index for device_id in owned)
+        ids.update(owned)
+    assert ids == set(range(1, 100))
+
+
+def test_port_range(worker):
+
+    assert sharding.port_range(10000, 10999) == (10000, 10999)
+    worker(0, 4)
+    assert sharding.port_range(10000, 10999) == (10000, 10249)
+    worker(3, 4)
+    assert sharding.port_range(10000, 10999) == (10750, 10999)
+    # range too small to be split
+    assert sharding.port_range(10000, 10002) == (10000, 10002)
+
+
+def test_worker_router():
+
+    router = WorkerRouter()
+    router.register("iou", 1)
+    router.register("dynamips", 3)
+    assert router.route("iou", "iou.start", {"id": 5}) == ["iou"]
+    assert router.route("dynamips", "dynamips.vm.start", {"id": 5}) == ["dynamips:2"]
+    assert router.route("dynamips", "dynamips.settings", {}) == ["dynamips:0", "dynamips:1", "dynamips:2"]
+    assert router.route("dynamips", "dynamips.vm.create", {"router_id": 4}) == ["dynamips:1"]
+    created = [router.route("dynamips", "dynamips.vm.create", {"name": "R"})[0] for _ in range(3)]
+    assert sorted(created) == ["dynamips:0", "dynamips:1", "dynamips:2"]
+    assert router.route("dynamips", "dynamips.echo", None) == ["dynamips:0"]
+    assert router.route("dynamips", "dynamips.set_link_impairment", {"lport": 20001}) == ["dynamips:0", "dynamips:1", "dynamips:2"]
+    assert [sharding.module_name(worker) for worker in ("iou", "dynamips:2")] == ["iou", "dynamips"]
+
+
+def test_vpcs_group_locate():
+
+    assert VPCSGroup.locate(1, 4) == (0, 1)
+    assert VPCSGroup.locate(6, 4) == (1, 2)
+    # IDs 2, 4, 6, 8, 10 belong to worker 1 of 2
+    assert [VPCSGroup.locate(vpcs_id, 2, 1, 2) for vpcs_id in (2, 4, 6, 8, 10)] == [(1, 1), (1, 2), (3, 1), (3, 2), (5, 1)]
+    assert VPCSGroup.locate(3, 2, 0, 2) == (0, 2)
+
+
+class FakeSpawner(object):
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, identity, message, spawn=True):
+        self.sent.append(identity)
+
+
+def test_link_impairment_broadcast(request):
+
+    handler = JSONRPCWebSocket.__new__(JSONRPCWebSocket)
+    handler._session_id = "session"
+    handler._batches = {}
+    handler.module_spawner = FakeSpawner()
+    handler.destinations = {"dynamips.set_link_impairment": "dynamips"}
+    handler.worker_router = WorkerRouter()
+    handler.worker_router.register("dynamips", 2)
+    delivered = []
+    handler.deliver = lambda payload, request_id, method: delivered.append(json_decode(payload))
+    JSONRPCWebSocket.clients.add(handler)
+    request.addfinalizer(lambda: JSONRPCWebSocket.clients.discard(handler))
+
+    params = {"lport": 20001, "latency": 50}
+    handler._handle_request({"jsonrpc": 2.0, "method": "dynamips.set_link_impairment", "id": 7, "params": params}, handler)
+    # the server doesn't know which worker owns the UDP port
+    assert handler.module_spawner.sent == ["dynamips:0", "dynamips:1"]
+
+    stream = None
+    for worker, active in (("dynamips:1", True), ("dynamips:0", False)):
+        result = {"lport": 20001, "active": active, "stats": {"packets": 1 if active else 0}}
+        frames = envelope.encode_module_message("session", jsonrpc.JSONRPCResponse(result, 7)())
+        JSONRPCWebSocket.dispatch_message(stream, [worker.encode("utf-8")] + frames)
+    # one response, from the worker owning the NIO
+    assert len(delivered) == 1
+    assert delivered[0]["id"] == 7
+    assert delivered[0]["result"]["active"] is True
+    assert delivered[0]["result"]["stats"]["packets"] == 1
+
+
+def test_merge_nio_stats():
+
+    router = WorkerRouter()
+    router.register("dynamips", 2)
+    assert router.route("dynamips", "dynamips.nio_stats", {"subscribe": True}) == ["dynamips:0", "dynamips:1"]
+    assert router.route("dynamips", "dynamips.session_closed", None) == ["dynamips:0", "dynamips:1"]
+
+    merge = sharding.broadcast_merge("dynamips.nio_stats")
+    stats = merge([{"timestamp": 10.0, "interval": 10, "nios": [{"nio": "nio_udp2"}]},
+                   {"timestamp": None, "interval": 10, "nios": []},
+                   {"timestamp": 11.0, "interval": 10, "nios": [{"nio": "nio_udp1"}]}])
+    assert stats == {"timestamp": 11.0, "interval": 10, "nios": [{"nio": "nio_udp1"}, {"nio": "nio_udp2"}]}
+    assert sharding.broadcast_merge("dynamips.settings") is None
+
+
+def test_slow_session_keeps_latest_nio_stats(request):
+
+    handler = JSONRPCWebSocket.__new__(JSONRPCWebSocket)
+    handler._session_id = "session"
+    handler._batches = {}
+    handler.coalesced_notifications = {"dynamips.nio_stats": ("worker",)}
+    written = []
+    flush = []
+    handler._outbound = OutboundQueue(lambda message, binary: written.append(message), flush.append, 10, 1024 * 1024)
+    JSONRPCWebSocket.clients.add(handler)
+    request.addfinalizer(lambda: JSONRPCWebSocket.clients.discard(handler))
+    request.addfinalizer(handler._outbound.close)
+
+    # the client is slow: the first notification is still in the socket buffer
+    for worker, timestamp in (("dynamips:0", 1), ("dynamips:1", 1), ("dynamips:0", 2), ("dynamips:1", 2), ("dynamips:0", 3)):
+        params = {"timestamp": timestamp, "interval": 10, "nios": [], "worker": worker}
+        frames = envelope.encode_module_message("session", jsonrpc.JSONRPCNotification("dynamips.nio_stats", params)())
+        JSONRPCWebSocket.dispatch_message(None, [worker.encode("utf-8")] + frames)
+    assert len(written) == 1
+    assert len(handler._outbound) == 2
+
+    # the workers do not supersede each other's statistics
+    while len(handler._outbound):
+        flush.pop()()
+    snapshots = [json_decode(message)["params"] for message in written[1:]]
+    assert [(params["worker"], params["timestamp"]) for params in snapshots] == [("dynamips:1", 2), ("dynamips:0", 3)]
@@ -0,0 +1,74 @@
+from gns3server.telemetry import RingBuffer
+from gns3server.telemetry import ProcessSampler
+from gns3server.telemetry import TelemetryStore
+from gns3server.telemetry import read_process_stats
+import os
+import sys
+import pytest
+
+"""
+Tests for the resource telemetry
+"""
+
+
+def test_ring_buffer():
+
+    buffer = RingBuffer(3)
+    assert buffer.values() == []
+    assert buffer.last() is None
+    for value in range(5):
+        buffer.append(value)
+    assert len(buffer) == 3
+    assert buffer.values() == [2, 3, 4]
+    assert buffer.values(2) == [3, 4]
+    assert buffer.last() == 4
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="procfs is required")
+def test_read_process_stats():
+
+    cpu_ticks, rss, read_bytes, write_bytes = read_process_stats(os.getpid())
+    assert rss > 0
+    assert read_process_stats(2 ** 22 + 1) is None
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="procfs is required")
+def test_process_sampler():
+
+    sampler = ProcessSampler()
+    nodes = {1: {"name": "R1", "pids": [os.getpid()]}}
+    sampler.sample(nodes)
+    samples = sampler.sample(nodes)
+    assert samples["1"]["name"] == "R1"
+    assert samples["1"]["rss"] > 0
+    assert samples["1"]["cpu"] >= 0
+
+
+def test_store_history_and_thresholds():
+
+    store = TelemetryStore(capacity=2, cpu_threshold=50)
+    breaches = store.add_samples("iou", 1.0, {"1": {"name": "IOU1", "cpu": 60, "rss": 10},
+                                              "2": {"name": "IOU2", "cpu": 10, "rss": 20}})
+    assert [breach["id"] for breach in breaches] == ["1"]
+    # no new notification while the node stays above the threshold
+    assert store.add_samples("iou", 2.0, {"1": {"name": "IOU1", "cpu": 70, "rss": 10}}) == []
+
+    stats = store.to_json()
+    assert stats["iou"]["total"]["cpu"] == [70, 70]
+    assert stats["iou"]["total"]["rss"] == [30, 10]
+    assert list(stats["iou"]["nodes"].keys()) == ["1"]
+    assert stats["iou"]["nodes"]["1"]["timestamps"] == [1.0, 2.0]
+    assert store.to_json(module="iou", node_id=1, count=1)["iou"]["nodes"]["1"]["cpu"] == [70]
+
+
+def test_store_sharded_module():
+
+    store = TelemetryStore(capacity=4)
+    store.add_samples("dynamips", 1.0, {"1": {"name": "R1", "cpu": 10}}, worker="dynamips:0")
+    store.add_samples("dynamips", 1.1, {"2": {"name": "R2", "cpu": 20}}, worker="dynamips:1")
+    # a worker only forgets its own nodes
+    store.add_samples("dynamips", 2.0, {"3": {"name": "R3", "cpu": 5}}, worker="dynamips:0")
+
+    stats = store.to_json(module="dynamips")
+    assert sorted(stats["dynamips"]["nodes"].keys()) == ["2", "3"]
+    assert stats["dynamips"]["total"]["cpu"] == [10, 30, 25]
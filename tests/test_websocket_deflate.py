@@ -0,0 +1,124 @@
+from gns3server.handlers.websocket_deflate import negotiate_deflate
+from gns3server.handlers.websocket_deflate import DeflateWebSocketProtocol
+import struct
+import zlib
+
+"""
+Tests for the permessage-deflate Websocket extension
+"""
+
+
+class FakeStream(object):
+
+    def __init__(self):
+        self.written = b""
+        self.incoming = b""
+        self.pending = None
+        self.aborted = False
+
+    def write(self, data):
+        self.written += data
+
+    def read_bytes(self, count, callback):
+        self.pending = (count, callback)
+        self.feed(b"")
+
+    def feed(self, data):
+        self.incoming += data
+        if self.pending and len(self.incoming) >= self.pending[0]:
+            count, callback = self.pending
+            self.pending = None
+            data, self.incoming = self.incoming[:count], self.incoming[count:]
+            callback(data)
+
+    def closed(self):
+        return False
+
+    def close(self):
+        self.aborted = True
+
+
+class FakeRequest(object):
+
+    headers = {}
+
+
+class FakeHandler(object):
+
+    def __init__(self):
+        self.request = FakeRequest()
+        self.stream = FakeStream()
+        self.messages = []
+
+    def on_message(self, message):
+        self.messages.append(message)
+
+    def on_connection_close(self):
+        pass
+
+
+def create_protocol(no_context_takeover=False, threshold=16):
+
+    handler = FakeHandler()
+    protocol = DeflateWebSocketProtocol(handler, "permessage-deflate", no_context_takeover, 6, threshold, 1024)
+    return handler, protocol
+
+
+def test_negotiate():
+
+    assert negotiate_deflate("") is None
+    assert negotiate_deflate("x-webkit-deflate-frame") is None
+    assert negotiate_deflate("permessage-deflate") == ("permessage-deflate", False)
+    assert negotiate_deflate("permessage-deflate; client_max_window_bits") == ("permessage-deflate", False)
+    assert negotiate_deflate("permessage-deflate; server_no_context_takeover") == ("permessage-deflate; server_no_context_takeover", True)
+    # unsupported offers are skipped
+    assert negotiate_deflate("permessage-deflate; server_max_window_bits=8, permessage-deflate; server_max_window_bits=10") == \
+        ("permessage-deflate; server_max_window_bits=10", False)
+    assert negotiate_deflate("permessage-deflate; unknown_param") is None
+
+
+def test_compressed_messages():
+
+    handler, protocol = create_protocol()
+    decompressor = zlib.decompressobj(-15)
+    message = '{"jsonrpc": "2.0", "result": "' + "A" * 1000 + '"}'
+    for _ in range(2):
+        handler.stream.written = b""
+        protocol.write_message(message)
+        frame = handler.stream.written
+        assert frame[0] == 0x80 | 0x40 | 0x1  # FIN, RSV1 and text opcode
+        assert frame[1] < 126
+        payload = frame[2:]
+        assert decompressor.decompress(payload + b"\x00\x00\xff\xff").decode("utf-8") == message
+
+
+def test_small_messages_not_compressed():
+
+    handler, protocol = create_protocol()
+    protocol.write_message("small")
+    assert handler.stream.written == b"\x81\x05small"
+
+
+def test_incoming_compressed_message():
+
+    handler, protocol = create_protocol()
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    payload = compressor.compress(b"hello" * 100) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    payload = payload[:-4]
+    mask = b"\x01\x02\x03\x04"
+    masked = bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+    protocol._receive_frame()
+    handler.stream.feed(struct.pack("BB", 0x80 | 0x40 | 0x1, 0x80 | len(payload)) + mask + masked)
+    assert handler.messages == ["hello" * 100]
+
+
+def test_incoming_message_too_large():
+
+    handler, protocol = create_protocol()
+    payload = zlib.compressobj(6, zlib.DEFLATED, -15)
+    data = payload.compress(b"a" * 4096) + payload.flush(zlib.Z_SYNC_FLUSH)
+    data = data[:-4]
+    protocol._receive_frame()
+    handler.stream.feed(struct.pack("BB", 0x80 | 0x40 | 0x1, len(data)) + data)
+    assert handler.messages == []
+    assert handler.stream.aborted
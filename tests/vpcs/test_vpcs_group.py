@@ -0,0 +1,113 @@
+from gns3server.modules.vpcs import VPCSDevice
+from gns3server.modules.vpcs.vpcs_group import VPCSGroup
+from gns3server.modules.vpcs.vpcs_group import find_unused_port_block
+from gns3server.modules.vpcs.nios.nio_udp import NIO_UDP
+from gns3server.modules.vpcs.vpcs_error import VPCSError
+import os
+import sys
+import socket
+import pytest
+
+
+@pytest.fixture
+def group(request, tmpdir):
+
+    udp_base = find_unused_port_block(9, 40000, 41000)
+    group = VPCSGroup(0, 9, "/usr/bin/vpcs", str(tmpdir), "127.0.0.1", "127.0.0.1", udp_base, 4501, 5000, [])
+    request.addfinalizer(VPCSDevice.reset)
+    return group
+
+
+def test_locate():
+
+    assert VPCSGroup.locate(1, 9) == (0, 1)
+    assert VPCSGroup.locate(9, 9) == (0, 9)
+    assert VPCSGroup.locate(10, 9) == (1, 1)
+    assert VPCSGroup.locate(255, 9) == (28, 3)
+
+
+def test_port_block_skips_ignored_ports():
+
+    base = find_unused_port_block(3, 40000, 41000, ignore_ports=[40001])
+    assert base >= 40002
+
+
+def test_build_command(group):
+
+    group._console = 4600
+    command = group.build_command()
+    assert command[command.index("-s") + 1] == str(group.udp_ports[0])
+    assert command[command.index("-i") + 1] == "9"
+    assert command[command.index("-m") + 1] == "1"
+
+
+def test_startup_script(group, tmpdir):
+
+    vpcs_device = VPCSDevice("PC2", "/usr/bin/vpcs", str(tmpdir), vpcs_id=None)
+    vpcs_device.pack(group, 2)
+    with open(os.path.join(vpcs_device.working_dir, "startup.vpc"), "w") as f:
+        f.write("ip 10.0.0.2/24\n1\n")
+    vpcs_device.script_file = "startup.vpc"
+    vpcs_device.port_add_nio_binding(0, NIO_UDP(group.udp_port(2), "127.0.0.1", 30001))
+    script_path = group._write_startup_script([2])
+    with open(script_path) as f:
+        lines = f.read().splitlines()
+    assert lines == ["2", "set pcname PC2", "set rport 30001", "set rhost 127.0.0.1", "ip 10.0.0.2/24", "2"]
+
+
+def test_packed_nio_must_use_slot_port(group, tmpdir):
+
+    vpcs_device = VPCSDevice("PC1", "/usr/bin/vpcs", str(tmpdir))
+    vpcs_device.pack(group, 1)
+    with pytest.raises(VPCSError):
+        vpcs_device.port_add_nio_binding(0, NIO_UDP(group.udp_port(2), "127.0.0.1", 30001))
+
+
+FAKE_VPCS = """#!{python}
+import sys
+import socket
+import threading
+
+# stands in for VPCS: accepts console connections and discards the input
+server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+server.bind(("127.0.0.1", int(sys.argv[sys.argv.index("-p") + 1])))
+server.listen(5)
+
+
+def discard(client):
+    while client.recv(4096):
+        pass
+
+
+while True:
+    client, _ = server.accept()
+    threading.Thread(target=discard, args=(client,), daemon=True).start()
+"""
+
+
+def test_restart_after_crash(group, tmpdir):
+
+    vpcs_path = os.path.join(str(tmpdir), "fake_vpcs")
+    with open(vpcs_path, "w") as f:
+        f.write(FAKE_VPCS.format(python=sys.executable))
+    os.chmod(vpcs_path, 0o755)
+    group.path = vpcs_path
+
+    vpcs_device = VPCSDevice("PC1", vpcs_path, str(tmpdir))
+    vpcs_device.pack(group, 1)
+    vpcs_device.port_add_nio_binding(0, NIO_UDP(group.udp_port(1), "127.0.0.1", 30001))
+    group.start_member(1)
+    try:
+        group._process.kill()
+        group._process.wait()
+        assert not group.is_member_running(1)
+
+        group.start_member(1)
+        assert group.is_member_running(1)
+        assert group._allocated_console_ports == [group.console]
+        # the console listener of the PC has been created again
+        socket.create_connection(("127.0.0.1", vpcs_device.console), 5).close()
+    finally:
+        group.stop()
+    assert group._allocated_console_ports == []